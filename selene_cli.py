@@ -6,7 +6,7 @@ Output:
     Saves model to a user-specified output file.
 
 Usage:
-    selene_cli.py <config-yml> [--lr=<lr>]
+    selene_cli.py <config-yml> [--lr=<lr>] [--world-size=<n>]
     selene_cli.py -h | --help
 
 Options:
@@ -15,6 +15,9 @@ Options:
     <config-yml>            Model-specific parameters
     --lr=<lr>               If training, the optimizer's learning rate
                             [default: None]
+    --world-size=<n>        If training, the number of processes to
+                            train the model with on the CPU
+                            [default: 1]
 """
 from docopt import docopt
 
@@ -29,4 +32,6 @@ if __name__ == "__main__":
         version=__version__)
 
     configs = load_path(arguments["<config-yml>"], instantiate=False)
-    parse_configs_and_run(configs, lr=arguments["--lr"])
+    parse_configs_and_run(configs,
+                          lr=arguments["--lr"],
+                          world_size=arguments["--world-size"])
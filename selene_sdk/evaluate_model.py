@@ -6,15 +6,20 @@ import os
 import warnings
 
 import numpy as np
+from numpy.lib.format import open_memmap
 import torch
 import torch.nn as nn
-from torch.autograd import Variable
 
 from .sequences import Genome
 from .utils import _is_lua_trained_model
 from .utils import initialize_logger
 from .utils import load_model_from_state_dict
 from .utils import PerformanceMetrics
+from .utils import StreamingPerformanceMetrics
+from .utils.profiling import _torch_profiler
+from .utils.utils import _autocast
+from .utils.utils import _check_precision
+from .utils.utils import _to_tensor
 
 
 logger = logging.getLogger("selene")
@@ -46,6 +51,8 @@ class EvaluateModel(object):
         number of samples on which you evaluate your model. If you are
         using a sampler of type `selene_sdk.samplers.OnlineSampler`,
         by default it will draw 640000 samples if `n_test_samples` is `None`.
+        With `stream_evaluation`, an online sampler's `n_test_samples` is
+        rounded down to a multiple of `batch_size`.
     report_gt_feature_n_positives : int, optional
         Default is 10. In the final test set, each class/feature must have
         more than `report_gt_feature_n_positives` positive samples in order to
@@ -63,6 +70,54 @@ class EvaluateModel(object):
         run the evaluation. The features in this list must be identical to or
         a subset of `features`, and in the order you want the resulting
         `test_targets.npz` and `test_predictions.npz` to be saved.
+    precision : {"float32", "bfloat16", "float16"}, optional
+        Default is "float32". The precision to run the model in. With
+        "bfloat16" (on the CPU or a GPU) or "float16" (on a GPU only),
+        the forward pass runs under automatic mixed precision
+        (autocast). The loss and the predictions are computed in
+        float32.
+    metrics_histogram_bins : int or None, optional
+        Default is None. If set, the metrics are estimated from
+        per-feature histograms with this many bins of the predictions
+        for the positive and negative examples (see
+        `selene_sdk.utils.StreamingPerformanceMetrics`), which are
+        accumulated batch by batch. The predictions are not kept, and
+        `test_predictions.npz` and `test_targets.npz` are not written.
+        The predictions must be in [0, 1]. A bound on the error of each
+        average score is logged.
+    metrics_n_workers : int, optional
+        Default is 1. The number of threads that compute the metrics and
+        the ROC and precision-recall curves, each for a block of the
+        features, and of processes that plot the curves (see
+        `selene_sdk.utils.PerformanceMetrics`).
+    visualize_kwargs : dict or None, optional
+        Default is None. Keyword arguments for plotting the ROC and
+        precision-recall curves (see
+        `selene_sdk.utils.PerformanceMetrics.visualize`), e.g.
+        `dict(background=True, file_format="png", n_curve_points=500)`.
+        With `background=True`, `evaluate` returns as soon as the scores
+        are written, while the figures are plotted in a background
+        process.
+    stream_evaluation : bool, optional
+        Default is `False`. If `True`, the test set is not loaded into
+        memory when `EvaluateModel` is constructed. Instead, its batches
+        are streamed from the sampler (see
+        `selene_sdk.samplers.Sampler.stream_data_and_targets`) during
+        `evaluate`, with the targets limited to the features in
+        `use_features_ord` as they are drawn, and the predictions and
+        targets are written batch by batch to `test_predictions.npy`
+        and `test_targets.npy` in `output_dir` rather than to `.npz`
+        files. Together with `metrics_histogram_bins`, which means that
+        no predictions or targets are written or kept, the memory used
+        only grows with the batch size and the number of features
+        evaluated, and not with the size of the test set.
+    profiler : dict or None, optional
+        Default is None. If set, a window of the evaluated batches is
+        profiled with `torch.profiler`. The keys are the same as for
+        the `profiler` of `selene_sdk.TrainModel`, and a Chrome trace
+        (`evaluate.<batch>.pt.trace.json`) and a table of the time spent
+        in each operator (`evaluate.<batch>.operators.txt`) are written
+        to a `profiler` directory in `output_dir` by default.
 
     Attributes
     ----------
@@ -80,6 +135,8 @@ class EvaluateModel(object):
         If `True`, use a CUDA-enabled GPU. If `False`, use the CPU.
     data_parallel : bool
         Whether to use multiple GPUs or not.
+    precision : str
+        The precision the model is run in.
 
     """
 
@@ -95,7 +152,15 @@ class EvaluateModel(object):
                  report_gt_feature_n_positives=10,
                  use_cuda=False,
                  data_parallel=False,
-                 use_features_ord=None):
+                 use_features_ord=None,
+                 precision="float32",
+                 metrics_histogram_bins=None,
+                 metrics_n_workers=1,
+                 visualize_kwargs=None,
+                 stream_evaluation=False,
+                 profiler=None):
+        _check_precision(precision, use_cuda=use_cuda)
+        self.precision = precision
         self.criterion = criterion
 
         trained_model = torch.load(
@@ -146,19 +211,25 @@ class EvaluateModel(object):
 
         self.batch_size = batch_size
 
-        self._metrics = PerformanceMetrics(
-            self._get_feature_from_index,
-            report_gt_feature_n_positives=report_gt_feature_n_positives)
-
-        self._test_data, self._all_test_targets = \
-            self.sampler.get_data_and_targets(self.batch_size, n_test_samples)
-        # TODO: we should be able to do this on the sampler end instead of
-        # here. the current workaround is problematic, since
-        # self._test_data still has the full featureset in it, and we
-        # select the subset during `evaluate`
-        self._all_test_targets = self._all_test_targets[:, self._use_ixs]
-
-        # reset Genome base ordering when applicable.
+        self._streaming_metrics = metrics_histogram_bins is not None
+        if self._streaming_metrics:
+            self._metrics = StreamingPerformanceMetrics(
+                self._get_feature_from_index,
+                len(self.features),
+                n_bins=metrics_histogram_bins,
+                report_gt_feature_n_positives=report_gt_feature_n_positives,
+                n_workers=metrics_n_workers)
+        else:
+            self._metrics = PerformanceMetrics(
+                self._get_feature_from_index,
+                report_gt_feature_n_positives=report_gt_feature_n_positives,
+                n_workers=metrics_n_workers)
+        self._visualize_kwargs = visualize_kwargs or dict()
+        self._profiler = _torch_profiler(
+            profiler, "evaluate", self.output_dir, use_cuda=self.use_cuda)
+
+        # reset Genome base ordering when applicable, before any
+        # examples are drawn.
         if (hasattr(self.sampler, "reference_sequence") and
                 isinstance(self.sampler.reference_sequence, Genome)):
             if _is_lua_trained_model(model):
@@ -166,6 +237,18 @@ class EvaluateModel(object):
             else:
                 Genome.update_bases_order(['A', 'C', 'G', 'T'])
 
+        self.stream_evaluation = stream_evaluation
+        self._n_test_samples = n_test_samples
+        self._test_data = None
+        self._all_test_targets = None
+        if not self.stream_evaluation:
+            # only the targets of the features that are evaluated are
+            # kept.
+            self._test_data, self._all_test_targets = \
+                self.sampler.get_data_and_targets(
+                    self.batch_size, n_test_samples,
+                    feature_indices=self._use_ixs)
+
     def _write_features_ordered_to_file(self):
         """
         Write the feature ordering specified by `use_features_ord`
@@ -208,54 +291,107 @@ class EvaluateModel(object):
 
         """
         batch_losses = []
+        batch_sizes = []
         all_predictions = []
-        for (inputs, targets) in self._test_data:
-            inputs = torch.Tensor(inputs)
-            targets = torch.Tensor(targets[:, self._use_ixs])
+        test_data = self._test_data
+        all_test_targets = self._all_test_targets
+        if self.stream_evaluation:
+            test_data, n_samples = self.sampler.stream_data_and_targets(
+                self.batch_size, self._n_test_samples,
+                feature_indices=self._use_ixs)
+            if not self._streaming_metrics:
+                shape = (n_samples, len(self.features))
+                all_predictions = open_memmap(
+                    os.path.join(self.output_dir, "test_predictions.npy"),
+                    mode="w+", dtype=np.float32, shape=shape)
+                all_test_targets = open_memmap(
+                    os.path.join(self.output_dir, "test_targets.npy"),
+                    mode="w+", dtype=np.float32, shape=shape)
+
+        offset = 0
+        if self._profiler is not None:
+            self._profiler.start()
+        for (inputs, targets) in test_data:
+            n_batch = len(inputs)
+            inputs = _to_tensor(inputs)
+            batch_targets = targets
+            targets = _to_tensor(targets)
 
             if self.use_cuda:
-                inputs = inputs.cuda()
-                targets = targets.cuda()
+                inputs = inputs.cuda(non_blocking=True)
+                targets = targets.cuda(non_blocking=True)
             with torch.no_grad():
-                inputs = Variable(inputs)
-                targets = Variable(targets)
-
                 predictions = None
-                if _is_lua_trained_model(self.model):
-                    predictions = self.model.forward(
-                        inputs.transpose(1, 2).contiguous().unsqueeze_(2))
-                else:
-                    predictions = self.model.forward(
-                        inputs.transpose(1, 2))
-                predictions = predictions[:, self._use_ixs]
+                with _autocast(self.precision, use_cuda=self.use_cuda):
+                    if _is_lua_trained_model(self.model):
+                        predictions = self.model.forward(
+                            inputs.transpose(1, 2).contiguous().unsqueeze_(2))
+                    else:
+                        predictions = self.model.forward(
+                            inputs.transpose(1, 2))
+                predictions = predictions[:, self._use_ixs].float()
                 loss = self.criterion(predictions, targets)
 
-                all_predictions.append(predictions.data.cpu().numpy())
+                if self._streaming_metrics:
+                    self._metrics.add(predictions.data.cpu().numpy(),
+                                      batch_targets)
+                elif self.stream_evaluation:
+                    all_predictions[offset:offset + n_batch] = \
+                        predictions.data.cpu().numpy()
+                    all_test_targets[offset:offset + n_batch] = \
+                        batch_targets
+                else:
+                    all_predictions.append(predictions.data.cpu().numpy())
                 batch_losses.append(loss.item())
-        all_predictions = np.vstack(all_predictions)
-
-        average_scores = self._metrics.update(
-            all_predictions, self._all_test_targets)
+                batch_sizes.append(n_batch)
+            offset += n_batch
+            if self._profiler is not None:
+                self._profiler.step()
+        if self._profiler is not None:
+            self._profiler.stop()
+
+        if self._streaming_metrics:
+            average_scores = self._metrics.update()
+        elif self.stream_evaluation:
+            all_predictions.flush()
+            all_test_targets.flush()
+            average_scores = self._metrics.update(
+                all_predictions, all_test_targets)
+        else:
+            all_predictions = np.vstack(all_predictions)
 
-        self._metrics.visualize(
-            all_predictions, self._all_test_targets, self.output_dir)
+            average_scores = self._metrics.update(
+                all_predictions, all_test_targets)
 
-        np.savez_compressed(
-            os.path.join(self.output_dir, "test_predictions.npz"),
-            data=all_predictions)
+            np.savez_compressed(
+                os.path.join(self.output_dir, "test_predictions.npz"),
+                data=all_predictions)
 
-        np.savez_compressed(
-            os.path.join(self.output_dir, "test_targets.npz"),
-            data=self._all_test_targets)
+            np.savez_compressed(
+                os.path.join(self.output_dir, "test_targets.npz"),
+                data=all_test_targets)
 
-        loss = np.average(batch_losses)
+        # the last batch may be smaller than the others.
+        loss = np.average(batch_losses, weights=batch_sizes)
         logger.info("test loss: {0}".format(loss))
         for name, score in average_scores.items():
             logger.info("test {0}: {1}".format(name, score))
+        if self._streaming_metrics:
+            for name, bound in self._metrics.average_error_bounds().items():
+                logger.info("test {0} error bound: {1}".format(name, bound))
 
         test_performance = os.path.join(
             self.output_dir, "test_performance.txt")
         feature_scores_dict = self._metrics.write_feature_scores_to_file(
             test_performance)
 
+        # the figures are plotted last, possibly in the background, once
+        # the scores are written.
+        if self._streaming_metrics:
+            self._metrics.visualize(self.output_dir, **self._visualize_kwargs)
+        else:
+            self._metrics.visualize(
+                all_predictions, all_test_targets, self.output_dir,
+                **self._visualize_kwargs)
+
         return feature_scores_dict
@@ -5,9 +5,10 @@ import math
 
 import numpy as np
 import torch
-from torch.autograd import Variable
 
 from ..utils import _is_lua_trained_model
+from ..utils.utils import _autocast
+from ..utils.utils import _to_tensor
 
 
 def get_reverse_complement(allele, complementary_base_dict):
@@ -63,7 +64,7 @@ def get_reverse_complement_encoding(allele_encoding,
     return allele_encoding[:, complement_indices][::-1, :]
 
 
-def predict(model, batch_sequences, use_cuda=False):
+def predict(model, batch_sequences, use_cuda=False, precision="float32"):
     """
     Return model predictions for a batch of sequences.
 
@@ -78,6 +79,10 @@ def predict(model, batch_sequences, use_cuda=False):
     use_cuda : bool, optional
         Default is `False`. Specifies whether CUDA-enabled GPUs are available
         for torch to use.
+    precision : {"float32", "bfloat16", "float16"}, optional
+        Default is "float32". The precision to run the model in. Reduced
+        precisions use automatic mixed precision (autocast). The
+        predictions are always returned as float32.
 
     Returns
     -------
@@ -86,18 +91,18 @@ def predict(model, batch_sequences, use_cuda=False):
         is the number of features (classes) the model predicts.
 
     """
-    inputs = torch.Tensor(batch_sequences)
+    inputs = _to_tensor(batch_sequences)
     if use_cuda:
-        inputs = inputs.cuda()
-    with torch.no_grad():
-        inputs = Variable(inputs)
-
+        inputs = inputs.cuda(non_blocking=True)
+    with torch.no_grad(), _autocast(precision, use_cuda=use_cuda):
+        # the model is called rather than its `forward` method, so that
+        # any hooks registered on it run.
         if _is_lua_trained_model(model):
-            outputs = model.forward(
+            outputs = model(
                 inputs.transpose(1, 2).contiguous().unsqueeze_(2))
         else:
-            outputs = model.forward(inputs.transpose(1, 2))
-        return outputs.data.cpu().numpy()
+            outputs = model(inputs.transpose(1, 2))
+    return outputs.data.float().cpu().numpy()
 
 
 def _pad_sequence(sequence, to_length, unknown_base):
@@ -271,7 +271,8 @@ def _handle_ref_alt_predictions(model,
                                 batch_alt_seqs,
                                 batch_ids,
                                 reporters,
-                                use_cuda=False):
+                                use_cuda=False,
+                                precision="float32"):
     """
     Helper method for variant effect prediction. Gets the model
     predictions and updates the reporters.
@@ -289,6 +290,8 @@ def _handle_ref_alt_predictions(model,
     use_cuda : bool, optional
         Default is `False`. Specifies whether CUDA-enabled GPUs are available
         for torch to use.
+    precision : {"float32", "bfloat16", "float16"}, optional
+        Default is "float32". The precision to run the model in.
 
 
     Returns
@@ -296,10 +299,12 @@ def _handle_ref_alt_predictions(model,
     None
 
     """
-    batch_ref_seqs = np.array(batch_ref_seqs)
-    batch_alt_seqs = np.array(batch_alt_seqs)
-    ref_outputs = predict(model, batch_ref_seqs, use_cuda=use_cuda)
-    alt_outputs = predict(model, batch_alt_seqs, use_cuda=use_cuda)
+    batch_ref_seqs = np.array(batch_ref_seqs, dtype=np.float32)
+    batch_alt_seqs = np.array(batch_alt_seqs, dtype=np.float32)
+    ref_outputs = predict(
+        model, batch_ref_seqs, use_cuda=use_cuda, precision=precision)
+    alt_outputs = predict(
+        model, batch_alt_seqs, use_cuda=use_cuda, precision=precision)
     for r in reporters:
         if r.needs_base_pred:
             r.handle_batch_predictions(alt_outputs, batch_ids, ref_outputs)
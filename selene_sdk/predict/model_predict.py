@@ -2,6 +2,7 @@
 This module provides the `AnalyzeSequences` class and supporting
 methods.
 """
+from functools import wraps
 import math
 import os
 from time import time
@@ -33,12 +34,43 @@ from .predict_handlers import WriteRefAltHandler
 from ..sequences import Genome
 from ..utils import _is_lua_trained_model
 from ..utils import load_model_from_state_dict
+from ..utils.profiling import _torch_profiler
+from ..utils.utils import _check_precision
 
 
 # TODO: MAKE THESE GENERIC:
 ISM_COLS = ["pos", "ref", "alt"]
 VARIANTEFFECT_COLS = ["chrom", "pos", "name", "ref", "alt", "strand", "ref_match", "contains_unk"]
 
+
+def _profile_forward_passes(method):
+    """
+    Decorates a method of `AnalyzeSequences` so that a window of the
+    forward passes of the model that it makes is profiled, if a
+    `profiler` was specified. Methods called from a profiled method
+    are profiled with it.
+    """
+    @wraps(method)
+    def profiled_method(self, *args, **kwargs):
+        if self._profiler_config is None or self._profiling:
+            return method(self, *args, **kwargs)
+        profiler = _torch_profiler(
+            self._profiler_config, method.__name__, '.',
+            use_cuda=self.use_cuda)
+        # each forward pass of the model ends a step.
+        hook = self.model.register_forward_hook(
+            lambda module, inputs, outputs: profiler.step())
+        self._profiling = True
+        profiler.start()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            profiler.stop()
+            hook.remove()
+            self._profiling = False
+    return profiled_method
+
+
 class AnalyzeSequences(object):
     """
     Score sequences and their variants using the predictions made
@@ -96,6 +128,23 @@ class AnalyzeSequences(object):
         possible consideration is your model size and whether you are
         using it on the CPU or a CUDA-enabled GPU (i.e. setting
         `use_cuda` to True).
+    precision : {"float32", "bfloat16", "float16"}, optional
+        Default is "float32". The precision to run the model in. With
+        "bfloat16" (on the CPU or a GPU) or "float16" (on a GPU only),
+        the model runs under automatic mixed precision (autocast), which
+        speeds up large convolutional and linear layers and halves
+        their memory traffic at a small cost in accuracy. The
+        predictions are always written as float32.
+    profiler : dict or None, optional
+        Default is None. If set, a window of the forward passes of the
+        model made by each call to one of the prediction methods (e.g.
+        `variant_effect_prediction`) is profiled with `torch.profiler`.
+        The keys are the same as for the `profiler` of
+        `selene_sdk.TrainModel`. A Chrome trace
+        (`<method>.<step>.pt.trace.json`) and a table of the time spent
+        in each operator (`<method>.<step>.operators.txt`) are written
+        to `output_dir` if it is one of the keys, or else to a
+        `profiler` directory in the current working directory.
 
     Attributes
     ----------
@@ -113,6 +162,8 @@ class AnalyzeSequences(object):
         Whether to use multiple GPUs or not.
     reference_sequence : class
         The type of sequence on which this analysis will be performed.
+    precision : str
+        The precision the model is run in.
 
     """
 
@@ -125,10 +176,14 @@ class AnalyzeSequences(object):
                  use_cuda=False,
                  data_parallel=False,
                  reference_sequence=Genome,
-                 write_mem_limit=1500):
+                 write_mem_limit=1500,
+                 precision="float32",
+                 profiler=None):
         """
         Constructs a new `AnalyzeSequences` object.
         """
+        _check_precision(precision, use_cuda=use_cuda)
+        self.precision = precision
         self.model = model
 
         if isinstance(trained_model_path, str):
@@ -179,6 +234,8 @@ class AnalyzeSequences(object):
         else:  # even if not using Genome, I guess we can update?
             Genome.update_bases_order(['A', 'C', 'G', 'T'])
         self._write_mem_limit = write_mem_limit
+        self._profiler_config = profiler
+        self._profiling = False
 
     def _initialize_reporters(self,
                               save_data,
@@ -341,6 +398,7 @@ class AnalyzeSequences(object):
 
         return sequences, labels
 
+    @_profile_forward_passes
     def get_predictions_for_bed_file(self,
                                      input_path,
                                      output_dir,
@@ -417,10 +475,14 @@ class AnalyzeSequences(object):
                     *coords,
                     pad=True)
             if sequences is None:
-                sequences = np.zeros((self.batch_size, *encoding.shape))
+                # every row is overwritten before the buffer is used, so
+                # it is reused for every batch.
+                sequences = np.zeros(
+                    (self.batch_size, *encoding.shape), dtype=np.float32)
             if i and i % self.batch_size == 0:
-                preds = predict(self.model, sequences, use_cuda=self.use_cuda)
-                sequences = np.zeros((self.batch_size, *encoding.shape))
+                preds = predict(
+                    self.model, sequences,
+                    use_cuda=self.use_cuda, precision=self.precision)
                 reporter.handle_batch_predictions(preds, batch_ids)
                 batch_ids = []
             batch_ids.append(label+(contains_unk,))
@@ -434,11 +496,14 @@ class AnalyzeSequences(object):
 
         if (batch_ids and i == 0) or i % self.batch_size != 0:
             sequences = sequences[:i % self.batch_size + 1, :, :]
-            preds = predict(self.model, sequences, use_cuda=self.use_cuda)
+            preds = predict(
+                self.model, sequences,
+                use_cuda=self.use_cuda, precision=self.precision)
             reporter.handle_batch_predictions(preds, batch_ids)
 
         reporter.write_to_file()
 
+    @_profile_forward_passes
     def get_predictions_for_fasta_file(self,
                                        input_path,
                                        output_dir,
@@ -496,7 +561,8 @@ class AnalyzeSequences(object):
             mode="prediction")[0]
         sequences = np.zeros((self.batch_size,
                               self.sequence_length,
-                              len(self.reference_sequence.BASES_ARR)))
+                              len(self.reference_sequence.BASES_ARR)),
+                             dtype=np.float32)
         batch_ids = []
         for i, fasta_record in enumerate(fasta_file):
             cur_sequence = self._pad_or_truncate_sequence(str(fasta_record))
@@ -504,9 +570,9 @@ class AnalyzeSequences(object):
                 cur_sequence)
 
             if i and i > 0 and i % self.batch_size == 0:
-                preds = predict(self.model, sequences, use_cuda=self.use_cuda)
-                sequences = np.zeros(
-                    (self.batch_size, *cur_sequence_encoding.shape))
+                preds = predict(
+                    self.model, sequences,
+                    use_cuda=self.use_cuda, precision=self.precision)
                 reporter.handle_batch_predictions(preds, batch_ids)
                 batch_ids = []
 
@@ -515,13 +581,16 @@ class AnalyzeSequences(object):
 
         if (batch_ids and i == 0) or i % self.batch_size != 0:
             sequences = sequences[:i % self.batch_size + 1, :, :]
-            preds = predict(self.model, sequences, use_cuda=self.use_cuda)
+            preds = predict(
+                self.model, sequences,
+                use_cuda=self.use_cuda, precision=self.precision)
             reporter.handle_batch_predictions(preds, batch_ids)
 
         fasta_file.close()
         reporter.write_to_file()
 
 
+    @_profile_forward_passes
     def get_predictions(self,
                         input,
                         output_dir=None,
@@ -582,7 +651,9 @@ class AnalyzeSequences(object):
             sequence = self._pad_or_truncate_sequence(input)
             seq_enc = self.reference_sequence.sequence_to_encoding(sequence)
             seq_enc = np.expand_dims(seq_enc, axis=0)  # add batch size of 1
-            return predict(self.model, seq_enc, use_cuda=self.use_cuda)
+            return predict(
+                self.model, seq_enc,
+                use_cuda=self.use_cuda, precision=self.precision)
         elif input.endswith('.fa') or input.endswith('.fasta'):
             self.get_predictions_for_fasta_file(
                 input, output_dir, output_format=output_format)
@@ -595,6 +666,7 @@ class AnalyzeSequences(object):
 
         return None
 
+    @_profile_forward_passes
     def in_silico_mutagenesis_predict(self,
                                       sequence,
                                       base_preds,
@@ -632,12 +704,16 @@ class AnalyzeSequences(object):
         """
         current_sequence_encoding = self.reference_sequence.sequence_to_encoding(
             sequence)
+        # every row is overwritten before the buffer is used, so it is
+        # reused for every batch.
+        batch_sequences = np.zeros(
+            (self.batch_size, *current_sequence_encoding.shape),
+            dtype=np.float32)
         for i in range(0, len(mutations_list), self.batch_size):
             start = i
             end = min(i + self.batch_size, len(mutations_list))
 
-            mutated_sequences = np.zeros(
-                (end - start, *current_sequence_encoding.shape))
+            mutated_sequences = batch_sequences[:end - start]
 
             batch_ids = []
             for ix, mutation_info in enumerate(mutations_list[start:end]):
@@ -647,7 +723,8 @@ class AnalyzeSequences(object):
                 mutated_sequences[ix, :, :] = mutated_seq
                 batch_ids.append(_ism_sample_id(sequence, mutation_info))
             outputs = predict(
-                self.model, mutated_sequences, use_cuda=self.use_cuda)
+                self.model, mutated_sequences,
+                use_cuda=self.use_cuda, precision=self.precision)
 
             for r in reporters:
                 if r.needs_base_pred:
@@ -658,6 +735,7 @@ class AnalyzeSequences(object):
         for r in reporters:
             r.write_to_file()
 
+    @_profile_forward_passes
     def in_silico_mutagenesis(self,
                               sequence,
                               save_data,
@@ -777,7 +855,8 @@ class AnalyzeSequences(object):
         current_sequence_encoding = current_sequence_encoding.reshape(
             (1, *current_sequence_encoding.shape))
         base_preds = predict(
-            self.model, current_sequence_encoding, use_cuda=self.use_cuda)
+            self.model, current_sequence_encoding,
+            use_cuda=self.use_cuda, precision=self.precision)
 
         if "predictions" in save_data and output_format == 'hdf5':
             ref_reporter = self._initialize_reporters(
@@ -797,6 +876,7 @@ class AnalyzeSequences(object):
             mutated_sequences,
             reporters=reporters)
 
+    @_profile_forward_passes
     def in_silico_mutagenesis_from_file(self,
                                         input_path,
                                         save_data,
@@ -914,7 +994,8 @@ class AnalyzeSequences(object):
             base_encoding = cur_sequence_encoding.reshape(
                 1, *cur_sequence_encoding.shape)
             base_preds = predict(
-                self.model, base_encoding, use_cuda=self.use_cuda)
+                self.model, base_encoding,
+                use_cuda=self.use_cuda, precision=self.precision)
 
             file_prefix = None
             if use_sequence_name:
@@ -948,6 +1029,7 @@ class AnalyzeSequences(object):
                 reporters=reporters)
         fasta_file.close()
 
+    @_profile_forward_passes
     def variant_effect_prediction(self,
                                   vcf_file,
                                   save_data,
@@ -1117,7 +1199,8 @@ class AnalyzeSequences(object):
                     batch_alt_seqs,
                     batch_ids,
                     reporters,
-                    use_cuda=self.use_cuda)
+                    use_cuda=self.use_cuda,
+                    precision=self.precision)
                 batch_ref_seqs = []
                 batch_alt_seqs = []
                 batch_ids = []
@@ -1134,7 +1217,8 @@ class AnalyzeSequences(object):
                 batch_alt_seqs,
                 batch_ids,
                 reporters,
-                use_cuda=self.use_cuda)
+                use_cuda=self.use_cuda,
+                precision=self.precision)
 
         for r in reporters:
             r.write_to_file()
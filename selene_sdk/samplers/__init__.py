@@ -6,6 +6,8 @@ from .sampler import Sampler
 from .online_sampler import OnlineSampler
 from .intervals_sampler import IntervalsSampler
 from .random_positions_sampler import RandomPositionsSampler
+from .mixture_sampler import MixtureSampler
+from .tiling_sampler import TilingSampler
 from .multi_file_sampler import MultiFileSampler
 from . import file_samplers
 
@@ -13,5 +15,7 @@ __all__ = ["Sampler",
            "OnlineSampler",
            "IntervalsSampler",
            "RandomPositionsSampler",
+           "MixtureSampler",
+           "TilingSampler",
            "MultiFileSampler",
            "file_samplers"]
@@ -0,0 +1,303 @@
+"""
+This module provides the `DatasetWriter` class, which writes the
+examples drawn by an online sampler to file on a background thread,
+and the `read_journal` method, which loads a file of examples written
+in the compact binary journal format.
+
+A journal file starts with the magic bytes `SELENEJR`, followed by
+any number of chunks. Each chunk starts with the length of its JSON
+metadata as a little-endian `uint32` and the metadata itself, which
+holds the number of examples `n`, the total number of feature indices
+`n_indices`, the number of features and the chromosome names used in
+the chunk. The metadata is followed by the columns of the chunk:
+
+    * `chrom` - `int32[n]`, indices into the chunk's chromosome names.
+    * `start`, `end` - `int64[n]`, the coordinates of each sequence.
+    * `strand` - `int8[n]`, 1 for '+' and -1 for '-'.
+    * `n_targets` - `int32[n]`, the number of features present in
+      each example.
+    * `targets` - `int32[n_indices]`, the indices of the features
+      present in each example, concatenated in order.
+
+"""
+import json
+import os
+from queue import Queue
+import struct
+from threading import Thread
+
+import numpy as np
+
+
+JOURNAL_MAGIC = b"SELENEJR"
+"""
+The bytes that every journal file starts with.
+"""
+
+_COLUMNS = (("chrom", np.int32),
+            ("start", np.int64),
+            ("end", np.int64),
+            ("strand", np.int8),
+            ("n_targets", np.int32))
+
+
+def _write_journal_chunk(file_handle, samples, n_features):
+    """
+    Writes a list of examples to a journal file as a single chunk.
+
+    Parameters
+    ----------
+    file_handle : file object
+        The journal file, opened for writing in binary mode.
+    samples : list(list)
+        The examples, each of which is a list of the chromosome, start,
+        end, strand and the indices of the features present.
+    n_features : int
+        The total number of features.
+
+    Returns
+    -------
+    None
+
+    """
+    chrom_indices = {}
+    chroms = []
+    columns = {name: np.zeros(len(samples), dtype=dtype)
+               for name, dtype in _COLUMNS}
+    targets = []
+    for i, (chrom, start, end, strand, feature_indices) in enumerate(
+            samples):
+        if chrom not in chrom_indices:
+            chrom_indices[chrom] = len(chroms)
+            chroms.append(chrom)
+        columns["chrom"][i] = chrom_indices[chrom]
+        columns["start"][i] = start
+        columns["end"][i] = end
+        columns["strand"][i] = -1 if strand == '-' else 1
+        columns["n_targets"][i] = len(feature_indices)
+        targets.append(np.asarray(feature_indices, dtype=np.int32))
+    targets = np.concatenate(targets) if targets else \
+        np.zeros(0, dtype=np.int32)
+
+    metadata = json.dumps({
+        "n": len(samples),
+        "n_indices": len(targets),
+        "n_features": n_features,
+        "chroms": chroms}).encode("utf-8")
+    file_handle.write(struct.pack("<I", len(metadata)))
+    file_handle.write(metadata)
+    for name, _ in _COLUMNS:
+        file_handle.write(columns[name].tobytes())
+    file_handle.write(targets.tobytes())
+
+
+def read_journal(journal_path):
+    """
+    Loads the examples in a journal file.
+
+    Parameters
+    ----------
+    journal_path : str
+        The path to the journal file.
+
+    Returns
+    -------
+    dict
+        A dictionary with the list of chromosome names (`chroms`), the
+        number of features (`n_features`), the columns `chrom`, `start`,
+        `end` and `strand` of every example, and the feature indices of
+        every example in compressed sparse row format (`target_indptr`
+        and `target_indices`).
+
+    Raises
+    ------
+    ValueError
+        If the file is not a journal file.
+
+    """
+    chroms = []
+    chrom_indices = {}
+    n_features = None
+    columns = {name: [] for name, _ in _COLUMNS}
+    targets = []
+    with open(journal_path, "rb") as file_handle:
+        if file_handle.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError(
+                "{0} is not a Selene journal file.".format(journal_path))
+        while True:
+            metadata_length = file_handle.read(4)
+            if not metadata_length:
+                break
+            metadata_length, = struct.unpack("<I", metadata_length)
+            metadata = json.loads(
+                file_handle.read(metadata_length).decode("utf-8"))
+            n = metadata["n"]
+            n_features = metadata["n_features"]
+            for name, dtype in _COLUMNS:
+                columns[name].append(np.frombuffer(
+                    file_handle.read(n * np.dtype(dtype).itemsize),
+                    dtype=dtype))
+            targets.append(np.frombuffer(
+                file_handle.read(metadata["n_indices"] * 4),
+                dtype=np.int32))
+            # map the chunk's chromosome indices to the journal's
+            chunk_chroms = np.zeros(len(metadata["chroms"]), dtype=np.int32)
+            for i, chrom in enumerate(metadata["chroms"]):
+                if chrom not in chrom_indices:
+                    chrom_indices[chrom] = len(chroms)
+                    chroms.append(chrom)
+                chunk_chroms[i] = chrom_indices[chrom]
+            columns["chrom"][-1] = chunk_chroms[columns["chrom"][-1]]
+
+    journal = {name: np.concatenate(columns[name]) if columns[name] else
+               np.zeros(0, dtype=dtype) for name, dtype in _COLUMNS}
+    n_targets = journal.pop("n_targets")
+    journal["target_indptr"] = np.concatenate(
+        [[0], np.cumsum(n_targets, dtype=np.int64)])
+    journal["target_indices"] = np.concatenate(targets) if targets else \
+        np.zeros(0, dtype=np.int32)
+    journal["chroms"] = chroms
+    journal["n_features"] = n_features
+    return journal
+
+
+class DatasetWriter(object):
+    """
+    Writes the examples drawn by a sampler to files in a background
+    thread, so that formatting and writing the examples does not slow
+    down sampling. The number of batches of examples waiting to be
+    written is bounded, so memory use stays bounded if writing falls
+    behind.
+
+    Parameters
+    ----------
+    output_dir : str
+        The directory to write the files to.
+    n_features : int
+        The total number of features.
+    file_format : {'bed', 'journal'}, optional
+        Default is 'bed'. Write the examples for each mode to a
+        `<mode>_data.bed` file with the columns
+        `[chr, start, end, strand, semicolon_separated_class_indices]`,
+        or to a `<mode>_data.journal` file in the compact binary journal
+        format.
+    max_queue_size : int, optional
+        Default is 4. The maximum number of batches of examples waiting
+        to be written.
+
+    Raises
+    ------
+    ValueError
+        If `file_format` is not one of the supported formats.
+
+    """
+
+    FILE_FORMATS = ("bed", "journal")
+    """
+    The formats that examples can be written in.
+    """
+
+    def __init__(self,
+                 output_dir,
+                 n_features,
+                 file_format="bed",
+                 max_queue_size=4):
+        """
+        Constructs a new `DatasetWriter` object.
+        """
+        if file_format not in self.FILE_FORMATS:
+            raise ValueError(
+                "File format must be one of {0}. Input was '{1}'.".format(
+                    self.FILE_FORMATS, file_format))
+        self.output_dir = output_dir
+        self.n_features = n_features
+        self.file_format = file_format
+        self._file_handles = {}
+        self._error = None
+        self._queue = Queue(maxsize=max_queue_size)
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            mode, samples, close = self._queue.get()
+            try:
+                if self._error is None:
+                    self._write(mode, samples, close)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _write(self, mode, samples, close):
+        if mode not in self._file_handles:
+            self._file_handles[mode] = open(
+                os.path.join(self.output_dir, "{0}_data.{1}".format(
+                    mode, self.file_format)),
+                'w' if self.file_format == "bed" else 'wb')
+            if self.file_format == "journal":
+                self._file_handles[mode].write(JOURNAL_MAGIC)
+        file_handle = self._file_handles[mode]
+        if samples and self.file_format == "bed":
+            file_handle.writelines(
+                "{0}\t{1}\t{2}\t{3}\t{4}\n".format(
+                    chrom, start, end, strand,
+                    ';'.join([str(f) for f in feature_indices]))
+                for (chrom, start, end, strand, feature_indices) in samples)
+        elif samples:
+            _write_journal_chunk(file_handle, samples, self.n_features)
+        if close:
+            file_handle.close()
+            del self._file_handles[mode]
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def write(self, mode, samples, close=False):
+        """
+        Queues examples to be written to the file for `mode`. This only
+        blocks if the queue is full or `close` is True.
+
+        Parameters
+        ----------
+        mode : str
+            The mode the examples were drawn in.
+        samples : list(list)
+            The examples, each of which is a list of the chromosome,
+            start, end, strand and the indices of the features present.
+            The list must not be modified after it is passed in.
+        close : bool, optional
+            Default is False. If True, close the file for `mode` after
+            writing `samples` and wait until all the queued examples are
+            written. If examples are written for `mode` again later,
+            the file is overwritten.
+
+        Raises
+        ------
+        Exception
+            Any error that occurred while writing previously queued
+            examples.
+
+        """
+        self._raise_error()
+        self._queue.put((mode, samples, close))
+        if close:
+            self.flush()
+
+    def flush(self):
+        """
+        Waits until all the queued examples are written.
+
+        Raises
+        ------
+        Exception
+            Any error that occurred while writing the queued examples.
+
+        """
+        self._queue.join()
+        for file_handle in self._file_handles.values():
+            file_handle.flush()
+        self._raise_error()
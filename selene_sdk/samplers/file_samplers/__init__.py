@@ -5,7 +5,15 @@ examples from files.
 from .file_sampler import FileSampler
 from .bed_file_sampler import BedFileSampler
 from .mat_file_sampler import MatFileSampler
+from .interleaved_file_sampler import InterleavedFileSampler
+from .replay_sampler import ReplaySampler
+from .shard_file_sampler import ShardFileSampler
+from .shard_file_sampler import export_shards
 
 __all__ = ["FileSampler",
            "BedFileSampler",
-           "MatFileSampler"]
+           "MatFileSampler",
+           "InterleavedFileSampler",
+           "ReplaySampler",
+           "ShardFileSampler",
+           "export_shards"]
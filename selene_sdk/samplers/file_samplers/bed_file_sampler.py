@@ -4,6 +4,7 @@ This module provides the BedFileSampler class.
 import numpy as np
 
 from .file_sampler import FileSampler
+from .file_sampler import _reseed
 
 class BedFileSampler(FileSampler):
     """
@@ -15,8 +16,12 @@ class BedFileSampler(FileSampler):
         The path to the file to load the data from.
     reference_sequence : selene_sdk.sequences.Sequence
         A reference sequence from which to create examples.
-    n_samples : int
-        Number of lines in the file. (`wc -l <filepath>`)
+    n_samples : int or None, optional
+        Default is None. Number of lines in the file
+        (`wc -l <filepath>`). If None, the number of intervals read
+        from the file is used. Streaming the file in order (see
+        `FileSampler.stream_data_and_targets`) only reads the intervals
+        that have a sequence in `reference_sequence`.
     sequence_length : int or None, optional
         Default is None. If the coordinates of each sample in the BED file
         already account for the full sequence (that is,
@@ -35,6 +40,12 @@ class BedFileSampler(FileSampler):
     n_features : int or None, optional
         Default is None. If `targets_avail` is True, must specify
         `n_features`, the total number of features (classes).
+    shuffle : bool, optional
+        Default is False. If True, shuffle the order of the intervals
+        after every pass over the file. Otherwise, intervals are
+        sampled in the order they appear in the file.
+    random_seed : int, optional
+        Default is 436. Sets the random seed for shuffling.
 
     Attributes
     ----------
@@ -67,22 +78,200 @@ class BedFileSampler(FileSampler):
     def __init__(self,
                  filepath,
                  reference_sequence,
-                 n_samples,
+                 n_samples=None,
                  sequence_length=None,
                  targets_avail=False,
-                 n_features=None):
+                 n_features=None,
+                 shuffle=False,
+                 random_seed=436):
         """
         Constructs a new `BedFileSampler` object.
         """
         super(BedFileSampler, self).__init__()
         self.filepath = filepath
-        self._file_handle = open(self.filepath, 'r')
         self.reference_sequence = reference_sequence
         self.sequence_length = sequence_length
         self.targets_avail = targets_avail
         self.n_features = n_features
+
+        self._load_intervals()
+        if n_samples is None:
+            n_samples = len(self._starts)
         self.n_samples = n_samples
 
+        self._shuffle = shuffle
+        self._rng = np.random.RandomState(random_seed)
+        self._sample_indices = np.arange(len(self._starts))
+        if self._shuffle:
+            self._rng.shuffle(self._sample_indices)
+        self._sample_next = 0
+        self._n_valid_intervals = None
+
+    def _load_intervals(self):
+        """
+        Parses the `*.bed` file once into arrays of chromosome indices,
+        start and end coordinates (adjusted to `sequence_length`), and
+        the feature indices of each interval in compressed sparse row
+        format.
+        """
+        self._chroms = []
+        chrom_indices = {}
+        chroms = []
+        starts = []
+        ends = []
+        target_indptr = [0]
+        target_indices = []
+        with open(self.filepath, 'r') as file_handle:
+            for line in file_handle:
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) < 3:
+                    continue
+                chrom = cols[0]
+                start = int(cols[1])
+                end = int(cols[2])
+                features = None
+                if len(cols) == 5:
+                    features = cols[4].strip()
+                elif len(cols) == 4 and self.targets_avail:
+                    features = cols[3].strip()
+
+                n = end - start
+                if self.sequence_length and n < self.sequence_length:
+                    diff = (self.sequence_length - n) / 2
+                    start = start - int(np.floor(diff))
+                    end = end + int(np.ceil(diff))
+                elif self.sequence_length and n > self.sequence_length:
+                    start = start + int((n - self.sequence_length) // 2)
+                    end = int(start + self.sequence_length)
+
+                if chrom not in chrom_indices:
+                    chrom_indices[chrom] = len(self._chroms)
+                    self._chroms.append(chrom)
+                chroms.append(chrom_indices[chrom])
+                starts.append(start)
+                ends.append(end)
+                if self.targets_avail:
+                    target_indices += [
+                        int(f) for f in features.split(';') if f]
+                    target_indptr.append(len(target_indices))
+        self._chrom_ids = np.array(chroms, dtype=np.int32)
+        self._starts = np.array(starts, dtype=np.int64)
+        self._ends = np.array(ends, dtype=np.int64)
+        self._target_indptr = np.array(target_indptr, dtype=np.int64)
+        self._target_indices = np.array(target_indices, dtype=np.int64)
+
+    def set_rank(self, rank, world_size=1):
+        """
+        Prepares the sampler to be used by one of several processes
+        that train a model together (see `FileSampler.set_rank`). If
+        the intervals are shuffled, the random state is reseeded
+        differently in each process and the order of the intervals is
+        drawn again. Otherwise, the intervals are split between the
+        processes.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        """
+        if not self._shuffle:
+            super(BedFileSampler, self).set_rank(rank, world_size=world_size)
+            return
+        super(BedFileSampler, self).set_rank(rank)
+        # the order of the first pass was drawn when the sampler was
+        # constructed, before the random state was reseeded.
+        self._rng = _reseed(self._rng, rank)
+        self._rng.shuffle(self._sample_indices)
+        self._sample_next = 0
+
+    def _split_rows(self, rank, world_size):
+        """
+        Restricts the sampler to the intervals on the rows
+        `rank::world_size` (see `FileSampler._split_rows`).
+        """
+        self._sample_indices = self._sample_indices[rank::world_size]
+        self._sample_next = 0
+
+    def _next_indices(self, n):
+        """
+        Gets the indices of the next `n` intervals to sample. The
+        intervals are reshuffled (if `shuffle`) after every pass over
+        the file.
+        """
+        indices = []
+        while n > 0:
+            if self._sample_next == len(self._sample_indices):
+                if self._shuffle:
+                    self._rng.shuffle(self._sample_indices)
+                self._sample_next = 0
+            end = min(self._sample_next + n, len(self._sample_indices))
+            indices.append(self._sample_indices[self._sample_next:end])
+            n -= end - self._sample_next
+            self._sample_next = end
+        return np.concatenate(indices)
+
+    def _get_encodings(self, indices):
+        """
+        Gets the sequence encodings of a batch of intervals. Sequences
+        are fetched in genomic order and, if they all have the same
+        length, encoded with a single call to the reference sequence.
+
+        Parameters
+        ----------
+        indices : numpy.ndarray
+            The indices of the intervals.
+
+        Returns
+        -------
+        encodings, valid : tuple(numpy.ndarray, numpy.ndarray)
+            The encodings of the valid intervals and a boolean mask of
+            which of the intervals in `indices` are valid (that is, the
+            reference sequence returned a non-empty sequence for them).
+
+        """
+        sequences = [None] * len(indices)
+        genome_order = np.lexsort(
+            (self._starts[indices], self._chrom_ids[indices]))
+        for i in genome_order:
+            ix = indices[i]
+            # strandedness is not used: all sequences are taken from the
+            # '+' strand.
+            sequences[i] = self.reference_sequence.get_sequence_from_coords(
+                self._chroms[self._chrom_ids[ix]],
+                int(self._starts[ix]),
+                int(self._ends[ix]),
+                strand='+')
+        valid = np.array([len(seq) > 0 for seq in sequences], dtype=bool)
+        sequences = [seq for seq in sequences if seq]
+        if not sequences:
+            return np.array([]), valid
+        lengths = set(len(seq) for seq in sequences)
+        if len(lengths) == 1:
+            encoding = self.reference_sequence.sequence_to_encoding(
+                ''.join(sequences))
+            return (encoding.reshape(len(sequences), lengths.pop(), -1).astype(
+                np.float32, copy=False), valid)
+        return (np.array([self.reference_sequence.sequence_to_encoding(seq)
+                          for seq in sequences], dtype=np.float32), valid)
+
+    def _get_targets(self, indices):
+        """
+        Builds the :math:`B \\times F` targets matrix of a batch of
+        intervals from the cached feature indices.
+        """
+        targets = np.zeros((len(indices), self.n_features), dtype=np.float32)
+        row_starts = self._target_indptr[indices]
+        n_features = self._target_indptr[indices + 1] - row_starts
+        offsets = row_starts - (np.cumsum(n_features) - n_features)
+        rows = np.repeat(np.arange(len(indices)), n_features)
+        cols = self._target_indices[
+            np.repeat(offsets, n_features) + np.arange(n_features.sum())]
+        targets[rows, cols] = 1
+        return targets
+
     def sample(self, batch_size=1):
         """
         Draws a mini-batch of examples and their corresponding
@@ -106,66 +295,81 @@ class BedFileSampler(FileSampler):
             The shape of `targets` will be :math:`B \\times F`,
             where :math:`F` is the number of features.
 
+        """
+        return self._get_batch(self._next_indices, batch_size)
+
+    def _get_batch(self, next_indices, batch_size):
+        """
+        Builds a batch of `batch_size` intervals, skipping the
+        intervals that have no sequence.
+
+        Parameters
+        ----------
+        next_indices : function
+            Returns the indices of the next `n` intervals to use.
+        batch_size : int
+            The number of intervals in the batch.
+
+        Returns
+        -------
+        sequences, targets : tuple(numpy.ndarray, numpy.ndarray)
+            The batch, in the format returned by `sample`.
+
         """
         sequences = []
-        targets = None
-        if self.targets_avail:
-            targets = []
-        while len(sequences) < batch_size:
-            line = self._file_handle.readline()
-            if not line:
-                # TODO: add functionality to shuffle the file if sampler
-                # reaches the end of the file.
-                self._file_handle.close()
-                self._file_handle = open(self.filepath, 'r')
-                line = self._file_handle.readline()
-            cols = line.split('\t')
-            chrom = cols[0]
-            start = int(cols[1])
-            end = int(cols[2])
-            strand_side = None
-            features = None
-
-            if len(cols) == 5:
-                strand_side = cols[3]
-                features = cols[4].strip()
-            elif len(cols) == 4 and self.targets_avail:
-                features = cols[3].strip()
-            elif len(cols) == 4:
-                strand_side = cols[3].strip()
-
-            # if strand_side is None, assume strandedness does not matter.
-            # can change this to randomly selecting +/- later
-            strand_side = '+'
-            n = end - start
-            if self.sequence_length and n < self.sequence_length:
-                diff = (self.sequence_length - n) / 2
-                pad_l = int(np.floor(diff))
-                pad_r = int(np.ceil(diff))
-                start = start - pad_l
-                end = end + pad_r
-            elif self.sequence_length and n > self.sequence_length:
-                start = int((n - self.sequence_length) // 2)
-                end = int(start + self.sequence_length)
-
-            sequence = self.reference_sequence.get_encoding_from_coords(
-                chrom, start, end, strand=strand_side)
-            if sequence.shape[0] == 0:
+        indices = []
+        n_needed = batch_size
+        while n_needed > 0:
+            batch_indices = next_indices(n_needed)
+            encodings, valid = self._get_encodings(batch_indices)
+            if not valid.any():
                 continue
+            sequences.append(encodings)
+            indices.append(batch_indices[valid])
+            n_needed -= int(valid.sum())
 
-            sequences.append(sequence)
-            if self.targets_avail:
-                tgts = np.zeros((self.n_features))
-                features = [int(f) for f in features.split(';') if f]
-                tgts[features] = 1
-                targets.append(tgts.astype(float))
-
-        sequences = np.array(sequences)
+        sequences = np.concatenate(sequences)
         if self.targets_avail:
-            targets = np.array(targets)
+            targets = self._get_targets(np.concatenate(indices))
             return (sequences, targets)
         return sequences,
 
+    def _n_streamed_samples(self):
+        """
+        Counts the intervals that have a sequence in the reference
+        sequence (e.g. that are not out of bounds or blacklisted), which
+        are the ones that `_read_in_order` reads, once.
+        """
+        if self._n_valid_intervals is None:
+            self._n_valid_intervals = sum(
+                self.reference_sequence.coords_in_bounds(
+                    self._chroms[chrom_id], int(start), int(end))
+                for (chrom_id, start, end) in zip(
+                    self._chrom_ids, self._starts, self._ends))
+        return min(self.n_samples, self._n_valid_intervals)
+
+    def _read_in_order(self, start, batch_size):
+        """
+        Reads the next `batch_size` intervals in the `*.bed` file that
+        have a sequence, starting with the interval on row `start` (see
+        `FileSampler._read_in_order`).
+        """
+        next_row = [start]
+
+        def _next_indices(n):
+            if next_row[0] == len(self._starts):
+                raise ValueError(
+                    "Reached the end of {0} before reading the requested "
+                    "number of intervals that have a sequence in the "
+                    "reference sequence.".format(self.filepath))
+            indices = np.arange(
+                next_row[0], min(next_row[0] + n, len(self._starts)))
+            next_row[0] = indices[-1] + 1
+            return indices
+
+        batch = self._get_batch(_next_indices, batch_size)
+        return batch, next_row[0]
+
     def get_data(self, batch_size, n_samples=None):
         """
         This method fetches a subset of the data from the sampler,
@@ -202,7 +406,8 @@ class BedFileSampler(FileSampler):
         sequences.append(seqs)
         return sequences
 
-    def get_data_and_targets(self, batch_size, n_samples=None):
+    def get_data_and_targets(self, batch_size, n_samples=None,
+                             feature_indices=None):
         """
         This method fetches a subset of the sequence data and
         targets from the sampler, divided into batches.
@@ -213,6 +418,9 @@ class BedFileSampler(FileSampler):
             The size of the batches to divide the data into.
         n_samples : int, optional
             Default is None. The total number of samples to retrieve.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
 
         Returns
         -------
@@ -242,11 +450,15 @@ class BedFileSampler(FileSampler):
         count = batch_size
         while count < n_samples:
             seqs, tgts = self.sample(batch_size=batch_size)
+            if feature_indices is not None:
+                tgts = tgts[:, feature_indices]
             sequences_and_targets.append((seqs, tgts))
             targets_mat.append(tgts)
             count += batch_size
         remainder = batch_size - (count - n_samples)
         seqs, tgts = self.sample(batch_size=remainder)
+        if feature_indices is not None:
+            tgts = tgts[:, feature_indices]
         sequences_and_targets.append((seqs, tgts))
         targets_mat.append(tgts)
         targets_mat = np.vstack(targets_mat).astype(int)
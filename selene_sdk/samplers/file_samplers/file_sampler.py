@@ -8,6 +8,20 @@ Selene implements and will resolve this issue soon.
 from abc import ABCMeta
 from abc import abstractmethod
 
+import numpy as np
+
+from ..sampler import _select_features
+
+
+def _reseed(random_state, rank):
+    """
+    Returns a new random state drawn from `random_state`, which is
+    seeded differently in each of several processes that train a
+    model together.
+    """
+    return np.random.RandomState(
+        (random_state.randint(2 ** 31) + rank) % 2 ** 32)
+
 
 class FileSampler(metaclass=ABCMeta):
     """
@@ -38,8 +52,67 @@ class FileSampler(metaclass=ABCMeta):
         """
         raise NotImplementedError()
 
+    def set_rank(self, rank, world_size=1):
+        """
+        Prepares the sampler to be used by one of several processes
+        that train a model together (see
+        `selene_sdk.samplers.Sampler.set_rank`). The `numpy.random`
+        state is reseeded differently in each process, and the rows of
+        the file are split between the processes (see `_split_rows`).
+        Samplers that read their file in a random order override this
+        to reseed their own random state and draw the order again
+        instead of splitting the file. This must be called before the
+        first batch is drawn.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process, from 0 to the number of processes
+            minus 1.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        Raises
+        ------
+        ValueError
+            If the sampler reads its file in order and cannot be split
+            between the processes.
+
+        """
+        np.random.seed((np.random.randint(2 ** 31) + rank) % 2 ** 32)
+        if world_size > 1:
+            self._split_rows(rank, world_size)
+
+    def _split_rows(self, rank, world_size):
+        """
+        Restricts a sampler that reads its file in order to the rows
+        `rank::world_size`, so that each of the `world_size` processes
+        that train a model together reads different examples: the
+        process with rank `rank` only reads the rows `rank`,
+        `rank + world_size`, `rank + 2 * world_size`, and so on.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process.
+        world_size : int
+            The number of processes.
+
+        Raises
+        ------
+        ValueError
+            If the sampler cannot be split.
+
+        """
+        raise ValueError(
+            "{0} reads its file in order, so every process would draw the "
+            "same training examples, and it cannot be split between "
+            "processes. Please enable shuffling for distributed "
+            "training.".format(type(self).__name__))
+
     @abstractmethod
-    def get_data_and_targets(self, batch_size, n_samples):
+    def get_data_and_targets(self, batch_size, n_samples,
+                             feature_indices=None):
         """
         This method fetches a subset of the sequence data and
         corresponding targets from the sampler, divided into batches.
@@ -50,10 +123,105 @@ class FileSampler(metaclass=ABCMeta):
             The size of the batches to divide the data into.
         n_samples : int
             The total number of samples to retrieve.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
 
         """
         raise NotImplementedError()
 
+    def _n_streamed_samples(self):
+        """
+        Gets the number of samples in one pass over the file with
+        `_read_in_order`, which is `n_samples` unless the sampler skips
+        some rows of the file.
+
+        Returns
+        -------
+        int
+            The number of samples.
+
+        """
+        return self.n_samples
+
+    def _read_in_order(self, start, batch_size):
+        """
+        Reads the `batch_size` samples that start at row `start` of
+        the file, in the order they are stored. This does not change
+        the state that `sample` draws from. Samplers that can be
+        streamed with `stream_data_and_targets` implement this method.
+
+        Parameters
+        ----------
+        start : int
+            The first row to read.
+        batch_size : int
+            The number of samples to read.
+
+        Returns
+        -------
+        batch, end : tuple(tuple(numpy.ndarray, ...), int)
+            The batch, in the same format as `sample` returns it, and
+            the row after the last one that was read.
+
+        """
+        raise NotImplementedError(
+            "{0} does not support streaming. Please use "
+            "`get_data_and_targets` instead.".format(type(self).__name__))
+
+    def stream_data_and_targets(self,
+                                batch_size,
+                                n_samples=None,
+                                feature_indices=None):
+        """
+        This method has the same role as `get_data_and_targets`, but
+        returns a generator that reads the batches as they are consumed
+        instead of holding all of them in memory. The samples are read
+        in the order they are stored in the file, starting from its
+        first row, so every pass over the generator returns the same
+        samples whether or not the sampler shuffles the samples it
+        draws with `sample`. Streaming does not change the samples that
+        `sample` draws.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+            If None or larger than the number of samples in the file,
+            uses one pass over the file.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        batches, n_samples : tuple(generator, int)
+            A generator of sequence-target pairs and the total number
+            of samples that the generator will yield. The last batch is
+            smaller than `batch_size` if `n_samples` is not a multiple
+            of it.
+
+        """
+        n_samples_in_file = self._n_streamed_samples()
+        if not n_samples or n_samples > n_samples_in_file:
+            n_samples = n_samples_in_file
+
+        def _batches():
+            count = 0
+            next_row = 0
+            while count < n_samples:
+                batch, next_row = self._read_in_order(
+                    next_row, min(batch_size, n_samples - count))
+                if len(batch) < 2:
+                    raise ValueError(
+                        "No targets are available from this sampler. "
+                        "Please use `get_data` instead.")
+                count += len(batch[0])
+                yield batch
+        return _select_features(_batches(), feature_indices), n_samples
+
     @abstractmethod
     def get_data(self, batch_size, n_samples):
         """
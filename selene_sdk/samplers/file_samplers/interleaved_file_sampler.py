@@ -0,0 +1,346 @@
+"""
+This module provides the `InterleavedFileSampler` class, which mixes
+the samples drawn from several file samplers.
+"""
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+
+from .file_sampler import FileSampler
+from .file_sampler import _reseed
+
+
+class InterleavedFileSampler(FileSampler):
+    """
+    Draws samples from several file samplers at once, mixed according
+    to a weight for each sampler. Every sampler is read on its own
+    background thread, so reads from different files overlap. The
+    samples are mixed in a shuffle buffer, from which each mini-batch
+    is drawn at random.
+
+    When a sampler is chosen for the next sample but its reader has
+    not yet caught up, a sample from another sampler that has one
+    ready is used instead, so that a single slow file does not stall
+    the batch. The skipped sample is made up for once the reader
+    catches up, so the samplers are mixed according to the weights
+    over time, unless a reader is persistently slower than its share
+    of the samples. Which sample is used instead depends on the timing
+    of the readers, so the batches differ between runs with the same
+    `random_seed`. Set `deterministic` to always wait for the chosen
+    sampler instead, which reproduces the batches exactly, at the cost
+    of stalling on a slow file. The samples are drawn at random, so
+    this sampler cannot be streamed with `stream_data_and_targets`.
+
+    Parameters
+    ----------
+    samplers : list(selene_sdk.samplers.file_samplers.FileSampler)
+        The file samplers to draw samples from. Each sampler must report
+        its number of samples (`n_samples`), and is only used by its
+        reader thread, so it must not be used elsewhere.
+    weights : list(float) or None, optional
+        Default is None. The relative frequency with which each sampler
+        is drawn from. If None, each sampler is weighted by its number
+        of samples (`n_samples`), which draws samples in the same
+        proportions as a single merged file would.
+    shuffle_buffer_size : int, optional
+        Default is 10000. The number of samples in the shuffle buffer.
+        Larger buffers mix the samplers more thoroughly. If 0, samples
+        are returned in the order they are drawn.
+    reader_batch_size : int, optional
+        Default is 64. The number of samples each reader thread draws
+        from its sampler at a time.
+    max_queue_size : int, optional
+        Default is 4. The maximum number of batches each reader thread
+        draws ahead.
+    random_seed : int, optional
+        Default is 436. The seed for choosing the samplers and shuffling
+        the buffer.
+    deterministic : bool, optional
+        Default is False. If True, always wait for the reader of the
+        chosen sampler, so that the samples drawn only depend on
+        `random_seed` and the samplers, and not on the timing of the
+        readers.
+
+    Attributes
+    ----------
+    n_samples : int
+        The total number of samples in all the samplers.
+    weights : numpy.ndarray
+        The probability of drawing from each sampler.
+
+    Raises
+    ------
+    ValueError
+        If `samplers` is empty, if a sampler does not report its number
+        of samples, or if the number of `weights` does not match the
+        number of samplers or the weights are not positive.
+
+    """
+
+    def __init__(self,
+                 samplers,
+                 weights=None,
+                 shuffle_buffer_size=10000,
+                 reader_batch_size=64,
+                 max_queue_size=4,
+                 random_seed=436,
+                 deterministic=False):
+        """
+        Constructs a new `InterleavedFileSampler` object.
+        """
+        super(InterleavedFileSampler, self).__init__()
+        if not samplers:
+            raise ValueError("At least 1 sampler must be specified.")
+        sampler_sizes = [getattr(s, "n_samples", None) for s in samplers]
+        if None in sampler_sizes:
+            raise ValueError(
+                "Sampler {0} does not report its number of samples "
+                "(`n_samples`), which is needed to know how many samples "
+                "all the samplers hold together.".format(
+                    sampler_sizes.index(None)))
+        if weights is None:
+            weights = sampler_sizes
+        if len(weights) != len(samplers) or min(weights) <= 0:
+            raise ValueError(
+                "Expected a positive weight for each of the {0} samplers. "
+                "Input was {1}.".format(len(samplers), weights))
+        self._samplers = samplers
+        self.weights = np.array(weights, dtype=float) / np.sum(weights)
+        self.n_samples = sum(sampler_sizes)
+
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._reader_batch_size = reader_batch_size
+        self._max_queue_size = max_queue_size
+        self._rng = np.random.RandomState(random_seed)
+        self._deterministic = deterministic
+
+        self._queues = None
+        self._pending = [None] * len(samplers)
+        self._owed = np.zeros(len(samplers), dtype=np.int64)
+        self._buffer = None
+
+    def set_rank(self, rank, world_size=1):
+        """
+        Reseeds the random state used to mix the samplers differently
+        in each of several processes that train a model together, and
+        prepares each sampler in the same way (see
+        `FileSampler.set_rank`). This must be called before the first
+        batch is drawn.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        """
+        # the samples are mixed at random, so only the samplers that are
+        # mixed are split between the processes.
+        super(InterleavedFileSampler, self).set_rank(rank)
+        self._rng = _reseed(self._rng, rank)
+        for sampler in self._samplers:
+            sampler.set_rank(rank, world_size=world_size)
+
+    def _read_sampler(self, sampler, queue):
+        """
+        Fills `queue` with batches drawn from `sampler` indefinitely.
+        This is run on a background thread. Any error is passed on
+        through `queue`.
+        """
+        try:
+            while True:
+                queue.put(sampler.sample(batch_size=self._reader_batch_size))
+        except Exception as error:
+            queue.put(error)
+
+    def _start_readers(self):
+        self._queues = []
+        for sampler in self._samplers:
+            queue = Queue(maxsize=self._max_queue_size)
+            reader = Thread(target=self._read_sampler, args=(sampler, queue))
+            reader.daemon = True
+            reader.start()
+            self._queues.append(queue)
+
+    def _has_ready_sample(self, index):
+        """
+        Whether a sample from sampler `index` can be taken without
+        waiting for its reader.
+        """
+        pending = self._pending[index]
+        return (pending is not None and pending[2] < len(pending[0])) or \
+            not self._queues[index].empty()
+
+    def _take_sample(self, index):
+        """
+        Takes the next sample drawn by the reader for sampler `index`,
+        waiting for the reader if needed.
+        """
+        pending = self._pending[index]
+        if pending is None or pending[2] == len(pending[0]):
+            batch = self._queues[index].get()
+            if isinstance(batch, Exception):
+                raise batch
+            pending = [batch[0], batch[1], 0]
+            self._pending[index] = pending
+        position = pending[2]
+        pending[2] += 1
+        return pending[0][position], pending[1][position]
+
+    def _substitute_ready_sampler(self, index):
+        """
+        Gets the sampler to take the next sample from when sampler
+        `index` is chosen, which is another sampler that has a sample
+        ready if the reader for `index` has not caught up.
+        """
+        # samples that were skipped because a reader had not caught up
+        # are made up for as soon as it has, so that the samplers are
+        # still mixed according to the weights over time.
+        owed = [i for i in np.nonzero(self._owed)[0]
+                if self._has_ready_sample(i)]
+        if owed:
+            index = self._rng.choice(
+                owed, p=self.weights[owed] / np.sum(self.weights[owed]))
+            self._owed[index] -= 1
+        elif not self._has_ready_sample(index):
+            ready = [i for i in range(len(self._samplers))
+                     if self._has_ready_sample(i)]
+            if ready:
+                self._owed[index] += 1
+                index = self._rng.choice(
+                    ready, p=self.weights[ready] / np.sum(
+                        self.weights[ready]))
+        return index
+
+    def _draw(self, n):
+        """
+        Draws `n` samples from the samplers according to their weights.
+        """
+        choices = self._rng.choice(len(self._samplers), size=n, p=self.weights)
+        sequences = []
+        targets = []
+        for index in choices:
+            if not self._deterministic:
+                index = self._substitute_ready_sampler(index)
+            sequence, target = self._take_sample(index)
+            sequences.append(sequence)
+            targets.append(target)
+        return np.array(sequences), np.array(targets)
+
+    def sample(self, batch_size=1):
+        """
+        Draws a mini-batch of examples and their corresponding labels
+        from the shuffle buffer.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Default is 1. The number of examples to include in the
+            mini-batch.
+
+        Returns
+        -------
+        sequences, targets : tuple(numpy.ndarray, numpy.ndarray)
+            A tuple containing the numeric representation of the
+            sequence examples and their corresponding labels. The
+            shape of `sequences` will be
+            :math:`B \\times L \\times N`, where :math:`B` is
+            `batch_size`, :math:`L` is the sequence length, and
+            :math:`N` is the size of the sequence type's alphabet.
+            The shape of `targets` will be :math:`B \\times F`,
+            where :math:`F` is the number of features.
+
+        """
+        if self._queues is None:
+            self._start_readers()
+        if self._shuffle_buffer_size == 0:
+            return self._draw(batch_size)
+        if self._buffer is None:
+            self._buffer = self._draw(
+                max(self._shuffle_buffer_size, batch_size))
+        # return random samples from the buffer and replace them with
+        # newly drawn ones.
+        buffer_sequences, buffer_targets = self._buffer
+        positions = self._rng.choice(
+            len(buffer_sequences), size=batch_size, replace=False)
+        sequences = buffer_sequences[positions]
+        targets = buffer_targets[positions]
+        buffer_sequences[positions], buffer_targets[positions] = \
+            self._draw(batch_size)
+        return sequences, targets
+
+    def get_data(self, batch_size, n_samples=None):
+        """
+        This method fetches a subset of the data from the sampler,
+        divided into batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+            If None, uses `self.n_samples`.
+
+        Returns
+        -------
+        sequences : list(np.ndarray)
+            The list of sequences grouped into batches.
+            An element in the `sequences` list is of
+            the shape :math:`B \\times L \\times N`, where :math:`B`
+            is `batch_size`, :math:`L` is the sequence length,
+            and :math:`N` is the size of the sequence type's alphabet.
+
+        """
+        sequences_and_targets, _ = self.get_data_and_targets(
+            batch_size, n_samples=n_samples)
+        return [s for (s, t) in sequences_and_targets]
+
+    def get_data_and_targets(self, batch_size, n_samples=None,
+                             feature_indices=None):
+        """
+        This method fetches a subset of the sequence data and
+        targets from the sampler, divided into batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+            If None, uses `self.n_samples`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        sequences_and_targets, targets_matrix : \
+        tuple(list(tuple(numpy.ndarray, numpy.ndarray)), numpy.ndarray)
+            Tuple containing the list of sequence-target pairs, as well
+            as a single matrix with all targets in the same order.
+            Note that `sequences_and_targets`'s sequence elements are of
+            the shape :math:`B \\times L \\times N` and its target
+            elements are of the shape :math:`B \\times F`, where
+            :math:`B` is `batch_size`, :math:`L` is the sequence length,
+            :math:`N` is the size of the sequence type's alphabet, and
+            :math:`F` is the number of features. Further,
+            `target_matrix` is of the shape :math:`S \\times F`, where
+            :math:`S =` `n_samples`.
+
+        """
+        if not n_samples:
+            n_samples = self.n_samples
+        sequences_and_targets = []
+        count = 0
+        while count < n_samples:
+            sequences, targets = self.sample(
+                batch_size=min(batch_size, n_samples - count))
+            if feature_indices is not None:
+                targets = targets[:, feature_indices]
+            sequences_and_targets.append((sequences, targets))
+            count += len(sequences)
+        targets_mat = np.vstack([t for (s, t) in sequences_and_targets])
+        return sequences_and_targets, targets_mat
@@ -2,14 +2,42 @@
 This module provides the `MatFileSampler` class and its supporting
 methods.
 """
+import os
+from queue import Queue
+from threading import Thread
+
 import h5py
 import numpy as np
 import scipy.io
 
 from .file_sampler import FileSampler
+from .file_sampler import _reseed
 
 
-def _load_mat_file(filepath, sequence_key, targets_key=None):
+def _npy_sidecar_path(filepath, key):
+    """
+    Gets the path to the `*.npy` copy of the matrix `key` in the
+    `*.mat` file `filepath`.
+    """
+    return "{0}.{1}.npy".format(filepath, key)
+
+
+def _write_npy_sidecar(filepath, key, matrix):
+    """
+    Saves a matrix loaded from a `*.mat` file to its `*.npy` copy and
+    memory-maps the copy. The copy is written to a temporary file
+    first, so that processes loading the same file concurrently never
+    see a partially written copy.
+    """
+    sidecar_path = _npy_sidecar_path(filepath, key)
+    tmp_path = "{0}.{1}.tmp".format(sidecar_path, os.getpid())
+    with open(tmp_path, "wb") as file_handle:
+        np.save(file_handle, matrix)
+    os.replace(tmp_path, sidecar_path)
+    return np.load(sidecar_path, mmap_mode='r')
+
+
+def _load_mat_file(filepath, sequence_key, targets_key=None, memmap=False):
     """
     Loads data from a `*.mat` file or a `*.h5` file.
 
@@ -21,6 +49,11 @@ def _load_mat_file(filepath, sequence_key, targets_key=None):
         The key for the sequences data matrix.
     targets_key : str, optional
         Default is None. The key for the targets data matrix.
+    memmap : bool, optional
+        Default is False. If the file can be loaded with `scipy.io`,
+        save each matrix to a `<filepath>.<key>.npy` file (once, or
+        whenever `filepath` is newer than it) and memory-map that
+        file read-only instead of keeping the matrix in memory.
 
     Returns
     -------
@@ -31,8 +64,21 @@ def _load_mat_file(filepath, sequence_key, targets_key=None):
         the 2 matrices and the h5py file handle are returned.
 
     """
+    keys = [sequence_key]
+    if targets_key:
+        keys.append(targets_key)
+    if memmap:
+        sidecar_paths = [_npy_sidecar_path(filepath, k) for k in keys]
+        if all(os.path.isfile(p) and
+               os.path.getmtime(p) >= os.path.getmtime(filepath)
+               for p in sidecar_paths):
+            matrices = [np.load(p, mmap_mode='r') for p in sidecar_paths]
+            return (matrices[0], matrices[1] if targets_key else None)
     try:  # see if we can load the file using scipy first
         mat = scipy.io.loadmat(filepath)
+        if memmap:
+            for key in keys:
+                mat[key] = _write_npy_sidecar(filepath, key, mat[key])
         targets = None
         if targets_key:
             targets = mat[targets_key]
@@ -46,6 +92,9 @@ def _load_mat_file(filepath, sequence_key, targets_key=None):
         return (sequences, targets, mat)
 
 
+_DEFAULT_BLOCK_SIZE = 1024
+
+
 class MatFileSampler(FileSampler):
     """
     A sampler for which the dataset is loaded directly from a `*.mat` file.
@@ -69,6 +118,33 @@ class MatFileSampler(FileSampler):
         Default is 1. Specify the alphabet axis.
     targets_batch_axis : int, optional
         Default is 0. Speciy the batch axis.
+    block_shuffle : bool, optional
+        Default is False. If True, samples are read in contiguous
+        blocks rather than one row at a time. The blocks are aligned
+        to the HDF5 chunks along the batch axis (if the matrix is
+        chunked), the order of the blocks is shuffled each pass over
+        the data, and the samples are shuffled within a read-ahead
+        buffer of `buffer_size` samples. Buffers are read and
+        transposed on a background thread. This is much faster for
+        large HDF5 (v7.3) `*.mat` files, which are otherwise read at
+        random across the whole file.
+    buffer_size : int, optional
+        Default is 65536. Only used if `block_shuffle`. The number of
+        samples read into each read-ahead buffer (rounded up to a
+        whole number of blocks).
+    dtype : str or None, optional
+        Default is None. The type of the sequences and targets that
+        are returned, e.g. 'float32' or 'uint8'. If None, 'float32'
+        is used. The matrix
+        is kept in its stored type (e.g. `uint8` one-hot encodings) and
+        only the samples in each batch are converted.
+    memmap : bool, optional
+        Default is False. Only used for files that can be loaded with
+        `scipy.io` (HDF5 files are always read lazily). If True, the
+        matrices are saved once to `<filepath>.<key>.npy` files in
+        their stored type and memory-mapped read-only. Processes on the
+        same machine that load the same file then share its pages in
+        the page cache, rather than each holding its own copy.
 
     Attributes
     ----------
@@ -84,7 +160,11 @@ class MatFileSampler(FileSampler):
                  shuffle=True,
                  sequence_batch_axis=0,
                  sequence_alphabet_axis=1,
-                 targets_batch_axis=0):
+                 targets_batch_axis=0,
+                 block_shuffle=False,
+                 buffer_size=65536,
+                 dtype=None,
+                 memmap=False):
         """
         Constructs a new `MatFileSampler` object.
         """
@@ -92,7 +172,8 @@ class MatFileSampler(FileSampler):
         out = _load_mat_file(
             filepath,
             sequence_key,
-            targets_key=targets_key)
+            targets_key=targets_key,
+            memmap=memmap)
         self._sample_seqs = out[0]
         self._sample_tgts = out[1]
         self._mat_fh = None
@@ -113,6 +194,22 @@ class MatFileSampler(FileSampler):
         if self._shuffle:
             np.random.shuffle(self._sample_indices)
 
+        self._block_shuffle = block_shuffle
+        if dtype is None:
+            dtype = "float32"
+        self._dtype = np.dtype(dtype)
+        if self._block_shuffle:
+            chunks = getattr(self._sample_seqs, "chunks", None)
+            self._block_size = _DEFAULT_BLOCK_SIZE
+            if chunks:
+                self._block_size = chunks[self._seq_batch_axis]
+            self._blocks_per_buffer = max(
+                1, -(-buffer_size // self._block_size))
+            self._rng = np.random.RandomState(random_seed)
+            self._buffers = None
+            self._buffer = None
+            self._buffer_next = 0
+
     def sample(self, batch_size=1):
         """
         Draws a mini-batch of examples and their corresponding
@@ -136,6 +233,8 @@ class MatFileSampler(FileSampler):
             The shape of `targets` will be :math:`B \\times F`,
             where :math:`F` is the number of features.
         """
+        if self._block_shuffle:
+            return self._sample_from_buffers(batch_size)
         sample_up_to = self._sample_next + batch_size
         use_indices = None
         if sample_up_to >= len(self._sample_indices):
@@ -148,11 +247,14 @@ class MatFileSampler(FileSampler):
         self._sample_next += batch_size
         use_indices = sorted(use_indices)
         if self._seq_batch_axis == 0:
-            sequences = self._sample_seqs[use_indices, :, :].astype(float)
+            sequences = self._sample_seqs[use_indices, :, :].astype(
+                self._dtype)
         elif self._seq_batch_axis == 1:
-            sequences = self._sample_seqs[:, use_indices, :].astype(float)
+            sequences = self._sample_seqs[:, use_indices, :].astype(
+                self._dtype)
         else:
-            sequences = self._sample_seqs[:, :, use_indices].astype(float)
+            sequences = self._sample_seqs[:, :, use_indices].astype(
+                self._dtype)
 
         if self._seq_batch_axis != 0 or self._seq_alphabet_axis != 2:
             sequences = np.transpose(
@@ -161,14 +263,160 @@ class MatFileSampler(FileSampler):
                             self._seq_alphabet_axis))
         if self._sample_tgts is not None:
             if self._tgts_batch_axis == 0:
-                targets = self._sample_tgts[use_indices, :].astype(float)
+                targets = self._sample_tgts[use_indices, :].astype(
+                    self._dtype)
             else:
-                targets = self._sample_tgts[:, use_indices].astype(float)
+                targets = self._sample_tgts[:, use_indices].astype(
+                    self._dtype)
                 targets = np.transpose(
                     targets, (1, 0))
             return (sequences, targets)
         return sequences,
 
+    def set_rank(self, rank, world_size=1):
+        """
+        Prepares the sampler to be used by one of several processes
+        that train a model together (see `FileSampler.set_rank`). If
+        the samples are shuffled, the random states are reseeded
+        differently in each process and the order of the samples is
+        drawn again. Otherwise, the samples are split between the
+        processes.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        """
+        if not self._shuffle:
+            super(MatFileSampler, self).set_rank(rank, world_size=world_size)
+            return
+        super(MatFileSampler, self).set_rank(rank)
+        if self._block_shuffle:
+            self._rng = _reseed(self._rng, rank)
+        else:
+            # the order of the first pass was drawn when the sampler was
+            # constructed, before the random state was reseeded.
+            np.random.shuffle(self._sample_indices)
+            self._sample_next = 0
+
+    def _split_rows(self, rank, world_size):
+        """
+        Restricts the sampler to the rows `rank::world_size` (see
+        `FileSampler._split_rows`). Blocks of samples that are read in
+        order (`block_shuffle`) cannot be split.
+        """
+        if self._block_shuffle:
+            super(MatFileSampler, self)._split_rows(rank, world_size)
+        self._sample_indices = self._sample_indices[rank::world_size]
+        self._sample_next = 0
+
+    def _read_slab(self, blocks):
+        """
+        Reads a list of blocks of contiguous samples and converts them
+        to batch-first arrays of the output type.
+
+        Parameters
+        ----------
+        blocks : list(tuple(int, int))
+            The `[start, end)` sample indices of each block to read.
+
+        Returns
+        -------
+        sequences, targets : tuple(numpy.ndarray, numpy.ndarray or None)
+            The sequences (:math:`S \\times L \\times N`) and targets
+            (:math:`S \\times F`) in the blocks, concatenated in order.
+
+        """
+        def _read(matrix, batch_axis):
+            slabs = []
+            for start, end in blocks:
+                index = [slice(None)] * len(matrix.shape)
+                index[batch_axis] = slice(start, end)
+                slabs.append(matrix[tuple(index)])
+            return np.concatenate(slabs, axis=batch_axis)
+
+        sequences = np.ascontiguousarray(
+            np.transpose(_read(self._sample_seqs, self._seq_batch_axis),
+                         (self._seq_batch_axis,
+                          self._seq_final_axis,
+                          self._seq_alphabet_axis)),
+            dtype=self._dtype)
+        targets = None
+        if self._sample_tgts is not None:
+            targets = _read(self._sample_tgts, self._tgts_batch_axis)
+            if self._tgts_batch_axis != 0:
+                targets = targets.T
+            targets = np.ascontiguousarray(targets, dtype=self._dtype)
+        return sequences, targets
+
+    def _read_in_order(self, start, batch_size):
+        """
+        Reads the `batch_size` samples that start at row `start` of
+        the matrix (see `FileSampler._read_in_order`).
+        """
+        end = start + batch_size
+        sequences, targets = self._read_slab([(start, end)])
+        if targets is not None:
+            return (sequences, targets), end
+        return (sequences,), end
+
+    def _read_buffers(self, buffers):
+        """
+        Fills `buffers` with shuffled read-ahead buffers of samples,
+        cycling through the whole matrix indefinitely. This is run on a
+        background thread. Any error is passed on through `buffers`.
+        """
+        try:
+            starts = np.arange(0, self.n_samples, self._block_size)
+            while True:
+                if self._shuffle:
+                    self._rng.shuffle(starts)
+                for i in range(0, len(starts), self._blocks_per_buffer):
+                    blocks = sorted(
+                        (s, min(s + self._block_size, self.n_samples))
+                        for s in starts[i:i + self._blocks_per_buffer])
+                    sequences, targets = self._read_slab(blocks)
+                    if self._shuffle:
+                        order = self._rng.permutation(len(sequences))
+                        sequences = sequences[order]
+                        if targets is not None:
+                            targets = targets[order]
+                    buffers.put((sequences, targets))
+        except Exception as error:
+            buffers.put(error)
+
+    def _sample_from_buffers(self, batch_size):
+        """
+        Draws the next `batch_size` samples from the read-ahead
+        buffers, starting the background reader if needed.
+        """
+        if self._buffers is None:
+            self._buffers = Queue(maxsize=2)
+            reader = Thread(target=self._read_buffers, args=(self._buffers,))
+            reader.daemon = True
+            reader.start()
+        sequences = []
+        targets = []
+        while batch_size > 0:
+            if self._buffer is None or \
+                    self._buffer_next == len(self._buffer[0]):
+                self._buffer = self._buffers.get()
+                self._buffer_next = 0
+                if isinstance(self._buffer, Exception):
+                    raise self._buffer
+            end = min(self._buffer_next + batch_size, len(self._buffer[0]))
+            sequences.append(self._buffer[0][self._buffer_next:end])
+            if self._buffer[1] is not None:
+                targets.append(self._buffer[1][self._buffer_next:end])
+            batch_size -= end - self._buffer_next
+            self._buffer_next = end
+        if self._sample_tgts is not None:
+            return (np.concatenate(sequences), np.concatenate(targets))
+        return np.concatenate(sequences),
+
     def get_data(self, batch_size, n_samples=None):
         """
         This method fetches a subset of the data from the sampler,
@@ -204,7 +452,8 @@ class MatFileSampler(FileSampler):
         sequences.append(seqs)
         return sequences
 
-    def get_data_and_targets(self, batch_size, n_samples=None):
+    def get_data_and_targets(self, batch_size, n_samples=None,
+                             feature_indices=None):
         """
         This method fetches a subset of the sequence data and
         targets from the sampler, divided into batches.
@@ -215,6 +464,9 @@ class MatFileSampler(FileSampler):
             The size of the batches to divide the data into.
         n_samples : int, optional
             Default is None. The total number of samples to retrieve.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
 
         Returns
         -------
@@ -243,11 +495,15 @@ class MatFileSampler(FileSampler):
         count = batch_size
         while count < n_samples:
             seqs, tgts = self.sample(batch_size=batch_size)
+            if feature_indices is not None:
+                tgts = tgts[:, feature_indices]
             sequences_and_targets.append((seqs, tgts))
             targets_mat.append(tgts)
             count += batch_size
         remainder = batch_size - (count - n_samples)
         seqs, tgts = self.sample(batch_size=remainder)
+        if feature_indices is not None:
+            tgts = tgts[:, feature_indices]
         sequences_and_targets.append((seqs, tgts))
         targets_mat.append(tgts)
         # TODO: should not assume targets are always integers
@@ -0,0 +1,201 @@
+"""
+This module provides the `ReplaySampler` class.
+"""
+import numpy as np
+
+from .file_sampler import FileSampler
+from ..dataset_journal import read_journal
+
+
+class ReplaySampler(FileSampler):
+    """
+    A sampler that replays the examples saved by an online sampler
+    with `save_datasets_format='journal'`. The examples are returned in
+    exactly the order they were drawn in, so a training run can be
+    repeated without querying the targets file or drawing random
+    positions again. Only the sequences are fetched from the reference
+    sequence; the targets are read from the journal.
+
+    Parameters
+    ----------
+    journal_path : str
+        The path to the `*.journal` file.
+    reference_sequence : selene_sdk.sequences.Sequence
+        The reference sequence the examples were drawn from.
+    n_samples : int or None, optional
+        Default is None. The number of examples in one pass over the
+        data. If None, the number of examples in the journal is used.
+
+    Attributes
+    ----------
+    reference_sequence : selene_sdk.sequences.Sequence
+        The reference sequence the examples were drawn from.
+    n_samples : int
+        The number of examples in one pass over the data.
+    n_features : int
+        The number of features (classes).
+
+    Raises
+    ------
+    ValueError
+        If the journal has no examples.
+
+    """
+
+    def __init__(self,
+                 journal_path,
+                 reference_sequence,
+                 n_samples=None):
+        """
+        Constructs a new `ReplaySampler` object.
+        """
+        super(ReplaySampler, self).__init__()
+        self.reference_sequence = reference_sequence
+        journal = read_journal(journal_path)
+        if len(journal["start"]) == 0:
+            raise ValueError(
+                "No examples found in journal {0}".format(journal_path))
+        self._chroms = journal["chroms"]
+        self._chrom_ids = journal["chrom"]
+        self._starts = journal["start"]
+        self._ends = journal["end"]
+        self._strands = journal["strand"]
+        self._target_indptr = journal["target_indptr"]
+        self._target_indices = journal["target_indices"]
+        self.n_features = journal["n_features"]
+        if n_samples is None:
+            n_samples = len(self._starts)
+        self.n_samples = n_samples
+        self._sample_indices = np.arange(len(self._starts))
+        self._sample_next = 0
+
+    def sample(self, batch_size=1):
+        """
+        Draws the next mini-batch of examples and their corresponding
+        labels, starting again from the first example after the last
+        one in the journal.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Default is 1. The number of examples to include in the
+            mini-batch.
+
+        Returns
+        -------
+        sequences, targets : tuple(numpy.ndarray, numpy.ndarray)
+            A tuple containing the numeric representation of the
+            sequence examples and their corresponding labels. The
+            shape of `sequences` will be
+            :math:`B \\times L \\times N`, where :math:`B` is
+            `batch_size`, :math:`L` is the sequence length, and
+            :math:`N` is the size of the sequence type's alphabet.
+            The shape of `targets` will be :math:`B \\times F`,
+            where :math:`F` is the number of features.
+
+        """
+        positions = (self._sample_next + np.arange(batch_size)) % \
+            len(self._sample_indices)
+        self._sample_next = (positions[-1] + 1) % len(self._sample_indices)
+        return self._get_examples(self._sample_indices[positions])
+
+    def _split_rows(self, rank, world_size):
+        """
+        Restricts the sampler to the examples on the rows
+        `rank::world_size` of the journal (see
+        `FileSampler._split_rows`).
+        """
+        self._sample_indices = self._sample_indices[rank::world_size]
+        self._sample_next = 0
+
+    def _read_in_order(self, start, batch_size):
+        """
+        Reads the `batch_size` examples that start at row `start` of
+        the journal, starting again from its first example after the
+        last one (see `FileSampler._read_in_order`).
+        """
+        end = start + batch_size
+        return (self._get_examples(np.arange(start, end) % len(self._starts)),
+                end)
+
+    def _get_examples(self, indices):
+        """
+        Fetches the sequences and builds the targets of the examples
+        at `indices` in the journal.
+        """
+        batch_size = len(indices)
+        sequences = []
+        targets = np.zeros((batch_size, self.n_features), dtype=np.float32)
+        for i, ix in enumerate(indices):
+            sequences.append(self.reference_sequence.get_encoding_from_coords(
+                self._chroms[self._chrom_ids[ix]],
+                int(self._starts[ix]),
+                int(self._ends[ix]),
+                '-' if self._strands[ix] < 0 else '+'))
+            targets[i, self._target_indices[
+                self._target_indptr[ix]:self._target_indptr[ix + 1]]] = 1
+        return (np.array(sequences, dtype=np.float32), targets)
+
+    def get_data(self, batch_size, n_samples=None):
+        """
+        This method fetches a subset of the data from the sampler,
+        divided into batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int, optional
+            Default is None. The total number of samples to retrieve.
+
+        Returns
+        -------
+        sequences : list(np.ndarray)
+            The list of sequences grouped into batches.
+            An element in the `sequences` list is of
+            the shape :math:`B \\times L \\times N`, where :math:`B`
+            is `batch_size`, :math:`L` is the sequence length,
+            and :math:`N` is the size of the sequence type's alphabet.
+
+        """
+        sequences_and_targets, _ = self.get_data_and_targets(
+            batch_size, n_samples=n_samples)
+        return [s for (s, t) in sequences_and_targets]
+
+    def get_data_and_targets(self, batch_size, n_samples=None,
+                             feature_indices=None):
+        """
+        This method fetches a subset of the sequence data and
+        targets from the sampler, divided into batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int, optional
+            Default is None. The total number of samples to retrieve.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        sequences_and_targets, targets_matrix : \
+        tuple(list(tuple(numpy.ndarray, numpy.ndarray)), numpy.ndarray)
+            Tuple containing the list of sequence-target pairs, as well
+            as a single matrix with all targets in the same order.
+            Note that `sequences_and_targets`'s sequence elements are of
+            the shape :math:`B \\times L \\times N` and its target
+            elements are of the shape :math:`B \\times F`, where
+            :math:`B` is `batch_size`, :math:`L` is the sequence length,
+            :math:`N` is the size of the sequence type's alphabet, and
+            :math:`F` is the number of features. Further,
+            `target_matrix` is of the shape :math:`S \\times F`, where
+            :math:`S =` `n_samples`.
+
+        """
+        batches, _ = self.stream_data_and_targets(
+            batch_size, n_samples=n_samples, feature_indices=feature_indices)
+        sequences_and_targets = list(batches)
+        targets_mat = np.vstack([t for (s, t) in sequences_and_targets])
+        return sequences_and_targets, targets_mat
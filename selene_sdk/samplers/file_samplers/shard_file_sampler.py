@@ -0,0 +1,639 @@
+"""
+This module provides the `ShardFileSampler` class, which reads examples
+from compact binary shard files, and the `export_shards` method, which
+writes the output of any sampler to these files.
+
+Each shard file starts with a small header: the magic bytes
+`SELENESH`, the length of the JSON metadata as a little-endian `uint32`
+and the JSON metadata itself. The metadata describes the data sections
+that follow it:
+
+    * `tokens` - a :math:`S \\times L` `uint8` matrix, where the value at
+      each position is the index of the base in the sequence's alphabet
+      (or the size of the alphabet for an unknown base).
+    * `labels` - the :math:`S \\times F` targets, either packed 8 per byte
+      with `numpy.packbits` (binary targets) or stored as `float32`.
+    * `coords` - the chromosome index, start, end and strand of each
+      example. The chromosome index refers to the `chroms` list in the
+      metadata and is -1 when the sampler does not report coordinates.
+
+"""
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+from .file_sampler import FileSampler
+from .file_sampler import _reseed
+
+
+SHARD_MAGIC = b"SELENESH"
+"""
+The bytes that every shard file starts with.
+"""
+
+SHARD_VERSION = 1
+"""
+The version of the shard file format.
+"""
+
+COORDS_DTYPE = np.dtype([("chrom", "<i4"),
+                         ("start", "<i8"),
+                         ("end", "<i8"),
+                         ("strand", "i1")])
+"""
+The record type of the coordinates index in a shard file.
+"""
+
+_STRAND_TO_INT = {'+': 1, '-': -1}
+_ALIGNMENT = 64
+
+
+def _encode_sequences(sequences):
+    """
+    Converts a batch of one-hot encoded sequences into `uint8` tokens.
+
+    Parameters
+    ----------
+    sequences : numpy.ndarray
+        A :math:`B \\times L \\times N` array of one-hot encoded
+        sequences, where unknown bases have the value :math:`1/N` in
+        every column.
+
+    Returns
+    -------
+    numpy.ndarray, dtype=numpy.uint8
+        The :math:`B \\times L` tokens, where unknown bases are encoded
+        as :math:`N`.
+
+    """
+    tokens = np.argmax(sequences, axis=2).astype(np.uint8)
+    tokens[np.max(sequences, axis=2) < 1] = sequences.shape[2]
+    return tokens
+
+
+def _decode_tokens(tokens, alphabet_size, dtype=np.float32):
+    """
+    Converts `uint8` tokens back into one-hot encoded sequences.
+
+    Parameters
+    ----------
+    tokens : numpy.ndarray, dtype=numpy.uint8
+        A :math:`B \\times L` array of tokens.
+    alphabet_size : int
+        The size of the sequence's alphabet, :math:`N`.
+    dtype : numpy.dtype, optional
+        Default is `numpy.float32`. The type of the output array.
+
+    Returns
+    -------
+    numpy.ndarray
+        The :math:`B \\times L \\times N` one-hot encoding.
+
+    """
+    table = np.vstack([np.eye(alphabet_size),
+                       np.full((1, alphabet_size), 1. / alphabet_size)])
+    return table.astype(dtype)[tokens]
+
+
+def write_shard(output_path, tokens, labels, coords, alphabet_size,
+                chroms=[]):
+    """
+    Writes a single shard file.
+
+    Parameters
+    ----------
+    output_path : str
+        The path to the shard file.
+    tokens : numpy.ndarray, dtype=numpy.uint8
+        The :math:`S \\times L` sequence tokens.
+    labels : numpy.ndarray
+        The :math:`S \\times F` targets. If every target is 0 or 1, the
+        targets are bit-packed. Otherwise, they are stored as `float32`.
+    coords : numpy.ndarray, dtype=COORDS_DTYPE
+        The coordinates of each of the :math:`S` examples.
+    alphabet_size : int
+        The size of the sequence's alphabet.
+    chroms : list(str), optional
+        Default is `[]`. The chromosome names that the `chrom` indices
+        in `coords` refer to.
+
+    Returns
+    -------
+    None
+
+    """
+    n_samples, n_features = labels.shape
+    if np.all((labels == 0) | (labels == 1)):
+        label_format = "packbits"
+        label_data = np.packbits(labels.astype(np.uint8), axis=1)
+    else:
+        label_format = "float32"
+        label_data = labels.astype(np.float32)
+    sections = [("tokens", np.ascontiguousarray(tokens, dtype=np.uint8)),
+                ("labels", np.ascontiguousarray(label_data)),
+                ("coords", np.ascontiguousarray(coords, dtype=COORDS_DTYPE))]
+
+    metadata = {
+        "version": SHARD_VERSION,
+        "n_samples": int(n_samples),
+        "sequence_length": int(tokens.shape[1]),
+        "alphabet_size": int(alphabet_size),
+        "n_features": int(n_features),
+        "label_format": label_format,
+        "chroms": list(chroms),
+        "sections": {}
+    }
+    # the section offsets are part of the header, so lay out the header
+    # with placeholder offsets first and grow it until it is stable.
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, data in sections:
+            metadata["sections"][name] = [offset, data.nbytes]
+            offset += -(-data.nbytes // _ALIGNMENT) * _ALIGNMENT
+        header = json.dumps(metadata).encode("utf-8")
+        header_end = len(SHARD_MAGIC) + 4 + len(header)
+        aligned_end = -(-header_end // _ALIGNMENT) * _ALIGNMENT
+        if aligned_end == data_start:
+            break
+        data_start = aligned_end
+
+    tmp_path = "{0}.tmp".format(output_path)
+    with open(tmp_path, "wb") as file_handle:
+        file_handle.write(SHARD_MAGIC)
+        file_handle.write(struct.pack("<I", len(header)))
+        file_handle.write(header)
+        for name, data in sections:
+            file_handle.seek(metadata["sections"][name][0])
+            file_handle.write(data.tobytes())
+    os.replace(tmp_path, output_path)
+
+
+def read_shard_metadata(shard_path):
+    """
+    Reads the header of a shard file.
+
+    Parameters
+    ----------
+    shard_path : str
+        The path to the shard file.
+
+    Returns
+    -------
+    dict
+        The shard metadata.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a shard file of a supported version.
+
+    """
+    with open(shard_path, "rb") as file_handle:
+        magic = file_handle.read(len(SHARD_MAGIC))
+        if magic != SHARD_MAGIC:
+            raise ValueError(
+                "{0} is not a Selene shard file.".format(shard_path))
+        header_length, = struct.unpack("<I", file_handle.read(4))
+        metadata = json.loads(file_handle.read(header_length).decode("utf-8"))
+    if metadata["version"] > SHARD_VERSION:
+        raise ValueError(
+            "Shard file {0} has version {1}, but only versions up to {2} "
+            "are supported.".format(
+                shard_path, metadata["version"], SHARD_VERSION))
+    return metadata
+
+
+class _Shard(object):
+    """
+    Memory-maps the data sections of a single shard file.
+
+    Parameters
+    ----------
+    shard_path : str
+        The path to the shard file.
+
+    """
+
+    def __init__(self, shard_path):
+        self.path = shard_path
+        self.metadata = read_shard_metadata(shard_path)
+        self.n_samples = self.metadata["n_samples"]
+        sections = self.metadata["sections"]
+        n_label_columns = self.metadata["n_features"]
+        label_dtype = np.float32
+        if self.metadata["label_format"] == "packbits":
+            n_label_columns = -(-n_label_columns // 8)
+            label_dtype = np.uint8
+        self.tokens = self._memmap(
+            sections["tokens"][0], np.uint8,
+            (self.n_samples, self.metadata["sequence_length"]))
+        self.labels = self._memmap(
+            sections["labels"][0], label_dtype,
+            (self.n_samples, n_label_columns))
+        self.coords = self._memmap(
+            sections["coords"][0], COORDS_DTYPE, (self.n_samples,))
+
+    def _memmap(self, offset, dtype, shape):
+        if self.n_samples == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(
+            self.path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    def read(self, start, end):
+        """
+        Reads the rows `[start, end)` of the shard into memory.
+
+        Returns
+        -------
+        tokens, labels, coords : \
+        tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            The tokens, decoded `float32` labels and coordinates.
+
+        """
+        labels = np.array(self.labels[start:end])
+        if self.metadata["label_format"] == "packbits":
+            labels = np.unpackbits(
+                labels, axis=1, count=self.metadata["n_features"])
+        return (np.array(self.tokens[start:end]),
+                labels.astype(np.float32),
+                np.array(self.coords[start:end]))
+
+
+def export_shards(sampler,
+                  mode,
+                  n_samples,
+                  output_dir,
+                  batch_size=64,
+                  samples_per_shard=100000):
+    """
+    Draws `n_samples` examples from a sampler and writes them to shard
+    files that can be read back with `ShardFileSampler`. This lets an
+    expensive sampler (e.g. an online sampler) be run once, so that
+    later training runs read sequential, compact data instead.
+
+    Parameters
+    ----------
+    sampler : selene_sdk.samplers.Sampler
+        The sampler to draw the examples from.
+    mode : str
+        The mode to draw the examples in (e.g. 'train').
+    n_samples : int
+        The number of examples to export.
+    output_dir : str
+        The directory to write the shard files to. The files are named
+        `<mode>-<index>.shard`.
+    batch_size : int, optional
+        Default is 64. The number of examples to draw from the sampler
+        at a time.
+    samples_per_shard : int, optional
+        Default is 100000. The maximum number of examples in each shard.
+
+    Returns
+    -------
+    list(str)
+        The paths to the shard files written.
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sampler.set_mode(mode)
+
+    # online samplers record the coordinates of every example they draw
+    # for modes in `_save_datasets`, so use that record as the index.
+    save_datasets = getattr(sampler, "_save_datasets", None)
+    record_coords = save_datasets is not None and \
+        hasattr(sampler, "reference_sequence")
+    saved_rows = None
+    if record_coords:
+        saved_rows = save_datasets.get(mode)
+        save_datasets[mode] = []
+
+    chroms = []
+    chrom_indices = {}
+    shard_paths = []
+    n_written = 0
+    try:
+        while n_written < n_samples:
+            shard_size = min(samples_per_shard, n_samples - n_written)
+            tokens = None
+            labels = None
+            coords = np.zeros(shard_size, dtype=COORDS_DTYPE)
+            coords["chrom"] = -1
+            n_filled = 0
+            while n_filled < shard_size:
+                sequences, targets = sampler.sample(
+                    batch_size=min(batch_size, shard_size - n_filled))[:2]
+                n_batch = len(sequences)
+                if tokens is None:
+                    alphabet_size = sequences.shape[2]
+                    tokens = np.zeros(
+                        (shard_size, sequences.shape[1]), dtype=np.uint8)
+                    labels = np.zeros(
+                        (shard_size, targets.shape[1]), dtype=np.float32)
+                rows = slice(n_filled, n_filled + n_batch)
+                tokens[rows] = _encode_sequences(sequences)
+                labels[rows] = targets
+                if record_coords:
+                    batch_coords = save_datasets[mode]
+                    save_datasets[mode] = []
+                    for i, (chrom, start, end, strand, _) in enumerate(
+                            batch_coords[-n_batch:]):
+                        if chrom not in chrom_indices:
+                            chrom_indices[chrom] = len(chroms)
+                            chroms.append(chrom)
+                        coords[n_filled + i] = (
+                            chrom_indices[chrom], start, end,
+                            _STRAND_TO_INT.get(strand, 0))
+                n_filled += n_batch
+
+            shard_path = os.path.join(
+                output_dir, "{0}-{1:05d}.shard".format(mode, len(shard_paths)))
+            write_shard(shard_path, tokens, labels, coords,
+                        alphabet_size, chroms=chroms)
+            shard_paths.append(shard_path)
+            n_written += shard_size
+    finally:
+        if record_coords:
+            if saved_rows is None:
+                del save_datasets[mode]
+            else:
+                save_datasets[mode] = saved_rows
+    return shard_paths
+
+
+class ShardFileSampler(FileSampler):
+    """
+    A sampler that reads examples from shard files written by
+    `selene_sdk.samplers.file_samplers.export_shards`. The shards are
+    memory-mapped and read in contiguous blocks, so that examples are
+    read at disk bandwidth. Shuffling is done at 2 levels: the order in
+    which the shards (and the blocks within each shard) are visited is
+    shuffled every pass, and the examples are shuffled within each
+    block that is read.
+
+    Parameters
+    ----------
+    shards : str or list(str)
+        A list of shard file paths, or a glob pattern matching them
+        (e.g. `/path/to/shards/train-*.shard`).
+    random_seed : int, optional
+        Default is 436. Sets the random seed for sampling.
+    shuffle : bool, optional
+        Default is True. Shuffle the shards and the examples in each
+        block. If False, examples are returned in the order they were
+        written.
+    shuffle_buffer_size : int, optional
+        Default is 65536. The number of consecutive examples that are
+        read from a shard at once and shuffled together.
+
+    Attributes
+    ----------
+    n_samples : int
+        The total number of examples across all shards.
+    sequence_length : int
+        The length of the sequences in the shards.
+    n_features : int
+        The number of features (classes) in the shards.
+
+    """
+
+    def __init__(self,
+                 shards,
+                 random_seed=436,
+                 shuffle=True,
+                 shuffle_buffer_size=65536):
+        """
+        Constructs a new `ShardFileSampler` object.
+        """
+        super(ShardFileSampler, self).__init__()
+        if isinstance(shards, str):
+            shard_paths = sorted(glob.glob(shards))
+        else:
+            shard_paths = list(shards)
+        if not shard_paths:
+            raise ValueError(
+                "No shard files found for input {0}".format(shards))
+        self._shards = [_Shard(p) for p in shard_paths]
+        metadata = self._shards[0].metadata
+        for shard in self._shards[1:]:
+            for key in ("sequence_length", "alphabet_size", "n_features"):
+                if shard.metadata[key] != metadata[key]:
+                    raise ValueError(
+                        "Shard {0} has {1} {2}, but shard {3} has {4}.".format(
+                            shard.path, key, shard.metadata[key],
+                            self._shards[0].path, metadata[key]))
+        self.sequence_length = metadata["sequence_length"]
+        self.n_features = metadata["n_features"]
+        self._alphabet_size = metadata["alphabet_size"]
+        self.n_samples = sum(s.n_samples for s in self._shards)
+
+        self._shuffle = shuffle
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._rng = np.random.RandomState(random_seed)
+        self._split = (0, 1)
+        self._blocks = self._iterate_blocks()
+        self._buffer = None
+        self._buffer_next = 0
+
+    def set_rank(self, rank, world_size=1):
+        """
+        Prepares the sampler to be used by one of several processes
+        that train a model together (see `FileSampler.set_rank`). If
+        the examples are shuffled, the random state is reseeded
+        differently in each process. Otherwise, the examples are split
+        between the processes.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        """
+        if not self._shuffle:
+            super(ShardFileSampler, self).set_rank(
+                rank, world_size=world_size)
+            return
+        super(ShardFileSampler, self).set_rank(rank)
+        self._rng = _reseed(self._rng, rank)
+
+    def _split_rows(self, rank, world_size):
+        """
+        Restricts the sampler to the examples on the rows
+        `rank::world_size` of the shards, taken in the order they were
+        given (see `FileSampler._split_rows`).
+        """
+        self._split = (rank, world_size)
+        self._blocks = self._iterate_blocks()
+        self._buffer = None
+        self._buffer_next = 0
+
+    def _iterate_blocks(self):
+        """
+        Yields the shuffled, in-memory blocks of examples, cycling
+        through all the shards indefinitely.
+        """
+        rank, world_size = self._split
+        shard_offsets = np.cumsum([0] + [s.n_samples for s in self._shards])
+        while True:
+            blocks = []
+            shard_order = np.arange(len(self._shards))
+            if self._shuffle:
+                self._rng.shuffle(shard_order)
+            for shard_index in shard_order:
+                shard = self._shards[shard_index]
+                starts = np.arange(
+                    0, shard.n_samples, self._shuffle_buffer_size)
+                if self._shuffle:
+                    self._rng.shuffle(starts)
+                blocks += [(shard_index, s) for s in starts]
+            for shard_index, start in blocks:
+                shard = self._shards[shard_index]
+                end = min(start + self._shuffle_buffer_size, shard.n_samples)
+                tokens, labels, _ = shard.read(start, end)
+                if world_size > 1:
+                    first = (rank - shard_offsets[shard_index] - start) % \
+                        world_size
+                    tokens = tokens[first::world_size]
+                    labels = labels[first::world_size]
+                if self._shuffle:
+                    order = self._rng.permutation(len(tokens))
+                    tokens, labels = tokens[order], labels[order]
+                yield tokens, labels
+
+    def _next_rows(self, n_rows):
+        """
+        Takes the next `n_rows` tokens and labels from the buffer,
+        refilling the buffer as needed.
+        """
+        tokens = []
+        labels = []
+        while n_rows > 0:
+            if self._buffer is None or \
+                    self._buffer_next == len(self._buffer[0]):
+                self._buffer = next(self._blocks)
+                self._buffer_next = 0
+            end = min(self._buffer_next + n_rows, len(self._buffer[0]))
+            tokens.append(self._buffer[0][self._buffer_next:end])
+            labels.append(self._buffer[1][self._buffer_next:end])
+            n_rows -= end - self._buffer_next
+            self._buffer_next = end
+        return np.concatenate(tokens), np.concatenate(labels)
+
+    def _read_in_order(self, start, batch_size):
+        """
+        Reads the `batch_size` examples that start at row `start` of
+        the shards, taken in the order they were given (see
+        `FileSampler._read_in_order`).
+        """
+        end = start + batch_size
+        tokens = []
+        labels = []
+        shard_start = 0
+        for shard in self._shards:
+            rows_start = max(start - shard_start, 0)
+            rows_end = min(end - shard_start, shard.n_samples)
+            if rows_start < rows_end:
+                shard_tokens, shard_labels, _ = shard.read(
+                    rows_start, rows_end)
+                tokens.append(shard_tokens)
+                labels.append(shard_labels)
+            shard_start += shard.n_samples
+        return ((_decode_tokens(np.concatenate(tokens), self._alphabet_size),
+                 np.concatenate(labels)), end)
+
+    def sample(self, batch_size=1):
+        """
+        Draws a mini-batch of examples and their corresponding
+        labels.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Default is 1. The number of examples to include in the
+            mini-batch.
+
+        Returns
+        -------
+        sequences, targets : tuple(numpy.ndarray, numpy.ndarray)
+            A tuple containing the numeric representation of the
+            sequence examples and their corresponding labels. The
+            shape of `sequences` will be
+            :math:`B \\times L \\times N`, where :math:`B` is
+            `batch_size`, :math:`L` is the sequence length, and
+            :math:`N` is the size of the sequence type's alphabet.
+            The shape of `targets` will be :math:`B \\times F`,
+            where :math:`F` is the number of features.
+
+        """
+        tokens, targets = self._next_rows(batch_size)
+        return (_decode_tokens(tokens, self._alphabet_size), targets)
+
+    def get_data(self, batch_size, n_samples=None):
+        """
+        This method fetches a subset of the data from the sampler,
+        divided into batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int, optional
+            Default is None. The total number of samples to retrieve.
+
+        Returns
+        -------
+        sequences : list(np.ndarray)
+            The list of sequences grouped into batches.
+            An element in the `sequences` list is of
+            the shape :math:`B \\times L \\times N`, where :math:`B`
+            is `batch_size`, :math:`L` is the sequence length,
+            and :math:`N` is the size of the sequence type's alphabet.
+
+        """
+        sequences_and_targets, _ = self.get_data_and_targets(
+            batch_size, n_samples=n_samples)
+        return [s for (s, t) in sequences_and_targets]
+
+    def get_data_and_targets(self, batch_size, n_samples=None,
+                             feature_indices=None):
+        """
+        This method fetches a subset of the sequence data and
+        targets from the sampler, divided into batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int, optional
+            Default is None. The total number of samples to retrieve.
+            If None, all the examples in the shards are used.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        sequences_and_targets, targets_matrix : \
+        tuple(list(tuple(numpy.ndarray, numpy.ndarray)), numpy.ndarray)
+            Tuple containing the list of sequence-target pairs, as well
+            as a single matrix with all targets in the same order.
+            Note that `sequences_and_targets`'s sequence elements are of
+            the shape :math:`B \\times L \\times N` and its target
+            elements are of the shape :math:`B \\times F`, where
+            :math:`B` is `batch_size`, :math:`L` is the sequence length,
+            :math:`N` is the size of the sequence type's alphabet, and
+            :math:`F` is the number of features. Further,
+            `target_matrix` is of the shape :math:`S \\times F`, where
+            :math:`S =` `n_samples`.
+
+        """
+        batches, _ = self.stream_data_and_targets(
+            batch_size, n_samples=n_samples, feature_indices=feature_indices)
+        sequences_and_targets = list(batches)
+        targets_mat = np.vstack([t for (s, t) in sequences_and_targets])
+        return sequences_and_targets, targets_mat
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from selene_sdk.samplers.file_samplers import BedFileSampler
+from selene_sdk.sequences import Genome
+
+
+GENOME_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))),
+    "sequences", "tests", "files", "small.fasta")
+
+
+class TestBedFileSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.genome = Genome(GENOME_PATH)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _write_bed(self, rows):
+        filepath = os.path.join(self.output_dir, "data.bed")
+        with open(filepath, 'w') as file_handle:
+            for row in rows:
+                file_handle.write('\t'.join(str(c) for c in row) + '\n')
+        return filepath
+
+    def test_matches_reference_sequence(self):
+        # each row, and the coordinates of its sequence of length 20
+        rows = [
+            # longer than the sequence length: truncated at both ends
+            (("chr2", 10, 80, "0"), ("chr2", 35, 55)),
+            (("chr4", 0, 33, ""), ("chr4", 6, 26)),
+            # shorter: extended at both ends, 1 more base at the end
+            (("chr2", 60, 65, "1;3"), ("chr2", 53, 73)),
+            (("chr1", 70, 90, "0;1;2;3"), ("chr1", 70, 90)),
+            # with a strand column, and features in the 5th column
+            (("chr2", 20, 30, "-", "3;1"), ("chr2", 15, 35))]
+        targets = np.array([[1, 0, 0, 0],
+                            [0, 0, 0, 0],
+                            [0, 1, 0, 1],
+                            [1, 1, 1, 1],
+                            [0, 1, 0, 1]], dtype=np.float32)
+        expected = np.array([
+            self.genome.get_encoding_from_coords(chrom, start, end, '+')
+            for (_, (chrom, start, end)) in rows])
+        filepath = self._write_bed([row for (row, _) in rows])
+
+        for shuffle in (False, True):
+            with self.subTest(shuffle=shuffle):
+                sampler = BedFileSampler(
+                    filepath, self.genome, sequence_length=20,
+                    targets_avail=True, n_features=4, shuffle=shuffle)
+                self.assertEqual(sampler.n_samples, len(rows))
+                sequences, sampled_targets = sampler.sample(batch_size=5)
+                self.assertEqual(sequences.dtype, np.float32)
+                order = sampler._sample_indices if shuffle else np.arange(5)
+                np.testing.assert_array_equal(sequences, expected[order])
+                np.testing.assert_array_equal(
+                    sampled_targets, targets[order])
+
+        sampler = BedFileSampler(filepath, self.genome, sequence_length=20)
+        sequences, = sampler.sample(batch_size=5)
+        np.testing.assert_array_equal(sequences, expected)
+
+    def test_without_sequence_length(self):
+        rows = [("chr2", 10, 30), ("chr4", 0, 20), ("chr1", 60, 80)]
+        sampler = BedFileSampler(self._write_bed(rows), self.genome)
+        sequences, = sampler.sample(batch_size=3)
+        np.testing.assert_array_equal(
+            sequences,
+            [self.genome.get_encoding_from_coords(*row) for row in rows])
+
+    def test_skips_intervals_without_sequence(self):
+        rows = [("chr3", 0, 20, "0"), ("chr2", 0, 20, "1"),
+                ("chr5", 0, 20, "0"), ("chr4", 30, 50, "2")]
+        sampler = BedFileSampler(
+            self._write_bed(rows), self.genome, targets_avail=True,
+            n_features=3)
+        sequences, targets = sampler.sample(batch_size=4)
+        np.testing.assert_array_equal(
+            sequences,
+            [self.genome.get_encoding_from_coords(*row[:3])
+             for row in [rows[1], rows[3]] * 2])
+        np.testing.assert_array_equal(
+            targets, [[0, 1, 0], [0, 0, 1]] * 2)
+
+    def test_get_targets(self):
+        rng = np.random.RandomState(0)
+        n_features = 7
+        features = []
+        rows = []
+        for i in range(50):
+            row_features = rng.choice(
+                n_features, size=rng.randint(0, n_features + 1),
+                replace=False)
+            features.append(row_features)
+            rows.append(("chr2", i, i + 20,
+                         ';'.join(str(f) for f in row_features)))
+        expected = np.zeros((len(rows), n_features), dtype=np.float32)
+        for i, row_features in enumerate(features):
+            expected[i, row_features] = 1
+        self.assertTrue((expected.sum(axis=1) == 0).any())
+
+        sampler = BedFileSampler(
+            self._write_bed(rows), self.genome, targets_avail=True,
+            n_features=n_features)
+        for indices in (np.arange(50), rng.permutation(50),
+                        rng.randint(50, size=80), np.array([3]),
+                        np.zeros(0, dtype=np.int64)):
+            with self.subTest(indices=indices):
+                np.testing.assert_array_equal(
+                    sampler._get_targets(indices), expected[indices])
+
+
+if __name__ == "__main__":
+    unittest.main()
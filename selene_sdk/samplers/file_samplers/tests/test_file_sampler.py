@@ -0,0 +1,274 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.io
+
+from selene_sdk.samplers.file_samplers import BedFileSampler
+from selene_sdk.samplers.file_samplers import MatFileSampler
+from selene_sdk.samplers.file_samplers import ShardFileSampler
+from selene_sdk.samplers.file_samplers.shard_file_sampler import \
+    COORDS_DTYPE, write_shard
+from selene_sdk.sequences import Genome
+
+
+SMALL_FASTA = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..",
+    "sequences", "tests", "files", "small.fasta")
+
+
+def _stream(sampler, batch_size, n_samples=None):
+    batches, n_samples = sampler.stream_data_and_targets(
+        batch_size, n_samples=n_samples)
+    sequences, targets = zip(*batches)
+    return np.concatenate(sequences), np.concatenate(targets), n_samples
+
+
+class _FileSamplerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+        self.sequences = np.eye(4, dtype=np.float32)[
+            random_state.randint(4, size=(50, 8))]
+        self.targets = random_state.randint(
+            2, size=(50, 3)).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _mat_sampler(self, **kwargs):
+        filepath = os.path.join(self.output_dir, "data.mat")
+        if not os.path.exists(filepath):
+            scipy.io.savemat(filepath, {
+                "sequences": self.sequences.astype(np.uint8).transpose(
+                    0, 2, 1),
+                "targets": self.targets.astype(np.uint8)})
+        return MatFileSampler(
+            filepath, "sequences", targets_key="targets", **kwargs)
+
+    def _shard_sampler(self, **kwargs):
+        tokens = np.argmax(self.sequences, axis=2).astype(np.uint8)
+        coords = np.zeros(len(tokens), dtype=COORDS_DTYPE)
+        shard_paths = []
+        for i, rows in enumerate((slice(0, 20), slice(20, 50))):
+            shard_paths.append(os.path.join(
+                self.output_dir, "train-{0:05d}.shard".format(i)))
+            write_shard(shard_paths[-1], tokens[rows], self.targets[rows],
+                        coords[rows], 4)
+        return ShardFileSampler(
+            shard_paths, shuffle_buffer_size=8, **kwargs)
+
+
+class TestFileSamplerStreaming(_FileSamplerTestCase):
+
+    def _check_stream(self, sampler, expected_sequences, expected_targets):
+        n_rows = len(expected_sequences)
+        for _ in range(2):
+            sequences, targets, n_samples = _stream(sampler, 16)
+            self.assertEqual(n_samples, n_rows)
+            np.testing.assert_array_equal(sequences, expected_sequences)
+            np.testing.assert_array_equal(targets, expected_targets)
+            # drawing from the sampler does not change the stream.
+            sampler.sample(batch_size=7)
+        sequences, targets, n_samples = _stream(sampler, 16, n_samples=21)
+        self.assertEqual(n_samples, 21)
+        np.testing.assert_array_equal(sequences, expected_sequences[:21])
+        np.testing.assert_array_equal(targets, expected_targets[:21])
+        _, _, n_samples = _stream(sampler, 16, n_samples=n_rows + 5)
+        self.assertEqual(n_samples, n_rows)
+
+    def _check_draws_unchanged(self, make_sampler):
+        sampler = make_sampler()
+        draws = [sampler.sample(batch_size=13) for _ in range(4)]
+        streamed_sampler = make_sampler()
+        for (sequences, targets) in draws:
+            _stream(streamed_sampler, 16)
+            streamed_sequences, streamed_targets = \
+                streamed_sampler.sample(batch_size=13)
+            np.testing.assert_array_equal(sequences, streamed_sequences)
+            np.testing.assert_array_equal(targets, streamed_targets)
+
+    def test_mat_file_sampler_stream(self):
+        for kwargs in (dict(shuffle=False),
+                       dict(shuffle=True),
+                       dict(shuffle=True, block_shuffle=True,
+                            buffer_size=16),
+                       dict(shuffle=True, memmap=True)):
+            with self.subTest(**kwargs):
+                self._check_stream(self._mat_sampler(**kwargs),
+                                   self.sequences, self.targets)
+
+    def test_mat_file_sampler_stream_does_not_change_draws(self):
+        for kwargs in (dict(shuffle=False),
+                       dict(shuffle=True, random_seed=1),
+                       dict(shuffle=True, block_shuffle=True,
+                            buffer_size=16, random_seed=1)):
+            with self.subTest(**kwargs):
+                np.random.seed(0)
+                state = np.random.get_state()
+
+                def make_sampler():
+                    np.random.set_state(state)
+                    return self._mat_sampler(**kwargs)
+
+                self._check_draws_unchanged(make_sampler)
+
+    def test_shard_file_sampler_stream(self):
+        for shuffle in (False, True):
+            with self.subTest(shuffle=shuffle):
+                self._check_stream(self._shard_sampler(shuffle=shuffle),
+                                   self.sequences, self.targets)
+
+    def test_shard_file_sampler_stream_does_not_change_draws(self):
+        self._check_draws_unchanged(
+            lambda: self._shard_sampler(shuffle=True, random_seed=1))
+
+    def test_bed_file_sampler_stream(self):
+        genome = Genome(SMALL_FASTA)
+        rows = [("chr2", 0, 10, "0"),
+                ("chr1", 60, 70, "1;2"),
+                ("chr4", 40, 50, ""),
+                # out of bounds, so it has no sequence and is skipped.
+                ("chr3", 20, 30, "0"),
+                ("chr2", 90, 100, "2"),
+                ("chr1", 50, 60, "0;1;2")]
+        filepath = os.path.join(self.output_dir, "data.bed")
+        with open(filepath, 'w') as file_handle:
+            for row in rows:
+                file_handle.write("{0}\t{1}\t{2}\t{3}\n".format(*row))
+        valid_rows = rows[:3] + rows[4:]
+        expected_sequences = np.array([
+            genome.get_encoding_from_coords(chrom, start, end, '+')
+            for (chrom, start, end, _) in valid_rows])
+        expected_targets = np.zeros((len(valid_rows), 3))
+        for i, (_, _, _, features) in enumerate(valid_rows):
+            for feature in features.split(';'):
+                if feature:
+                    expected_targets[i, int(feature)] = 1
+        # by default, `n_samples` counts the rows without a sequence.
+        for (shuffle, n_samples) in ((False, None), (True, None),
+                                     (False, len(valid_rows))):
+            with self.subTest(shuffle=shuffle, n_samples=n_samples):
+                sampler = BedFileSampler(
+                    filepath, genome, n_samples=n_samples,
+                    sequence_length=10, targets_avail=True, n_features=3,
+                    shuffle=shuffle)
+                for _ in range(2):
+                    sequences, targets, n_samples = _stream(sampler, 2)
+                    self.assertEqual(n_samples, len(valid_rows))
+                    np.testing.assert_array_equal(
+                        sequences, expected_sequences)
+                    np.testing.assert_array_equal(targets, expected_targets)
+                    sampler.sample(batch_size=3)
+
+
+class TestFileSamplerFeatureIndices(_FileSamplerTestCase):
+
+    def test_get_data_and_targets_selects_features(self):
+        for make_sampler in (lambda: self._mat_sampler(shuffle=False),
+                             lambda: self._shard_sampler(shuffle=False)):
+            sampler = make_sampler()
+            batches, targets_mat = sampler.get_data_and_targets(
+                16, n_samples=40, feature_indices=[2, 0])
+            sequences, targets = zip(*batches)
+            self.assertEqual([t.shape for t in targets],
+                             [(16, 2), (16, 2), (8, 2)])
+            np.testing.assert_array_equal(
+                np.concatenate(sequences), self.sequences[:40])
+            np.testing.assert_array_equal(
+                np.concatenate(targets), self.targets[:40, [2, 0]])
+            np.testing.assert_array_equal(
+                targets_mat, self.targets[:40, [2, 0]])
+
+
+class TestFileSamplerSetRank(_FileSamplerTestCase):
+
+    def _row_indices(self, sequences):
+        rows = {sequence.tobytes(): i
+                for (i, sequence) in enumerate(self.sequences)}
+        self.assertEqual(len(rows), len(self.sequences))
+        return [rows[sequence.tobytes()] for sequence in sequences]
+
+    def _check_split(self, make_sampler, world_size, n_rows=50):
+        for rank in range(world_size):
+            sampler = make_sampler()
+            sampler.set_rank(rank, world_size=world_size)
+            n_rank_rows = len(range(rank, n_rows, world_size))
+            sequences, _ = sampler.sample(batch_size=n_rank_rows)
+            self.assertEqual(sorted(self._row_indices(sequences)),
+                             list(range(rank, n_rows, world_size)))
+
+    def test_unshuffled_mat_file_sampler_is_split(self):
+        self._check_split(lambda: self._mat_sampler(shuffle=False), 3)
+
+    def test_unshuffled_shard_file_sampler_is_split(self):
+        self._check_split(lambda: self._shard_sampler(shuffle=False), 3)
+        self._check_split(lambda: self._shard_sampler(shuffle=False), 4)
+
+    def test_shuffled_samplers_are_reseeded(self):
+        for make_sampler in (lambda: self._mat_sampler(shuffle=True),
+                             lambda: self._mat_sampler(
+                                 shuffle=True, block_shuffle=True),
+                             lambda: self._shard_sampler(shuffle=True)):
+            draws = []
+            for rank in range(2):
+                np.random.seed(0)
+                sampler = make_sampler()
+                sampler.set_rank(rank, world_size=2)
+                draws.append(self._row_indices(
+                    sampler.sample(batch_size=10)[0]))
+            # every process draws from the whole file, in its own order.
+            self.assertNotEqual(draws[0], draws[1])
+            self.assertTrue(any(i % 2 for i in draws[0]))
+
+    def test_block_reading_mat_file_sampler_cannot_be_split(self):
+        sampler = self._mat_sampler(shuffle=False, block_shuffle=True)
+        sampler.set_rank(0)
+        with self.assertRaises(ValueError):
+            sampler.set_rank(1, world_size=2)
+
+    def _write_bed_file(self):
+        rows = [("chr2", start, start + 10) for start in range(0, 90, 10)]
+        filepath = os.path.join(self.output_dir, "data.bed")
+        with open(filepath, 'w') as file_handle:
+            for row in rows:
+                file_handle.write("{0}\t{1}\t{2}\n".format(*row))
+        return filepath, rows
+
+    def test_shuffled_bed_file_sampler_is_reseeded(self):
+        genome = Genome(SMALL_FASTA)
+        filepath, rows = self._write_bed_file()
+        encodings = [genome.get_encoding_from_coords(chrom, start, end, '+')
+                     for (chrom, start, end) in rows]
+        draws = []
+        for rank in range(2):
+            sampler = BedFileSampler(filepath, genome, sequence_length=10,
+                                     shuffle=True)
+            sampler.set_rank(rank, world_size=2)
+            sequences, = sampler.sample(batch_size=len(rows))
+            draws.append([
+                next(i for (i, encoding) in enumerate(encodings)
+                     if np.array_equal(sequence, encoding))
+                for sequence in sequences])
+        # every process draws from the whole file, in its own order.
+        self.assertNotEqual(draws[0], draws[1])
+        self.assertEqual(sorted(draws[0]), list(range(len(rows))))
+        self.assertEqual(sorted(draws[1]), list(range(len(rows))))
+
+    def test_unshuffled_bed_file_sampler_is_split(self):
+        genome = Genome(SMALL_FASTA)
+        filepath, rows = self._write_bed_file()
+        for rank in range(2):
+            sampler = BedFileSampler(filepath, genome, sequence_length=10)
+            sampler.set_rank(rank, world_size=2)
+            sequences, = sampler.sample(batch_size=len(rows[rank::2]))
+            np.testing.assert_array_equal(sequences, [
+                genome.get_encoding_from_coords(chrom, start, end, '+')
+                for (chrom, start, end) in rows[rank::2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from selene_sdk.samplers.file_samplers import InterleavedFileSampler
+from selene_sdk.samplers.file_samplers.file_sampler import FileSampler
+
+
+class _CountingSampler(FileSampler):
+    """
+    Draws samples that hold the index of the sampler and the number of
+    samples drawn before them, optionally slowly (only once `started` is
+    set) or failing after `n_batches` batches.
+    """
+
+    def __init__(self, index, n_samples, delay=0., started=None,
+                 n_batches=None):
+        super(_CountingSampler, self).__init__()
+        self.index = index
+        self.n_samples = n_samples
+        self._delay = delay
+        self._started = started
+        self._n_batches = n_batches
+        self._rng = np.random.RandomState(index)
+        self._count = 0
+
+    def sample(self, batch_size=1):
+        if self._n_batches is not None:
+            if self._n_batches == 0:
+                raise IOError("Could not read sampler {0}.".format(self.index))
+            self._n_batches -= 1
+        if self._started is not None:
+            self._started.wait()
+        if self._delay:
+            time.sleep(self._rng.uniform(0, self._delay))
+        counts = np.arange(self._count, self._count + batch_size)
+        self._count += batch_size
+        sequences = np.stack(
+            [np.full(batch_size, self.index), counts], axis=1)
+        return sequences, np.full((batch_size, 1), self.index)
+
+    def get_data(self, batch_size, n_samples=None):
+        raise NotImplementedError
+
+    def get_data_and_targets(self, batch_size, n_samples=None):
+        raise NotImplementedError
+
+
+def _wait_for_readers(sampler, timeout=10.):
+    """
+    Waits until the queue of each reader is full, so that which samplers
+    have a sample ready does not depend on how fast the readers are.
+    """
+    end = time.time() + timeout
+    while not all(queue.full() for queue in sampler._queues):
+        if time.time() > end:
+            raise AssertionError("The readers did not fill their queues.")
+        time.sleep(0.01)
+
+
+class TestInterleavedFileSampler(unittest.TestCase):
+
+    def _source_fractions(self, sampler, n_samples, batch_size=100):
+        sources = np.concatenate([
+            sampler.sample(batch_size=batch_size)[1][:, 0]
+            for _ in range(n_samples // batch_size)])
+        return np.bincount(sources, minlength=3) / len(sources)
+
+    def test_mixed_according_to_weights(self):
+        for kwargs in (dict(weights=[3, 1, 1]),
+                       dict(weights=[3, 1, 1], shuffle_buffer_size=0),
+                       dict(weights=[3, 1, 1], deterministic=True),
+                       dict()):
+            with self.subTest(**kwargs):
+                sampler = InterleavedFileSampler(
+                    [_CountingSampler(0, 6000), _CountingSampler(1, 2000),
+                     _CountingSampler(2, 2000)],
+                    reader_batch_size=16, **kwargs)
+                np.testing.assert_allclose(sampler.weights, [.6, .2, .2])
+                np.testing.assert_allclose(
+                    self._source_fractions(sampler, 20000),
+                    [.6, .2, .2], atol=0.02)
+
+    def test_late_reader_made_up_for(self):
+        started = threading.Event()
+        sampler = InterleavedFileSampler(
+            [_CountingSampler(0, 1), _CountingSampler(1, 1, started=started),
+             _CountingSampler(2, 1)],
+            shuffle_buffer_size=0, reader_batch_size=8, max_queue_size=100)
+        sampler._start_readers()
+        try:
+            while not (sampler._queues[0].full() and
+                       sampler._queues[2].full()):
+                time.sleep(0.01)
+            # the first batch does not wait for the late reader.
+            sources = [sampler.sample(batch_size=300)[1][:, 0]]
+            self.assertEqual(np.count_nonzero(sources[0] == 1), 0)
+            self.assertGreater(sampler._owed[1], 50)
+            self.assertEqual(np.sum(sampler._owed), sampler._owed[1])
+        finally:
+            started.set()
+        for _ in range(20):
+            _wait_for_readers(sampler)
+            sources.append(sampler.sample(batch_size=300)[1][:, 0])
+        # the skipped samples are made up for as soon as it has caught up.
+        self.assertGreater(np.count_nonzero(sources[1] == 1), 150)
+        self.assertEqual(np.sum(sampler._owed), 0)
+        np.testing.assert_allclose(
+            np.bincount(np.concatenate(sources)) / 6300.,
+            [1 / 3.] * 3, atol=0.02)
+
+    def test_deterministic(self):
+        batches = []
+        for _ in range(2):
+            sampler = InterleavedFileSampler(
+                [_CountingSampler(0, 1, delay=0.002), _CountingSampler(1, 1),
+                 _CountingSampler(2, 1, delay=0.001)],
+                shuffle_buffer_size=50, reader_batch_size=8,
+                random_seed=1, deterministic=True)
+            batches.append([sampler.sample(batch_size=20)
+                            for _ in range(20)])
+        for (sequences, targets), (other_sequences, other_targets) in zip(
+                *batches):
+            np.testing.assert_array_equal(sequences, other_sequences)
+            np.testing.assert_array_equal(targets, other_targets)
+
+    def test_reader_error_raised(self):
+        for kwargs in (dict(shuffle_buffer_size=0),
+                       dict(shuffle_buffer_size=20),
+                       dict(deterministic=True)):
+            with self.subTest(**kwargs):
+                sampler = InterleavedFileSampler(
+                    [_CountingSampler(0, 1),
+                     _CountingSampler(1, 1, n_batches=2)],
+                    reader_batch_size=4, **kwargs)
+                with self.assertRaises(IOError):
+                    for _ in range(100):
+                        sampler.sample(batch_size=10)
+
+    def test_invalid_weights(self):
+        samplers = [_CountingSampler(0, 1), _CountingSampler(1, 1)]
+        for weights in ([1], [1, 0], [1, -1]):
+            with self.subTest(weights=weights):
+                with self.assertRaises(ValueError):
+                    InterleavedFileSampler(samplers, weights=weights)
+        with self.assertRaises(ValueError):
+            InterleavedFileSampler([])
+
+    def test_sampler_size_required(self):
+        sampler = _CountingSampler(1, 1)
+        del sampler.n_samples
+        for weights in (None, [1, 1]):
+            with self.subTest(weights=weights):
+                with self.assertRaises(ValueError):
+                    InterleavedFileSampler(
+                        [_CountingSampler(0, 1), sampler], weights=weights)
+
+
+if __name__ == "__main__":
+    unittest.main()
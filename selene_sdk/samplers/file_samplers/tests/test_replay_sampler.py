@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from selene_sdk.samplers import RandomPositionsSampler
+from selene_sdk.samplers.file_samplers import ReplaySampler
+from selene_sdk.samplers.tests.test_online_sampler import FEATURES, \
+    TARGETS, write_genome
+from selene_sdk.sequences import Genome
+
+
+class TestReplaySampler(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.genome_path = os.path.join(self.output_dir, "genome.fa")
+        write_genome(self.genome_path,
+                     [("1", 600000), ("2", 50000), ("10", 50000)])
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _journaled_run(self, batch_sizes, **kwargs):
+        sampler = RandomPositionsSampler(
+            Genome(self.genome_path), TARGETS, FEATURES, seed=1,
+            validation_holdout=["10"], test_holdout=["2"],
+            sequence_length=100, center_bin_to_predict=20,
+            save_datasets=["train"], output_dir=self.output_dir,
+            save_datasets_format="journal", **kwargs)
+        batches = []
+        for batch_size in batch_sizes:
+            batches.append(sampler.sample(batch_size=batch_size))
+            sampler.save_dataset_to_file("train")
+        sampler.save_dataset_to_file("train", close_filehandle=True)
+        return batches, os.path.join(self.output_dir, "train_data.journal")
+
+    def test_replays_run_bit_for_bit(self):
+        batch_sizes = [16, 7, 32, 16]
+        for kwargs in (dict(window_cache_size=0),
+                       dict(window_cache_size=50),
+                       dict(window_cache_size=50, window_cache_max_shift=5)):
+            with self.subTest(**kwargs):
+                batches, journal_path = self._journaled_run(
+                    batch_sizes, **kwargs)
+                replay = ReplaySampler(journal_path, Genome(self.genome_path))
+                self.assertEqual(replay.n_samples, sum(batch_sizes))
+                self.assertEqual(replay.n_features, len(FEATURES))
+                for _ in range(2):
+                    for (sequences, targets) in batches:
+                        replay_sequences, replay_targets = replay.sample(
+                            batch_size=len(sequences))
+                        np.testing.assert_array_equal(
+                            sequences, replay_sequences)
+                        np.testing.assert_array_equal(
+                            targets, replay_targets)
+
+    def test_stream_and_set_rank(self):
+        batches, journal_path = self._journaled_run([10, 10])
+        sequences = np.concatenate([s for (s, _) in batches])
+        targets = np.concatenate([t for (_, t) in batches])
+        replay = ReplaySampler(journal_path, Genome(self.genome_path))
+        replay.sample(batch_size=3)
+        stream, n_samples = replay.stream_data_and_targets(8)
+        self.assertEqual(n_samples, 20)
+        stream_sequences, stream_targets = zip(*stream)
+        np.testing.assert_array_equal(
+            np.concatenate(stream_sequences), sequences)
+        np.testing.assert_array_equal(
+            np.concatenate(stream_targets), targets)
+
+        for rank in range(2):
+            replay = ReplaySampler(journal_path, Genome(self.genome_path))
+            replay.set_rank(rank, world_size=2)
+            rank_sequences, rank_targets = replay.sample(batch_size=10)
+            np.testing.assert_array_equal(
+                rank_sequences, sequences[rank::2])
+            np.testing.assert_array_equal(rank_targets, targets[rank::2])
+
+
+if __name__ == "__main__":
+    unittest.main()
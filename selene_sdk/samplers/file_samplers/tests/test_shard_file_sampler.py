@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from selene_sdk.samplers import RandomPositionsSampler
+from selene_sdk.samplers.file_samplers import ShardFileSampler
+from selene_sdk.samplers.file_samplers import export_shards
+from selene_sdk.samplers.file_samplers.shard_file_sampler import \
+    COORDS_DTYPE, _Shard, _decode_tokens, _encode_sequences, write_shard
+from selene_sdk.samplers.tests.test_online_sampler import FEATURES, \
+    TARGETS, write_genome
+from selene_sdk.sequences import Genome
+
+
+class TestShardFileSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.random_state = np.random.RandomState(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _write_shard(self, name, n_samples, labels=None, n_features=11,
+                     sequence_length=9):
+        # token 4 is an unknown base.
+        tokens = self.random_state.randint(
+            5, size=(n_samples, sequence_length)).astype(np.uint8)
+        if labels is None:
+            labels = self.random_state.randint(
+                2, size=(n_samples, n_features)).astype(np.float32)
+        coords = np.zeros(n_samples, dtype=COORDS_DTYPE)
+        coords["chrom"] = self.random_state.randint(3, size=n_samples)
+        coords["start"] = self.random_state.randint(10 ** 9, size=n_samples)
+        coords["end"] = coords["start"] + sequence_length
+        coords["strand"] = self.random_state.choice([-1, 1], size=n_samples)
+        shard_path = os.path.join(self.output_dir, name)
+        write_shard(shard_path, tokens, labels, coords, 4,
+                    chroms=["chr1", "chr2", "chr3"])
+        return shard_path, tokens, labels, coords
+
+    def test_write_shard_round_trip(self):
+        float_labels = self.random_state.rand(20, 11).astype(np.float32)
+        for (label_format, labels) in (("packbits", None),
+                                       ("float32", float_labels)):
+            with self.subTest(label_format=label_format):
+                shard_path, tokens, labels, coords = self._write_shard(
+                    "{0}.shard".format(label_format), 20, labels=labels)
+                shard = _Shard(shard_path)
+                self.assertEqual(shard.metadata["label_format"], label_format)
+                self.assertEqual(shard.metadata["chroms"],
+                                 ["chr1", "chr2", "chr3"])
+                self.assertEqual(shard.n_samples, 20)
+                shard_tokens, shard_labels, shard_coords = shard.read(3, 17)
+                np.testing.assert_array_equal(shard_tokens, tokens[3:17])
+                np.testing.assert_array_equal(shard_labels, labels[3:17])
+                np.testing.assert_array_equal(shard_coords, coords[3:17])
+
+    def test_encode_tokens_round_trip(self):
+        tokens = self.random_state.randint(5, size=(6, 9)).astype(np.uint8)
+        np.testing.assert_array_equal(
+            _encode_sequences(_decode_tokens(tokens, 4)), tokens)
+
+    def test_export_shards_coords_match_tokens(self):
+        genome_path = os.path.join(self.output_dir, "genome.fa")
+        write_genome(genome_path, [("1", 300000), ("2", 50000),
+                                   ("10", 50000)])
+        genome = Genome(genome_path)
+        sampler = RandomPositionsSampler(
+            genome, TARGETS, FEATURES, seed=1,
+            validation_holdout=["10"], test_holdout=["2"],
+            sequence_length=50, center_bin_to_predict=20)
+        shard_paths = export_shards(
+            sampler, "train", 45, os.path.join(self.output_dir, "shards"),
+            batch_size=8, samples_per_shard=20)
+        self.assertEqual(len(shard_paths), 3)
+        n_samples = 0
+        for shard_path in shard_paths:
+            shard = _Shard(shard_path)
+            tokens, labels, coords = shard.read(0, shard.n_samples)
+            self.assertEqual(labels.shape, (shard.n_samples, len(FEATURES)))
+            self.assertTrue(np.all(coords["chrom"] >= 0))
+            for (row_tokens, row) in zip(tokens, coords):
+                encoding = genome.get_encoding_from_coords(
+                    shard.metadata["chroms"][row["chrom"]],
+                    int(row["start"]), int(row["end"]),
+                    '+' if row["strand"] > 0 else '-')
+                np.testing.assert_array_equal(
+                    _encode_sequences(encoding[np.newaxis])[0], row_tokens)
+            n_samples += shard.n_samples
+        self.assertEqual(n_samples, 45)
+
+    def test_every_example_once_per_pass(self):
+        shard_tokens = []
+        shard_paths = []
+        for (i, n_samples) in enumerate((23, 5, 40)):
+            shard_path, tokens, _, _ = self._write_shard(
+                "train-{0}.shard".format(i), n_samples, sequence_length=30)
+            shard_paths.append(shard_path)
+            shard_tokens.append(tokens)
+        rows = {tokens.tobytes(): i for (i, tokens) in
+                enumerate(np.concatenate(shard_tokens))}
+        self.assertEqual(len(rows), 68)
+        sampler = ShardFileSampler(
+            os.path.join(self.output_dir, "train-*.shard"),
+            shuffle_buffer_size=7)
+        self.assertEqual(sampler.n_samples, 68)
+        passes = []
+        for _ in range(3):
+            sequences, targets = sampler.sample(batch_size=68)
+            self.assertEqual(targets.shape, (68, 11))
+            passes.append([rows[tokens.tobytes()]
+                           for tokens in _encode_sequences(sequences)])
+            self.assertEqual(sorted(passes[-1]), list(range(68)))
+        self.assertNotEqual(passes[0], passes[1])
+
+    def test_mismatched_shards(self):
+        shard_path, _, _, _ = self._write_shard("a.shard", 5)
+        for (key, kwargs) in (("n_features", dict(n_features=12)),
+                              ("sequence_length", dict(sequence_length=10))):
+            with self.subTest(key=key):
+                other_path, _, _, _ = self._write_shard(
+                    "b.shard", 5, **kwargs)
+                with self.assertRaisesRegex(ValueError, key):
+                    ShardFileSampler([shard_path, other_path])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -92,6 +92,28 @@ class IntervalsSampler(OnlineSampler):
         a non-empty list, `output_dir` must be specified. If
         the path in `output_dir` does not exist it will be created
         automatically.
+    save_datasets_format : {'bed', 'journal'}, optional
+        Default is 'bed'. The format to save sampled data in. 'bed'
+        writes a `<mode>_data.bed` file for each mode in
+        `save_datasets`, and 'journal' writes a compact binary
+        `<mode>_data.journal` file that can be replayed with
+        `selene_sdk.samplers.file_samplers.ReplaySampler`.
+    window_cache_size : int, optional
+        Default is 0. The maximum number of training examples to keep
+        in an in-memory cache for reuse. If 0, no cache is kept. The
+        cached windows include `window_cache_max_shift` bases of flanking
+        sequence on each side, along with the targets for every shift.
+        When the cache is full, a random cached window is replaced.
+    window_cache_reuse : float, optional
+        Default is 0.5. The probability that a training example is drawn
+        from the cache (once it is non-empty) rather than from the
+        genome. Each reused example is shifted by a random number of
+        bases up to `window_cache_max_shift` and taken from a random
+        strand, so a higher value trades example diversity for speed.
+    window_cache_max_shift : int, optional
+        Default is 0. The maximum number of bases that a reused example
+        is shifted by. The targets of a shifted example are computed for
+        its shifted center bin when the window is cached.
 
     Attributes
     ----------
@@ -153,7 +175,11 @@ class IntervalsSampler(OnlineSampler):
                  feature_thresholds=0.5,
                  mode="train",
                  save_datasets=["test"],
-                 output_dir=None):
+                 output_dir=None,
+                 save_datasets_format="bed",
+                 window_cache_size=0,
+                 window_cache_reuse=0.5,
+                 window_cache_max_shift=0):
         """
         Constructs a new `IntervalsSampler` object.
         """
@@ -169,7 +195,11 @@ class IntervalsSampler(OnlineSampler):
             feature_thresholds=feature_thresholds,
             mode=mode,
             save_datasets=save_datasets,
-            output_dir=output_dir)
+            output_dir=output_dir,
+            save_datasets_format=save_datasets_format,
+            window_cache_size=window_cache_size,
+            window_cache_reuse=window_cache_reuse,
+            window_cache_max_shift=window_cache_max_shift)
 
         self._sample_from_mode = {}
         self._randcache = {}
@@ -314,44 +344,71 @@ class IntervalsSampler(OnlineSampler):
         """
         bin_start = position - self._start_radius
         bin_end = position + self._end_radius
-        retrieved_targets = self.target.get_feature_data(
+        retrieved_targets = self._fetch_targets(
             chrom, bin_start, bin_end)
         if not self.sample_negative and np.sum(retrieved_targets) == 0:
-            logger.info("No features found in region surrounding "
-                        "region \"{0}\" position {1}. Sampling again.".format(
-                            chrom, position))
+            self._reject("no_features", chrom)
             return None
 
         window_start = bin_start - self.surrounding_sequence_radius
         window_end = bin_end + self.surrounding_sequence_radius
         strand = self.STRAND_SIDES[random.randint(0, 1)]
-        retrieved_seq = \
-            self.reference_sequence.get_encoding_from_coords(
-                chrom, window_start, window_end, strand)
+        retrieved_seq = self._fetch_encoding(
+            chrom, window_start, window_end, strand)
         if retrieved_seq.shape[0] == 0:
-            logger.info("Full sequence centered at region \"{0}\" position "
-                        "{1} could not be retrieved. Sampling again.".format(
-                            chrom, position))
+            self._reject(self._empty_encoding_reason(
+                chrom, window_start, window_end), chrom)
             return None
         elif np.sum(retrieved_seq) / float(retrieved_seq.shape[0]) < 0.60:
-            logger.info("Over 30% of the bases in the sequence centered "
-                        "at region \"{0}\" position {1} are ambiguous ('N'). "
-                        "Sampling again.".format(chrom, position))
+            self._reject("n_content", chrom)
             return None
 
-        if self.mode in self._save_datasets:
-            feature_indices = ';'.join(
-                [str(f) for f in np.nonzero(retrieved_targets)[0]])
-            self._save_datasets[self.mode].append(
-                [chrom,
-                 window_start,
-                 window_end,
-                 strand,
-                 feature_indices])
-            if len(self._save_datasets[self.mode]) > 200000:
-                self.save_dataset_to_file(self.mode)
+        self._accept(chrom)
+        self._save_sample(
+            chrom, window_start, window_end, strand, retrieved_targets)
+        self._cache_fetched_window()
         return (retrieved_seq, retrieved_targets)
 
+    def _valid_window_shifts(self, shifted_targets):
+        """
+        Determines which shifts of a cached window may be used as
+        examples. If `sample_negative` is False, only the shifts with
+        at least 1 positive target are valid.
+
+        Parameters
+        ----------
+        shifted_targets : numpy.ndarray
+            The :math:`(2S + 1) \\times F` targets of the window for each
+            shift from :math:`-S` to :math:`S`.
+
+        Returns
+        -------
+        numpy.ndarray, dtype=bool
+            Whether each shift is valid.
+
+        """
+        if self.sample_negative:
+            return np.ones(len(shifted_targets), dtype=bool)
+        return np.any(shifted_targets, axis=1)
+
+    def set_rank(self, rank, world_size=1):
+        """
+        Reseeds the random state differently in each of several
+        processes that train a model together (see
+        `selene_sdk.samplers.Sampler.set_rank`), and redraws the cache
+        of training samples with it.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        """
+        super(IntervalsSampler, self).set_rank(rank, world_size=world_size)
+        self._update_randcache(mode="train")
+
     def _update_randcache(self, mode=None):
         """
         Updates the cache of indices of intervals. This allows us
@@ -399,10 +456,18 @@ class IntervalsSampler(OnlineSampler):
             where :math:`F` is the number of features.
 
         """
-        sequences = np.zeros((batch_size, self.sequence_length, 4))
-        targets = np.zeros((batch_size, self.n_features))
+        sequences = np.zeros(
+            (batch_size, self.sequence_length, 4), dtype=np.float32)
+        targets = np.zeros((batch_size, self.n_features), dtype=np.float32)
         n_samples_drawn = 0
         while n_samples_drawn < batch_size:
+            cached_output = self._sample_window_cache()
+            if cached_output is not None:
+                sequences[n_samples_drawn, :, :] = cached_output[0]
+                targets[n_samples_drawn, :] = cached_output[1]
+                n_samples_drawn += 1
+                continue
+
             sample_index = self._randcache[self.mode]["sample_next"]
             if sample_index == len(self._sample_from_mode[self.mode].indices):
                 self._update_randcache()
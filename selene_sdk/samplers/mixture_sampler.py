@@ -0,0 +1,456 @@
+"""
+This module provides the `MixtureSampler` class, which draws a fixed
+fraction of positive examples from the feature annotations and the rest
+from a precomputed index of regions without any features.
+
+TODO: Currently, only works with sequences from `selene_sdk.sequences.Genome`.
+"""
+import gzip
+import logging
+import random
+
+import numpy as np
+
+from .online_sampler import OnlineSampler
+
+logger = logging.getLogger(__name__)
+
+
+def _complement_intervals(start, end, exclude_starts, exclude_ends):
+    """
+    Gets the parts of `[start, end)` that do not overlap any of the
+    excluded intervals. Empty excluded intervals are ignored, so the
+    remaining intervals are never adjacent.
+
+    Parameters
+    ----------
+    start : int
+        The start of the region.
+    end : int
+        The end of the region.
+    exclude_starts : numpy.ndarray
+        The starts of the intervals to exclude.
+    exclude_ends : numpy.ndarray
+        The ends of the intervals to exclude.
+
+    Returns
+    -------
+    starts, ends : tuple(numpy.ndarray, numpy.ndarray)
+        The starts and ends of the remaining intervals, in order.
+
+    """
+    exclude_starts = np.asarray(exclude_starts, dtype=np.int64)
+    exclude_ends = np.asarray(exclude_ends, dtype=np.int64)
+    nonempty = exclude_ends > exclude_starts
+    exclude_starts = exclude_starts[nonempty]
+    exclude_ends = exclude_ends[nonempty]
+    order = np.argsort(exclude_starts, kind="mergesort")
+    exclude_starts = exclude_starts[order]
+    exclude_ends = np.maximum.accumulate(exclude_ends[order]) \
+        if len(order) else np.zeros(0, dtype=np.int64)
+    starts = np.clip(np.concatenate([[start], exclude_ends]), start, end)
+    ends = np.clip(np.concatenate([exclude_starts, [end]]), start, end)
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+def _merge_intervals(starts, ends):
+    """
+    Merges overlapping intervals.
+
+    Parameters
+    ----------
+    starts : numpy.ndarray
+        The starts of the intervals.
+    ends : numpy.ndarray
+        The ends of the intervals.
+
+    Returns
+    -------
+    starts, ends : tuple(numpy.ndarray, numpy.ndarray)
+        The starts and ends of the merged intervals, in order.
+
+    """
+    if len(starts) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    gap_starts, gap_ends = _complement_intervals(
+        np.min(starts), np.max(ends), starts, ends)
+    return (np.concatenate([[np.min(starts)], gap_ends]),
+            np.concatenate([gap_starts, [np.max(ends)]]))
+
+
+class _RegionIndex(object):
+    """
+    An index of intervals from which positions are drawn uniformly at
+    random.
+
+    Parameters
+    ----------
+    chroms : list(str)
+        The chromosome of each interval.
+    starts : numpy.ndarray
+        The start of each interval.
+    ends : numpy.ndarray
+        The end of each interval.
+
+    Attributes
+    ----------
+    n_positions : int
+        The total number of positions in the intervals.
+
+    """
+
+    def __init__(self, chroms, starts, ends):
+        self._chroms = chroms
+        self._starts = np.asarray(starts, dtype=np.int64)
+        self._cumulative_lengths = np.cumsum(
+            np.asarray(ends, dtype=np.int64) - self._starts)
+        self.n_positions = int(self._cumulative_lengths[-1]) \
+            if len(self._cumulative_lengths) else 0
+
+    def sample(self):
+        """
+        Draws a position uniformly at random from all the positions in
+        the intervals.
+
+        Returns
+        -------
+        chrom, position : tuple(str, int)
+            The chromosome and position drawn.
+
+        """
+        offset = np.random.randint(self.n_positions)
+        index = np.searchsorted(self._cumulative_lengths, offset, side="right")
+        offset -= self._cumulative_lengths[index - 1] if index else 0
+        return (self._chroms[index], int(self._starts[index] + offset))
+
+
+class MixtureSampler(OnlineSampler):
+    """
+    Draws examples so that a fixed fraction of each batch is positive
+    (has at least 1 feature in the center bin) and the rest is
+    negative. Positives are drawn from positions inside the feature
+    annotations in `target_path`. Negatives are drawn uniformly from an
+    index, built once when the sampler is constructed, of the positions
+    whose center bin overlaps no feature annotation and whose sequence
+    overlaps no blacklist region or run of unknown bases. Negatives
+    therefore need no label query and are never rejected.
+
+    Parameters
+    ----------
+    reference_sequence : selene_sdk.sequences.Genome
+        A reference sequence from which to create examples.
+    target_path : str
+        Path to tabix-indexed, compressed BED file (`*.bed.gz`) of genomic
+        coordinates mapped to the genomic features we want to predict.
+        The file is read in full once to build the positive and negative
+        indices.
+    features : list(str)
+        List of distinct features that we aim to predict.
+    positive_fraction : float, optional
+        Default is 0.5. The fraction of the examples in each batch that
+        are positives. The number of positives in a batch is rounded to
+        the nearest integer.
+    seed : int, optional
+        Default is 436. Sets the random seed for sampling.
+    validation_holdout : list(str) or float, optional
+        Default is `['chr6', 'chr7']`. Holdout can be regional or
+        proportional. If regional, expects a list (e.g. `['chrX', 'chrY']`).
+        If proportional, specify a percentage between (0.0, 1.0) of
+        the chromosomes to hold out. Typically 0.10 or 0.20.
+    test_holdout : list(str) or float, optional
+        Default is `['chr8', 'chr9']`. See documentation for
+        `validation_holdout` for additional information.
+    sequence_length : int, optional
+        Default is 1000. Model is trained on sequences of `sequence_length`
+        where genomic features are annotated to the center regions of
+        these sequences.
+    center_bin_to_predict : int, optional
+        Default is 200. Query the tabix-indexed file for a region of
+        length `center_bin_to_predict`.
+    feature_thresholds : float [0.0, 1.0], optional
+        Default is 0.5. The `feature_threshold` to pass to the
+        `GenomicFeatures` object.
+    mode : {'train', 'validate', 'test'}
+        Default is `'train'`. The mode to run the sampler in.
+    save_datasets : list(str), optional
+        Default is `[]`. The list of modes for which we should
+        save the sampled data to file.
+    output_dir : str or None, optional
+        Default is None. The path to the directory where we should
+        save sampled examples for a mode. If `save_datasets` is
+        a non-empty list, `output_dir` must be specified. If
+        the path in `output_dir` does not exist it will be created
+        automatically.
+    save_datasets_format : {'bed', 'journal'}, optional
+        Default is 'bed'. The format to save sampled data in. See
+        `selene_sdk.samplers.OnlineSampler`.
+
+    Attributes
+    ----------
+    reference_sequence : selene_sdk.sequences.Genome
+        The reference sequence that examples are created from.
+    target : selene_sdk.targets.Target
+        The `selene_sdk.targets.Target` object holding the features that we
+        would like to predict.
+    positive_fraction : float
+        The fraction of the examples in each batch that are positives.
+
+    Raises
+    ------
+    ValueError
+        If `positive_fraction` is not in [0, 1], or if a mode has no
+        positions to draw positives or negatives from when it needs them.
+
+    """
+
+    def __init__(self,
+                 reference_sequence,
+                 target_path,
+                 features,
+                 positive_fraction=0.5,
+                 seed=436,
+                 validation_holdout=['chr6', 'chr7'],
+                 test_holdout=['chr8', 'chr9'],
+                 sequence_length=1000,
+                 center_bin_to_predict=200,
+                 feature_thresholds=0.5,
+                 mode="train",
+                 save_datasets=[],
+                 output_dir=None,
+                 save_datasets_format="bed"):
+        """
+        Constructs a new `MixtureSampler` object.
+        """
+        super(MixtureSampler, self).__init__(
+            reference_sequence,
+            target_path,
+            features,
+            seed=seed,
+            validation_holdout=validation_holdout,
+            test_holdout=test_holdout,
+            sequence_length=sequence_length,
+            center_bin_to_predict=center_bin_to_predict,
+            feature_thresholds=feature_thresholds,
+            mode=mode,
+            save_datasets=save_datasets,
+            output_dir=output_dir,
+            save_datasets_format=save_datasets_format)
+
+        if positive_fraction < 0 or positive_fraction > 1:
+            raise ValueError(
+                "The fraction of positive examples must be in [0, 1]. "
+                "Input was {0}.".format(positive_fraction))
+        self.positive_fraction = positive_fraction
+
+        chrom_modes = self._partition_chromosomes()
+        feature_intervals = self._load_feature_intervals(target_path)
+        self._positive_index = {}
+        self._negative_index = {}
+        for mode in self.modes:
+            chroms = [c for c, m in chrom_modes.items() if m == mode]
+            self._positive_index[mode], self._negative_index[mode] = \
+                self._build_indices(chroms, feature_intervals)
+            if positive_fraction > 0 and \
+                    self._positive_index[mode].n_positions == 0:
+                raise ValueError(
+                    "No positive examples can be drawn in mode '{0}'.".format(
+                        mode))
+            if positive_fraction < 1 and \
+                    self._negative_index[mode].n_positions == 0:
+                raise ValueError(
+                    "No negative examples can be drawn in mode '{0}'.".format(
+                        mode))
+
+    def _load_feature_intervals(self, target_path):
+        """
+        Reads the annotations of the features the model predicts.
+
+        Parameters
+        ----------
+        target_path : str
+            Path to the compressed BED file of feature annotations.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping chromosome names to a tuple of the
+            start and end coordinates of the annotations.
+
+        """
+        features = set(self._features)
+        intervals = {}
+        with gzip.open(target_path, 'rt') as file_handle:
+            for line in file_handle:
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) < 4 or cols[3] not in features:
+                    continue
+                if cols[0] not in intervals:
+                    intervals[cols[0]] = ([], [])
+                intervals[cols[0]][0].append(int(cols[1]))
+                intervals[cols[0]][1].append(int(cols[2]))
+        return {chrom: (np.array(starts, dtype=np.int64),
+                        np.array(ends, dtype=np.int64))
+                for chrom, (starts, ends) in intervals.items()}
+
+    def _build_indices(self, chroms, feature_intervals):
+        """
+        Builds the indices of the positions to draw positives and
+        negatives from in a set of chromosomes. Positions are the
+        centers of the examples' center bins.
+
+        Parameters
+        ----------
+        chroms : list(str)
+            The chromosomes to build the indices for.
+        feature_intervals : dict
+            The output of `_load_feature_intervals`.
+
+        Returns
+        -------
+        positive_index, negative_index : tuple(_RegionIndex, _RegionIndex)
+            The indices of positions for positives and negatives.
+
+        """
+        window_start_radius = \
+            self._start_radius + self.surrounding_sequence_radius
+        window_end_radius = \
+            self._end_radius + self.surrounding_sequence_radius
+        positives = ([], [], [])
+        negatives = ([], [], [])
+        for chrom in chroms:
+            len_chrom = self.reference_sequence.len_chrs[chrom]
+            first = window_start_radius
+            last = len_chrom - window_end_radius + 1
+            if last <= first:
+                continue
+            feature_starts, feature_ends = feature_intervals.get(
+                chrom, (np.zeros(0, dtype=np.int64),
+                        np.zeros(0, dtype=np.int64)))
+
+            # positives: centered inside an annotation
+            starts, ends = _merge_intervals(feature_starts, feature_ends)
+            starts, ends = np.clip(starts, first, last), \
+                np.clip(ends, first, last)
+            keep = ends > starts
+            positives[0].extend([chrom] * int(np.sum(keep)))
+            positives[1].append(starts[keep])
+            positives[2].append(ends[keep])
+
+            # negatives: the center bin overlaps no annotation and the
+            # whole window overlaps no blacklist region or unknown bases.
+            excluded = self.reference_sequence.get_blacklist_regions(chrom) + \
+                self.reference_sequence.get_unknown_base_regions(chrom)
+            excluded_starts = np.concatenate([
+                feature_starts - self._end_radius + 1,
+                np.array([s for s, _ in excluded], dtype=np.int64) -
+                window_end_radius + 1])
+            excluded_ends = np.concatenate([
+                feature_ends + self._start_radius,
+                np.array([e for _, e in excluded], dtype=np.int64) +
+                window_start_radius])
+            starts, ends = _complement_intervals(
+                first, last, excluded_starts, excluded_ends)
+            negatives[0].extend([chrom] * len(starts))
+            negatives[1].append(starts)
+            negatives[2].append(ends)
+
+        def _index(chroms, starts, ends):
+            if not chroms:
+                return _RegionIndex([], [], [])
+            return _RegionIndex(
+                chroms, np.concatenate(starts), np.concatenate(ends))
+        return _index(*positives), _index(*negatives)
+
+    def _retrieve(self, chrom, position, positive):
+        """
+        Retrieves the example centered at a position.
+
+        Parameters
+        ----------
+        chrom : str
+            The name of the chromosome.
+        position : int
+            The center position of the example.
+        positive : bool
+            Whether the position was drawn from the positive index. If
+            False, no label query is made, since the center bin overlaps
+            no feature annotations.
+
+        Returns
+        -------
+        retrieved_seq, retrieved_targets : \
+        tuple(numpy.ndarray, numpy.ndarray) or None
+            The sequence encoding and targets of the example, or None
+            if a positive example did not have any positive targets or
+            its sequence could not be retrieved.
+
+        """
+        bin_start = position - self._start_radius
+        bin_end = position + self._end_radius
+        if positive:
+            retrieved_targets = self.target.get_feature_data(
+                chrom, bin_start, bin_end)
+            if np.sum(retrieved_targets) == 0:
+                self._reject("no_features", chrom)
+                return None
+        else:
+            retrieved_targets = np.zeros(self.n_features)
+
+        window_start = bin_start - self.surrounding_sequence_radius
+        window_end = bin_end + self.surrounding_sequence_radius
+        strand = self.STRAND_SIDES[random.randint(0, 1)]
+        retrieved_seq = self.reference_sequence.get_encoding_from_coords(
+            chrom, window_start, window_end, strand)
+        if retrieved_seq.shape[0] == 0:
+            self._reject(self._empty_encoding_reason(
+                chrom, window_start, window_end), chrom)
+            return None
+
+        self._accept(chrom)
+        self._save_sample(
+            chrom, window_start, window_end, strand, retrieved_targets)
+        return (retrieved_seq, retrieved_targets)
+
+    def sample(self, batch_size=1):
+        """
+        Randomly draws a mini-batch of examples and their corresponding
+        labels, with `positive_fraction` of the examples drawn as
+        positives. The positives and negatives are in random order.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Default is 1. The number of examples to include in the
+            mini-batch.
+
+        Returns
+        -------
+        sequences, targets : tuple(numpy.ndarray, numpy.ndarray)
+            A tuple containing the numeric representation of the
+            sequence examples and their corresponding labels. The
+            shape of `sequences` will be
+            :math:`B \\times L \\times N`, where :math:`B` is
+            `batch_size`, :math:`L` is the sequence length, and
+            :math:`N` is the size of the sequence type's alphabet.
+            The shape of `targets` will be :math:`B \\times F`,
+            where :math:`F` is the number of features.
+
+        """
+        sequences = np.zeros(
+            (batch_size, self.sequence_length, 4), dtype=np.float32)
+        targets = np.zeros((batch_size, self.n_features), dtype=np.float32)
+        n_positives = int(round(batch_size * self.positive_fraction))
+        is_positive = np.random.permutation(
+            np.arange(batch_size) < n_positives)
+        for index, positive in enumerate(is_positive):
+            if positive:
+                region_index = self._positive_index[self.mode]
+            else:
+                region_index = self._negative_index[self.mode]
+            retrieve_output = None
+            while retrieve_output is None:
+                chrom, position = region_index.sample()
+                retrieve_output = self._retrieve(chrom, position, positive)
+            sequences[index, :, :], targets[index, :] = retrieve_output
+        return (sequences, targets)
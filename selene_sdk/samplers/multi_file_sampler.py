@@ -4,6 +4,7 @@ FileSampler for each mode of sampling (train, test, validation).
 The MultiFileSampler is therefore a subclass of Sampler.
 """
 
+from .file_samplers import InterleavedFileSampler
 from .sampler import Sampler
 
 
@@ -16,9 +17,13 @@ class MultiFileSampler(Sampler):
 
     Attributes
     ----------
-    train_sampler : selene_sdk.samplers.file_samplers.FileSampler
+    train_sampler : selene_sdk.samplers.file_samplers.FileSampler or list
         Load your training data as a `FileSampler` before passing it
-        into the `MultiFileSampler` constructor.
+        into the `MultiFileSampler` constructor. If a list of file
+        samplers is passed in, the training data is drawn from all of
+        them, mixed according to `train_sampler_weights`, with each
+        file read on its own background thread (see
+        `selene_sdk.samplers.file_samplers.InterleavedFileSampler`).
     validate_sampler : selene_sdk.samplers.file_samplers.FileSampler
         The validation dataset file sampler.
     features : list(str)
@@ -37,6 +42,10 @@ class MultiFileSampler(Sampler):
         Default is None. Used if the sampler has any data or logging
         statements to save to file. Currently not useful for
         `MultiFileSampler`.
+    train_sampler_weights : list(float) or None, optional
+        Default is None. If `train_sampler` is a list, the relative
+        frequency with which each training sampler is drawn from. If
+        None, the samplers are weighted by their number of samples.
 
     Attributes
     ----------
@@ -53,7 +62,8 @@ class MultiFileSampler(Sampler):
                  test_sampler=None,
                  mode="train",
                  save_datasets=[],
-                 output_dir=None):
+                 output_dir=None,
+                 train_sampler_weights=None):
         """
         Constructs a new `MultiFileSampler` object.
         """
@@ -62,6 +72,10 @@ class MultiFileSampler(Sampler):
             save_datasets=save_datasets,
             output_dir=output_dir)
 
+        if isinstance(train_sampler, (list, tuple)):
+            train_sampler = InterleavedFileSampler(
+                train_sampler, weights=train_sampler_weights)
+
         self._samplers = {
             "train": train_sampler,
             "validate": validate_sampler
@@ -100,6 +114,26 @@ class MultiFileSampler(Sampler):
                 "{1}".format(mode, self.modes))
         self.mode = mode
 
+    def set_rank(self, rank, world_size=1):
+        """
+        Prepares the sampler to be used by one of several processes
+        that train a model together. The training sampler is reseeded
+        differently in each process, or split between the processes if
+        it does not shuffle its file (see
+        `selene_sdk.samplers.file_samplers.FileSampler.set_rank`).
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process, from 0 to the number of processes
+            minus 1.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        """
+        super(MultiFileSampler, self).set_rank(rank, world_size=world_size)
+        self._samplers["train"].set_rank(rank, world_size=world_size)
+
     def get_feature_from_index(self, index):
         """
         Returns the feature corresponding to an index in the feature
@@ -130,7 +164,11 @@ class MultiFileSampler(Sampler):
         """
         return self._samplers[self.mode].sample(batch_size)
 
-    def get_data_and_targets(self, batch_size, n_samples, mode=None):
+    def get_data_and_targets(self,
+                             batch_size,
+                             n_samples,
+                             mode=None,
+                             feature_indices=None):
         """
         This method fetches a subset of the data from the sampler,
         divided into batches. This method also allows the user to
@@ -147,11 +185,50 @@ class MultiFileSampler(Sampler):
             Default is None. The operating mode that the sampler
             should run in. If None, will use the current
             `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
 
         """
         mode = self.mode
         return self._samplers[mode].get_data_and_targets(
-            batch_size, n_samples)
+            batch_size, n_samples, feature_indices=feature_indices)
+
+    def stream_data_and_targets(self,
+                                batch_size,
+                                n_samples=None,
+                                mode=None,
+                                feature_indices=None):
+        """
+        Returns a generator over a subset of the data from the file
+        sampler for `mode`, divided into batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+            If None, all the samples in the file are used.
+        mode : str, optional
+            Default is None. The operating mode that the sampler
+            should run in. If None, will use the current
+            `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        batches, n_samples : tuple(generator, int)
+            A generator of sequence-target pairs and the total number
+            of samples that the generator will yield.
+
+        """
+        if mode is None:
+            mode = self.mode
+        return self._samplers[mode].stream_data_and_targets(
+            batch_size, n_samples, feature_indices=feature_indices)
 
     def get_validation_set(self, batch_size, n_samples=None):
         """
@@ -5,15 +5,21 @@ Objects of the class `OnlineSampler`, are samplers which load examples
 
 """
 from abc import ABCMeta
-import os
+from collections import Counter
+import logging
 import random
 
 import numpy as np
 
+from .dataset_journal import DatasetWriter
+from .sampler import _select_features
 from .sampler import Sampler
 from ..targets import GenomicFeatures
 
 
+logger = logging.getLogger(__name__)
+
+
 class OnlineSampler(Sampler, metaclass=ABCMeta):
     """
     A sampler in which training/validation/test data is constructed
@@ -62,6 +68,28 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
         a non-empty list, `output_dir` must be specified. If
         the path in `output_dir` does not exist it will be created
         automatically.
+    save_datasets_format : {'bed', 'journal'}, optional
+        Default is 'bed'. The format to save sampled data in. 'bed'
+        writes a `<mode>_data.bed` file for each mode in
+        `save_datasets`, and 'journal' writes a compact binary
+        `<mode>_data.journal` file that can be replayed with
+        `selene_sdk.samplers.file_samplers.ReplaySampler`.
+    window_cache_size : int, optional
+        Default is 0. The maximum number of training examples to keep
+        in an in-memory cache for reuse. If 0, no cache is kept. The
+        cached windows include `window_cache_max_shift` bases of flanking
+        sequence on each side, along with the targets for every shift.
+        When the cache is full, a random cached window is replaced.
+    window_cache_reuse : float, optional
+        Default is 0.5. The probability that a training example is drawn
+        from the cache (once it is non-empty) rather than from the
+        genome. Each reused example is shifted by a random number of
+        bases up to `window_cache_max_shift` and taken from a random
+        strand, so a higher value trades example diversity for speed.
+    window_cache_max_shift : int, optional
+        Default is 0. The maximum number of bases that a reused example
+        is shifted by. The targets of a shifted example are computed for
+        its shifted center bin when the window is cached.
 
     Attributes
     ----------
@@ -114,6 +142,22 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
     Defines the strands that features can be sampled from.
     """
 
+    REJECTION_REASONS = ("no_features",
+                         "out_of_bounds",
+                         "n_content",
+                         "blacklist",
+                         "short_sequence")
+    """
+    The reasons for which a draw from the reference sequence can be
+    rejected, as counted in `stats`.
+    """
+
+    REJECTION_SUMMARY_INTERVAL = 100000
+    """
+    The number of rejected draws in a mode between the summaries of
+    the rejection counts that are logged.
+    """
+
     def __init__(self,
                  reference_sequence,
                  target_path,
@@ -126,7 +170,11 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
                  feature_thresholds=0.5,
                  mode="train",
                  save_datasets=[],
-                 output_dir=None):
+                 output_dir=None,
+                 save_datasets_format="bed",
+                 window_cache_size=0,
+                 window_cache_reuse=0.5,
+                 window_cache_max_shift=0):
 
         """
         Creates a new `OnlineSampler` object.
@@ -206,7 +254,32 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
             target_path, self._features,
             feature_thresholds=feature_thresholds)
 
-        self._save_filehandles = {}
+        if save_datasets_format not in DatasetWriter.FILE_FORMATS:
+            raise ValueError(
+                "Format to save datasets in must be one of {0}. Input "
+                "was '{1}'.".format(
+                    DatasetWriter.FILE_FORMATS, save_datasets_format))
+        self._save_datasets_format = save_datasets_format
+        self._dataset_writer = None
+
+        self._n_accepted = Counter()
+        self._n_rejected = Counter()
+        self._n_rejected_in_mode = Counter()
+
+        self._window_cache_size = window_cache_size
+        self._window_cache_reuse = window_cache_reuse
+        self._window_cache_max_shift = window_cache_max_shift
+        self._window_cache = []
+        self._fetched_window = None
+        if self._window_cache_size > 0:
+            if not hasattr(reference_sequence, "COMPLEMENTARY_BASE_DICT"):
+                raise ValueError(
+                    "A window cache can only be used with a reference "
+                    "sequence that has complementary bases.")
+            self._complement_indices = [
+                reference_sequence.BASE_TO_INDEX[
+                    reference_sequence.COMPLEMENTARY_BASE_DICT[base]]
+                for base in reference_sequence.BASES_ARR]
 
     def get_feature_from_index(self, index):
         """
@@ -245,6 +318,282 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
         """
         return self.reference_sequence.encoding_to_sequence(encoding)
 
+    def _partition_chromosomes(self):
+        """
+        Assigns each chromosome in the reference sequence to a mode.
+        If the holdouts are proportional, the fractions of chromosomes
+        given by `validation_holdout` and `test_holdout` are chosen at
+        random.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping chromosome names to modes.
+
+        """
+        chroms = self.reference_sequence.get_chrs()
+        chrom_modes = {}
+        if self._holdout_type == "chromosome":
+            for chrom in chroms:
+                if chrom in self.validation_holdout:
+                    chrom_modes[chrom] = "validate"
+                elif self.test_holdout and chrom in self.test_holdout:
+                    chrom_modes[chrom] = "test"
+                else:
+                    chrom_modes[chrom] = "train"
+            return chrom_modes
+        select_indices = np.random.permutation(len(chroms))
+        n_validate = int(len(chroms) * self.validation_holdout)
+        n_test = 0
+        if self.test_holdout:
+            n_test = int(len(chroms) * self.test_holdout)
+        for rank, index in enumerate(select_indices):
+            if rank < n_validate:
+                chrom_modes[chroms[index]] = "validate"
+            elif rank < n_validate + n_test:
+                chrom_modes[chroms[index]] = "test"
+            else:
+                chrom_modes[chroms[index]] = "train"
+        return chrom_modes
+
+    def _save_sample(self, chrom, start, end, strand, targets, mode=None):
+        """
+        Records a sampled example if examples drawn in its mode are
+        saved to file.
+
+        Parameters
+        ----------
+        chrom : str
+            The name of the region the example was drawn from.
+        start : int
+            The 0-based start coordinate of the example's sequence.
+        end : int
+            One past the last coordinate of the example's sequence.
+        strand : {'+', '-'}
+            The strand the sequence was taken from.
+        targets : numpy.ndarray
+            The example's targets.
+        mode : str or None, optional
+            Default is None. The mode the example was drawn in. If None,
+            will use the current mode `self.mode`.
+
+        """
+        if mode is None:
+            mode = self.mode
+        if mode not in self._save_datasets:
+            return
+        self._save_datasets[mode].append(
+            [chrom, start, end, strand, np.nonzero(targets)[0]])
+        if len(self._save_datasets[mode]) > 200000:
+            self.save_dataset_to_file(mode)
+
+    def _accept(self, chrom):
+        """
+        Counts an example drawn from the reference sequence that was
+        accepted.
+        """
+        self._n_accepted[(self.mode, chrom)] += 1
+
+    def _reject(self, reason, chrom):
+        """
+        Counts a draw from the reference sequence that was rejected,
+        and logs a summary of the rejections in the current mode every
+        `REJECTION_SUMMARY_INTERVAL` rejections.
+
+        Parameters
+        ----------
+        reason : str
+            One of `REJECTION_REASONS`.
+        chrom : str
+            The name of the region the example was drawn from.
+
+        """
+        self._n_rejected[(self.mode, reason, chrom)] += 1
+        self._n_rejected_in_mode[self.mode] += 1
+        if self._n_rejected_in_mode[self.mode] % \
+                self.REJECTION_SUMMARY_INTERVAL == 0:
+            mode_stats = self.stats()[self.mode]
+            logger.info(
+                "Sampler rejected {0} of {1} draws in mode '{2}': "
+                "{3}".format(mode_stats["rejected"],
+                             mode_stats["rejected"] + mode_stats["accepted"],
+                             self.mode,
+                             mode_stats["rejection_reasons"]))
+
+    def _empty_encoding_reason(self, chrom, start, end):
+        """
+        Determines why no sequence could be retrieved for
+        `[start, end)`: either the coordinates are out of the bounds of
+        the region, or the sequence overlaps a blacklist region.
+        """
+        len_chrs = getattr(self.reference_sequence, "len_chrs", None)
+        if len_chrs is not None and chrom in len_chrs and \
+                0 <= start < end <= len_chrs[chrom]:
+            return "blacklist"
+        return "out_of_bounds"
+
+    def stats(self):
+        """
+        Gets the number of draws from the reference sequence that were
+        accepted or rejected so far, for each mode. Examples reused
+        from the window cache are not counted.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping each mode to a dictionary with the
+            total number of `"accepted"` and `"rejected"` draws, the
+            number of rejections for each of `REJECTION_REASONS`
+            (`"rejection_reasons"`) and, for each region that draws were
+            made from (`"chromosomes"`), the number of accepted draws
+            and of rejections for each reason.
+
+        """
+        stats = {}
+        for mode in self.modes:
+            stats[mode] = {
+                "accepted": 0,
+                "rejected": 0,
+                "rejection_reasons": {
+                    reason: 0 for reason in self.REJECTION_REASONS},
+                "chromosomes": {}
+            }
+        for (mode, chrom), count in self._n_accepted.items():
+            chrom_stats = stats[mode]["chromosomes"].setdefault(
+                chrom, {"accepted": 0})
+            chrom_stats["accepted"] += count
+            stats[mode]["accepted"] += count
+        for (mode, reason, chrom), count in self._n_rejected.items():
+            chrom_stats = stats[mode]["chromosomes"].setdefault(
+                chrom, {"accepted": 0})
+            chrom_stats[reason] = chrom_stats.get(reason, 0) + count
+            stats[mode]["rejection_reasons"][reason] += count
+            stats[mode]["rejected"] += count
+        return stats
+
+    def _window_cache_active(self):
+        """
+        Whether examples are cached for reuse. Only training examples
+        are cached.
+        """
+        return self._window_cache_size > 0 and self.mode == "train"
+
+    def _orient_encoding(self, encoding, strand):
+        """
+        Returns the reverse complement of a '+' strand encoding if
+        `strand` is '-', or the encoding itself otherwise.
+        """
+        if strand == '-':
+            return encoding[::-1, self._complement_indices]
+        return encoding
+
+    def _fetch_targets(self, chrom, start, end):
+        """
+        Gets the targets for the center bin `[start, end)`. If the
+        window cache is active, the targets for every allowed shift of
+        the bin are computed at the same time and kept until the
+        example is accepted or rejected.
+        """
+        self._fetched_window = None
+        if not self._window_cache_active():
+            return self.target.get_feature_data(chrom, start, end)
+        shifted_targets = self.target.get_shifted_feature_data(
+            chrom, start, end, self._window_cache_max_shift)
+        self._fetched_window = {"chrom": chrom, "targets": shifted_targets}
+        return shifted_targets[self._window_cache_max_shift]
+
+    def _fetch_encoding(self, chrom, start, end, strand):
+        """
+        Gets the encoding of the sequence `[start, end)` on `strand`.
+        If the window cache is active, the sequence is fetched with its
+        flanking sequence so that it can be cached for reuse.
+        """
+        if self._fetched_window is None:
+            return self.reference_sequence.get_encoding_from_coords(
+                chrom, start, end, strand)
+        max_shift = self._window_cache_max_shift
+        encoding = self.reference_sequence.get_encoding_from_coords(
+            chrom, start - max_shift, end + max_shift, '+')
+        if encoding.shape[0] == 0:
+            # the flanks are out of bounds or blacklisted, so this
+            # example cannot be reused.
+            self._fetched_window = None
+            return self.reference_sequence.get_encoding_from_coords(
+                chrom, start, end, strand)
+        self._fetched_window.update(
+            start=start, end=end, encoding=encoding.astype(np.float32))
+        return self._orient_encoding(
+            encoding[max_shift:max_shift + end - start], strand)
+
+    def _valid_window_shifts(self, shifted_targets):
+        """
+        Determines which shifts of a cached window may be used as
+        examples. All shifts are valid by default.
+
+        Parameters
+        ----------
+        shifted_targets : numpy.ndarray
+            The :math:`(2S + 1) \\times F` targets of the window for each
+            shift from :math:`-S` to :math:`S`.
+
+        Returns
+        -------
+        numpy.ndarray, dtype=bool
+            Whether each shift is valid.
+
+        """
+        return np.ones(len(shifted_targets), dtype=bool)
+
+    def _cache_fetched_window(self):
+        """
+        Adds the window of the last accepted example to the cache,
+        replacing a random cached window if the cache is full.
+        """
+        window = self._fetched_window
+        self._fetched_window = None
+        if window is None or "encoding" not in window:
+            return
+        window["shifts"] = np.nonzero(
+            self._valid_window_shifts(window["targets"]))[0]
+        if len(window["shifts"]) == 0:
+            return
+        if len(self._window_cache) < self._window_cache_size:
+            self._window_cache.append(window)
+        else:
+            self._window_cache[
+                random.randrange(self._window_cache_size)] = window
+
+    def _sample_window_cache(self):
+        """
+        Draws an example from the window cache with probability
+        `window_cache_reuse`, at a random valid shift and on a random
+        strand.
+
+        Returns
+        -------
+        tuple(numpy.ndarray, numpy.ndarray) or None
+            The sequence encoding and targets of the example, or None
+            if the example should be drawn from the genome instead.
+
+        """
+        if not self._window_cache_active() or not self._window_cache or \
+                random.random() >= self._window_cache_reuse:
+            return None
+        window = self._window_cache[random.randrange(len(self._window_cache))]
+        shift_index = window["shifts"][random.randrange(len(window["shifts"]))]
+        shift = shift_index - self._window_cache_max_shift
+        strand = self.STRAND_SIDES[random.randint(0, 1)]
+        length = window["end"] - window["start"]
+        encoding = self._orient_encoding(
+            window["encoding"][shift_index:shift_index + length], strand)
+        targets = window["targets"][shift_index]
+        self._save_sample(window["chrom"],
+                          window["start"] + shift,
+                          window["end"] + shift,
+                          strand,
+                          targets)
+        return (encoding, targets)
+
     def save_dataset_to_file(self, mode, close_filehandle=False):
         """
         Save samples for each partition (i.e. train/validate/test) to
@@ -259,25 +608,28 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
             Default is False. `close_filehandle=True` assumes that all
             data corresponding to the input `mode` has been saved to
             file and `save_dataset_to_file` will not be called with
-            `mode` again.
+            `mode` again. Samples are written in the background, so
+            the file is only guaranteed to be complete once this
+            method is called with `close_filehandle=True`.
         """
         if mode not in self._save_datasets:
             return
+        if self._dataset_writer is None:
+            self._dataset_writer = DatasetWriter(
+                self._output_dir,
+                self.n_features,
+                file_format=self._save_datasets_format)
+        # hand the list of samples over to the writer's background
+        # thread and start a new one.
         samples = self._save_datasets[mode]
-        if mode not in self._save_filehandles:
-            self._save_filehandles[mode] = open(
-                os.path.join(self._output_dir,
-                             "{0}_data.bed".format(mode)),
-                'w+')
-        file_handle = self._save_filehandles[mode]
-        while len(samples) > 0:
-            cols = samples.pop(0)
-            line = '\t'.join([str(c) for c in cols])
-            file_handle.write("{0}\n".format(line))
-        if close_filehandle:
-            file_handle.close()
-
-    def get_data_and_targets(self, batch_size, n_samples=None, mode=None):
+        self._save_datasets[mode] = []
+        self._dataset_writer.write(mode, samples, close=close_filehandle)
+
+    def get_data_and_targets(self,
+                             batch_size,
+                             n_samples=None,
+                             mode=None,
+                             feature_indices=None):
         """
         This method fetches a subset of the data from the sampler,
         divided into batches. This method also allows the user to
@@ -299,6 +651,9 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
             fetching the samples. See
             `selene_sdk.samplers.IntervalsSampler.modes` for more
             information. If None, will use the current mode `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
 
         Returns
         -------
@@ -329,12 +684,148 @@ class OnlineSampler(Sampler, metaclass=ABCMeta):
         n_batches = int(n_samples / batch_size)
         for _ in range(n_batches):
             inputs, targets = self.sample(batch_size)
+            if feature_indices is not None:
+                targets = targets[:, feature_indices]
             sequences_and_targets.append((inputs, targets))
         targets_mat = np.vstack([t for (s, t) in sequences_and_targets])
         if mode in self._save_datasets:
             self.save_dataset_to_file(mode, close_filehandle=True)
         return sequences_and_targets, targets_mat
 
+    def _swap_sampling_state(self, mode, state):
+        """
+        Swaps the random number generator states used for sampling, as
+        well as the cache of random draws for `mode` if the sampler
+        keeps one, with those in `state`.
+
+        Parameters
+        ----------
+        mode : str
+            The mode whose cache of random draws should be swapped.
+        state : tuple
+            A tuple of the `numpy.random` state, the `random` state and
+            the cache of random draws for `mode` (or None).
+
+        Returns
+        -------
+        tuple
+            The state that was replaced, in the same format as `state`.
+
+        """
+        previous_state = (np.random.get_state(), random.getstate(), None)
+        np.random.set_state(state[0])
+        random.setstate(state[1])
+        randcache = getattr(self, "_randcache", None)
+        if randcache is not None:
+            previous_state = previous_state[:2] + (randcache[mode],)
+            randcache[mode] = state[2]
+        return previous_state
+
+    def _stream_batches(self, mode, batch_size, n_batches):
+        """
+        Draws `n_batches` batches for `mode`, one at a time. The draws
+        use random number generators that are seeded with `self.seed`
+        at the start of every stream and are swapped in and out around
+        each batch, so the same examples are drawn on every pass
+        regardless of what else is sampled in between.
+
+        Parameters
+        ----------
+        mode : str
+            The mode to draw the batches from.
+        batch_size : int
+            The size of each batch.
+        n_batches : int
+            The number of batches to draw.
+
+        Yields
+        ------
+        tuple(numpy.ndarray, numpy.ndarray)
+            The sequences and targets of a batch.
+
+        """
+        stream_state = (np.random.RandomState(self.seed).get_state(),
+                        random.Random(self.seed + 1).getstate(),
+                        {"cache_indices": None, "sample_next": 0})
+        for index in range(n_batches):
+            current_mode = self.mode
+            outer_state = self._swap_sampling_state(mode, stream_state)
+            self.mode = mode
+            try:
+                if index == 0 and hasattr(self, "_update_randcache"):
+                    self._update_randcache(mode=mode)
+                batch = self.sample(batch_size)
+            finally:
+                stream_state = self._swap_sampling_state(mode, outer_state)
+                self.mode = current_mode
+            yield batch
+
+        if mode in self._save_datasets:
+            self.save_dataset_to_file(mode, close_filehandle=True)
+            # every pass draws the same examples, so only the first
+            # one is written to file.
+            del self._save_datasets[mode]
+
+    def stream_data_and_targets(self,
+                                batch_size,
+                                n_samples=None,
+                                mode=None,
+                                feature_indices=None):
+        """
+        This method has the same role as `get_data_and_targets`, but
+        returns a generator that draws the batches as they are consumed
+        instead of holding all of them in memory. Every call with the
+        same arguments yields the same examples.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+            If `n_samples` is None and the mode is `validate`, will
+            set `n_samples` to 32000; if the mode is `test`, will set
+            `n_samples` to 640000 if it is None. If the mode is `train`
+            you must have specified a value for `n_samples`.
+        mode : str, optional
+            Default is None. The mode to run the sampler in when
+            fetching the samples. If None, will use the current mode
+            `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        batches, n_samples : tuple(generator, int)
+            A generator of sequence-target pairs, where the sequences
+            are of the shape :math:`B \\times L \\times N` and the targets
+            are of the shape :math:`B \\times F`, and the total number
+            of samples that the generator will yield. This is
+            `n_samples` rounded down to a multiple of `batch_size`.
+
+        Raises
+        ------
+        ValueError
+            If `mode` is not a valid mode.
+
+        """
+        if mode is None:
+            mode = self.mode
+        elif mode not in self.modes:
+            raise ValueError(
+                "Tried to stream data for mode '{0}' but the only valid "
+                "modes are {1}".format(mode, self.modes))
+        if n_samples is None and mode == "validate":
+            n_samples = 32000
+        elif n_samples is None and mode == "test":
+            n_samples = 640000
+
+        n_batches = int(n_samples / batch_size)
+        batches = self._stream_batches(mode, batch_size, n_batches)
+        return (_select_features(batches, feature_indices),
+                n_batches * batch_size)
+
     def get_dataset_in_batches(self, mode, batch_size, n_samples=None):
         """
         This method returns a subset of the data for a specified run
@@ -90,6 +90,28 @@ class RandomPositionsSampler(OnlineSampler):
         a non-empty list, `output_dir` must be specified. If
         the path in `output_dir` does not exist it will be created
         automatically.
+    save_datasets_format : {'bed', 'journal'}, optional
+        Default is 'bed'. The format to save sampled data in. 'bed'
+        writes a `<mode>_data.bed` file for each mode in
+        `save_datasets`, and 'journal' writes a compact binary
+        `<mode>_data.journal` file that can be replayed with
+        `selene_sdk.samplers.file_samplers.ReplaySampler`.
+    window_cache_size : int, optional
+        Default is 0. The maximum number of training examples to keep
+        in an in-memory cache for reuse. If 0, no cache is kept. The
+        cached windows include `window_cache_max_shift` bases of flanking
+        sequence on each side, along with the targets for every shift.
+        When the cache is full, a random cached window is replaced.
+    window_cache_reuse : float, optional
+        Default is 0.5. The probability that a training example is drawn
+        from the cache (once it is non-empty) rather than from the
+        genome. Each reused example is shifted by a random number of
+        bases up to `window_cache_max_shift` and taken from a random
+        strand, so a higher value trades example diversity for speed.
+    window_cache_max_shift : int, optional
+        Default is 0. The maximum number of bases that a reused example
+        is shifted by. The targets of a shifted example are computed for
+        its shifted center bin when the window is cached.
 
     Attributes
     ----------
@@ -136,7 +158,11 @@ class RandomPositionsSampler(OnlineSampler):
                  feature_thresholds=0.5,
                  mode="train",
                  save_datasets=[],
-                 output_dir=None):
+                 output_dir=None,
+                 save_datasets_format="bed",
+                 window_cache_size=0,
+                 window_cache_reuse=0.5,
+                 window_cache_max_shift=0):
         super(RandomPositionsSampler, self).__init__(
             reference_sequence,
             target_path,
@@ -149,7 +175,11 @@ class RandomPositionsSampler(OnlineSampler):
             feature_thresholds=feature_thresholds,
             mode=mode,
             save_datasets=save_datasets,
-            output_dir=output_dir)
+            output_dir=output_dir,
+            save_datasets_format=save_datasets_format,
+            window_cache_size=window_cache_size,
+            window_cache_reuse=window_cache_reuse,
+            window_cache_max_shift=window_cache_max_shift)
 
         self._sample_from_mode = {}
         self._randcache = {}
@@ -235,53 +265,51 @@ class RandomPositionsSampler(OnlineSampler):
     def _retrieve(self, chrom, position):
         bin_start = position - self._start_radius
         bin_end = position + self._end_radius
-        retrieved_targets = self.target.get_feature_data(
+        retrieved_targets = self._fetch_targets(
             chrom, bin_start, bin_end)
         window_start = bin_start - self.surrounding_sequence_radius
         window_end = bin_end + self.surrounding_sequence_radius
         if window_end - window_start < self.sequence_length:
-            print(bin_start, bin_end,
-                  self._start_radius, self._end_radius,
-                  self.surrounding_sequence_radius)
+            self._reject("short_sequence", chrom)
             return None
         strand = self.STRAND_SIDES[random.randint(0, 1)]
-        retrieved_seq = \
-            self.reference_sequence.get_encoding_from_coords(
-                chrom, window_start, window_end, strand)
+        retrieved_seq = self._fetch_encoding(
+            chrom, window_start, window_end, strand)
         if retrieved_seq.shape[0] == 0:
-            logger.info("Full sequence centered at {0} position {1} "
-                        "could not be retrieved. Sampling again.".format(
-                            chrom, position))
+            self._reject(self._empty_encoding_reason(
+                chrom, window_start, window_end), chrom)
             return None
         elif np.sum(retrieved_seq) / float(retrieved_seq.shape[0]) < 0.60:
-            logger.info("Over 30% of the bases in the sequence centered "
-                        "at {0} position {1} are ambiguous ('N'). "
-                        "Sampling again.".format(chrom, position))
+            self._reject("n_content", chrom)
             return None
-
-        if retrieved_seq.shape[0] < self.sequence_length:
-            # TODO: remove after investigating this bug.
-            print("Warning: sequence retrieved for {0}, {1}, {2}, {3} "
-                  "had length less than required sequence length {4}. "
-                  "This bug will be investigated and addressed in the next "
-                  "version of Selene.".format(
-                      chrom, window_start, window_end, strand,
-                      self.sequence_length))
+        elif retrieved_seq.shape[0] < self.sequence_length:
+            self._reject("short_sequence", chrom)
             return None
 
-        if self.mode in self._save_datasets:
-            feature_indices = ';'.join(
-                [str(f) for f in np.nonzero(retrieved_targets)[0]])
-            self._save_datasets[self.mode].append(
-                [chrom,
-                 window_start,
-                 window_end,
-                 strand,
-                 feature_indices])
-            if len(self._save_datasets[self.mode]) > 200000:
-                self.save_dataset_to_file(self.mode)
+        self._accept(chrom)
+        self._save_sample(
+            chrom, window_start, window_end, strand, retrieved_targets)
+        self._cache_fetched_window()
         return (retrieved_seq, retrieved_targets)
 
+    def set_rank(self, rank, world_size=1):
+        """
+        Reseeds the random state differently in each of several
+        processes that train a model together (see
+        `selene_sdk.samplers.Sampler.set_rank`), and redraws the cache
+        of training samples with it.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process.
+        world_size : int, optional
+            Default is 1. The number of processes.
+
+        """
+        super(RandomPositionsSampler, self).set_rank(rank, world_size=world_size)
+        self._update_randcache(mode="train")
+
     def _update_randcache(self, mode=None):
         if not mode:
             mode = self.mode
@@ -316,10 +344,18 @@ class RandomPositionsSampler(OnlineSampler):
             where :math:`F` is the number of features.
 
         """
-        sequences = np.zeros((batch_size, self.sequence_length, 4))
-        targets = np.zeros((batch_size, self.n_features))
+        sequences = np.zeros(
+            (batch_size, self.sequence_length, 4), dtype=np.float32)
+        targets = np.zeros((batch_size, self.n_features), dtype=np.float32)
         n_samples_drawn = 0
         while n_samples_drawn < batch_size:
+            cached_output = self._sample_window_cache()
+            if cached_output is not None:
+                sequences[n_samples_drawn, :, :] = cached_output[0]
+                targets[n_samples_drawn, :] = cached_output[1]
+                n_samples_drawn += 1
+                continue
+
             sample_index = self._randcache[self.mode]["sample_next"]
             if sample_index == len(self._randcache[self.mode]["cache_indices"]):
                 self._update_randcache()
@@ -5,6 +5,21 @@ a way to query some training/validation/test data for examples.
 from abc import ABCMeta
 from abc import abstractmethod
 import os
+import random
+
+import numpy as np
+
+
+def _select_features(batches, feature_indices):
+    """
+    Yields the sequences and targets of each batch in `batches`, keeping
+    only the targets of the features at `feature_indices` (or all of
+    them if `feature_indices` is None).
+    """
+    for sequences, targets in batches:
+        if feature_indices is not None:
+            targets = targets[:, feature_indices]
+        yield sequences, targets
 
 
 class Sampler(metaclass=ABCMeta):
@@ -32,6 +47,8 @@ class Sampler(metaclass=ABCMeta):
         A list of the names of the modes that the object may operate in.
     mode : str or None
         The current mode that the object is operating in.
+    n_features : int
+        The number of features (classes) the model predicts.
 
     """
     BASE_MODES = ("train", "validate")
@@ -47,6 +64,7 @@ class Sampler(metaclass=ABCMeta):
         self.mode = None
 
         self._features = features
+        self.n_features = len(features)
 
         self._save_datasets = {}
         for mode in save_datasets:
@@ -78,6 +96,32 @@ class Sampler(metaclass=ABCMeta):
                 "{1}".format(mode, self.modes))
         self.mode = mode
 
+    def set_rank(self, rank, world_size=1):
+        """
+        Prepares the sampler to be used by one of several processes
+        that train a model together (see the `distributed` parameter of
+        `selene_sdk.TrainModel`). Every process constructs the same
+        sampler, so the `random` and `numpy.random` states are reseeded
+        differently in each process, which then draws different
+        training examples. Only the process with rank 0 saves the
+        sampled data to file.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process, from 0 to the number of processes
+            minus 1.
+        world_size : int, optional
+            Default is 1. The number of processes. Samplers that draw
+            their examples at random do not use it.
+
+        """
+        seed = (np.random.randint(2 ** 31) + rank) % 2 ** 32
+        random.seed(seed)
+        np.random.seed(seed)
+        if rank != 0:
+            self._save_datasets = {}
+
     @abstractmethod
     def get_feature_from_index(self, index):
         """
@@ -111,7 +155,11 @@ class Sampler(metaclass=ABCMeta):
         raise NotImplementedError()
 
     @abstractmethod
-    def get_data_and_targets(self, batch_size, n_samples, mode=None):
+    def get_data_and_targets(self,
+                             batch_size,
+                             n_samples,
+                             mode=None,
+                             feature_indices=None):
         """
         This method fetches a subset of the data from the sampler,
         divided into batches. This method also allows the user to
@@ -127,6 +175,9 @@ class Sampler(metaclass=ABCMeta):
         mode : str, optional
             Default is None. The operating mode that the object should run in.
             If None, will use the current mode `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
 
         """
         raise NotImplementedError()
@@ -187,6 +238,108 @@ class Sampler(metaclass=ABCMeta):
         """
         raise NotImplementedError()
 
+    def stream_data_and_targets(self,
+                                batch_size,
+                                n_samples=None,
+                                mode=None,
+                                feature_indices=None):
+        """
+        This method has the same role as `get_data_and_targets`, but
+        rather than returning the whole subset of the data at once, it
+        returns a generator that draws the batches lazily as they are
+        consumed. Samplers that support streaming should draw the same
+        examples every time this method is called with the same
+        arguments, so that a streamed validation or test set is the
+        same on every pass. The targets of each batch can be limited
+        to a subset of the features as it is drawn.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+        mode : str, optional
+            Default is None. The operating mode that the object should run in.
+            If None, will use the current mode `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        batches, n_samples : tuple(generator, int)
+            A generator of the sequence-target pairs (see
+            `get_data_and_targets`) and the total number of samples it
+            will yield.
+
+        Raises
+        ------
+        NotImplementedError
+            If the sampler does not support streaming its data.
+
+        """
+        raise NotImplementedError(
+            "{0} does not support streaming its data. Please use "
+            "`get_data_and_targets` instead.".format(
+                self.__class__.__name__))
+
+    def stream_validation_set(self, batch_size, n_samples=None):
+        """
+        Returns a generator over the validation data, divided into
+        batches. See `stream_data_and_targets` for more information.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of validation examples to
+            retrieve.
+
+        Returns
+        -------
+        batches, n_samples : tuple(generator, int)
+            A generator of the sequence-target pairs and the total
+            number of samples it will yield.
+
+        """
+        return self.stream_data_and_targets(
+            batch_size, n_samples=n_samples, mode="validate")
+
+    def stream_test_set(self, batch_size, n_samples=None):
+        """
+        Returns a generator over the test data, divided into batches.
+        See `stream_data_and_targets` for more information.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of test examples to
+            retrieve.
+
+        Returns
+        -------
+        batches, n_samples : tuple(generator, int)
+            A generator of the sequence-target pairs and the total
+            number of samples it will yield.
+
+        Raises
+        ------
+        ValueError
+            If no test partition of the data was specified during
+            sampler initialization.
+
+        """
+        if "test" not in self.modes:
+            raise ValueError("No test partition of the data was specified "
+                             "during initialization. Cannot use method "
+                             "`stream_test_set`.")
+        return self.stream_data_and_targets(
+            batch_size, n_samples=n_samples, mode="test")
+
     @abstractmethod
     def save_dataset_to_file(self, mode, close_filehandle=False):
         """
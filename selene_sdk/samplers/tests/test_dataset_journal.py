@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from selene_sdk.samplers.dataset_journal import DatasetWriter
+from selene_sdk.samplers.dataset_journal import read_journal
+
+
+class TestDatasetWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.samples = [["chr1", 10, 30, '+', [0, 2]],
+                        ["chr2", 5, 25, '-', []],
+                        ["chr1", 40, 60, '-', [1]]]
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_journal_round_trip(self):
+        writer = DatasetWriter(self.output_dir, 3, file_format="journal")
+        writer.write("train", self.samples[:2])
+        writer.write("train", self.samples[2:], close=True)
+        journal = read_journal(
+            os.path.join(self.output_dir, "train_data.journal"))
+        self.assertEqual(journal["n_features"], 3)
+        self.assertEqual(
+            [journal["chroms"][i] for i in journal["chrom"]],
+            ["chr1", "chr2", "chr1"])
+        np.testing.assert_array_equal(journal["start"], [10, 5, 40])
+        np.testing.assert_array_equal(journal["end"], [30, 25, 60])
+        np.testing.assert_array_equal(journal["strand"], [1, -1, -1])
+        np.testing.assert_array_equal(journal["target_indptr"], [0, 2, 2, 3])
+        np.testing.assert_array_equal(journal["target_indices"], [0, 2, 1])
+
+    def test_bed_format(self):
+        writer = DatasetWriter(self.output_dir, 3)
+        writer.write("validate", self.samples, close=True)
+        with open(os.path.join(self.output_dir,
+                               "validate_data.bed")) as file_handle:
+            self.assertEqual(file_handle.read(),
+                             "chr1\t10\t30\t+\t0;2\n"
+                             "chr2\t5\t25\t-\t\n"
+                             "chr1\t40\t60\t-\t1\n")
+
+    def test_error_surfaces_on_close(self):
+        writer = DatasetWriter(
+            os.path.join(self.output_dir, "missing"), 3)
+        # the error is raised in the background thread, so queueing
+        # more examples does not fail.
+        writer.write("train", self.samples)
+        with self.assertRaises(IOError):
+            writer.write("train", self.samples, close=True)
+        # the error is only raised once.
+        writer.flush()
+
+    def test_error_surfaces_on_next_write(self):
+        writer = DatasetWriter(self.output_dir, 3, file_format="journal")
+        writer.write("train", [["chr1", 10, 30, '+', ["not an index"]]])
+        writer._queue.join()
+        with self.assertRaises(ValueError):
+            writer.write("train", self.samples)
+
+    def test_unknown_file_format(self):
+        with self.assertRaises(ValueError):
+            DatasetWriter(self.output_dir, 3, file_format="csv")
+
+    def test_read_journal_rejects_other_files(self):
+        filepath = os.path.join(self.output_dir, "train_data.bed")
+        with open(filepath, 'w') as file_handle:
+            file_handle.write("chr1\t10\t30\t+\t0\n")
+        with self.assertRaises(ValueError):
+            read_journal(filepath)
+
+
+if __name__ == "__main__":
+    unittest.main()
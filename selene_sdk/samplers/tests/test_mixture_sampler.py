@@ -0,0 +1,118 @@
+import unittest
+
+import numpy as np
+
+from selene_sdk.samplers.mixture_sampler import _complement_intervals
+from selene_sdk.samplers.mixture_sampler import _merge_intervals
+from selene_sdk.samplers.mixture_sampler import _RegionIndex
+
+
+def _intervals_from_mask(mask, offset=0):
+    """
+    Gets the runs of True values in `mask` as (start, end) tuples.
+    """
+    changes = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return list(zip((np.nonzero(changes == 1)[0] + offset).tolist(),
+                    (np.nonzero(changes == -1)[0] + offset).tolist()))
+
+
+class TestIntervals(unittest.TestCase):
+
+    def _assert_intervals(self, observed, expected):
+        starts, ends = observed
+        self.assertEqual(list(zip(starts.tolist(), ends.tolist())), expected)
+
+    def test_complement_intervals(self):
+        for (start, end, exclude, expected) in [
+                (0, 10, [], [(0, 10)]),
+                (0, 10, [(0, 10)], []),
+                (0, 10, [(-5, 20)], []),
+                # adjacent
+                (0, 10, [(2, 4), (4, 6)], [(0, 2), (6, 10)]),
+                # overlapping and nested, out of order
+                (0, 20, [(8, 12), (2, 10), (3, 4)], [(0, 2), (12, 20)]),
+                # at the boundaries and out of range
+                (5, 15, [(0, 5), (15, 30), (-10, -5), (40, 50)], [(5, 15)]),
+                (5, 15, [(0, 6), (14, 30)], [(6, 14)]),
+                # empty excluded intervals
+                (0, 10, [(3, 3), (6, 2)], [(0, 10)])]:
+            with self.subTest(start=start, end=end, exclude=exclude):
+                self._assert_intervals(
+                    _complement_intervals(
+                        start, end,
+                        np.array([s for s, _ in exclude], dtype=np.int64),
+                        np.array([e for _, e in exclude], dtype=np.int64)),
+                    expected)
+
+    def test_complement_intervals_random(self):
+        rng = np.random.RandomState(0)
+        for _ in range(200):
+            n = rng.randint(0, 6)
+            exclude_starts = rng.randint(-10, 60, size=n)
+            exclude_ends = exclude_starts + rng.randint(0, 15, size=n)
+            mask = np.ones(50, dtype=bool)
+            for s, e in zip(exclude_starts, exclude_ends):
+                mask[max(s, 0):max(e, 0)] = False
+            with self.subTest(starts=exclude_starts, ends=exclude_ends):
+                self._assert_intervals(
+                    _complement_intervals(0, 50, exclude_starts, exclude_ends),
+                    _intervals_from_mask(mask))
+
+    def test_merge_intervals(self):
+        for (intervals, expected) in [
+                ([], []),
+                ([(3, 5)], [(3, 5)]),
+                ([(0, 5), (5, 10)], [(0, 10)]),
+                ([(6, 10), (0, 5)], [(0, 5), (6, 10)]),
+                ([(0, 10), (2, 3), (9, 12), (20, 25)], [(0, 12), (20, 25)])]:
+            with self.subTest(intervals=intervals):
+                self._assert_intervals(
+                    _merge_intervals(
+                        np.array([s for s, _ in intervals], dtype=np.int64),
+                        np.array([e for _, e in intervals], dtype=np.int64)),
+                    expected)
+
+    def test_merge_intervals_random(self):
+        rng = np.random.RandomState(1)
+        for _ in range(200):
+            n = rng.randint(1, 6)
+            starts = rng.randint(0, 40, size=n)
+            ends = starts + rng.randint(1, 10, size=n)
+            mask = np.zeros(50, dtype=bool)
+            for s, e in zip(starts, ends):
+                mask[s:e] = True
+            with self.subTest(starts=starts, ends=ends):
+                self._assert_intervals(_merge_intervals(starts, ends),
+                                       _intervals_from_mask(mask))
+
+
+class TestRegionIndex(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(_RegionIndex([], [], []).n_positions, 0)
+
+    def test_samples_every_position_uniformly(self):
+        chroms = ["chr1", "chr1", "chr2", "chr2", "chr3"]
+        starts = [0, 10, 5, 8, 100]
+        ends = [3, 10, 6, 12, 102]
+        index = _RegionIndex(chroms, starts, ends)
+        self.assertEqual(index.n_positions, 10)
+        positions = [("chr1", p) for p in range(0, 3)] + \
+            [("chr2", 5)] + [("chr2", p) for p in range(8, 12)] + \
+            [("chr3", p) for p in range(100, 102)]
+
+        np.random.seed(0)
+        n_draws = 20000
+        counts = dict()
+        for _ in range(n_draws):
+            draw = index.sample()
+            counts[draw] = counts.get(draw, 0) + 1
+        # the empty interval (chr1, 10) is never drawn
+        self.assertEqual(sorted(counts), sorted(positions))
+        for position in positions:
+            self.assertAlmostEqual(
+                counts[position] / n_draws, 0.1, delta=0.015)
+
+
+if __name__ == "__main__":
+    unittest.main()
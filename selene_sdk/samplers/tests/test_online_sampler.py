@@ -0,0 +1,206 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from selene_sdk.samplers import IntervalsSampler
+from selene_sdk.samplers import RandomPositionsSampler
+from selene_sdk.samplers.dataset_journal import read_journal
+from selene_sdk.sequences import Genome
+
+
+TARGETS = os.path.join(
+    os.path.dirname(__file__), "..", "..",
+    "targets", "tests", "files", "sorted_aggregate.bed.gz")
+
+FEATURES = ["CTCF", "eGFP-FOS", "GABP", "Pbx3", "Pol2", "TBP"]
+
+
+def write_genome(filepath, chrom_lengths, seed=0):
+    """
+    Writes a FASTA file of random sequences.
+    """
+    random_state = np.random.RandomState(seed)
+    with open(filepath, 'w') as file_handle:
+        for chrom, length in chrom_lengths:
+            sequence = ''.join(np.array(list("ACGT"))[
+                random_state.randint(4, size=length)])
+            file_handle.write(">{0}\n".format(chrom))
+            for start in range(0, length, 60):
+                file_handle.write(sequence[start:start + 60] + "\n")
+
+
+class _OnlineSamplerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.genome_path = os.path.join(self.output_dir, "genome.fa")
+        write_genome(self.genome_path,
+                     [("1", 600000), ("2", 100000), ("10", 200000)])
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _sampler(self, **kwargs):
+        return RandomPositionsSampler(
+            Genome(self.genome_path),
+            TARGETS,
+            FEATURES,
+            seed=1,
+            validation_holdout=["10"],
+            test_holdout=["2"],
+            sequence_length=100,
+            center_bin_to_predict=20,
+            **kwargs)
+
+
+class TestOnlineSamplerStreaming(_OnlineSamplerTestCase):
+
+    def _stream(self, sampler):
+        batches, n_samples = sampler.stream_data_and_targets(
+            8, n_samples=40, mode="validate")
+        sequences, targets = zip(*batches)
+        self.assertEqual(n_samples, 40)
+        return np.concatenate(sequences), np.concatenate(targets)
+
+    def test_stream_passes_are_equal(self):
+        for window_cache_size in (0, 50):
+            with self.subTest(window_cache_size=window_cache_size):
+                sampler = self._sampler(window_cache_size=window_cache_size)
+                sequences, targets = self._stream(sampler)
+                self.assertEqual(sequences.shape, (40, 100, 4))
+                self.assertEqual(targets.shape, (40, len(FEATURES)))
+                sampler.sample(batch_size=16)
+                streamed_sequences, streamed_targets = self._stream(sampler)
+                np.testing.assert_array_equal(sequences, streamed_sequences)
+                np.testing.assert_array_equal(targets, streamed_targets)
+
+    def test_stream_does_not_change_training_draws(self):
+        for window_cache_size in (0, 50):
+            with self.subTest(window_cache_size=window_cache_size):
+                sampler = self._sampler(window_cache_size=window_cache_size)
+                draws = [sampler.sample(batch_size=16) for _ in range(3)]
+                streamed_sampler = self._sampler(
+                    window_cache_size=window_cache_size)
+                for (sequences, targets) in draws:
+                    self._stream(streamed_sampler)
+                    streamed_sequences, streamed_targets = \
+                        streamed_sampler.sample(batch_size=16)
+                    np.testing.assert_array_equal(
+                        sequences, streamed_sequences)
+                    np.testing.assert_array_equal(targets, streamed_targets)
+
+
+class TestOnlineSamplerSetRank(_OnlineSamplerTestCase):
+
+    def test_only_rank_0_saves_datasets(self):
+        for rank in range(2):
+            output_dir = os.path.join(self.output_dir, str(rank))
+            os.makedirs(output_dir)
+            sampler = self._sampler(
+                save_datasets=["train"], output_dir=output_dir)
+            sampler.set_rank(rank, world_size=2)
+            sampler.sample(batch_size=16)
+            sampler.save_dataset_to_file("train", close_filehandle=True)
+            if rank == 0:
+                with open(os.path.join(output_dir,
+                                       "train_data.bed")) as file_handle:
+                    self.assertEqual(len(file_handle.readlines()), 16)
+            else:
+                self.assertEqual(os.listdir(output_dir), [])
+
+    def test_ranks_draw_different_examples(self):
+        draws = []
+        for rank in range(2):
+            np.random.seed(0)
+            sampler = self._sampler()
+            sampler.set_rank(rank, world_size=2)
+            draws.append(sampler.sample(batch_size=16)[0])
+        self.assertFalse(np.array_equal(draws[0], draws[1]))
+
+
+class TestOnlineSamplerWindowCache(_OnlineSamplerTestCase):
+
+    def test_cached_examples_match_genome(self):
+        # most of the positions from 840 kb to 960 kb on chromosome 1
+        # have features.
+        genome_path = os.path.join(self.output_dir, "peaks.fa")
+        write_genome(genome_path,
+                     [("1", 1000000), ("2", 100000), ("10", 200000)])
+        intervals_path = os.path.join(self.output_dir, "intervals.bed")
+        with open(intervals_path, 'w') as file_handle:
+            file_handle.write("1\t840000\t960000\n"
+                              "2\t10000\t90000\n"
+                              "10\t10000\t190000\n")
+        genome = Genome(genome_path)
+        sampler = IntervalsSampler(
+            genome,
+            TARGETS,
+            FEATURES,
+            intervals_path,
+            seed=1,
+            validation_holdout=["10"],
+            test_holdout=["2"],
+            sequence_length=100,
+            center_bin_to_predict=20,
+            save_datasets=["train"],
+            output_dir=self.output_dir,
+            save_datasets_format="journal",
+            window_cache_size=30,
+            window_cache_max_shift=50)
+
+        cached_rows = []
+        sample_window_cache = sampler._sample_window_cache
+
+        def _sample_window_cache():
+            output = sample_window_cache()
+            if output is not None:
+                cached_rows.append(len(sampler._save_datasets["train"]) - 1)
+            return output
+
+        sampler._sample_window_cache = _sample_window_cache
+        sequences, targets = sampler.sample(batch_size=128)
+        sampler.save_dataset_to_file("train", close_filehandle=True)
+        journal = read_journal(
+            os.path.join(self.output_dir, "train_data.journal"))
+
+        self.assertEqual(len(journal["start"]), 128)
+        radius = sampler.surrounding_sequence_radius
+        rows = []
+        for index in range(128):
+            chrom = journal["chroms"][journal["chrom"][index]]
+            start = journal["start"][index]
+            end = journal["end"][index]
+            strand = '+' if journal["strand"][index] > 0 else '-'
+            rows.append((chrom, start, strand))
+            np.testing.assert_array_equal(
+                sequences[index],
+                genome.get_encoding_from_coords(chrom, start, end, strand))
+            np.testing.assert_array_equal(
+                targets[index],
+                sampler.target.get_feature_data(
+                    chrom, start + radius, end - radius))
+            np.testing.assert_array_equal(
+                journal["target_indices"][journal["target_indptr"][index]:
+                                          journal["target_indptr"][index + 1]],
+                np.nonzero(targets[index])[0])
+        self.assertTrue(np.all(np.any(targets, axis=1)))
+
+        # the cached examples are drawn on both strands and at shifts
+        # other than that of the window's first example, which change
+        # their targets.
+        cached = [rows[index] for index in cached_rows]
+        self.assertGreater(len(cached), 10)
+        self.assertGreater(
+            len({tuple(targets[index]) for index in cached_rows}), 1)
+        self.assertEqual({strand for (_, _, strand) in cached}, {'+', '-'})
+        uncached_starts = {(chrom, start) for (index, (chrom, start, _))
+                           in enumerate(rows) if index not in cached_rows}
+        self.assertFalse({(chrom, start) for (chrom, start, _) in cached} <=
+                         uncached_starts)
+
+
+if __name__ == "__main__":
+    unittest.main()
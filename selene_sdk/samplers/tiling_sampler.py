@@ -0,0 +1,455 @@
+"""
+This module provides the `TilingSampler` class, which walks the
+chromosomes of each mode at a fixed stride in genomic order.
+
+TODO: Currently, only works with sequences from `selene_sdk.sequences.Genome`.
+"""
+import numpy as np
+
+from .mixture_sampler import _complement_intervals
+from .online_sampler import OnlineSampler
+from .sampler import _select_features
+
+
+class TilingSampler(OnlineSampler):
+    """
+    Draws examples deterministically by tiling the chromosomes of each
+    mode with windows placed every `stride` bases, in genomic order.
+    Unlike the random samplers, streaming or fetching the data for a
+    mode returns every window in its chromosomes exactly once, which
+    makes it well suited to exhaustive, full-chromosome evaluation with
+    `selene_sdk.EvaluateModel`.
+
+    Windows are read from the reference sequence in blocks of up to
+    `read_length` bases, and each block is sliced into all the windows
+    that fall inside it, so overlapping windows share a single read.
+    The targets for the windows in a block are computed from a single
+    tabix query.
+
+    Parameters
+    ----------
+    reference_sequence : selene_sdk.sequences.Genome
+        A reference sequence from which to create examples.
+    target_path : str
+        Path to tabix-indexed, compressed BED file (`*.bed.gz`) of genomic
+        coordinates mapped to the genomic features we want to predict.
+    features : list(str)
+        List of distinct features that we aim to predict.
+    stride : int or None, optional
+        Default is None. The distance between the centers of adjacent
+        windows. If None, `center_bin_to_predict` is used, so that the
+        center bins of the windows tile the chromosomes without gaps or
+        overlaps.
+    read_length : int, optional
+        Default is 1000000. The maximum number of bases read from the
+        reference sequence at a time.
+    exclude_unknown_bases : bool, optional
+        Default is True. Skip windows that overlap a run of unknown
+        bases (e.g. an assembly gap). Windows that overlap a blacklist
+        region are always skipped.
+    seed : int, optional
+        Default is 436. Sets the random seed. This is only used to
+        choose the chromosomes of each mode if the holdouts are
+        proportional.
+    validation_holdout : list(str) or float, optional
+        Default is `['chr6', 'chr7']`. Holdout can be regional or
+        proportional. If regional, expects a list (e.g. `['chrX', 'chrY']`).
+        If proportional, specify a percentage between (0.0, 1.0) of
+        the chromosomes to hold out. Typically 0.10 or 0.20.
+    test_holdout : list(str) or float, optional
+        Default is `['chr8', 'chr9']`. See documentation for
+        `validation_holdout` for additional information.
+    sequence_length : int, optional
+        Default is 1000. Model is trained on sequences of `sequence_length`
+        where genomic features are annotated to the center regions of
+        these sequences.
+    center_bin_to_predict : int, optional
+        Default is 200. Query the tabix-indexed file for a region of
+        length `center_bin_to_predict`.
+    feature_thresholds : float [0.0, 1.0], optional
+        Default is 0.5. The `feature_threshold` to pass to the
+        `GenomicFeatures` object.
+    mode : {'train', 'validate', 'test'}
+        Default is `'train'`. The mode to run the sampler in.
+    save_datasets : list(str), optional
+        Default is `[]`. The list of modes for which we should
+        save the sampled data to file.
+    output_dir : str or None, optional
+        Default is None. The path to the directory where we should
+        save sampled examples for a mode. If `save_datasets` is
+        a non-empty list, `output_dir` must be specified. If
+        the path in `output_dir` does not exist it will be created
+        automatically.
+    save_datasets_format : {'bed', 'journal'}, optional
+        Default is 'bed'. The format to save sampled data in. See
+        `selene_sdk.samplers.OnlineSampler`.
+
+    Attributes
+    ----------
+    reference_sequence : selene_sdk.sequences.Genome
+        The reference sequence that examples are created from.
+    target : selene_sdk.targets.Target
+        The `selene_sdk.targets.Target` object holding the features that we
+        would like to predict.
+    stride : int
+        The distance between the centers of adjacent windows.
+
+    Raises
+    ------
+    ValueError
+        If `stride` or `read_length` is not positive.
+
+    """
+
+    def __init__(self,
+                 reference_sequence,
+                 target_path,
+                 features,
+                 stride=None,
+                 read_length=1000000,
+                 exclude_unknown_bases=True,
+                 seed=436,
+                 validation_holdout=['chr6', 'chr7'],
+                 test_holdout=['chr8', 'chr9'],
+                 sequence_length=1000,
+                 center_bin_to_predict=200,
+                 feature_thresholds=0.5,
+                 mode="train",
+                 save_datasets=[],
+                 output_dir=None,
+                 save_datasets_format="bed"):
+        """
+        Constructs a new `TilingSampler` object.
+        """
+        super(TilingSampler, self).__init__(
+            reference_sequence,
+            target_path,
+            features,
+            seed=seed,
+            validation_holdout=validation_holdout,
+            test_holdout=test_holdout,
+            sequence_length=sequence_length,
+            center_bin_to_predict=center_bin_to_predict,
+            feature_thresholds=feature_thresholds,
+            mode=mode,
+            save_datasets=save_datasets,
+            output_dir=output_dir,
+            save_datasets_format=save_datasets_format)
+
+        if stride is None:
+            stride = center_bin_to_predict
+        if stride <= 0 or read_length <= 0:
+            raise ValueError(
+                "The stride and read length must be positive. Inputs were "
+                "{0} and {1}.".format(stride, read_length))
+        self.stride = stride
+        self._read_length = read_length
+        self._exclude_unknown_bases = exclude_unknown_bases
+
+        self._chrom_modes = self._partition_chromosomes()
+        self._tiles = {}
+        self._sample_iterators = {}
+
+    def _get_tiles(self, mode):
+        """
+        Gets the centers of the windows in a mode. The centers are
+        computed the first time they are needed for a mode.
+
+        Parameters
+        ----------
+        mode : str
+            The mode to get the windows for.
+
+        Returns
+        -------
+        list(tuple(str, numpy.ndarray))
+            The chromosome and window centers of each run of
+            consecutive windows, in genomic order. The windows in a run
+            can be read from the reference sequence together.
+
+        """
+        if mode in self._tiles:
+            return self._tiles[mode]
+        window_start_radius = \
+            self._start_radius + self.surrounding_sequence_radius
+        window_end_radius = \
+            self._end_radius + self.surrounding_sequence_radius
+        tiles = []
+        for chrom in self.reference_sequence.get_chrs():
+            if self._chrom_modes[chrom] != mode:
+                continue
+            # all the window centers lie on the same grid, so that the
+            # windows on either side of a skipped region stay aligned.
+            first = window_start_radius
+            last = self.reference_sequence.len_chrs[chrom] - \
+                window_end_radius + 1
+            excluded = self.reference_sequence.get_blacklist_regions(chrom)
+            if self._exclude_unknown_bases:
+                excluded += \
+                    self.reference_sequence.get_unknown_base_regions(chrom)
+            starts, ends = _complement_intervals(
+                first, last,
+                np.array([s for s, _ in excluded], dtype=np.int64) -
+                window_end_radius + 1,
+                np.array([e for _, e in excluded], dtype=np.int64) +
+                window_start_radius)
+            for start, end in zip(starts, ends):
+                first_tile = -(-(start - first) // self.stride)
+                last_tile = -(-(end - first) // self.stride)
+                if last_tile > first_tile:
+                    tiles.append((chrom, first + self.stride * np.arange(
+                        first_tile, last_tile, dtype=np.int64)))
+        self._tiles[mode] = tiles
+        return tiles
+
+    def get_n_tiles(self, mode=None):
+        """
+        Gets the number of windows that tile the chromosomes of a mode.
+
+        Parameters
+        ----------
+        mode : str or None, optional
+            Default is None. The mode to count the windows in. If None,
+            will use the current mode `self.mode`.
+
+        Returns
+        -------
+        int
+            The number of windows.
+
+        """
+        if mode is None:
+            mode = self.mode
+        return sum(len(centers) for _, centers in self._get_tiles(mode))
+
+    def _read_tiles(self, mode):
+        """
+        Reads the windows of a mode in genomic order, one block of the
+        reference sequence at a time.
+
+        Parameters
+        ----------
+        mode : str
+            The mode to read the windows of.
+
+        Yields
+        ------
+        tuple(str, int, numpy.ndarray, numpy.ndarray)
+            The chromosome, start coordinate, sequence encoding and
+            targets of each window.
+
+        """
+        window_start_radius = \
+            self._start_radius + self.surrounding_sequence_radius
+        tiles_per_read = max(
+            1, (self._read_length - self.sequence_length) // self.stride + 1)
+        for chrom, centers in self._get_tiles(mode):
+            for index in range(0, len(centers), tiles_per_read):
+                block_centers = centers[index:index + tiles_per_read]
+                window_starts = block_centers - window_start_radius
+                block_start = int(window_starts[0])
+                encoding = self.reference_sequence.get_encoding_from_coords(
+                    chrom, block_start,
+                    int(window_starts[-1]) + self.sequence_length)
+                targets = self.target.get_binned_feature_data(
+                    chrom,
+                    block_centers - self._start_radius,
+                    block_centers + self._end_radius)
+                for window_start, window_targets in zip(
+                        window_starts, targets):
+                    offset = window_start - block_start
+                    yield (chrom, int(window_start),
+                           encoding[offset:offset + self.sequence_length],
+                           window_targets)
+
+    def _tile_batches(self, mode, batch_size, n_samples):
+        """
+        Groups the first `n_samples` windows of a mode into batches, in
+        genomic order. The last batch may be smaller than `batch_size`.
+
+        Parameters
+        ----------
+        mode : str
+            The mode to read the windows of.
+        batch_size : int
+            The size of each batch.
+        n_samples : int
+            The number of windows to read.
+
+        Yields
+        ------
+        tuple(numpy.ndarray, numpy.ndarray)
+            The sequences and targets of a batch.
+
+        """
+        tiles = self._read_tiles(mode)
+        for batch_start in range(0, n_samples, batch_size):
+            sequences = []
+            targets = []
+            for _ in range(min(batch_size, n_samples - batch_start)):
+                chrom, window_start, encoding, window_targets = next(tiles)
+                self._save_sample(
+                    chrom, window_start, window_start + self.sequence_length,
+                    '+', window_targets, mode=mode)
+                sequences.append(encoding)
+                targets.append(window_targets)
+            yield (np.array(sequences, dtype=np.float32),
+                   np.array(targets, dtype=np.float32))
+
+    def sample(self, batch_size=1):
+        """
+        Gets the next mini-batch of windows in the current mode. After
+        the last window of the mode, the windows start again from the
+        first one.
+
+        Parameters
+        ----------
+        batch_size : int, optional
+            Default is 1. The number of examples to include in the
+            mini-batch.
+
+        Returns
+        -------
+        sequences, targets : tuple(numpy.ndarray, numpy.ndarray)
+            A tuple containing the numeric representation of the
+            sequence examples and their corresponding labels. The
+            shape of `sequences` will be
+            :math:`B \\times L \\times N`, where :math:`B` is
+            `batch_size`, :math:`L` is the sequence length, and
+            :math:`N` is the size of the sequence type's alphabet.
+            The shape of `targets` will be :math:`B \\times F`,
+            where :math:`F` is the number of features.
+
+        Raises
+        ------
+        ValueError
+            If there are no windows in the current mode.
+
+        """
+        if self.get_n_tiles() == 0:
+            raise ValueError(
+                "No windows can be drawn in mode '{0}'.".format(self.mode))
+        sequences = []
+        targets = []
+        while len(sequences) < batch_size:
+            tile = next(self._sample_iterators.get(self.mode, iter(())), None)
+            if tile is None:
+                self._sample_iterators[self.mode] = self._read_tiles(self.mode)
+                continue
+            chrom, window_start, encoding, window_targets = tile
+            self._save_sample(
+                chrom, window_start, window_start + self.sequence_length,
+                '+', window_targets)
+            sequences.append(encoding)
+            targets.append(window_targets)
+        return (np.array(sequences, dtype=np.float32),
+                np.array(targets, dtype=np.float32))
+
+    def stream_data_and_targets(self,
+                                batch_size,
+                                n_samples=None,
+                                mode=None,
+                                feature_indices=None):
+        """
+        Returns a generator over the windows of a mode, in genomic
+        order, divided into batches. Every call yields the same
+        windows.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+            If None, every window in the mode is retrieved.
+        mode : str, optional
+            Default is None. The mode to run the sampler in when
+            fetching the samples. If None, will use the current mode
+            `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        batches, n_samples : tuple(generator, int)
+            A generator of sequence-target pairs, where the sequences
+            are of the shape :math:`B \\times L \\times N` and the targets
+            are of the shape :math:`B \\times F`, and the total number
+            of samples that the generator will yield. The last batch
+            may be smaller than `batch_size`.
+
+        Raises
+        ------
+        ValueError
+            If `mode` is not a valid mode.
+
+        """
+        if mode is None:
+            mode = self.mode
+        elif mode not in self.modes:
+            raise ValueError(
+                "Tried to stream data for mode '{0}' but the only valid "
+                "modes are {1}".format(mode, self.modes))
+        n_tiles = self.get_n_tiles(mode)
+        if n_samples is None or n_samples > n_tiles:
+            n_samples = n_tiles
+
+        def _batches():
+            for batch in self._tile_batches(mode, batch_size, n_samples):
+                yield batch
+            if mode in self._save_datasets:
+                self.save_dataset_to_file(mode, close_filehandle=True)
+                # every pass yields the same windows, so only the first
+                # one is written to file.
+                del self._save_datasets[mode]
+        return _select_features(_batches(), feature_indices), n_samples
+
+    def get_data_and_targets(self,
+                             batch_size,
+                             n_samples=None,
+                             mode=None,
+                             feature_indices=None):
+        """
+        This method fetches the windows of a mode, divided into
+        batches. See `stream_data_and_targets` for more information.
+
+        Parameters
+        ----------
+        batch_size : int
+            The size of the batches to divide the data into.
+        n_samples : int or None, optional
+            Default is None. The total number of samples to retrieve.
+            If None, every window in the mode is retrieved.
+        mode : str, optional
+            Default is None. The mode to run the sampler in when
+            fetching the samples. If None, will use the current mode
+            `self.mode`.
+        feature_indices : list(int) or None, optional
+            Default is None. If specified, the targets of each batch
+            only include the features at these indices, in this order.
+
+        Returns
+        -------
+        sequences_and_targets, targets_matrix : \
+        tuple(list(tuple(numpy.ndarray, numpy.ndarray)), numpy.ndarray)
+            Tuple containing the list of sequence-target pairs, as well
+            as a single matrix with all targets in the same order.
+            Note that `sequences_and_targets`'s sequence elements are of
+            the shape :math:`B \\times L \\times N` and its target
+            elements are of the shape :math:`B \\times F`, where
+            :math:`B` is `batch_size`, :math:`L` is the sequence length,
+            :math:`N` is the size of the sequence type's alphabet, and
+            :math:`F` is the number of features. Further,
+            `target_matrix` is of the shape :math:`S \\times F`, where
+            :math:`S =` `n_samples`.
+
+        """
+        if mode is not None:
+            self.set_mode(mode)
+        batches, _ = self.stream_data_and_targets(
+            batch_size, n_samples=n_samples, mode=mode,
+            feature_indices=feature_indices)
+        sequences_and_targets = list(batches)
+        targets_mat = np.vstack([t for (s, t) in sequences_and_targets])
+        return sequences_and_targets, targets_mat
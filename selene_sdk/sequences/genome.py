@@ -353,6 +353,73 @@ class Genome(Sequence):
                              end,
                              blacklist_tabix=self._blacklist_tabix)
 
+    def get_blacklist_regions(self, chrom):
+        """
+        Gets the blacklist regions in a chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The name of the chromosome, e.g. "chr1".
+
+        Returns
+        -------
+        list(tuple(int, int))
+            The 0-based start and end coordinates of each blacklist region
+            in `chrom`. Empty if no blacklist regions were specified.
+
+        """
+        if self._blacklist_tabix is None or chrom not in self.len_chrs:
+            return []
+        try:
+            rows = self._blacklist_tabix.query(
+                chrom, 0, self.len_chrs[chrom])
+            return [(int(row[1]), int(row[2])) for row in rows]
+        except tabix.TabixError:
+            return []
+
+    def get_unknown_base_regions(self, chrom, chunk_size=10000000):
+        """
+        Gets the runs of unknown bases (`UNK_BASE`, e.g. assembly gaps) in
+        a chromosome. The chromosome is read in chunks of `chunk_size`
+        bases.
+
+        Parameters
+        ----------
+        chrom : str
+            The name of the chromosome, e.g. "chr1".
+        chunk_size : int, optional
+            Default is 10000000. The number of bases read at a time.
+
+        Returns
+        -------
+        list(tuple(int, int))
+            The 0-based start and end coordinates of each run of
+            unknown bases in `chrom`.
+
+        """
+        unk_bases = np.frombuffer(
+            (self.UNK_BASE.upper() + self.UNK_BASE.lower()).encode(),
+            dtype=np.uint8)
+        len_chrom = self.len_chrs[chrom]
+        regions = []
+        for chunk_start in range(0, len_chrom, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, len_chrom)
+            sequence = np.frombuffer(
+                self._genome_sequence(chrom, chunk_start, chunk_end).encode(),
+                dtype=np.uint8)
+            is_unk = np.isin(sequence, unk_bases).astype(np.int8)
+            changes = np.diff(np.concatenate([[0], is_unk, [0]]))
+            run_starts = np.nonzero(changes == 1)[0] + chunk_start
+            run_ends = np.nonzero(changes == -1)[0] + chunk_start
+            for start, end in zip(run_starts, run_ends):
+                if regions and regions[-1][1] == start:
+                    # merge runs that span 2 chunks
+                    regions[-1] = (regions[-1][0], int(end))
+                else:
+                    regions.append((int(start), int(end)))
+        return regions
+
     def get_sequence_from_coords(self,
                                  chrom,
                                  start,
@@ -1,7 +1,14 @@
+import gzip
+import os
+import re
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
+import pkg_resources
 
+from selene_sdk.sequences.genome import Genome
 from selene_sdk.sequences.genome import _get_sequence_from_coords
 from selene_sdk.sequences.sequence import sequence_to_encoding, \
     encoding_to_sequence
@@ -106,5 +113,67 @@ class TestGenome(unittest.TestCase):
         self.assertEqual(observed2, "")
 
 
+
+class TestGenomeRegions(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        sequence = rng.choice(list("ACGTacgt"), size=300)
+        # runs of unknown bases at both ends, of 1 base, and of mixed case
+        for start, end in [(0, 3), (20, 21), (40, 77), (99, 101),
+                           (150, 200), (201, 202), (297, 300)]:
+            sequence[start:end] = rng.choice(["N", "n"], size=end - start)
+        self.sequence = "".join(sequence)
+        self.genome_path = self._write_fasta(
+            "genome.fa", [("chr1", self.sequence), ("chr2", "ACGT" * 10)])
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _write_fasta(self, filename, chroms):
+        filepath = os.path.join(self.output_dir, filename)
+        with open(filepath, 'w') as file_handle:
+            for chrom, sequence in chroms:
+                file_handle.write(">{0}\n".format(chrom))
+                for i in range(0, len(sequence), 60):
+                    file_handle.write(sequence[i:i + 60] + "\n")
+        return filepath
+
+    def test_get_unknown_base_regions(self):
+        genome = Genome(self.genome_path)
+        expected = [(m.start(), m.end())
+                    for m in re.finditer("[Nn]+", self.sequence)]
+        self.assertEqual(expected[:2], [(0, 3), (20, 21)])
+        for chunk_size in range(1, 101):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(
+                    genome.get_unknown_base_regions(
+                        "chr1", chunk_size=chunk_size),
+                    expected)
+        self.assertEqual(genome.get_unknown_base_regions("chr2"), [])
+
+    def test_get_blacklist_regions(self):
+        blacklist_path = pkg_resources.resource_filename(
+            "selene_sdk", "sequences/data/hg19_blacklist_ENCFF001TDO.bed.gz")
+        with gzip.open(blacklist_path, "rt") as file_handle:
+            rows = [line.split('\t') for line in file_handle]
+        blacklist = [(int(row[1]), int(row[2]))
+                     for row in rows if row[0] == "chr1"]
+        # the last region overlaps the end of the chromosome
+        genome_path = self._write_fasta(
+            "hg19.fa", [("chr1", "A" * 725000), ("chrMT", "A" * 100)])
+        genome = Genome(genome_path, blacklist_regions="hg19")
+        self.assertEqual(genome.get_blacklist_regions("chr1"),
+                         [r for r in blacklist if r[0] < 725000])
+        self.assertEqual(genome.get_blacklist_regions("chr1")[-1],
+                         (724136, 727043))
+        # not in the blacklist file, or not in the genome
+        self.assertEqual(genome.get_blacklist_regions("chrMT"), [])
+        self.assertEqual(genome.get_blacklist_regions("chr2"), [])
+        self.assertEqual(
+            Genome(genome_path).get_blacklist_regions("chr1"), [])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -375,3 +375,89 @@ class GenomicFeatures(Target):
         return _get_feature_data(
             chrom, start, end, self._feature_thresholds_vec,
             self.feature_index_dict, self._query_tabix)
+
+    def get_shifted_feature_data(self, chrom, start, end, max_shift):
+        """
+        Computes the targets for the region `[start, end)` shifted by
+        every offset from `-max_shift` to `max_shift`, with a single
+        tabix query over the region extended by `max_shift` on both
+        sides.
+
+        Parameters
+        ----------
+        chrom : str
+            The name of the region (e.g. '1', '2', ..., 'X', 'Y').
+        start : int
+            The 0-based first position in the region.
+        end : int
+            One past the 0-based last position in the region.
+        max_shift : int
+            The maximum number of bases to shift the region by.
+
+        Returns
+        -------
+        numpy.ndarray
+            :math:`(2S + 1) \\times N` array, where :math:`S =`
+            `max_shift` and :math:`N =` `self.n_features`. Row `i` holds
+            the targets for the region shifted by `i - max_shift` bases,
+            that is, the output of `get_feature_data` for that region.
+
+        """
+        shifts = np.arange(-max_shift, max_shift + 1)
+        return self.get_binned_feature_data(
+            chrom, start + shifts, end + shifts)
+
+    def get_binned_feature_data(self, chrom, starts, ends):
+        """
+        Computes the targets for many regions in the same chromosome
+        with a single tabix query over the span of all the regions.
+        This is much faster than calling `get_feature_data` for each
+        region when the regions are close together, e.g. when tiling a
+        chromosome.
+
+        Parameters
+        ----------
+        chrom : str
+            The name of the region (e.g. '1', '2', ..., 'X', 'Y').
+        starts : numpy.ndarray
+            The 0-based first position in each region.
+        ends : numpy.ndarray
+            One past the 0-based last position in each region.
+
+        Returns
+        -------
+        numpy.ndarray
+            :math:`R \\times N` array, where :math:`R` is the number of
+            regions and :math:`N =` `self.n_features`. Row `i` holds the
+            output of `get_feature_data` for region `i`.
+
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if self._feature_thresholds_vec is None:
+            return np.array([self.get_feature_data(chrom, int(s), int(e))
+                             for s, e in zip(starts, ends)])
+        targets = np.zeros((len(starts), self.n_features))
+        if len(starts) == 0:
+            return targets
+        rows = self._query_tabix(chrom, int(np.min(starts)), int(np.max(ends)))
+        rows = list(rows) if rows else []
+        if not rows:
+            return targets
+        # tabix returns rows sorted by start, so the rows overlapping a
+        # region are found by a binary search on the starts, bounded by
+        # the length of the longest row.
+        row_starts = np.array([int(r[1]) for r in rows], dtype=np.int64)
+        row_ends = np.array([int(r[2]) for r in rows], dtype=np.int64)
+        max_row_length = np.max(row_ends - row_starts)
+        first_rows = np.searchsorted(
+            row_starts, starts - max_row_length, side="right")
+        last_rows = np.searchsorted(row_starts, ends, side="left")
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            region_rows = [rows[j] for j in range(first_rows[i], last_rows[i])
+                           if row_ends[j] > start]
+            if region_rows:
+                targets[i] = _fast_get_feature_data(
+                    int(start), int(end), self._feature_thresholds_vec,
+                    self.feature_index_dict, region_rows)
+        return targets
@@ -248,5 +248,20 @@ class TestGenomicFeatures(unittest.TestCase):
             query_features._feature_thresholds_vec.tolist(),
             [0.40, 0.50, 0.50, 0.30, 0.50, 0.50])
 
+    def test_GenomicFeatures_get_binned_feature_data(self):
+        data_path = os.path.join(
+            "selene_sdk", "targets", "tests",
+            "files", "sorted_aggregate.bed.gz")
+        query_features = GenomicFeatures(
+            data_path, self.features, 0.50)
+        starts = np.arange(15000, 20000, 50)
+        ends = starts + 200
+        expected = np.array([
+            query_features.get_feature_data("1", start, end)
+            for start, end in zip(starts, ends)])
+        observed = query_features.get_binned_feature_data("1", starts, ends)
+        self.assertGreater(np.sum(expected), 0)
+        np.testing.assert_array_equal(observed, expected)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from selene_sdk.evaluate_model import EvaluateModel
+from selene_sdk.samplers import MultiFileSampler
+from selene_sdk.samplers.file_samplers import MatFileSampler
+from selene_sdk.tests.test_train_model import _Model, _write_mat_file
+
+
+class TestEvaluateModel(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.sequence_length = 20
+        self.features = ["f0", "f1", "f2", "f3"]
+        for (name, seed) in (("train", 0), ("test", 1)):
+            _write_mat_file(
+                os.path.join(self.output_dir, "{0}.mat".format(name)),
+                200, self.sequence_length, len(self.features), seed)
+        torch.manual_seed(0)
+        self.model_path = os.path.join(self.output_dir, "model.pth.tar")
+        torch.save(
+            _Model(self.sequence_length, len(self.features)).state_dict(),
+            self.model_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _evaluate(self, name, **kwargs):
+        mat_path = os.path.join(self.output_dir, "{0}.mat")
+        sampler = MultiFileSampler(
+            MatFileSampler(mat_path.format("train"), "sequences",
+                           targets_key="targets"),
+            MatFileSampler(mat_path.format("train"), "sequences",
+                           targets_key="targets"),
+            self.features,
+            test_sampler=MatFileSampler(
+                mat_path.format("test"), "sequences",
+                targets_key="targets", shuffle=False),
+            mode="test")
+        output_dir = os.path.join(self.output_dir, name)
+        evaluator = EvaluateModel(
+            _Model(self.sequence_length, len(self.features)),
+            torch.nn.BCELoss(),
+            sampler,
+            self.features,
+            self.model_path,
+            output_dir,
+            batch_size=16,
+            n_test_samples=150,
+            report_gt_feature_n_positives=1,
+            use_features_ord=["f3", "f1"],
+            visualize_kwargs=dict(style="default", dpi=20, file_format="png"),
+            **kwargs)
+        scores = evaluator.evaluate()
+        return scores, output_dir
+
+    def test_stream_evaluation_matches_in_memory(self):
+        scores, output_dir = self._evaluate("in_memory")
+        predictions = np.load(
+            os.path.join(output_dir, "test_predictions.npz"))["data"]
+        targets = np.load(
+            os.path.join(output_dir, "test_targets.npz"))["data"]
+        self.assertEqual(predictions.shape, (150, 2))
+
+        stream_scores, stream_output_dir = self._evaluate(
+            "stream", stream_evaluation=True)
+        stream_predictions = np.load(
+            os.path.join(stream_output_dir, "test_predictions.npy"))
+        stream_targets = np.load(
+            os.path.join(stream_output_dir, "test_targets.npy"))
+        np.testing.assert_allclose(predictions, stream_predictions)
+        np.testing.assert_array_equal(targets, stream_targets)
+        self.assertEqual(scores.keys(), stream_scores.keys())
+        for feature in scores:
+            for metric, score in scores[feature].items():
+                self.assertAlmostEqual(
+                    score, stream_scores[feature][metric], places=6)
+
+    def test_loss_is_averaged_over_examples(self):
+        # 150 examples in batches of 16, so the last batch has 6.
+        with self.assertLogs("selene", level="INFO") as logs:
+            self._evaluate("loss")
+        loss = [float(line.split("test loss: ")[1])
+                for line in logs.output if "test loss: " in line]
+        predictions = np.load(os.path.join(
+            self.output_dir, "loss", "test_predictions.npz"))["data"]
+        targets = np.load(os.path.join(
+            self.output_dir, "loss", "test_targets.npz"))["data"]
+        expected = torch.nn.BCELoss()(
+            torch.from_numpy(predictions),
+            torch.from_numpy(targets.astype(np.float32))).item()
+        self.assertEqual(len(loss), 1)
+        self.assertAlmostEqual(loss[0], expected, places=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,718 @@
+import inspect
+import json
+import os
+import shutil
+import tempfile
+from threading import Lock
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import scipy.io
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from selene_sdk.samplers import MultiFileSampler
+from selene_sdk.samplers import RandomPositionsSampler
+from selene_sdk.samplers.dataset_journal import read_journal
+from selene_sdk.samplers.file_samplers import MatFileSampler
+from selene_sdk.train_model import TrainModel
+from selene_sdk.samplers.tests.test_online_sampler import FEATURES as \
+    GENOME_FEATURES
+from selene_sdk.samplers.tests.test_online_sampler import TARGETS, \
+    write_genome
+from selene_sdk.sequences import Genome
+from selene_sdk.train_model import _BackgroundValidator
+from selene_sdk.train_model import _BatchPrefetcher
+from selene_sdk.train_model import _CheckpointWriter
+from selene_sdk.train_model import _StageTimer
+
+
+class _Model(nn.Module):
+
+    def __init__(self, sequence_length, n_features):
+        super(_Model, self).__init__()
+        self.linear = nn.Linear(4 * sequence_length, n_features)
+
+    def forward(self, x):
+        return torch.sigmoid(self.linear(x.reshape(x.size(0), -1)))
+
+
+def _load(filepath):
+    kwargs = {}
+    if "weights_only" in inspect.signature(torch.load).parameters:
+        # the checkpoints hold numpy scalars (e.g. `min_loss`)
+        kwargs["weights_only"] = False
+    return torch.load(filepath, map_location="cpu", **kwargs)
+
+
+def _write_mat_file(filepath, n_samples, sequence_length, n_features, seed):
+    random_state = np.random.RandomState(seed)
+    sequences = np.eye(4, dtype=np.uint8)[
+        random_state.randint(4, size=(n_samples, sequence_length))]
+    targets = random_state.randint(2, size=(n_samples, n_features))
+    scipy.io.savemat(filepath, {
+        "sequences": sequences.transpose(0, 2, 1),
+        "targets": targets.astype(np.uint8)})
+
+
+SEQUENCE_LENGTH = 20
+
+FEATURES = ["f0", "f1", "f2"]
+
+
+def _write_data(data_dir):
+    for (name, seed) in (("train", 0), ("validate", 1), ("test", 2)):
+        _write_mat_file(os.path.join(data_dir, "{0}.mat".format(name)),
+                        200, SEQUENCE_LENGTH, len(FEATURES), seed)
+
+
+def _train_model(data_dir, output_dir=None, **kwargs):
+    mat_path = os.path.join(data_dir, "{0}.mat")
+    sampler = MultiFileSampler(
+        MatFileSampler(mat_path.format("train"), "sequences",
+                       targets_key="targets"),
+        MatFileSampler(mat_path.format("validate"), "sequences",
+                       targets_key="targets", shuffle=False),
+        FEATURES,
+        test_sampler=MatFileSampler(
+            mat_path.format("test"), "sequences",
+            targets_key="targets", shuffle=False))
+    torch.manual_seed(0)
+    return TrainModel(
+        _Model(SEQUENCE_LENGTH, len(FEATURES)),
+        sampler,
+        nn.BCELoss(),
+        torch.optim.SGD,
+        {"lr": 0.5},
+        batch_size=8,
+        output_dir=output_dir or data_dir,
+        n_validation_samples=64,
+        n_test_samples=100,
+        report_gt_feature_n_positives=1,
+        logging_verbosity=0,
+        visualize_kwargs=dict(style="default", dpi=20, file_format="png"),
+        **kwargs)
+
+
+def _train_distributed(rank, data_dir, init_method):
+    dist.init_process_group(
+        "gloo", init_method=init_method, rank=rank, world_size=2)
+    try:
+        trainer = _train_model(
+            data_dir,
+            output_dir=os.path.join(data_dir, "rank{0}".format(rank)),
+            max_steps=11,
+            report_stats_every_n_steps=5,
+            save_checkpoint_every_n_steps=5,
+            distributed=True)
+        trainer.train_and_validate()
+    finally:
+        dist.destroy_process_group()
+
+
+class TestTrainModel(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        _write_data(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _train_model(self, **kwargs):
+        return _train_model(self.output_dir, **kwargs)
+
+    def _load_checkpoint(self, filename, output_dir=None):
+        return _load(os.path.join(output_dir or self.output_dir, filename))
+
+    def test_background_validation_keeps_latest_checkpoint(self):
+        trainer = self._train_model(
+            max_steps=41,
+            report_stats_every_n_steps=10,
+            save_checkpoint_every_n_steps=10,
+            validate_in_background=True)
+        # the validation of step 30, which is only reported after the
+        # checkpoint of step 40 is saved, has the lowest loss.
+        validation_losses = [0.5, 0.6, 0.4, 0.7]
+        validation_result = trainer._validator.result
+
+        def _validation_result():
+            scores = validation_result()
+            scores["loss"] = validation_losses.pop(0)
+            return scores
+
+        trainer._validator.result = _validation_result
+        trainer.train_and_validate()
+        self.assertEqual(validation_losses, [])
+        self.assertEqual(
+            self._load_checkpoint("checkpoint.pth.tar")["step"], 40)
+        best_model = self._load_checkpoint("best_model.pth.tar")
+        self.assertEqual(best_model["step"], 30)
+        self.assertEqual(best_model["min_loss"], 0.4)
+
+    def test_background_best_model_keys_match_checkpoint(self):
+        trainer = self._train_model(
+            max_steps=21,
+            report_stats_every_n_steps=10,
+            data_parallel=True,
+            validate_in_background=True)
+        trainer.train_and_validate()
+        checkpoint = self._load_checkpoint("checkpoint.pth.tar")
+        best_model = self._load_checkpoint("best_model.pth.tar")
+        self.assertIn(best_model["step"], (10, 20))
+        self.assertEqual(list(best_model["state_dict"].keys()),
+                         list(checkpoint["state_dict"].keys()))
+        self.assertTrue(all(key.startswith("module.")
+                            for key in best_model["state_dict"]))
+
+    def _training_inputs(self, trainer):
+        """
+        Records the inputs of each training step of `trainer`.
+        """
+        inputs = []
+
+        def _record(module, module_inputs, output):
+            if module.training:
+                inputs.append(module_inputs[0].detach().clone())
+
+        trainer.model.register_forward_hook(_record)
+        return inputs
+
+    def test_prefetched_training_matches(self):
+        trainers = []
+        inputs = []
+        for prefetch_batches in (0, 3):
+            # the training file is shuffled with `numpy.random`.
+            np.random.seed(0)
+            trainer = self._train_model(
+                max_steps=12, report_stats_every_n_steps=5,
+                prefetch_batches=prefetch_batches)
+            inputs.append(self._training_inputs(trainer))
+            trainer.train_and_validate()
+            trainers.append(trainer)
+        self.assertEqual(len(inputs[0]), 12)
+        self.assertEqual(len(inputs[1]), 12)
+        for (batch, prefetched_batch) in zip(*inputs):
+            self.assertTrue(torch.equal(batch, prefetched_batch))
+        for (weight, prefetched_weight) in zip(
+                trainers[0].model.parameters(),
+                trainers[1].model.parameters()):
+            self.assertTrue(torch.equal(weight, prefetched_weight))
+
+    def test_prefetcher_only_draws_trained_batches(self):
+        genome_path = os.path.join(self.output_dir, "genome.fa")
+        write_genome(genome_path,
+                     [("1", 600000), ("2", 100000), ("10", 200000)])
+        sampler = RandomPositionsSampler(
+            Genome(genome_path), TARGETS, GENOME_FEATURES, seed=1,
+            validation_holdout=["10"], test_holdout=["2"],
+            sequence_length=100, center_bin_to_predict=20,
+            save_datasets=["train"], output_dir=self.output_dir,
+            save_datasets_format="journal")
+        trainer = TrainModel(
+            _Model(100, len(GENOME_FEATURES)),
+            sampler,
+            nn.BCELoss(),
+            torch.optim.SGD,
+            {"lr": 0.5},
+            batch_size=8,
+            max_steps=12,
+            report_stats_every_n_steps=5,
+            output_dir=self.output_dir,
+            n_validation_samples=16,
+            report_gt_feature_n_positives=1,
+            logging_verbosity=0,
+            prefetch_batches=4)
+        inputs = self._training_inputs(trainer)
+        trainer.train_and_validate()
+        journal = read_journal(
+            os.path.join(self.output_dir, "train_data.journal"))
+        self.assertEqual(len(inputs), 12)
+        self.assertEqual(len(journal["start"]), 12 * 8)
+
+    def test_best_model_linked_to_checkpoint(self):
+        trainer = self._train_model(
+            max_steps=41,
+            report_stats_every_n_steps=10,
+            save_checkpoint_every_n_steps=10)
+        # the validations of steps 10 and 40 have the lowest loss so far.
+        validation_losses = [0.5, 0.6, 0.7, 0.4]
+        validate = trainer.validate
+
+        def _validate():
+            scores = validate()
+            scores["loss"] = validation_losses.pop(0)
+            return scores
+
+        trainer.validate = _validate
+        with mock.patch("selene_sdk.train_model.torch.save",
+                        wraps=torch.save) as save:
+            trainer.train_and_validate()
+        self.assertEqual(validation_losses, [])
+        # 1 write for each of the steps 0, 10, 20, 30 and 40.
+        self.assertEqual(
+            [os.path.basename(call[0][1]) for call in save.call_args_list],
+            ["checkpoint.pth.tar.tmp"] * 5)
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.output_dir, "best_model.pth.tar"),
+            os.path.join(self.output_dir, "checkpoint.pth.tar")))
+        best_model = self._load_checkpoint("best_model.pth.tar")
+        self.assertEqual(best_model["step"], 40)
+        self.assertEqual(best_model["min_loss"], 0.4)
+
+    def test_stream_evaluation_matches_in_memory(self):
+        trainer = self._train_model(
+            max_steps=10, report_stats_every_n_steps=5)
+        validation_scores = trainer.validate()
+        test_scores, _ = trainer.evaluate()
+        predictions = np.load(os.path.join(
+            self.output_dir, "test_predictions.npz"))["data"]
+
+        stream_trainer = self._train_model(
+            max_steps=10, report_stats_every_n_steps=5,
+            stream_evaluation=True)
+        for _ in range(2):
+            stream_validation_scores = stream_trainer.validate()
+            for (name, score) in validation_scores.items():
+                self.assertAlmostEqual(
+                    score, stream_validation_scores[name], places=6)
+        self.assertEqual(
+            stream_trainer._validation_predictions.shape, (64, 3))
+        stream_test_scores, _ = stream_trainer.evaluate()
+        stream_predictions = np.load(
+            os.path.join(self.output_dir, "test_predictions.npy"))
+        stream_targets = np.load(
+            os.path.join(self.output_dir, "test_targets.npy"))
+        np.testing.assert_allclose(predictions, stream_predictions)
+        np.testing.assert_array_equal(
+            trainer._all_test_targets, stream_targets)
+        for (name, score) in test_scores.items():
+            self.assertAlmostEqual(score, stream_test_scores[name], places=6)
+
+    def test_evaluation_loss_is_averaged_over_examples(self):
+        trainer = self._train_model(
+            max_steps=10, report_stats_every_n_steps=5)
+        random_state = np.random.RandomState(0)
+        inputs = torch.from_numpy(np.eye(4, dtype=np.float32)[
+            random_state.randint(4, size=(20, SEQUENCE_LENGTH))])
+        targets = torch.from_numpy(random_state.randint(
+            2, size=(20, len(FEATURES))).astype(np.float32))
+        # batches of 8, 8 and 4 examples
+        batches = [(inputs[i:i + 8], targets[i:i + 8])
+                   for i in range(0, 20, 8)]
+        loss, predictions = trainer._evaluate_on_data(batches)
+        self.assertEqual(predictions.shape, (20, len(FEATURES)))
+        self.assertAlmostEqual(
+            loss,
+            nn.BCELoss()(torch.from_numpy(predictions), targets).item(),
+            places=5)
+
+    def _train_step(self, **kwargs):
+        """
+        Trains a model for a step on a fixed batch, and returns the
+        trainer and the training loss.
+        """
+        random_state = np.random.RandomState(0)
+        sequences = np.eye(4, dtype=np.float32)[
+            random_state.randint(4, size=(8, SEQUENCE_LENGTH))]
+        targets = random_state.randint(
+            2, size=(8, len(FEATURES))).astype(np.float32)
+        trainer = self._train_model(
+            max_steps=10, report_stats_every_n_steps=5, **kwargs)
+        trainer._get_batch = lambda: (sequences, targets)
+        return trainer, trainer.train()
+
+    def _assert_same_parameters(self, model, other_model):
+        for (weight, other_weight) in zip(model.parameters(),
+                                          other_model.parameters()):
+            torch.testing.assert_close(weight, other_weight)
+
+    def test_gradient_accumulation_matches_batch(self):
+        trainer, loss = self._train_step()
+        # micro-batches of 3, 3 and 2 examples, and of 1 example.
+        for gradient_accumulation_steps in (3, 8):
+            with self.subTest(
+                    gradient_accumulation_steps=gradient_accumulation_steps):
+                accumulating_trainer, accumulated_loss = self._train_step(
+                    gradient_accumulation_steps=gradient_accumulation_steps)
+                self.assertAlmostEqual(accumulated_loss, loss, places=6)
+                self._assert_same_parameters(
+                    trainer.model, accumulating_trainer.model)
+
+        for gradient_accumulation_steps in (0, 9):
+            with self.assertRaises(ValueError):
+                self._train_model(
+                    max_steps=10, report_stats_every_n_steps=5,
+                    gradient_accumulation_steps=gradient_accumulation_steps)
+
+    def test_gradients_only_synchronized_once_accumulated(self):
+        trainer, _ = self._train_step(gradient_accumulation_steps=3)
+        trainer.distributed = True
+        trainer.model.no_sync = mock.MagicMock()
+        trainer.train()
+        self.assertEqual(trainer.model.no_sync.call_count, 2)
+
+    def test_activation_checkpointing_matches(self):
+        trainer, loss = self._train_step()
+        checkpointing_trainer, checkpointing_loss = self._train_step(
+            checkpoint_modules=["linear"])
+        self.assertAlmostEqual(checkpointing_loss, loss, places=6)
+        self._assert_same_parameters(
+            trainer.model, checkpointing_trainer.model)
+        self.assertEqual(list(checkpointing_trainer.model.state_dict()),
+                         list(trainer.model.state_dict()))
+        with mock.patch("selene_sdk.train_model.checkpoint",
+                        wraps=checkpoint) as checkpointed:
+            checkpointing_trainer.train()
+            self.assertEqual(checkpointed.call_count, 1)
+            # the activations are only checkpointed when training.
+            checkpointing_trainer.validate()
+            self.assertEqual(checkpointed.call_count, 1)
+
+        with self.assertRaises(ValueError):
+            self._train_model(max_steps=10, report_stats_every_n_steps=5,
+                              checkpoint_modules=["conv_net"])
+
+    def test_bfloat16_training(self):
+        trainers = []
+        output_dtypes = []
+        for precision in ("float32", "bfloat16"):
+            np.random.seed(0)
+            trainer = self._train_model(
+                max_steps=10, report_stats_every_n_steps=5,
+                precision=precision)
+            trainer.model.linear.register_forward_hook(
+                lambda module, inputs, output:
+                    output_dtypes.append((precision, output.dtype)))
+            trainer.train_and_validate()
+            trainers.append(trainer)
+        self.assertEqual(set(output_dtypes),
+                         {("float32", torch.float32),
+                          ("bfloat16", torch.bfloat16)})
+        validation_loss = trainers[1].validate()["loss"]
+        self.assertTrue(np.isfinite(validation_loss))
+        self.assertAlmostEqual(
+            validation_loss, trainers[0].validate()["loss"], places=2)
+        for (weight, bfloat16_weight) in zip(
+                trainers[0].model.parameters(),
+                trainers[1].model.parameters()):
+            self.assertEqual(bfloat16_weight.dtype, torch.float32)
+            torch.testing.assert_close(
+                bfloat16_weight, weight, atol=0.05, rtol=0.)
+
+    def test_precision_checked(self):
+        with self.assertRaises(ValueError):
+            self._train_model(max_steps=10, report_stats_every_n_steps=5,
+                              precision="float16")
+
+    def test_stage_times_logged(self):
+        trainer = self._train_model(
+            max_steps=11, report_stats_every_n_steps=5,
+            log_stage_times=True)
+        trainer.train_and_validate()
+        with open(os.path.join(self.output_dir,
+                               "selene_sdk.train_model.timing.jsonl")) as \
+                file_handle:
+            summaries = [json.loads(line) for line in file_handle]
+        self.assertEqual([summary["step"] for summary in summaries], [5, 10])
+        self.assertEqual(
+            [summary["n_steps"] for summary in summaries], [6, 5])
+        step_stages = {"sample", "host_to_tensor", "forward", "loss",
+                       "backward", "optimizer"}
+        # the checkpoint of step 0 is saved in the first window.
+        self.assertEqual(set(summaries[0]["stages"]),
+                         step_stages | {"validate", "checkpoint"})
+        self.assertEqual(set(summaries[1]["stages"]),
+                         step_stages | {"validate"})
+        for summary in summaries:
+            self.assertGreater(summary["samples_per_second"], 0)
+            self.assertEqual(summary["stages"]["forward"]["n_steps"],
+                             summary["n_steps"])
+            self.assertEqual(summary["stages"]["validate"]["n_steps"], 1)
+            for stage in summary["stages"].values():
+                self.assertEqual(
+                    set(stage),
+                    {"p50", "p90", "p99", "max", "total", "n_steps",
+                     "share"})
+
+    def test_training_profiled(self):
+        trainer = self._train_model(
+            max_steps=11, report_stats_every_n_steps=5,
+            profiler=dict(skip_first=2, warmup=1, active=2))
+        trainer.train_and_validate()
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.output_dir, "profiler"))),
+            ["train.5.operators.txt", "train.5.pt.trace.json"])
+
+    def test_distributed_training_saves_only_in_rank_0(self):
+        mp.spawn(_train_distributed,
+                 args=(self.output_dir, "file://{0}".format(
+                     os.path.join(self.output_dir, "process_group"))),
+                 nprocs=2)
+        rank_0_dir = os.path.join(self.output_dir, "rank0")
+        self.assertEqual(
+            self._load_checkpoint("checkpoint.pth.tar", rank_0_dir)["step"],
+            10)
+        self.assertTrue(os.path.exists(
+            os.path.join(rank_0_dir, "best_model.pth.tar")))
+        self.assertEqual(
+            os.listdir(os.path.join(self.output_dir, "rank1")), [])
+
+
+class _CountingSampler(object):
+    """
+    Draws batches whose examples hold the number of examples drawn
+    before them, and raises an error on batch `fail_at` if set.
+    """
+
+    def __init__(self, fail_at=None):
+        self.n_batches = 0
+        self.mode = None
+        self._fail_at = fail_at
+
+    def set_mode(self, mode):
+        self.mode = mode
+
+    def sample(self, batch_size=1):
+        if self.n_batches == self._fail_at:
+            raise IOError("Could not draw batch {0}.".format(self.n_batches))
+        start = self.n_batches * batch_size
+        self.n_batches += 1
+        sequences = np.arange(start, start + batch_size, dtype=np.float32)
+        return (np.tile(sequences[:, None, None], (1, 3, 4)),
+                sequences[:, None] * 2)
+
+
+class TestBatchPrefetcher(unittest.TestCase):
+
+    def test_batches_in_order(self):
+        sampler = _CountingSampler()
+        prefetcher = _BatchPrefetcher(sampler, 4, 2, Lock(), max_batches=10)
+        for i in range(10):
+            sequences, targets = prefetcher.get()
+            expected = torch.arange(i * 4, i * 4 + 4, dtype=torch.float32)
+            self.assertEqual(tuple(sequences.shape), (4, 3, 4))
+            self.assertTrue(torch.equal(sequences[:, 2, 3], expected))
+            self.assertTrue(torch.equal(targets[:, 0], expected * 2))
+        with self.assertRaises(ValueError):
+            prefetcher.get()
+        prefetcher.close()
+        self.assertEqual(sampler.n_batches, 10)
+        self.assertEqual(sampler.mode, "train")
+
+    def test_error_raised(self):
+        prefetcher = _BatchPrefetcher(
+            _CountingSampler(fail_at=2), 4, 2, Lock())
+        prefetcher.get()
+        prefetcher.get()
+        with self.assertRaises(IOError):
+            prefetcher.get()
+        prefetcher.close()
+
+    def test_close_stops_drawing(self):
+        sampler = _CountingSampler()
+        prefetcher = _BatchPrefetcher(sampler, 4, 2, Lock())
+        prefetcher.get()
+        # the queue is full and the thread waits to add a batch.
+        while sampler.n_batches < 4:
+            time.sleep(0.01)
+        prefetcher.close()
+        self.assertFalse(prefetcher._thread.is_alive())
+        n_batches = sampler.n_batches
+        time.sleep(0.2)
+        self.assertEqual(sampler.n_batches, n_batches)
+
+
+class TestBackgroundValidator(unittest.TestCase):
+
+    def test_validates_snapshot_with_own_threads(self):
+        model = _Model(SEQUENCE_LENGTH, len(FEATURES))
+        n_threads = torch.get_num_threads()
+
+        def _validate(validated_model):
+            return {"n_threads": torch.get_num_threads(),
+                    "weight": validated_model.linear.weight.clone()}
+
+        validator = _BackgroundValidator(
+            model, _validate, n_threads=n_threads + 1)
+        validator.start(model.state_dict())
+        weight = model.linear.weight.detach().clone()
+        with torch.no_grad():
+            model.linear.weight.add_(1)
+        result = validator.result()
+        self.assertEqual(result["n_threads"], n_threads + 1)
+        self.assertTrue(torch.equal(result["weight"], weight))
+        self.assertEqual(torch.get_num_threads(), n_threads)
+
+    def test_raises_validation_error(self):
+        def _validate(validated_model):
+            raise ValueError("Validation failed.")
+
+        model = _Model(SEQUENCE_LENGTH, len(FEATURES))
+        validator = _BackgroundValidator(model, _validate)
+        validator.start(model.state_dict())
+        with self.assertRaises(ValueError):
+            validator.result()
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def test_summarize(self):
+        timer = _StageTimer()
+        for step in range(4):
+            # the stage runs twice in each step, e.g. once per
+            # micro-batch.
+            for _ in range(2):
+                with timer.stage("forward"):
+                    time.sleep(0.001 * (step + 1))
+            if step == 3:
+                with timer.stage("validate"):
+                    time.sleep(0.01)
+            timer.end_step(8)
+        summary = timer.summarize()
+        self.assertEqual(summary["n_steps"], 4)
+        self.assertGreater(summary["samples_per_second"], 0)
+        self.assertEqual(sorted(summary["stages"]), ["forward", "validate"])
+        forward = summary["stages"]["forward"]
+        self.assertEqual(forward["n_steps"], 4)
+        self.assertGreaterEqual(forward["max"], 0.008)
+        self.assertLessEqual(forward["p50"], forward["p90"])
+        self.assertLessEqual(forward["p90"], forward["p99"])
+        self.assertLessEqual(forward["p99"], forward["max"])
+        self.assertGreaterEqual(forward["total"], 0.02)
+        self.assertEqual(summary["stages"]["validate"]["n_steps"], 1)
+        self.assertLessEqual(
+            forward["share"] + summary["stages"]["validate"]["share"], 1.)
+
+        # a summary starts a new window.
+        timer.end_step(8)
+        summary = timer.summarize()
+        self.assertEqual(summary["n_steps"], 1)
+        self.assertEqual(summary["stages"], {})
+
+    def test_stage_timed_when_it_raises(self):
+        timer = _StageTimer()
+        with self.assertRaises(RuntimeError):
+            with timer.stage("sample"):
+                raise RuntimeError()
+        timer.end_step(1)
+        self.assertEqual(timer.summarize()["stages"]["sample"]["n_steps"], 1)
+
+
+class TestCheckpointWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _filepath(self, filename):
+        return os.path.join(self.output_dir, filename)
+
+    def _save_steps(self, writer, steps, best_steps=()):
+        for step in steps:
+            writer.save({"step": step, "weight": torch.full((2,), step)},
+                        "checkpoint-{0}".format(step),
+                        is_best=step in best_steps,
+                        rotate=True)
+            writer.save({"step": step}, "checkpoint")
+        writer.close()
+
+    def test_keeps_last_n_rotated_checkpoints(self):
+        writer = _CheckpointWriter(self.output_dir, keep_last_n=3)
+        self._save_steps(writer, range(1, 8))
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            ["checkpoint-5.pth.tar", "checkpoint-6.pth.tar",
+             "checkpoint-7.pth.tar", "checkpoint.pth.tar"])
+        self.assertEqual(
+            _load(self._filepath("checkpoint.pth.tar"))["step"], 7)
+        # a checkpoint that is saved again only counts once
+        writer.save({"step": 7}, "checkpoint-7", rotate=True)
+        writer.save({"step": 8}, "checkpoint-8", rotate=True)
+        writer.close()
+        self.assertTrue(
+            os.path.exists(self._filepath("checkpoint-6.pth.tar")))
+
+        writer = _CheckpointWriter(self.output_dir)
+        self._save_steps(writer, range(10, 15))
+        self.assertEqual(len(os.listdir(self.output_dir)), 9)
+
+    def test_best_model_survives_rotation(self):
+        for link_fails in (False, True):
+            with self.subTest(link_fails=link_fails), \
+                    mock.patch("selene_sdk.train_model.os.link",
+                               side_effect=OSError if link_fails else os.link):
+                writer = _CheckpointWriter(self.output_dir, keep_last_n=2)
+                self._save_steps(writer, [1, 2], best_steps=[2])
+                best_filepath = self._filepath("best_model.pth.tar")
+                self.assertEqual(
+                    os.path.samefile(
+                        best_filepath, self._filepath("checkpoint-2.pth.tar")),
+                    not link_fails)
+                self._save_steps(writer, [3, 4, 5])
+                self.assertFalse(
+                    os.path.exists(self._filepath("checkpoint-2.pth.tar")))
+                best_model = _load(best_filepath)
+                self.assertEqual(best_model["step"], 2)
+                self.assertTrue(torch.equal(best_model["weight"],
+                                            torch.full((2,), 2)))
+                self.assertFalse(any(f.endswith(".tmp")
+                                     for f in os.listdir(self.output_dir)))
+
+    def test_best_only(self):
+        writer = _CheckpointWriter(self.output_dir, keep_last_n=1)
+        writer.save({"step": 2}, "checkpoint", rotate=True)
+        writer.save({"step": 1}, "checkpoint", is_best=True, best_only=True)
+        writer.close()
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            ["best_model.pth.tar", "checkpoint.pth.tar"])
+        self.assertEqual(
+            _load(self._filepath("checkpoint.pth.tar"))["step"], 2)
+        self.assertEqual(
+            _load(self._filepath("best_model.pth.tar"))["step"], 1)
+
+    def test_state_copied_when_saved(self):
+        writer = _CheckpointWriter(self.output_dir)
+        weight = torch.zeros(3)
+        writer.save({"weight": weight}, "checkpoint")
+        weight += 1
+        writer.close()
+        self.assertTrue(torch.equal(
+            _load(self._filepath("checkpoint.pth.tar"))["weight"],
+            torch.zeros(3)))
+
+    def test_close_raises_write_error(self):
+        writer = _CheckpointWriter(self._filepath("missing"))
+        writer.save({"step": 1}, "checkpoint")
+        with self.assertRaises((OSError, RuntimeError)):
+            writer.close()
+        # the error is only raised once
+        writer.close()
+
+        writer = _CheckpointWriter(self.output_dir, keep_last_n=1)
+        writer.save({"step": 1}, "checkpoint-1", rotate=True)
+        writer.close()
+        os.remove(self._filepath("checkpoint-1.pth.tar"))
+        writer.save({"step": 2}, "checkpoint-2", rotate=True)
+        with self.assertRaises(FileNotFoundError):
+            writer.close()
+
+    def test_save_raises_previous_write_error(self):
+        writer = _CheckpointWriter(self._filepath("missing"))
+        writer.save({"step": 1}, "checkpoint")
+        writer._queue.join()
+        with self.assertRaises((OSError, RuntimeError)):
+            writer.save({"step": 2}, "checkpoint")
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
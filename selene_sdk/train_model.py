@@ -1,39 +1,576 @@
 """
 This module provides the `TrainModel` class and supporting methods.
 """
+from collections import defaultdict
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextlib import nullcontext
+import copy
+from functools import partial
+import json
 import logging
 import math
 import os
+from queue import Full
+from queue import Queue
 import shutil
+from threading import Event
+from threading import Lock
+from threading import Thread
 from time import strftime
 from time import time
 
 import numpy as np
+from numpy.lib.format import open_memmap
 import torch
+import torch.distributed as dist
 import torch.nn as nn
-from torch.autograd import Variable
 from torch.optim.lr_scheduler import ReduceLROnPlateau
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import average_precision_score
+from torch.utils.checkpoint import checkpoint
 
 from .utils import initialize_logger
 from .utils import load_model_from_state_dict
+from .utils import multilabel_average_precision_score
+from .utils import multilabel_roc_auc_score
 from .utils import PerformanceMetrics
+from .utils import StreamingPerformanceMetrics
+from .utils.profiling import _torch_profiler
+from .utils.utils import _autocast
+from .utils.utils import _check_precision
+from .utils.utils import _to_tensor
 
 logger = logging.getLogger("selene")
 
 
-def _metrics_logger(name, out_filepath):
+def _metrics_logger(name, out_filepath, extension="txt"):
     logger = logging.getLogger("{0}".format(name))
     logger.setLevel(logging.INFO)
     formatter = logging.Formatter("%(message)s")
     file_handle = logging.FileHandler(
-        os.path.join(out_filepath, "{0}.txt".format(name)))
+        os.path.join(out_filepath, "{0}.{1}".format(name, extension)))
     file_handle.setFormatter(formatter)
     logger.addHandler(file_handle)
     return logger
 
 
+def _log_error_bounds(prefix, streaming_metrics):
+    """
+    Logs the bound on the error of each average score last computed by
+    a `selene_sdk.utils.StreamingPerformanceMetrics` object.
+    """
+    for name, bound in streaming_metrics.average_error_bounds().items():
+        logger.info("{0} {1} error bound: {2}".format(prefix, name, bound))
+
+
+def _to_tensor_batches(data_in_batches, pin_memory=False):
+    """
+    Converts a list of batches of arrays to a list of batches of
+    tensors, so that they are only converted once.
+    """
+    tensor_batches = []
+    for (inputs, targets) in data_in_batches:
+        inputs = _to_tensor(inputs)
+        targets = _to_tensor(targets)
+        if pin_memory:
+            inputs = inputs.pin_memory()
+            targets = targets.pin_memory()
+        tensor_batches.append((inputs, targets))
+    return tensor_batches
+
+
+def _checkpointed_forward(forward, *inputs):
+    """
+    Runs `forward` without keeping its intermediate activations when
+    gradients are computed. They are recomputed during the backward
+    pass instead.
+    """
+    if torch.is_grad_enabled():
+        return checkpoint(forward, *inputs, use_reentrant=False)
+    return forward(*inputs)
+
+
+def _checkpoint_submodules(model, names):
+    """
+    Enables activation checkpointing for the submodules of `model` with
+    the given names (e.g. "conv_net" or "conv_net.4"). The submodules'
+    `forward` methods are replaced, so the model's state dict does not
+    change.
+
+    Raises
+    ------
+    ValueError
+        If `model` has no submodule with one of the names.
+
+    """
+    submodules = dict(model.named_modules())
+    for name in names:
+        if name not in submodules:
+            raise ValueError(
+                "Cannot checkpoint the activations of submodule '{0}' "
+                "because the model has no submodule with that "
+                "name.".format(name))
+        module = submodules[name]
+        module.forward = partial(_checkpointed_forward, module.forward)
+
+
+def _copy_to_cpu(state):
+    """
+    Copies the tensors in a (nested) checkpoint dictionary to the CPU,
+    so that the copy does not change as training continues.
+    """
+    if torch.is_tensor(state):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        state_copy = type(state)(
+            (key, _copy_to_cpu(value)) for (key, value) in state.items())
+        if hasattr(state, "_metadata"):
+            state_copy._metadata = state._metadata
+        return state_copy
+    if isinstance(state, (list, tuple)):
+        return type(state)(_copy_to_cpu(value) for value in state)
+    return state
+
+
+class _CheckpointWriter(object):
+    """
+    Writes checkpoints to files on a background thread, so that
+    training continues while they are saved. Each file is written to a
+    temporary file that is then renamed, so a checkpoint file is never
+    left partially written. The best model is a hard link to its
+    checkpoint file rather than a second copy, where the file system
+    supports it, unless it is written on its own (`best_only`).
+
+    Parameters
+    ----------
+    output_dir : str
+        The directory to write the checkpoints to.
+    keep_last_n : int or None, optional
+        Default is None. The number of the most recent rotated
+        checkpoints to keep. Older ones are deleted. If None, all of
+        them are kept.
+
+    """
+
+    def __init__(self, output_dir, keep_last_n=None):
+        self._output_dir = output_dir
+        self._keep_last_n = keep_last_n
+        self._rotated_filepaths = []
+        # at most 1 checkpoint waits to be written while another one is,
+        # so that a slow disk does not hold many copies in memory.
+        self._queue = Queue(maxsize=1)
+        self._error = None
+        self._thread = None
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _write(self, state, filename, is_best, rotate, best_only):
+        if best_only:
+            best_filepath = os.path.join(
+                self._output_dir, "best_model.pth.tar")
+            torch.save(state, "{0}.tmp".format(best_filepath))
+            os.replace("{0}.tmp".format(best_filepath), best_filepath)
+            return
+        filepath = os.path.join(
+            self._output_dir, "{0}.pth.tar".format(filename))
+        torch.save(state, "{0}.tmp".format(filepath))
+        os.replace("{0}.tmp".format(filepath), filepath)
+        if is_best:
+            best_filepath = os.path.join(
+                self._output_dir, "best_model.pth.tar")
+            try:
+                os.link(filepath, "{0}.tmp".format(best_filepath))
+            except OSError:
+                shutil.copyfile(filepath, "{0}.tmp".format(best_filepath))
+            os.replace("{0}.tmp".format(best_filepath), best_filepath)
+        if rotate and filepath not in self._rotated_filepaths:
+            self._rotated_filepaths.append(filepath)
+            while self._keep_last_n is not None and \
+                    len(self._rotated_filepaths) > self._keep_last_n:
+                os.remove(self._rotated_filepaths.pop(0))
+
+    def save(self,
+             state,
+             filename,
+             is_best=False,
+             rotate=False,
+             best_only=False):
+        """
+        Copies a checkpoint to the CPU and queues it to be written to
+        `<filename>.pth.tar`. This only waits if the previous checkpoint
+        is still waiting to be written.
+
+        Parameters
+        ----------
+        state : dict
+            The checkpoint.
+        filename : str
+            The name of the checkpoint file, without the extension.
+        is_best : bool, optional
+            Default is False. Whether to also make this checkpoint
+            `best_model.pth.tar`.
+        rotate : bool, optional
+            Default is False. Whether this checkpoint counts towards the
+            `keep_last_n` most recent checkpoints that are kept.
+        best_only : bool, optional
+            Default is False. Whether to write this checkpoint only to
+            `best_model.pth.tar`, and not to `<filename>.pth.tar`. This
+            is used for checkpoints that may be older than the last one
+            written to `<filename>.pth.tar`.
+
+        Raises
+        ------
+        Exception
+            Any error raised while writing a previous checkpoint.
+
+        """
+        self._raise_error()
+        if self._thread is None:
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(
+            (_copy_to_cpu(state), filename, is_best, rotate, best_only))
+
+    def close(self):
+        """
+        Waits for all the queued checkpoints to be written and stops
+        the background thread.
+
+        Raises
+        ------
+        Exception
+            Any error raised while writing a checkpoint.
+
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+
+class _BackgroundValidator(object):
+    """
+    Validates a copy of the model on a background thread, so that
+    training continues while the validation set is evaluated. The copy's
+    weights are a snapshot of the model's weights when the validation
+    starts. At most one validation runs at a time.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        The model to validate, which is copied once.
+    validate : function
+        A function that validates the model passed to it and returns
+        the validation scores.
+    n_threads : int or None, optional
+        Default is None. The number of threads that the validation
+        thread uses for CPU operations in PyTorch. If None, it uses as
+        many as training does.
+
+    """
+
+    def __init__(self, model, validate, n_threads=None):
+        self.model = copy.deepcopy(model)
+        self._validate = validate
+        self._n_threads = n_threads
+        self._thread = None
+        self._result = None
+
+    def _run(self):
+        try:
+            if self._n_threads is not None:
+                # with the OpenMP backend, this only sets the number of
+                # threads for operations run from this thread.
+                torch.set_num_threads(self._n_threads)
+            self._result = self._validate(self.model)
+        except Exception as error:
+            self._result = error
+
+    def start(self, state_dict):
+        """
+        Copies the weights in `state_dict` to the model copy and starts
+        validating it. A previous validation must have finished.
+
+        Parameters
+        ----------
+        state_dict : dict
+            The weights of the model being trained.
+
+        """
+        load_model_from_state_dict(state_dict, self.model)
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def result(self):
+        """
+        Waits for the validation to finish.
+
+        Returns
+        -------
+        dict
+            The validation scores.
+
+        Raises
+        ------
+        Exception
+            Any error raised during the validation.
+
+        """
+        self._thread.join()
+        self._thread = None
+        result, self._result = self._result, None
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class _StageTimer(object):
+    """
+    Records how long each stage of the training steps takes, and
+    summarizes the steps of each reporting window.
+
+    The time of each stage is summed over a step (e.g. over the
+    micro-batches of gradient accumulation), and the summary of a window
+    gives percentiles of these per-step times over the steps in which
+    the stage ran, together with the stage's share of the window's wall
+    time and the number of training examples per second.
+
+    Parameters
+    ----------
+    synchronize_cuda : bool, optional
+        Default is False. Whether to wait for the GPU to finish its work
+        before and after each stage, so that the time of the operations
+        launched asynchronously is attributed to the stage that launched
+        them. This slows training down a little.
+
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, synchronize_cuda=False):
+        self._synchronize_cuda = synchronize_cuda
+        self._step_times = defaultdict(float)
+        self.start_window()
+
+    def start_window(self):
+        """
+        Starts a new reporting window, discarding the steps recorded
+        since the last one.
+        """
+        self._times = defaultdict(list)
+        self._n_steps = 0
+        self._n_samples = 0
+        self._window_start = time()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the code run in the context as part of stage `name`.
+        """
+        if self._synchronize_cuda:
+            torch.cuda.synchronize()
+        t_i = time()
+        try:
+            yield
+        finally:
+            if self._synchronize_cuda:
+                torch.cuda.synchronize()
+            self._step_times[name] += time() - t_i
+
+    def end_step(self, n_samples):
+        """
+        Ends a training step on `n_samples` examples.
+        """
+        for name, duration in self._step_times.items():
+            self._times[name].append(duration)
+        self._step_times = defaultdict(float)
+        self._n_steps += 1
+        self._n_samples += n_samples
+
+    def summarize(self):
+        """
+        Summarizes the steps since the last summary, and starts a new
+        window.
+
+        Returns
+        -------
+        dict
+            The number of steps, the number of examples per second and,
+            for each stage, the percentiles, maximum and total of its
+            per-step times in seconds, and its share of the wall time.
+
+        """
+        elapsed = time() - self._window_start
+        summary = {
+            "n_steps": self._n_steps,
+            "samples_per_second": self._n_samples / elapsed,
+            "stages": {}}
+        for name, times in self._times.items():
+            percentiles = np.percentile(times, self.PERCENTILES)
+            stage = {"p{0}".format(p): value
+                     for p, value in zip(self.PERCENTILES, percentiles)}
+            stage.update(n_steps=len(times),
+                         max=max(times),
+                         total=sum(times),
+                         share=sum(times) / elapsed)
+            summary["stages"][name] = stage
+        self.start_window()
+        return summary
+
+
+class _BatchPrefetcher(object):
+    """
+    Draws training batches from a sampler on a background thread and
+    copies them into a ring of reusable (and, if `pin_memory`, pinned)
+    tensors, so that sampling the next batches overlaps with the
+    current training step.
+
+    Parameters
+    ----------
+    sampler : selene_sdk.samplers.Sampler
+        The sampler to draw training batches from.
+    batch_size : int
+        The number of examples in each batch.
+    n_batches : int
+        The maximum number of batches to draw ahead.
+    sampler_lock : threading.Lock
+        A lock that is held whenever the sampler is used, so that other
+        uses of the sampler (e.g. streaming the validation set) do not
+        interleave with drawing training batches.
+    pin_memory : bool, optional
+        Default is False. Whether to allocate the tensors in pinned
+        memory, which speeds up copying them to a GPU.
+    max_batches : int or None, optional
+        Default is None. The total number of batches to draw, e.g. the
+        number of training steps left, so that no batch is drawn (and
+        saved with the sampler's `save_datasets`) without being trained
+        on. If None, batches are drawn until `close` is called.
+
+    """
+
+    def __init__(self,
+                 sampler,
+                 batch_size,
+                 n_batches,
+                 sampler_lock,
+                 pin_memory=False,
+                 max_batches=None):
+        self._sampler = sampler
+        self._batch_size = batch_size
+        self._sampler_lock = sampler_lock
+        self._pin_memory = pin_memory
+        self._max_batches = max_batches
+        self._n_batches_taken = 0
+        self._queue = Queue(maxsize=n_batches)
+        # a slot can be refilled once it is out of the queue and the
+        # training step that used it is done: there are at most
+        # `n_batches` slots in the queue, 1 in use and 1 being filled.
+        self._slots = [None] * (n_batches + 2)
+        self._stop = Event()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _copy_to_slot(self, index, sequences, targets):
+        slot = self._slots[index]
+        if slot is None or tuple(slot[0].shape) != sequences.shape or \
+                tuple(slot[1].shape) != targets.shape:
+            slot = (torch.empty(sequences.shape, dtype=torch.float32),
+                    torch.empty(targets.shape, dtype=torch.float32))
+            if self._pin_memory:
+                slot = (slot[0].pin_memory(), slot[1].pin_memory())
+            self._slots[index] = slot
+        slot[0].copy_(torch.from_numpy(np.asarray(sequences)))
+        slot[1].copy_(torch.from_numpy(np.asarray(targets)))
+        return slot
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def _run(self):
+        index = 0
+        n_batches_drawn = 0
+        try:
+            while not self._stop.is_set() and (
+                    self._max_batches is None or
+                    n_batches_drawn < self._max_batches):
+                t_i_sampling = time()
+                with self._sampler_lock:
+                    self._sampler.set_mode("train")
+                    sequences, targets = self._sampler.sample(
+                        batch_size=self._batch_size)
+                t_f_sampling = time()
+                logger.debug(
+                    ("[BATCH] Time to sample {0} examples: {1} s.").format(
+                         self._batch_size,
+                         t_f_sampling - t_i_sampling))
+                self._put(self._copy_to_slot(index, sequences, targets))
+                index = (index + 1) % len(self._slots)
+                n_batches_drawn += 1
+        except Exception as error:
+            self._put(error)
+
+    def get(self):
+        """
+        Gets the next batch of tensors, waiting for it if needed.
+
+        Returns
+        -------
+        tuple(torch.Tensor, torch.Tensor)
+            The examples and targets. The tensors are reused for a
+            later batch, so they must not be kept after the training
+            step that uses them.
+
+        Raises
+        ------
+        ValueError
+            If all `max_batches` batches have been taken.
+        Exception
+            Any error raised while drawing the batch.
+
+        """
+        if self._max_batches is not None and \
+                self._n_batches_taken == self._max_batches:
+            raise ValueError(
+                "All {0} batches have been drawn.".format(self._max_batches))
+        self._n_batches_taken += 1
+        batch = self._queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    def close(self):
+        """
+        Stops drawing batches and waits for the background thread to
+        finish.
+        """
+        self._stop.set()
+        self._thread.join()
+
+
 class TrainModel(object):
     """
     This class ties together the various objects and methods needed to
@@ -52,6 +589,8 @@ class TrainModel(object):
     training history (e.g. you can use `matplotlib`, `plt.plot(auc_list)`)
     and see, for example, whether the model is still improving, if there are
     signs of overfitting, etc.
+    If `log_stage_times` is set, the time spent in each stage of the
+    training steps is also written to `selene_sdk.train_model.timing.jsonl`.
 
     Parameters
     ----------
@@ -91,6 +630,11 @@ class TrainModel(object):
         `save_checkpoint_every_n_steps`. Before this point,
         the file `checkpoint.pth.tar` is overwritten every
         `save_checkpoint_every_n_steps` to limit the memory requirements.
+    keep_last_n_checkpoints : int or None, optional
+        Default is None. The number of the most recent
+        `checkpoint-<TIMESTAMP>.pth.tar` files to keep when
+        `save_new_checkpoints_after_n_steps` is set. Older ones are
+        deleted. If None, all of them are kept.
     n_validation_samples : int or None, optional
         Default is `None`. Specify the number of validation samples in the
         validation set. If `n_validation_samples` is `None` and the data sampler
@@ -137,6 +681,137 @@ class TrainModel(object):
         Default is `None`. If `checkpoint_resume` is not None, it should be the
         path to a model file generated by `torch.save` that can now be read
         using `torch.load`.
+    metrics : dict(metric_name: metric_fn)
+        Default is `dict(roc_auc=selene_sdk.utils.multilabel_roc_auc_score,
+        average_precision=selene_sdk.utils.multilabel_average_precision_score)`.
+        Metric functions to log. The default metrics compute the same
+        scores as `sklearn.metrics.roc_auc_score` and
+        `sklearn.metrics.average_precision_score`, for all features at
+        once. Functions that score the targets and predictions of one
+        feature at a time, such as those in `sklearn.metrics`, can also
+        be used.
+    stream_evaluation : bool, optional
+        Default is `False`. If `True`, the validation and test sets are not
+        loaded into memory up front. Instead, they are streamed from the
+        sampler batch by batch every time the model is evaluated (the sampler
+        draws the same examples on every pass), and the predictions and
+        targets are written into preallocated float32 arrays. For the test
+        set, these arrays are memory-mapped to `test_predictions.npy` and
+        `test_targets.npy` in `output_dir`, which replace the `.npz` files
+        written otherwise.
+    prefetch_batches : int, optional
+        Default is 0. The number of training batches to draw ahead on a
+        background thread while the model trains on the current batch,
+        so that sampling time is hidden behind compute. The batches are
+        copied into reusable tensors (pinned in memory if `use_cuda`).
+        If 0, each batch is drawn when it is needed.
+    distributed : bool, optional
+        Default is `False`. Specify whether this is one of several
+        processes that train the model together on the CPU, with
+        `torch.nn.parallel.DistributedDataParallel`. The
+        `torch.distributed` process group (e.g. with the "gloo" backend)
+        must be initialized before `TrainModel` is constructed, as
+        `selene_cli.py --world-size` does. Each process draws different
+        training batches (see `selene_sdk.samplers.Sampler.set_rank`),
+        and the gradients are averaged across the processes at every
+        step, so the effective batch size is `batch_size` times the
+        number of processes. Only the process with rank 0 evaluates the
+        model, writes logs and saves checkpoints.
+    precision : {"float32", "bfloat16", "float16"}, optional
+        Default is "float32". The precision to train and evaluate the
+        model in. With "bfloat16" (on the CPU or a GPU) or "float16" (on
+        a GPU only), the forward and backward passes run under automatic
+        mixed precision (autocast), which speeds up large convolutional
+        and linear layers and halves their memory traffic. The weights,
+        the optimizer state and the loss stay in float32. With
+        "float16", the loss is scaled to keep small gradients from
+        underflowing; "bfloat16" has the same range as float32 and needs
+        no loss scaling.
+    gradient_accumulation_steps : int, optional
+        Default is 1. The number of micro-batches to split each training
+        batch of `batch_size` examples into. The model runs on one
+        micro-batch at a time and the gradients are accumulated before
+        the optimizer steps once, so a training step is the same as
+        with the whole batch but the activations only need to fit in
+        memory for :math:`1/k` of it. This must be at most `batch_size`.
+    validate_in_background : bool, optional
+        Default is `False`. If `True`, the model is validated on a
+        background thread while training continues, using a copy of the
+        model with a snapshot of its weights at the validation step.
+        The results of each validation are logged, and used to adjust
+        the learning rate and to save the best model, at the next
+        validation step (or once training finishes), so they lag behind
+        by `report_stats_every_n_steps` steps. At most one validation
+        runs at a time. This requires the validation set to be held in
+        memory, so it cannot be combined with `stream_evaluation`.
+    validation_n_threads : int or None, optional
+        Default is None. If `validate_in_background`, the number of
+        threads used for CPU operations in PyTorch by the background
+        validation, so that it takes a fixed share of the CPU from
+        training. This applies to PyTorch builds that parallelize CPU
+        operations with OpenMP (the default), where the number of
+        threads is set separately for each thread. If None, the
+        validation uses `cpu_n_threads` threads, in addition to those
+        used by training.
+    checkpoint_modules : list(str) or None, optional
+        Default is None. The names of submodules of `model` (as in
+        `model.named_modules()`, e.g. `["conv_net"]` or
+        `["conv_net.0", "conv_net.4"]`) whose activations are not kept
+        for the backward pass while training, but recomputed from their
+        inputs instead (activation checkpointing). This trades extra
+        computation for the memory needed to train on long sequences.
+    metrics_histogram_bins : int or None, optional
+        Default is None. If set, the validation and test metrics are
+        estimated from per-feature histograms with this many bins of the
+        predictions for the positive and negative examples (see
+        `selene_sdk.utils.StreamingPerformanceMetrics`), which are
+        accumulated batch by batch. The predictions are not kept, so
+        together with `stream_evaluation`, the model can be evaluated on
+        arbitrarily large sets in constant memory, and the test
+        predictions and targets are not written to `output_dir`. The
+        predictions must be in [0, 1] and only the default metrics are
+        supported. A bound on the error of each average score is logged.
+    metrics_n_workers : int, optional
+        Default is 1. The number of threads that compute the validation
+        and test metrics and the test ROC and precision-recall curves,
+        each for a block of the features, and of processes that plot
+        the curves (see `selene_sdk.utils.PerformanceMetrics`).
+    visualize_kwargs : dict or None, optional
+        Default is None. Keyword arguments for plotting the test ROC and
+        precision-recall curves (see
+        `selene_sdk.utils.PerformanceMetrics.visualize`), e.g.
+        `dict(background=True, file_format="png", n_curve_points=500)`.
+        With `background=True`, `evaluate` returns as soon as the scores
+        are written, while the figures are plotted in a background
+        process.
+    log_stage_times : bool, optional
+        Default is `False`. If `True`, the time each training step spends
+        in each stage (sampling the batch or waiting for it if
+        `prefetch_batches` is set, converting it to tensors and copying
+        it to the GPU, the forward pass, the loss, the backward pass, the
+        optimizer step, saving checkpoints and validating) is recorded.
+        Every `report_stats_every_n_steps`, the percentiles of the
+        per-step times of each stage, its share of the wall time and the
+        number of training examples per second are written as a line of
+        JSON to `selene_sdk.train_model.timing.jsonl`, together with the
+        sampler's `stats()` if it has them (e.g. how many draws it
+        rejected). This tells whether training is limited by the
+        sampler, by data transfer or by compute. With `use_cuda`, the
+        GPU is synchronized around each stage, which slows training
+        down a little.
+    profiler : dict or None, optional
+        Default is None. If set, a window of training steps is profiled
+        with `torch.profiler`, which shows the operators (and so the
+        layers) of the model that training spends its time in. The keys
+        are `skip_first`, `wait`, `warmup`, `active` and `repeat`,
+        which choose the steps that are recorded (by default, the
+        second to the fourth step), `record_shapes` and
+        `profile_memory`, which also record the input shapes and the
+        memory of each operator, `with_stack`, `sort_by`, `row_limit`
+        and `output_dir`, which defaults to a `profiler` directory in
+        `output_dir`. For every window, a Chrome trace
+        (`train.<step>.pt.trace.json`) and a table of the time spent in
+        each operator (`train.<step>.operators.txt`) are written.
 
     Attributes
     ----------
@@ -167,8 +842,9 @@ class TrainModel(object):
     metrics : dict
         A dictionary that maps metric names (`str`) to metric functions.
         By default, this contains `"roc_auc"`, which maps to
-        `sklearn.metrics.roc_auc_score`, and `"average_precision"`,
-        which maps to `sklearn.metrics.average_precision_score`.
+        `selene_sdk.utils.multilabel_roc_auc_score`, and
+        `"average_precision"`, which maps to
+        `selene_sdk.utils.multilabel_average_precision_score`.
 
     """
 
@@ -184,6 +860,7 @@ class TrainModel(object):
                  output_dir,
                  save_checkpoint_every_n_steps=1000,
                  save_new_checkpoints_after_n_steps=None,
+                 keep_last_n_checkpoints=None,
                  report_gt_feature_n_positives=10,
                  n_validation_samples=None,
                  n_test_samples=None,
@@ -192,11 +869,37 @@ class TrainModel(object):
                  data_parallel=False,
                  logging_verbosity=2,
                  checkpoint_resume=None,
-                 metrics=dict(roc_auc=roc_auc_score,
-                              average_precision=average_precision_score)):
+                 metrics=dict(
+                     roc_auc=multilabel_roc_auc_score,
+                     average_precision=multilabel_average_precision_score),
+                 stream_evaluation=False,
+                 prefetch_batches=0,
+                 distributed=False,
+                 precision="float32",
+                 gradient_accumulation_steps=1,
+                 validate_in_background=False,
+                 validation_n_threads=None,
+                 checkpoint_modules=None,
+                 metrics_histogram_bins=None,
+                 metrics_n_workers=1,
+                 visualize_kwargs=None,
+                 log_stage_times=False,
+                 profiler=None):
         """
         Constructs a new `TrainModel` object.
         """
+        _check_precision(precision, use_cuda=use_cuda)
+        if not 1 <= gradient_accumulation_steps <= batch_size:
+            raise ValueError(
+                "The number of gradient accumulation steps must be "
+                "between 1 and the batch size ({0}), but was "
+                "{1}.".format(batch_size, gradient_accumulation_steps))
+        if validate_in_background and stream_evaluation:
+            raise ValueError("Validation in the background requires the "
+                             "validation set to be held in memory, so it "
+                             "cannot be combined with `stream_evaluation`.")
+        if checkpoint_modules:
+            _checkpoint_submodules(model, checkpoint_modules)
         self.model = model
         self.sampler = data_sampler
         self.criterion = loss_criterion
@@ -204,6 +907,7 @@ class TrainModel(object):
             self.model.parameters(), **optimizer_kwargs)
 
         self.batch_size = batch_size
+        self.gradient_accumulation_steps = gradient_accumulation_steps
         self.max_steps = max_steps
         self.nth_step_report_stats = report_stats_every_n_steps
         self.nth_step_save_checkpoint = None
@@ -213,6 +917,10 @@ class TrainModel(object):
             self.nth_step_save_checkpoint = save_checkpoint_every_n_steps
 
         self.save_new_checkpoints = save_new_checkpoints_after_n_steps
+        if keep_last_n_checkpoints is not None and keep_last_n_checkpoints < 1:
+            raise ValueError(
+                "The number of checkpoints to keep must be at least 1, "
+                "but was {0}.".format(keep_last_n_checkpoints))
 
         logger.info("Training parameters set: batch size {0}, "
                     "number of steps per 'epoch': {1}, "
@@ -225,36 +933,81 @@ class TrainModel(object):
 
         self.use_cuda = use_cuda
         self.data_parallel = data_parallel
+        self.precision = precision
+        self._grad_scaler = None
+        if precision == "float16":
+            self._grad_scaler = torch.amp.GradScaler("cuda")
 
         if self.data_parallel:
             self.model = nn.DataParallel(model)
             logger.debug("Wrapped model in DataParallel")
 
+        self.distributed = distributed
+        self._rank = 0
+        self._world_size = 1
+        if self.distributed:
+            if self.use_cuda or self.data_parallel:
+                raise ValueError("Distributed training is only supported "
+                                 "on the CPU, but `use_cuda` or "
+                                 "`data_parallel` was set.")
+            if not dist.is_initialized():
+                raise ValueError("Distributed training requires the "
+                                 "`torch.distributed` process group to be "
+                                 "initialized before `TrainModel` is "
+                                 "constructed.")
+            self._rank = dist.get_rank()
+            self._world_size = dist.get_world_size()
+            self.model = nn.parallel.DistributedDataParallel(model)
+            self.sampler.set_rank(self._rank, world_size=self._world_size)
+
         if self.use_cuda:
             self.model.cuda()
             self.criterion.cuda()
             logger.debug("Set modules to use CUDA")
 
+        self.validate_in_background = validate_in_background
+        self._validator = None
+        if self.validate_in_background and self._rank == 0:
+            self._validator = _BackgroundValidator(
+                model, self._validate, n_threads=validation_n_threads)
+
         os.makedirs(output_dir, exist_ok=True)
         self.output_dir = output_dir
-
-        initialize_logger(
-            os.path.join(self.output_dir, "{0}.log".format(__name__)),
-            verbosity=logging_verbosity)
-
-        self._create_validation_set(n_samples=n_validation_samples)
-        self._validation_metrics = PerformanceMetrics(
-            self.sampler.get_feature_from_index,
-            report_gt_feature_n_positives=report_gt_feature_n_positives,
-            metrics=metrics)
+        self._checkpoint_writer = _CheckpointWriter(
+            output_dir, keep_last_n=keep_last_n_checkpoints)
+
+        if self._rank == 0:
+            initialize_logger(
+                os.path.join(self.output_dir, "{0}.log".format(__name__)),
+                verbosity=logging_verbosity)
+        if self.distributed:
+            logger.info("Training in process {0} of {1}.".format(
+                self._rank, self._world_size))
+
+        self.stream_evaluation = stream_evaluation
+        self._metrics_histogram_bins = metrics_histogram_bins
+        self._metrics_n_workers = metrics_n_workers
+        self._visualize_kwargs = visualize_kwargs or dict()
+        self._stage_timer = None
+        if log_stage_times:
+            self._stage_timer = _StageTimer(synchronize_cuda=self.use_cuda)
+        self._profiler = None
+        if self._rank == 0:
+            self._profiler = _torch_profiler(
+                profiler, "train", self.output_dir, use_cuda=self.use_cuda)
+        self._prefetch_batches = prefetch_batches
+        self._prefetcher = None
+        self._sampler_lock = Lock()
+        if self._rank == 0:
+            self._create_validation_set(n_samples=n_validation_samples)
+        self._validation_metrics = self._create_metrics(
+            metrics, report_gt_feature_n_positives)
 
         if "test" in self.sampler.modes:
             self._test_data = None
             self._n_test_samples = n_test_samples
-            self._test_metrics = PerformanceMetrics(
-                self.sampler.get_feature_from_index,
-                report_gt_feature_n_positives=report_gt_feature_n_positives,
-                metrics=metrics)
+            self._test_metrics = self._create_metrics(
+                metrics, report_gt_feature_n_positives)
 
         self._start_step = 0
         self._min_loss = float("inf") # TODO: Should this be set when it is used later? Would need to if we want to train model 2x in one run.
@@ -287,14 +1040,40 @@ class TrainModel(object):
                 ("Resuming from checkpoint: step {0}, min loss {1}").format(
                     self._start_step, self._min_loss))
 
-        self._train_logger = _metrics_logger(
-                "{0}.train".format(__name__), self.output_dir)
-        self._validation_logger = _metrics_logger(
-                "{0}.validation".format(__name__), self.output_dir)
+        if self._rank == 0:
+            self._train_logger = _metrics_logger(
+                    "{0}.train".format(__name__), self.output_dir)
+            self._validation_logger = _metrics_logger(
+                    "{0}.validation".format(__name__), self.output_dir)
+
+            if self._stage_timer is not None:
+                self._timing_logger = _metrics_logger(
+                    "{0}.timing".format(__name__), self.output_dir,
+                    extension="jsonl")
 
-        self._train_logger.info("loss")
-        self._validation_logger.info("\t".join(["loss"] +
-            sorted([x for x in self._validation_metrics.metrics.keys()])))
+            self._train_logger.info("loss")
+            self._validation_logger.info("\t".join(["loss"] +
+                sorted([x for x in self._validation_metrics.metrics.keys()])))
+
+    def _create_metrics(self, metrics, report_gt_feature_n_positives):
+        """
+        Creates the object that tracks the validation or test metrics,
+        which are estimated from histograms of the predictions if
+        `metrics_histogram_bins` is set.
+        """
+        if self._metrics_histogram_bins is None:
+            return PerformanceMetrics(
+                self.sampler.get_feature_from_index,
+                report_gt_feature_n_positives=report_gt_feature_n_positives,
+                metrics=metrics,
+                n_workers=self._metrics_n_workers)
+        return StreamingPerformanceMetrics(
+            self.sampler.get_feature_from_index,
+            self.sampler.n_features,
+            n_bins=self._metrics_histogram_bins,
+            report_gt_feature_n_positives=report_gt_feature_n_positives,
+            metrics=metrics,
+            n_workers=self._metrics_n_workers)
 
     def _create_validation_set(self, n_samples=None):
         """
@@ -307,11 +1086,30 @@ class TrainModel(object):
             will use all validation examples in the sampler.
 
         """
+        if self.stream_evaluation:
+            self._n_validation_samples = n_samples
+            _, n_streamed = self.sampler.stream_validation_set(
+                self.batch_size, n_samples=n_samples)
+            self._validation_data = None
+            self._all_validation_targets = None
+            self._validation_predictions = None
+            if self._metrics_histogram_bins is None:
+                self._all_validation_targets = np.zeros(
+                    (n_streamed, self.sampler.n_features), dtype=np.float32)
+                self._validation_predictions = np.zeros(
+                    (n_streamed, self.sampler.n_features), dtype=np.float32)
+            logger.info(("{0} validation examples will be streamed from "
+                         "the sampler to evaluate after each training "
+                         "step.").format(n_streamed))
+            return
+
         logger.info("Creating validation dataset.")
         t_i = time()
         self._validation_data, self._all_validation_targets = \
             self.sampler.get_validation_set(
                 self.batch_size, n_samples=n_samples)
+        self._validation_data = _to_tensor_batches(
+            self._validation_data, pin_memory=self.use_cuda)
         t_f = time()
         logger.info(("{0} s to load {1} validation examples ({2} validation "
                      "batches) to evaluate after each training step.").format(
@@ -325,14 +1123,22 @@ class TrainModel(object):
         We do not create the test set in the `TrainModel` object until
         this method is called, so that we avoid having to load it into
         memory until the model has been trained and is ready to be
-        evaluated.
+        evaluated. If `stream_evaluation` is set, the test set is never
+        loaded into memory and this method does nothing.
 
         """
+        if self.stream_evaluation:
+            logger.info("The test dataset will be streamed from the "
+                        "sampler during evaluation.")
+            return
         logger.info("Creating test dataset.")
         t_i = time()
-        self._test_data, self._all_test_targets = \
-            self.sampler.get_test_set(
-                self.batch_size, n_samples=self._n_test_samples)
+        with self._sampler_lock:
+            self._test_data, self._all_test_targets = \
+                self.sampler.get_test_set(
+                    self.batch_size, n_samples=self._n_test_samples)
+        self._test_data = _to_tensor_batches(
+            self._test_data, pin_memory=self.use_cuda)
         t_f = time()
         logger.info(("{0} s to load {1} test examples ({2} test batches) "
                      "to evaluate after all training steps.").format(
@@ -373,70 +1179,272 @@ class TrainModel(object):
             self.optimizer,
             'min',
             patience=16,
-            verbose=True,
             factor=0.8)
 
         time_per_step = []
+        pending_validation = None
+        if self._prefetch_batches > 0 and self._prefetcher is None:
+            # only the batches of the remaining steps are drawn.
+            self._start_prefetcher(
+                max_batches=self.max_steps - self._start_step)
+        if self._stage_timer is not None:
+            self._stage_timer.start_window()
+        if self._profiler is not None:
+            self._profiler.start()
         for step in range(self._start_step, self.max_steps):
             t_i = time()
             train_loss = self.train()
             t_f = time()
             time_per_step.append(t_f - t_i)
 
-            if step % self.nth_step_save_checkpoint == 0:
-                checkpoint_dict = {
-                    "step": step,
-                    "arch": self.model.__class__.__name__,
-                    "state_dict": self.model.state_dict(),
-                    "min_loss": min_loss,
-                    "optimizer": self.optimizer.state_dict()
-                }
-                if self.save_new_checkpoints is not None and \
-                        self.save_new_checkpoints >= step:
-                    checkpoint_filename = "checkpoint-{0}".format(
-                        strftime("%m%d%H%M%S"))
-                    self._save_checkpoint(
-                        checkpoint_dict, False, filename=checkpoint_filename)
-                    logger.debug("Saving checkpoint `{0}.pth.tar`".format(
-                        checkpoint_filename))
-                else:
-                    self._save_checkpoint(
-                        checkpoint_dict, False)
-
+            saved_checkpoint = False
             # TODO: Should we have some way to report training stats without running validation?
             if step and step % self.nth_step_report_stats == 0:
                 logger.info(("[STEP {0}] average number "
                              "of steps per second: {1:.1f}").format(
                     step, 1. / np.average(time_per_step)))
                 time_per_step = []
-                valid_scores = self.validate()
-                validation_loss = valid_scores["loss"]
-                self._train_logger.info(train_loss)
-                to_log = [str(validation_loss)]
-                for k in sorted(self._validation_metrics.metrics.keys()):
-                    if k in valid_scores and valid_scores[k]:
-                        to_log.append(str(valid_scores[k]))
+                if self.distributed:
+                    train_loss = self._average_across_processes(train_loss)
+                with self._time_stage("validate"):
+                    if not self.validate_in_background:
+                        checkpoint_dict = None
+                        if self._rank == 0:
+                            checkpoint_dict = {
+                                "step": step,
+                                "arch": self.model.__class__.__name__,
+                                "state_dict": self.model.state_dict(),
+                                "optimizer": self.optimizer.state_dict()}
+                        previous_min_loss = min_loss
+                        min_loss = self._report_validation(
+                            scheduler, min_loss, train_loss, checkpoint_dict)
+                        # a new best model was saved to
+                        # `checkpoint.pth.tar` already.
+                        saved_checkpoint = min_loss < previous_min_loss
                     else:
-                        to_log.append("NA")
-                self._validation_logger.info("\t".join(to_log))
-                scheduler.step(math.ceil(validation_loss * 1000.0) / 1000.0)
+                        if pending_validation is not None:
+                            min_loss = self._report_validation(
+                                scheduler, min_loss, *pending_validation)
+                        pending_validation = (
+                            train_loss,
+                            self._start_background_validation(step))
 
-                if validation_loss < min_loss:
-                    min_loss = validation_loss
-                    self._save_checkpoint({
+                # Logging training and validation on same line requires 2 parsers or more complex parser.
+                # Separate logging of train/validate is just a grep for validation/train and then same parser.
+            rotate_checkpoint = self.save_new_checkpoints is not None and \
+                step >= self.save_new_checkpoints
+            if step % self.nth_step_save_checkpoint == 0 and \
+                    self._rank == 0 and \
+                    (rotate_checkpoint or not saved_checkpoint):
+                with self._time_stage("checkpoint"):
+                    checkpoint_dict = {
                         "step": step,
                         "arch": self.model.__class__.__name__,
                         "state_dict": self.model.state_dict(),
                         "min_loss": min_loss,
-                        "optimizer": self.optimizer.state_dict()}, True)
-                    logger.debug("Updating `best_model.pth.tar`")
-                logger.info("training loss: {0}".format(train_loss))
-                logger.info("validation loss: {0}".format(validation_loss))
-
-                # Logging training and validation on same line requires 2 parsers or more complex parser.
-                # Separate logging of train/validate is just a grep for validation/train and then same parser.
+                        "optimizer": self.optimizer.state_dict()
+                    }
+                    if rotate_checkpoint:
+                        checkpoint_filename = "checkpoint-{0}".format(
+                            strftime("%m%d%H%M%S"))
+                        self._save_checkpoint(
+                            checkpoint_dict, False,
+                            filename=checkpoint_filename, rotate=True)
+                        logger.debug("Saving checkpoint `{0}.pth.tar`".format(
+                            checkpoint_filename))
+                    else:
+                        self._save_checkpoint(
+                            checkpoint_dict, False)
+
+            if self._stage_timer is not None:
+                self._stage_timer.end_step(self.batch_size)
+                if step and step % self.nth_step_report_stats == 0:
+                    self._log_stage_times(step)
+            if self._profiler is not None:
+                self._profiler.step()
+        if self._profiler is not None:
+            self._profiler.stop()
+        if pending_validation is not None:
+            min_loss = self._report_validation(
+                scheduler, min_loss, *pending_validation)
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+        self._checkpoint_writer.close()
         self.sampler.save_dataset_to_file("train", close_filehandle=True)
 
+    def _start_background_validation(self, step):
+        """
+        Starts validating a snapshot of the model on a background
+        thread (only in the process with rank 0).
+
+        Parameters
+        ----------
+        step : int
+            The current step.
+
+        Returns
+        -------
+        dict or None
+            The checkpoint of the snapshot, which is saved as the best
+            model if the validation loss is the lowest so far. None in
+            the processes other than rank 0.
+
+        """
+        if self._rank != 0:
+            return None
+        state_dict = self.model.state_dict()
+        self._validator.start(state_dict)
+        # the snapshot is taken from the copy, which is not wrapped (e.g.
+        # in `nn.DataParallel`), under the names of the model's weights,
+        # as in the checkpoints saved during training.
+        snapshot = OrderedDict(zip(
+            state_dict.keys(), self._validator.model.state_dict().values()))
+        return {
+            "step": step,
+            "arch": self.model.__class__.__name__,
+            "state_dict": snapshot,
+            "optimizer": _copy_to_cpu(self.optimizer.state_dict())}
+
+    def _report_validation(self,
+                           scheduler,
+                           min_loss,
+                           train_loss,
+                           checkpoint_dict):
+        """
+        Gets the validation performance, either by validating the model
+        or from the validation running in the background, and logs it.
+        Then adjusts the learning rate and saves the best model.
+
+        Parameters
+        ----------
+        scheduler : torch.optim.lr_scheduler.ReduceLROnPlateau
+            The learning rate scheduler.
+        min_loss : float
+            The lowest validation loss so far.
+        train_loss : float
+            The training loss at the step that is validated.
+        checkpoint_dict : dict or None
+            The checkpoint of the model that is validated, which is
+            saved as the best model if its validation loss is the lowest
+            so far. None in the processes other than rank 0.
+
+        Returns
+        -------
+        float
+            The lowest validation loss so far.
+
+        """
+        if self._rank != 0:
+            # only rank 0 validates. The other processes wait for its
+            # validation loss, so that every process adjusts the
+            # learning rate in the same way.
+            validation_loss = self._broadcast_validation_loss()
+            self._step_scheduler(scheduler, validation_loss)
+            return min_loss
+        if self.validate_in_background:
+            valid_scores = self._validator.result()
+        else:
+            valid_scores = self.validate()
+        validation_loss = valid_scores["loss"]
+        if self.distributed:
+            self._broadcast_validation_loss(validation_loss)
+        self._train_logger.info(train_loss)
+        to_log = [str(validation_loss)]
+        for k in sorted(self._validation_metrics.metrics.keys()):
+            if k in valid_scores and valid_scores[k]:
+                to_log.append(str(valid_scores[k]))
+            else:
+                to_log.append("NA")
+        self._validation_logger.info("\t".join(to_log))
+        self._step_scheduler(scheduler, validation_loss)
+
+        if validation_loss < min_loss:
+            min_loss = validation_loss
+            checkpoint_dict["min_loss"] = min_loss
+            # a snapshot validated in the background is older than the
+            # last checkpoint saved to `checkpoint.pth.tar`, so it is
+            # only saved as the best model. Otherwise the checkpoint is
+            # saved and `best_model.pth.tar` links to it.
+            self._save_checkpoint(
+                checkpoint_dict, True,
+                best_only=self.validate_in_background)
+            logger.debug("Updating `best_model.pth.tar`")
+        logger.info("training loss: {0}".format(train_loss))
+        logger.info("validation loss: {0}".format(validation_loss))
+        return min_loss
+
+    def _step_scheduler(self, scheduler, validation_loss):
+        """
+        Adjusts the learning rate for a validation loss, and logs when
+        it is reduced. (`ReduceLROnPlateau` no longer logs this itself
+        in recent versions of PyTorch.)
+        """
+        learning_rates = [g["lr"] for g in self.optimizer.param_groups]
+        scheduler.step(math.ceil(validation_loss * 1000.0) / 1000.0)
+        for i, (group, learning_rate) in enumerate(
+                zip(self.optimizer.param_groups, learning_rates)):
+            if group["lr"] < learning_rate:
+                logger.info(
+                    "Reducing learning rate of group {0} to {1:.4e}.".format(
+                        i, group["lr"]))
+
+    def _average_across_processes(self, value):
+        """
+        Averages a value over all the processes of a distributed
+        training run.
+
+        Parameters
+        ----------
+        value : float
+            This process's value.
+
+        Returns
+        -------
+        float
+            The average of the values of all the processes.
+
+        """
+        total = torch.tensor([value], dtype=torch.float64)
+        dist.all_reduce(total, op=dist.ReduceOp.SUM)
+        return total.item() / self._world_size
+
+    def _broadcast_validation_loss(self, validation_loss=None):
+        """
+        Sends the validation loss computed by rank 0 to all the
+        processes of a distributed training run.
+
+        Parameters
+        ----------
+        validation_loss : float or None, optional
+            Default is None. The validation loss, which is only
+            specified in the process with rank 0.
+
+        Returns
+        -------
+        float
+            The validation loss of rank 0.
+
+        """
+        loss = torch.tensor(
+            [validation_loss if validation_loss is not None else 0.],
+            dtype=torch.float64)
+        dist.broadcast(loss, 0)
+        return loss.item()
+
+    def _start_prefetcher(self, max_batches=None):
+        """
+        Starts drawing training batches in the background (see
+        `_BatchPrefetcher`), at most `max_batches` of them.
+        """
+        self._prefetcher = _BatchPrefetcher(
+            self.sampler,
+            self.batch_size,
+            self._prefetch_batches,
+            self._sampler_lock,
+            pin_memory=self.use_cuda,
+            max_batches=max_batches)
+
     def train(self):
         """
         Trains the model on a batch of data.
@@ -448,70 +1456,172 @@ class TrainModel(object):
 
         """
         self.model.train()
-        self.sampler.set_mode("train")
-
-        inputs, targets = self._get_batch()
-        inputs = torch.Tensor(inputs)
-        targets = torch.Tensor(targets)
+        if self._prefetch_batches > 0:
+            if self._prefetcher is None:
+                self._start_prefetcher()
+            # the batches are sampled and copied into tensors in the
+            # background, so this is the time spent waiting for them.
+            with self._time_stage("sample"):
+                inputs, targets = self._prefetcher.get()
+        else:
+            self.sampler.set_mode("train")
+            with self._time_stage("sample"):
+                inputs, targets = self._get_batch()
+            with self._time_stage("host_to_tensor"):
+                inputs = _to_tensor(inputs)
+                targets = _to_tensor(targets)
 
         if self.use_cuda:
-            inputs = inputs.cuda()
-            targets = targets.cuda()
+            with self._time_stage("host_to_tensor"):
+                inputs = inputs.cuda(non_blocking=True)
+                targets = targets.cuda(non_blocking=True)
 
-        inputs = Variable(inputs)
-        targets = Variable(targets)
+        self.optimizer.zero_grad()
+        micro_batches = list(zip(
+            inputs.chunk(self.gradient_accumulation_steps),
+            targets.chunk(self.gradient_accumulation_steps)))
+        batch_loss = 0.
+        for index, (micro_inputs, micro_targets) in enumerate(micro_batches):
+            # the gradients are only averaged across the processes of a
+            # distributed run once they are accumulated.
+            sync = not self.distributed or index == len(micro_batches) - 1
+            with nullcontext() if sync else self.model.no_sync():
+                with self._time_stage("forward"), \
+                        _autocast(self.precision, use_cuda=self.use_cuda):
+                    predictions = self.model(micro_inputs.transpose(1, 2))
+                # weighting the loss of each micro-batch by its share of
+                # the batch gives the gradient of the loss on the whole
+                # batch.
+                with self._time_stage("loss"):
+                    loss = self.criterion(
+                        predictions.float(), micro_targets) * \
+                        (len(micro_inputs) / len(inputs))
+                with self._time_stage("backward"):
+                    if self._grad_scaler is not None:
+                        self._grad_scaler.scale(loss).backward()
+                    else:
+                        loss.backward()
+            batch_loss += loss.item()
 
-        predictions = self.model(inputs.transpose(1, 2))
-        loss = self.criterion(predictions, targets)
+        with self._time_stage("optimizer"):
+            if self._grad_scaler is not None:
+                self._grad_scaler.step(self.optimizer)
+                self._grad_scaler.update()
+            else:
+                self.optimizer.step()
 
-        self.optimizer.zero_grad()
-        loss.backward()
-        self.optimizer.step()
+        return batch_loss
 
-        return loss.item()
+    def _time_stage(self, name):
+        """
+        Returns a context that times the code run in it as part of
+        stage `name` of the training step, if `log_stage_times` is set.
+        """
+        if self._stage_timer is None:
+            return nullcontext()
+        return self._stage_timer.stage(name)
 
-    def _evaluate_on_data(self, data_in_batches):
+    def _log_stage_times(self, step):
+        """
+        Writes the summary of the stage times since the last report
+        (see `_StageTimer.summarize`) as a JSON line, together with the
+        sampler's statistics if it provides them.
+        """
+        summary = self._stage_timer.summarize()
+        if self._rank != 0:
+            return
+        summary = dict(step=step, **summary)
+        if hasattr(self.sampler, "stats"):
+            summary["sampler"] = self.sampler.stats()
+        self._timing_logger.info(json.dumps(summary))
+
+    def _evaluate_on_data(self,
+                          data_in_batches,
+                          predictions_out=None,
+                          targets_out=None,
+                          streaming_metrics=None,
+                          model=None):
         """
         Makes predictions for some labeled input data.
 
         Parameters
         ----------
-        data_in_batches : list(tuple(numpy.ndarray, numpy.ndarray))
-            A list of tuples of the data, where the first element is
-            the example, and the second element is the label.
+        data_in_batches : list(tuple(numpy.ndarray, numpy.ndarray)) or \
+                generator
+            The tuples of the data, where the first element is
+            the example, and the second element is the label. This may
+            be a generator when the data is streamed from the sampler.
+            The elements may also be tensors that were converted ahead
+            of time.
+        predictions_out : numpy.ndarray or None, optional
+            Default is None. A preallocated :math:`S \\times F` array
+            to write the predictions into. If None, the predictions
+            for each batch are stacked into a new array at the end.
+        targets_out : numpy.ndarray or None, optional
+            Default is None. A preallocated :math:`S \\times F` array
+            to write the targets of each batch into as they are consumed.
+        streaming_metrics : selene_sdk.utils.StreamingPerformanceMetrics \
+                or None, optional
+            Default is None. If set, the predictions and targets of each
+            batch are added to these metrics instead of being kept, and
+            no predictions are returned.
+        model : torch.nn.Module or None, optional
+            Default is None. The model to evaluate. If None, uses
+            `self.model`.
 
         Returns
         -------
-        tuple(float, list(numpy.ndarray))
-            Returns the average loss, and the list of all predictions.
+        tuple(float, numpy.ndarray or None)
+            Returns the average loss of the examples, and the array
+            of all predictions.
 
         """
-        self.model.eval()
+        if model is None:
+            model = self.model
+        model.eval()
 
         batch_losses = []
+        batch_sizes = []
         all_predictions = []
+        offset = 0
 
         for (inputs, targets) in data_in_batches:
-            inputs = torch.Tensor(inputs)
-            targets = torch.Tensor(targets)
+            n_batch = len(inputs)
+            if not torch.is_tensor(inputs):
+                inputs = _to_tensor(inputs)
+                targets = _to_tensor(targets)
+            if targets_out is not None:
+                targets_out[offset:offset + n_batch] = targets.numpy()
 
             if self.use_cuda:
-                inputs = inputs.cuda()
-                targets = targets.cuda()
+                inputs = inputs.cuda(non_blocking=True)
+                targets = targets.cuda(non_blocking=True)
 
             with torch.no_grad():
-                inputs = Variable(inputs)
-                targets = Variable(targets)
-
-                predictions = self.model(inputs.transpose(1, 2))
+                with _autocast(self.precision, use_cuda=self.use_cuda):
+                    predictions = model(inputs.transpose(1, 2))
+                predictions = predictions.float()
                 loss = self.criterion(predictions, targets)
 
-                all_predictions.append(
-                    predictions.data.cpu().numpy())
+                if streaming_metrics is not None:
+                    streaming_metrics.add(predictions.data.cpu().numpy(),
+                                          targets.data.cpu().numpy())
+                elif predictions_out is not None:
+                    predictions_out[offset:offset + n_batch] = \
+                        predictions.data.cpu().numpy()
+                else:
+                    all_predictions.append(
+                        predictions.data.cpu().numpy())
 
                 batch_losses.append(loss.item())
+                batch_sizes.append(n_batch)
+            offset += n_batch
+        # the last batch may be smaller than the others.
+        loss = np.average(batch_losses, weights=batch_sizes)
+        if streaming_metrics is not None or predictions_out is not None:
+            return loss, predictions_out
         all_predictions = np.vstack(all_predictions)
-        return np.average(batch_losses), all_predictions
+        return loss, all_predictions
 
     def validate(self):
         """
@@ -525,12 +1635,43 @@ class TrainModel(object):
             the validation set.
 
         """
-        average_loss, all_predictions = self._evaluate_on_data(
-            self._validation_data)
-        average_scores = self._validation_metrics.update(all_predictions,
-                                                         self._all_validation_targets)
+        return self._validate(self.model)
+
+    def _validate(self, model):
+        """
+        Measures the validation performance of `model`, which is either
+        the model being trained or a snapshot of it.
+        """
+        streaming_metrics = None
+        if self._metrics_histogram_bins is not None:
+            streaming_metrics = self._validation_metrics
+            streaming_metrics.reset()
+        if self.stream_evaluation:
+            # the training batches drawn ahead are paused while the
+            # validation set is streamed from the same sampler.
+            with self._sampler_lock:
+                validation_data, _ = self.sampler.stream_validation_set(
+                    self.batch_size, n_samples=self._n_validation_samples)
+                average_loss, all_predictions = self._evaluate_on_data(
+                    validation_data,
+                    predictions_out=self._validation_predictions,
+                    targets_out=self._all_validation_targets,
+                    streaming_metrics=streaming_metrics,
+                    model=model)
+        else:
+            average_loss, all_predictions = self._evaluate_on_data(
+                self._validation_data,
+                streaming_metrics=streaming_metrics,
+                model=model)
+        if streaming_metrics is not None:
+            average_scores = streaming_metrics.update()
+        else:
+            average_scores = self._validation_metrics.update(
+                all_predictions, self._all_validation_targets)
         for name, score in average_scores.items():
             logger.info("validation {0}: {1}".format(name, score))
+        if streaming_metrics is not None:
+            _log_error_bounds("validation", streaming_metrics)
 
         average_scores["loss"] = average_loss
         return average_scores
@@ -547,19 +1688,53 @@ class TrainModel(object):
             the test set.
 
         """
-        if self._test_data is None:
-            self.create_test_set()
-        average_loss, all_predictions = self._evaluate_on_data(
-            self._test_data)
-
-        average_scores = self._test_metrics.update(all_predictions,
-                                                   self._all_test_targets)
-        np.savez_compressed(
-            os.path.join(self.output_dir, "test_predictions.npz"),
-            data=all_predictions)
+        streaming_metrics = None
+        if self._metrics_histogram_bins is not None:
+            streaming_metrics = self._test_metrics
+            streaming_metrics.reset()
+        if self.stream_evaluation:
+            test_data, n_samples = self.sampler.stream_test_set(
+                self.batch_size, n_samples=self._n_test_samples)
+            all_predictions = None
+            all_test_targets = None
+            if streaming_metrics is None:
+                shape = (n_samples, self.sampler.n_features)
+                all_predictions = open_memmap(
+                    os.path.join(self.output_dir, "test_predictions.npy"),
+                    mode="w+", dtype=np.float32, shape=shape)
+                all_test_targets = open_memmap(
+                    os.path.join(self.output_dir, "test_targets.npy"),
+                    mode="w+", dtype=np.float32, shape=shape)
+            with self._sampler_lock:
+                average_loss, _ = self._evaluate_on_data(
+                    test_data,
+                    predictions_out=all_predictions,
+                    targets_out=all_test_targets,
+                    streaming_metrics=streaming_metrics)
+            if streaming_metrics is None:
+                all_predictions.flush()
+                all_test_targets.flush()
+        else:
+            if self._test_data is None:
+                self.create_test_set()
+            all_test_targets = self._all_test_targets
+            average_loss, all_predictions = self._evaluate_on_data(
+                self._test_data, streaming_metrics=streaming_metrics)
+
+        if streaming_metrics is not None:
+            average_scores = streaming_metrics.update()
+        else:
+            average_scores = self._test_metrics.update(all_predictions,
+                                                       all_test_targets)
+            if not self.stream_evaluation:
+                np.savez_compressed(
+                    os.path.join(self.output_dir, "test_predictions.npz"),
+                    data=all_predictions)
 
         for name, score in average_scores.items():
             logger.info("test {0}: {1}".format(name, score))
+        if streaming_metrics is not None:
+            _log_error_bounds("test", streaming_metrics)
 
         test_performance = os.path.join(
             self.output_dir, "test_performance.txt")
@@ -568,21 +1743,32 @@ class TrainModel(object):
 
         average_scores["loss"] = average_loss
 
-        self._test_metrics.visualize(
-            all_predictions, self._all_test_targets, self.output_dir)
+        if streaming_metrics is not None:
+            streaming_metrics.visualize(
+                self.output_dir, **self._visualize_kwargs)
+        else:
+            self._test_metrics.visualize(
+                all_predictions, all_test_targets, self.output_dir,
+                **self._visualize_kwargs)
 
         return (average_scores, feature_scores_dict)
 
     def _save_checkpoint(self,
                          state,
                          is_best,
-                         filename="checkpoint"):
+                         filename="checkpoint",
+                         rotate=False,
+                         best_only=False):
         """
         Saves snapshot of the model state to file. Will save a checkpoint
         with name `<filename>.pth.tar` and, if this is the model's best
         performance so far, will save the state to a `best_model.pth.tar`
         file as well.
 
+        The state is copied to the CPU and written on a background
+        thread, so this returns before the file is written. The files
+        are complete once training finishes.
+
         Models are saved in the state dictionary format. This is a more
         stable format compared to saving the whole model (which is another
         option supported by PyTorch). Note that we do save a number of
@@ -607,6 +1793,13 @@ class TrainModel(object):
             Default is "checkpoint". Specify the checkpoint filename. Will
             append a file extension to the end of the `filename`
             (e.g. `checkpoint.pth.tar`).
+        rotate : bool, optional
+            Default is False. Whether this is one of the
+            `checkpoint-<TIMESTAMP>.pth.tar` files, of which only the
+            most recent `keep_last_n_checkpoints` are kept.
+        best_only : bool, optional
+            Default is False. Whether to save the state only to
+            `best_model.pth.tar` and not to `<filename>.pth.tar`.
 
         Returns
         -------
@@ -615,11 +1808,7 @@ class TrainModel(object):
         """
         logger.debug("[TRAIN] {0}: Saving model state to file.".format(
             state["step"]))
-        cp_filepath = os.path.join(
-            self.output_dir, filename)
-        torch.save(state, "{0}.pth.tar".format(cp_filepath))
-        if is_best:
-            best_filepath = os.path.join(self.output_dir, "best_model")
-            shutil.copyfile("{0}.pth.tar".format(cp_filepath),
-                            "{0}.pth.tar".format(best_filepath))
+        self._checkpoint_writer.save(
+            state, filename, is_best=is_best, rotate=rotate,
+            best_only=best_only)
 
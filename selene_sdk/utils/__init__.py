@@ -10,10 +10,14 @@ from .utils import get_indices_and_probabilities
 from .utils import initialize_logger
 from .utils import load_features_list
 from .utils import load_model_from_state_dict
+from .profiling import profile_model_layers
 from .performance_metrics import PerformanceMetrics
+from .performance_metrics import StreamingPerformanceMetrics
 from .performance_metrics import visualize_roc_curves
 from .performance_metrics import visualize_precision_recall_curves
 from .performance_metrics import auc_u_test
+from .performance_metrics import multilabel_average_precision_score
+from .performance_metrics import multilabel_roc_auc_score
 from .config import load
 from .config import load_path
 from .config import instantiate
@@ -28,13 +32,17 @@ __all__ = ["_is_lua_trained_model",
            "initialize_logger",
            "load_features_list",
            "load_model_from_state_dict",
+           "profile_model_layers",
            "PerformanceMetrics",
+           "StreamingPerformanceMetrics",
            "load",
            "load_path",
            "instantiate",
            "get_indices_and_probabilities",
            "visualize_roc_curves",
            "visualize_precision_recall_curves",
+           "multilabel_roc_auc_score",
+           "multilabel_average_precision_score",
            "initialize_model",
            "execute",
            "parse_configs_and_run",
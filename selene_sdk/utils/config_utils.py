@@ -10,9 +10,13 @@ from time import strftime
 import types
 
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 
 from . import _is_lua_trained_model
 from . import instantiate
+from . import profile_model_layers
+from ..samplers.file_samplers import export_shards
 
 
 def class_instantiate(classobj):
@@ -208,6 +212,60 @@ def execute(operations, configs, output_dir):
                 evaluate_model = instantiate(evaluate_model_info)
                 evaluate_model.evaluate()
 
+        elif op == "export":
+            sampler_info = configs["sampler"]
+            if output_dir is not None:
+                sampler_info.bind(output_dir=output_dir)
+            sampler = instantiate(sampler_info)
+            export_info = dict(configs["export_shards"])
+            if "n_samples" not in export_info:
+                raise ValueError("exporting shards requires the number of "
+                                 "samples to export for each mode "
+                                 "('n_samples').")
+            n_samples_per_mode = export_info.pop("n_samples")
+            shards_dir = export_info.pop("output_dir", output_dir)
+            if shards_dir is None:
+                raise ValueError("exporting shards requires an output "
+                                 "directory ('output_dir'), but found "
+                                 "neither a top-level nor an "
+                                 "'export_shards' output directory.")
+            for mode, n_samples in n_samples_per_mode.items():
+                export_shards(sampler, mode, n_samples, shards_dir,
+                              **export_info)
+
+        elif op == "profile":
+            if not model:
+                model, _ = initialize_model(
+                    configs["model"], train=False)
+            profile_info = dict(configs["profile_model"])
+            if "sequence_length" not in profile_info:
+                raise ValueError("profiling the model requires the length "
+                                 "of the sequences it expects "
+                                 "('sequence_length').")
+            profile_dir = profile_info.pop("output_dir", output_dir)
+            if profile_dir is not None:
+                os.makedirs(profile_dir, exist_ok=True)
+                profile_info["output_path"] = os.path.join(
+                    profile_dir, "layer_profile.txt")
+            profile = profile_model_layers(model, **profile_info)
+            print("Forward pass of a batch of {0} sequences: {1:.2f} ms, "
+                  "{2:.3g} GFLOPs, {3} parameters.".format(
+                      profile_info.get("batch_size", 64),
+                      profile[0]["time_ms"],
+                      profile[0]["flops"] / 1e9,
+                      profile[0]["n_parameters"]))
+            for layer in sorted(profile[1:],
+                                key=lambda layer: -layer["self_time_ms"])[:10]:
+                print("{0} ({1}): {2:.2f} ms ({3:.1%}) excluding its "
+                      "submodules, {4:.3g} GFLOPs, {5} output bytes".format(
+                          layer["layer"], layer["type"],
+                          layer["self_time_ms"],
+                          layer["self_time_ms"] / profile[0]["time_ms"],
+                          layer["flops"] / 1e9, int(layer["output_bytes"])))
+            if profile_dir is not None:
+                print("Layer profile saved to {0}".format(
+                    profile_info["output_path"]))
+
         elif op == "analyze":
             if not model:
                 model, _ = initialize_model(
@@ -247,9 +305,50 @@ def execute(operations, configs, output_dir):
                 analyze_seqs.get_predictions(**predict_info)
 
 
+def _execute_distributed(rank, world_size, operations, configs, output_dir,
+                         seed=None):
+    """
+    Runs the operations in one of the `world_size` processes of a
+    distributed training run on the CPU. The processes communicate
+    over the "gloo" backend of `torch.distributed`. Only the process
+    with rank 0 runs the operations other than "train".
+
+    Parameters
+    ----------
+    rank : int
+        The rank of this process.
+    world_size : int
+        The number of processes.
+    operations : list(str)
+        The list of operations to carry out in _Selene_.
+    configs : dict or object
+        The loaded configurations from a YAML file.
+    output_dir : str or None
+        The path to the directory where all outputs will be saved.
+    seed : int or None, optional
+        Default is None. The random seed for `torch`, which is set the
+        same in every process so that the model is initialized the
+        same way.
+
+    """
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", "29500")
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    if seed is not None:
+        torch.manual_seed(seed)
+    configs["train_model"].bind(distributed=True)
+    if rank != 0:
+        operations = ["train"]
+    try:
+        execute(operations, configs, output_dir)
+    finally:
+        dist.destroy_process_group()
+
+
 def parse_configs_and_run(configs,
                           create_subdirectory=True,
-                          lr=None):
+                          lr=None,
+                          world_size=1):
     """
     Method to parse the configuration YAML file and run each operation
     specified.
@@ -261,7 +360,7 @@ def parse_configs_and_run(configs,
         for the following top-level parameters:
 
             * `ops`: A list of 1 or more of the values \
-            {"train", "evaluate", "analyze"}. The operations specified\
+            {"train", "evaluate", "analyze", "export", "profile"}. The operations specified\
             determine what objects and information we expect to parse\
             in order to run these operations. This is required.
             * `output_dir`: Output directory to use for all the operations.\
@@ -293,6 +392,14 @@ def parse_configs_and_run(configs,
         unless you want to override the value in `configs`. Otherwise,
         set `lr` to the desired learning rate if "train" is one of the
         operations to be executed.
+    world_size : int, optional
+        Default is 1. The number of processes to train the model with.
+        If greater than 1, the processes are started on this machine
+        and train the model together on the CPU with
+        `torch.nn.parallel.DistributedDataParallel` over the "gloo"
+        backend (see the `distributed` parameter of
+        `selene_sdk.TrainModel`). The `MASTER_ADDR` and `MASTER_PORT`
+        environment variables are used if they are set.
 
     Returns
     -------
@@ -300,8 +407,19 @@ def parse_configs_and_run(configs,
         Executes the operations listed and outputs any files
         to the dirs specified in each operation's configuration.
 
+    Raises
+    ------
+    ValueError
+        If `world_size` is greater than 1 but "train" is not one of
+        the operations.
+
     """
     operations = configs["ops"]
+    world_size = int(world_size)
+    if world_size > 1 and "train" not in operations:
+        raise ValueError("Running in {0} processes is only supported "
+                         "for training, but 'train' is not one of the "
+                         "operations {1}.".format(world_size, operations))
 
     if "train" in operations and "lr" not in configs and lr != "None":
         configs["lr"] = float(lr)
@@ -313,7 +431,8 @@ def parse_configs_and_run(configs,
 
     current_run_output_dir = None
     if "output_dir" not in configs and \
-            ("train" in operations or "evaluate" in operations):
+            ("train" in operations or "evaluate" in operations or
+             "export" in operations):
         print("No top-level output directory specified. All constructors "
               "to be initialized (e.g. Sampler, TrainModel) that require "
               "this parameter must have it specified in their individual "
@@ -330,6 +449,7 @@ def parse_configs_and_run(configs,
         print("Outputs and logs saved to {0}".format(
             current_run_output_dir))
 
+    seed = None
     if "random_seed" in configs:
         seed = configs["random_seed"]
         torch.manual_seed(seed)
@@ -338,4 +458,10 @@ def parse_configs_and_run(configs,
         print("Warning: no random seed specified in config file. "
               "Using a random seed ensures results are reproducible.")
 
+    if world_size > 1:
+        mp.spawn(_execute_distributed,
+                 args=(world_size, operations, configs,
+                       current_run_output_dir, seed),
+                 nprocs=world_size)
+        return
     execute(operations, configs, current_run_output_dir)
@@ -67,8 +67,8 @@ class NonStrandSpecific(Module):
         else:
             reverse_input = _flip(_flip(input, 1), 2)
 
-        output = self.model.forward(input)
-        output_from_rev = self.model.forward(reverse_input)
+        output = self.model(input)
+        output_from_rev = self.model(reverse_input)
 
         if self.mode == "mean":
             return (output + output_from_rev) / 2
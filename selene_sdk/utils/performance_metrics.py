@@ -3,14 +3,13 @@ This module provides the `PerformanceMetrics` class and supporting
 functionality for tracking and computing model performance.
 """
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import multiprocessing
 import os
 
 import numpy as np
-from sklearn.metrics import average_precision_score
-from sklearn.metrics import precision_recall_curve
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import roc_curve
+from scipy.special import digamma
 from scipy.stats import rankdata
 
 
@@ -39,13 +38,293 @@ data : list(float)
 """
 
 
+def _column_blocks(n_columns, n_blocks):
+    """
+    Splits `n_columns` columns into at most `n_blocks` contiguous
+    slices of similar sizes (and always at least one slice).
+    """
+    n_blocks = max(1, min(n_blocks, n_columns))
+    bounds = np.linspace(0, n_columns, n_blocks + 1).astype(int)
+    return [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _process_pool(n_processes):
+    """
+    Creates a pool of worker processes. The processes are spawned
+    rather than forked, which is safe while other threads (e.g. those
+    writing checkpoints) are running, but means that a script that uses
+    them must guard its entry point with `if __name__ == "__main__":`.
+    """
+    return multiprocessing.get_context("spawn").Pool(n_processes)
+
+
+def _start_process(fn, *args, **kwargs):
+    """
+    Runs `fn(*args, **kwargs)` in a spawned background process (see
+    `_process_pool`), and returns the `multiprocessing.Process`. The
+    interpreter waits for the process to finish before exiting.
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=fn, args=args, kwargs=kwargs)
+    process.start()
+    return process
+
+
+def _map_column_blocks(fn, prediction, target, n_workers, *args):
+    """
+    Calls `fn(prediction_block, target_block, *args)` on contiguous
+    blocks of the columns (features) of `prediction` and `target`, one
+    per thread of a pool if `n_workers` is greater than 1, and returns
+    the list of the results for each block in order. Threads share the
+    arrays without copying them, and numpy releases the GIL while it
+    sorts and accumulates them.
+    """
+    blocks = _column_blocks(target.shape[1], n_workers)
+    tasks = [(prediction[:, b], target[:, b]) + args for b in blocks]
+    if len(tasks) == 1:
+        return [fn(*tasks[0])]
+    with ThreadPoolExecutor(len(tasks)) as pool:
+        return list(pool.map(lambda task: fn(*task), tasks))
+
+
+def _downsample_curve(x, y, n_points):
+    """
+    Keeps at most `n_points` evenly spaced points of a curve, including
+    its first and last points.
+    """
+    if len(x) <= n_points:
+        return x, y
+    keep = np.unique(np.linspace(0, len(x) - 1, n_points).round().astype(int))
+    return x[keep], y[keep]
+
+
+def _curves_from_ranking(ranking, n_curve_points):
+    """
+    Computes the ROC curve and the precision-recall curve of each column
+    of a ranking (see `_rank_columns`) that has both positive and
+    negative examples.
+
+    Parameters
+    ----------
+    ranking : dict
+        The ranking of some columns of predictions.
+    n_curve_points : int
+        The maximum number of points of each curve, which is
+        downsampled if it has more.
+
+    Returns
+    -------
+    roc_curves, precision_recall_curves : tuple(list, list)
+        The ROC curves, as tuples of the false and true positive rates,
+        and the precision-recall curves, as tuples of the recalls and
+        precisions in the order of
+        `sklearn.metrics.precision_recall_curve`.
+
+    """
+    roc_curves = []
+    precision_recall_curves = []
+    column = ranking["column"]
+    if not len(column):
+        return roc_curves, precision_recall_curves
+    starts = np.nonzero(np.r_[True, column[1:] != column[:-1]])[0]
+    for index, tps, fps in zip(column[starts],
+                               np.split(ranking["tps"], starts[1:]),
+                               np.split(ranking["fps"], starts[1:])):
+        n_positives = ranking["n_positives"][index]
+        n_negatives = ranking["n_negatives"][index]
+        if not n_positives or not n_negatives:
+            continue
+        tpr = tps / n_positives
+        roc_curves.append(_downsample_curve(
+            np.r_[0, fps / n_negatives], np.r_[0, tpr], n_curve_points))
+        precision_recall_curves.append(_downsample_curve(
+            np.r_[tpr[::-1], 0], np.r_[(tps / (tps + fps))[::-1], 1],
+            n_curve_points))
+    return roc_curves, precision_recall_curves
+
+
+def _feature_curves(prediction, target, report_gt_feature_n_positives,
+                    n_curve_points):
+    """
+    Computes the ROC and precision-recall curves (see
+    `_curves_from_ranking`) of the features with more than
+    `report_gt_feature_n_positives` positive examples, sorting the
+    predictions of each feature once.
+    """
+    roc_curves = []
+    precision_recall_curves = []
+    features = np.nonzero(
+        np.count_nonzero(target, axis=0) > report_gt_feature_n_positives)[0]
+    if len(features):
+        for _, ranking in _rank_columns(
+                prediction[:, features], target[:, features]):
+            roc, precision_recall = _curves_from_ranking(
+                ranking, n_curve_points=n_curve_points)
+            roc_curves += roc
+            precision_recall_curves += precision_recall
+    return roc_curves, precision_recall_curves
+
+
+def _compute_curves(prediction, target, report_gt_feature_n_positives,
+                    n_curve_points, n_workers=1):
+    """
+    Computes the curves of `_feature_curves`, for blocks of features in
+    `n_workers` threads.
+    """
+    roc_curves = []
+    precision_recall_curves = []
+    for roc, precision_recall in _map_column_blocks(
+            _feature_curves, prediction, target, n_workers,
+            report_gt_feature_n_positives, n_curve_points):
+        roc_curves += roc
+        precision_recall_curves += precision_recall
+    return roc_curves, precision_recall_curves
+
+
+def _plot_curves(curves, output_path, xlabel, ylabel,
+                 style="seaborn-colorblind", fig_title=None, dpi=500,
+                 file_format="svg", rasterized=False, step=False):
+    """
+    Plots the curves of all features in one figure and saves it. Each
+    curve is a tuple of its x and y coordinates, which are drawn as
+    steps if `step` is True (as for precision-recall curves). If
+    `rasterized`, the curves are drawn as an image at `dpi` inside a
+    vector format such as SVG, while the axes and labels stay vector
+    graphics.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # TODO: fix this
+    import matplotlib
+    backend = matplotlib.get_backend()
+    if "inline" not in backend:
+        matplotlib.use("SVG")
+    import matplotlib.pyplot as plt
+
+    plt.style.use(style)
+    plt.figure()
+    for x, y in curves:
+        if step:
+            plt.step(x, y, color="black", alpha=0.3, lw=1,
+                     where="post", rasterized=rasterized)
+        else:
+            plt.plot(x, y, color="black", alpha=0.3, lw=1,
+                     rasterized=rasterized)
+    plt.xlim([0.0, 1.0])
+    plt.ylim([0.0, 1.05])
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    if fig_title:
+        plt.title(fig_title)
+    plt.savefig(output_path, format=file_format, dpi=dpi)
+    plt.close()
+
+
+def _plot_figure(figure):
+    """
+    Plots one figure, described by the keyword arguments of
+    `_plot_curves`.
+    """
+    _plot_curves(**figure)
+
+
+def _plot_figures(figures, n_processes=1):
+    """
+    Plots several figures (see `_plot_figure`), in up to `n_processes`
+    processes at once.
+    """
+    n_processes = min(n_processes, len(figures))
+    if n_processes <= 1:
+        for figure in figures:
+            _plot_figure(figure)
+        return
+    with _process_pool(n_processes) as pool:
+        pool.map(_plot_figure, figures)
+
+
+def _curve_figures(roc_curves,
+                   precision_recall_curves,
+                   output_dir,
+                   style="seaborn-colorblind",
+                   fig_title=None,
+                   dpi=500,
+                   file_format="svg",
+                   rasterized=False):
+    """
+    Describes the figures of the ROC curves and of the precision-recall
+    curves, if they are not None, for `_plot_figures`. If `fig_title`
+    is None, each figure gets its default title.
+    """
+    options = dict(style=style,
+                   dpi=dpi,
+                   file_format=file_format,
+                   rasterized=rasterized)
+    figures = []
+    if roc_curves is not None:
+        figures.append(dict(
+            curves=roc_curves,
+            output_path=os.path.join(
+                output_dir, "roc_curves.{0}".format(file_format)),
+            xlabel='False Positive Rate',
+            ylabel='True Positive Rate',
+            fig_title=("Feature ROC curves" if fig_title is None
+                       else fig_title),
+            **options))
+    if precision_recall_curves is not None:
+        figures.append(dict(
+            curves=precision_recall_curves,
+            output_path=os.path.join(
+                output_dir, "precision_recall_curves.{0}".format(
+                    file_format)),
+            xlabel='Recall',
+            ylabel='Precision',
+            fig_title=("Feature precision-recall curves" if fig_title is None
+                       else fig_title),
+            step=True,
+            **options))
+    return figures
+
+
+def _visualize_curves(prediction,
+                      target,
+                      output_dir,
+                      report_gt_feature_n_positives,
+                      roc=True,
+                      precision_recall=True,
+                      n_workers=1,
+                      n_curve_points=1000,
+                      background=False,
+                      **kwargs):
+    """
+    Computes the ROC and/or precision-recall curves of each feature in
+    `n_workers` threads, and plots them in up to `n_workers` processes.
+    If `background`, the figures are plotted in a background process
+    and this returns it once the curves are computed. The keyword
+    arguments are passed to `_curve_figures`.
+    """
+    roc_curves, precision_recall_curves = _compute_curves(
+        prediction, target, report_gt_feature_n_positives, n_curve_points,
+        n_workers=n_workers)
+    figures = _curve_figures(
+        roc_curves if roc else None,
+        precision_recall_curves if precision_recall else None,
+        output_dir,
+        **kwargs)
+    if background:
+        return _start_process(_plot_figures, figures, n_processes=n_workers)
+    _plot_figures(figures, n_processes=n_workers)
+
+
 def visualize_roc_curves(prediction,
                          target,
                          output_dir,
                          report_gt_feature_n_positives=50,
                          style="seaborn-colorblind",
                          fig_title="Feature ROC curves",
-                         dpi=500):
+                         dpi=500,
+                         n_curve_points=1000,
+                         file_format="svg",
+                         rasterized=False):
     """
     Output the ROC curves for each feature predicted by a model
     as an SVG.
@@ -69,6 +348,16 @@ def visualize_roc_curves(prediction,
         Default is "Feature ROC curves". Set the figure title.
     dpi : int, optional
         Default is 500. Specify dots per inch (resolution) of the figure.
+    n_curve_points : int, optional
+        Default is 1000. The maximum number of points drawn for each
+        curve, which is downsampled if it has more.
+    file_format : str, optional
+        Default is "svg". The format of the figure, e.g. "png" to
+        output a raster image rather than a vector graphic.
+    rasterized : bool, optional
+        Default is `False`. Whether to draw the curves as an image
+        inside a vector figure, which keeps SVG files small when there
+        are many features.
 
     Returns
     -------
@@ -76,31 +365,15 @@ def visualize_roc_curves(prediction,
         Outputs the figure in `output_dir`.
 
     """
-    os.makedirs(output_dir, exist_ok=True)
-
-    import matplotlib
-    backend = matplotlib.get_backend()
-    if "inline" not in backend:
-        matplotlib.use("SVG")
-    import matplotlib.pyplot as plt
-
-    plt.style.use(style)
-    plt.figure()
-    for index, feature_preds in enumerate(prediction.T):
-        feature_targets = target[:, index]
-        if len(np.unique(feature_targets)) > 1 and \
-                np.sum(feature_targets) > report_gt_feature_n_positives:
-            fpr, tpr, _ = roc_curve(feature_targets, feature_preds)
-            plt.plot(fpr, tpr, 'r-', color="black", alpha=0.3, lw=1)
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel('False Positive Rate')
-    plt.ylabel('True Positive Rate')
-    if fig_title:
-        plt.title(fig_title)
-    plt.savefig(os.path.join(output_dir, "roc_curves.svg"),
-                format="svg",
-                dpi=dpi)
+    _visualize_curves(prediction, target, output_dir,
+                      report_gt_feature_n_positives,
+                      precision_recall=False,
+                      n_curve_points=n_curve_points,
+                      style=style,
+                      fig_title=fig_title,
+                      dpi=dpi,
+                      file_format=file_format,
+                      rasterized=rasterized)
 
 
 def visualize_precision_recall_curves(
@@ -110,7 +383,10 @@ def visualize_precision_recall_curves(
         report_gt_feature_n_positives=50,
         style="seaborn-colorblind",
         fig_title="Feature precision-recall curves",
-        dpi=500):
+        dpi=500,
+        n_curve_points=1000,
+        file_format="svg",
+        rasterized=False):
     """
     Output the precision-recall (PR) curves for each feature predicted by
     a model as an SVG.
@@ -134,6 +410,16 @@ def visualize_precision_recall_curves(
         Default is "Feature precision-recall curves". Set the figure title.
     dpi : int, optional
         Default is 500. Specify dots per inch (resolution) of the figure.
+    n_curve_points : int, optional
+        Default is 1000. The maximum number of points drawn for each
+        curve, which is downsampled if it has more.
+    file_format : str, optional
+        Default is "svg". The format of the figure, e.g. "png" to
+        output a raster image rather than a vector graphic.
+    rasterized : bool, optional
+        Default is `False`. Whether to draw the curves as an image
+        inside a vector figure, which keeps SVG files small when there
+        are many features.
 
     Returns
     -------
@@ -141,35 +427,314 @@ def visualize_precision_recall_curves(
         Outputs the figure in `output_dir`.
 
     """
-    os.makedirs(output_dir, exist_ok=True)
+    _visualize_curves(prediction, target, output_dir,
+                      report_gt_feature_n_positives,
+                      roc=False,
+                      n_curve_points=n_curve_points,
+                      style=style,
+                      fig_title=fig_title,
+                      dpi=dpi,
+                      file_format=file_format,
+                      rasterized=rasterized)
+
+
+_RANKING_CHUNK_SIZE = 2 ** 22
+"""
+The maximum number of prediction values that are ranked at once by
+`_rank_columns`, which bounds the memory it uses.
+"""
 
-    # TODO: fix this
-    import matplotlib
-    backend = matplotlib.get_backend()
-    if "inline" not in backend:
-        matplotlib.use("SVG")
-    import matplotlib.pyplot as plt
 
-    plt.style.use(style)
-    plt.figure()
-    for index, feature_preds in enumerate(prediction.T):
-        feature_targets = target[:, index]
-        if len(np.unique(feature_targets)) > 1 and \
-                np.sum(feature_targets) > report_gt_feature_n_positives:
-            precision, recall, _ = precision_recall_curve(
-                feature_targets, feature_preds)
-            plt.step(
-                recall, precision, 'r-',
-                color="black", alpha=0.3, lw=1, where="post")
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel('Recall')
-    plt.ylabel('Precision')
-    if fig_title:
-        plt.title(fig_title)
-    plt.savefig(os.path.join(output_dir, "precision_recall_curves.svg"),
-                format="svg",
-                dpi=dpi)
+def _rank_columns(prediction, target):
+    """
+    Sorts each column of `prediction` in descending order, a chunk of
+    columns at a time, and computes the number of positive and negative
+    examples above each threshold, from which the ranking metrics are
+    computed.
+
+    Parameters
+    ----------
+    prediction : numpy.ndarray
+        The :math:`N \\times F` predictions.
+    target : numpy.ndarray
+        The :math:`N \\times F` binary targets. Nonzero values are
+        positive.
+
+    Yields
+    ------
+    columns, ranking : tuple(slice, dict)
+        The columns in the chunk, and a dictionary describing the
+        thresholds of the columns of the chunk, i.e. their distinct
+        predictions in descending order. For every threshold of every
+        column, `column` is the index of the column in the chunk, `tps`
+        and `fps` are the numbers of positives and negatives predicted
+        at or above the threshold, and `tps_before` and `fps_before`
+        are those at the previous threshold of the column (0 for the
+        first one). `n_positives` and `n_negatives` are the numbers of
+        positives and negatives of each column.
+
+    """
+    n_samples, n_features = prediction.shape
+    chunk_size = max(1, _RANKING_CHUNK_SIZE // max(1, n_samples))
+    for start in range(0, n_features, chunk_size):
+        columns = slice(start, min(start + chunk_size, n_features))
+        # each column is sorted as a contiguous row of the transpose.
+        chunk_predictions = np.ascontiguousarray(prediction[:, columns].T)
+        order = np.argsort(-chunk_predictions, axis=1)
+        sorted_predictions = np.take_along_axis(
+            chunk_predictions, order, axis=1)
+        positives = np.take_along_axis(
+            target[:, columns].T != 0, order, axis=1)
+        tps = np.cumsum(positives, axis=1)
+
+        # tied predictions are not separated by any threshold, so only
+        # the last of each run of ties ends a threshold.
+        ends_threshold = np.ones(sorted_predictions.shape, dtype=bool)
+        ends_threshold[:, :-1] = \
+            sorted_predictions[:, 1:] != sorted_predictions[:, :-1]
+        column, position = np.nonzero(ends_threshold)
+        threshold_tps = tps[column, position]
+        n_positives = tps[:, -1] if n_samples else \
+            np.zeros(len(chunk_predictions), dtype=int)
+        yield columns, _ranking_from_thresholds(
+            column, threshold_tps, position + 1 - threshold_tps,
+            n_positives, n_samples - n_positives)
+
+
+def _ranking_from_thresholds(column, tps, fps, n_positives, n_negatives):
+    """
+    Builds the ranking dictionary described in `_rank_columns` from the
+    numbers of positives and negatives at or above each threshold of
+    each column, with the thresholds of each column in descending order
+    and the columns in ascending order.
+    """
+    starts_column = np.ones(len(column), dtype=bool)
+    starts_column[1:] = column[1:] != column[:-1]
+    return dict(column=column,
+                tps=tps,
+                fps=fps,
+                tps_before=np.where(starts_column, 0, np.roll(tps, 1)),
+                fps_before=np.where(starts_column, 0, np.roll(fps, 1)),
+                n_positives=n_positives,
+                n_negatives=n_negatives)
+
+
+def _roc_auc_from_ranking(ranking):
+    """
+    Computes the area under the ROC curve of each column of a ranking
+    (see `_rank_columns`) with the trapezoidal rule, as
+    `sklearn.metrics.roc_auc_score` does.
+    """
+    n_positives = ranking["n_positives"]
+    n_negatives = ranking["n_negatives"]
+    areas = np.bincount(
+        ranking["column"],
+        weights=(ranking["fps"] - ranking["fps_before"]) *
+                (ranking["tps"] + ranking["tps_before"]) / 2,
+        minlength=len(n_positives))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = areas / (n_positives * n_negatives)
+    scores[(n_positives == 0) | (n_negatives == 0)] = np.nan
+    return scores
+
+
+def _average_precision_from_ranking(ranking):
+    """
+    Computes the average precision of each column of a ranking (see
+    `_rank_columns`): the precision at each threshold, weighted by the
+    increase in recall from the previous threshold, as
+    `sklearn.metrics.average_precision_score` does.
+    """
+    n_positives = ranking["n_positives"]
+    tps = ranking["tps"]
+    weighted_precisions = np.bincount(
+        ranking["column"],
+        weights=(tps - ranking["tps_before"]) * tps /
+                (tps + ranking["fps"]),
+        minlength=len(n_positives))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = weighted_precisions / n_positives
+    scores[n_positives == 0] = np.nan
+    return scores
+
+
+def _roc_auc_error_bound(ranking):
+    """
+    Bounds the difference between the area under the ROC curve of each
+    column of a ranking (see `_roc_auc_from_ranking`) and the area that
+    would be computed if the examples tied at a threshold were ordered.
+    Each pair of a positive and a negative example tied at a threshold
+    counts 1/2 towards the area, instead of 0 or 1.
+    """
+    n_positives = ranking["n_positives"]
+    n_negatives = ranking["n_negatives"]
+    tied_pairs = np.bincount(
+        ranking["column"],
+        weights=(ranking["tps"] - ranking["tps_before"]) *
+                (ranking["fps"] - ranking["fps_before"]),
+        minlength=len(n_positives))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bounds = tied_pairs / 2 / (n_positives * n_negatives)
+    bounds[(n_positives == 0) | (n_negatives == 0)] = np.nan
+    return bounds
+
+
+def _average_precision_error_bound(ranking):
+    """
+    Bounds the difference between the average precision of each column
+    of a ranking (see `_average_precision_from_ranking`) and the average
+    precision that would be computed if the examples tied at a
+    threshold were ordered. The :math:`i`-th of the :math:`p` positives
+    tied at a threshold, after :math:`T` positives and :math:`F`
+    negatives, has a precision between :math:`(T+i)/(T+F+i+n)` and
+    :math:`(T+i)/(T+F+i)`, depending on how many of the :math:`n` tied
+    negatives precede it. These are summed over :math:`i` in closed form
+    with the digamma function.
+    """
+    n_positives = ranking["n_positives"]
+    tps_before = ranking["tps_before"].astype(np.float64)
+    fps_before = ranking["fps_before"].astype(np.float64)
+    tied_positives = ranking["tps"] - tps_before
+    tied_negatives = ranking["fps"] - fps_before
+    ranked_before = tps_before + fps_before
+    tied_precision = tied_positives * ranking["tps"] / (
+        ranking["tps"] + ranking["fps"])
+    lowest = tied_positives - (fps_before + tied_negatives) * (
+        digamma(ranked_before + tied_negatives + tied_positives + 1) -
+        digamma(ranked_before + tied_negatives + 1))
+    highest = tied_positives - fps_before * (
+        digamma(ranked_before + tied_positives + 1) -
+        digamma(ranked_before + 1))
+    errors = np.bincount(
+        ranking["column"],
+        weights=np.maximum(tied_precision - lowest, highest - tied_precision),
+        minlength=len(n_positives))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bounds = errors / n_positives
+    bounds[n_positives == 0] = np.nan
+    return bounds
+
+
+def _compute_ranking_scores(prediction, target, metric_fns,
+                            report_gt_feature_n_positives=10):
+    """
+    Computes several ranking metrics (see `multilabel_roc_auc_score`)
+    for all the features at once, sorting the predictions for each
+    feature only once.
+
+    Parameters
+    ----------
+    prediction : numpy.ndarray
+        Value predicted by user model.
+    target : numpy.ndarray
+        True value that the user model was trying to predict.
+    metric_fns : list(types.FunctionType)
+        The ranking metrics, which have a `from_ranking` attribute.
+    report_gt_feature_n_positives : int, optional
+        Default is 10. The minimum number of positive examples for a
+        feature in order to compute the score for it.
+
+    Returns
+    -------
+    list(tuple(float, numpy.ndarray))
+        The average of all feature scores and the vector of scores for
+        each feature, for each metric, as returned by `compute_score`.
+
+    """
+    feature_scores = [np.ones(target.shape[1]) * np.nan for _ in metric_fns]
+    scored_features = np.nonzero(
+        np.count_nonzero(target, axis=0) > report_gt_feature_n_positives)[0]
+    if len(scored_features):
+        for columns, ranking in _rank_columns(
+                prediction[:, scored_features], target[:, scored_features]):
+            for scores, metric_fn in zip(feature_scores, metric_fns):
+                scores[scored_features[columns]] = \
+                    metric_fn.from_ranking(ranking)
+    return [(_average_score(scores), scores) for scores in feature_scores]
+
+
+def _average_score(feature_scores):
+    """
+    Averages the feature scores that are not NaN, or returns None if
+    there are none.
+    """
+    valid_feature_scores = feature_scores[~np.isnan(feature_scores)]
+    if not len(valid_feature_scores):
+        return None
+    return np.average(valid_feature_scores)
+
+
+def multilabel_roc_auc_score(target, prediction):
+    """
+    Computes the area under the ROC curve for each feature (column) at
+    once. The predictions for each feature are sorted once, and tied
+    predictions are handled as in `sklearn.metrics.roc_auc_score`, which
+    this matches.
+
+    This can be used as a metric in `PerformanceMetrics`, which computes
+    it together with the other metrics of this kind (e.g.
+    `multilabel_average_precision_score`) from one sort of the
+    predictions.
+
+    Parameters
+    ----------
+    target : numpy.ndarray
+        The :math:`N \\times F` binary targets for :math:`N` examples
+        and :math:`F` features. Nonzero values are positive.
+    prediction : numpy.ndarray
+        The :math:`N \\times F` predictions.
+
+    Returns
+    -------
+    numpy.ndarray
+        The score for each feature, which is NaN for features whose
+        examples are all positive or all negative.
+
+    """
+    return _compute_ranking_scores(
+        prediction, target, [multilabel_roc_auc_score],
+        report_gt_feature_n_positives=-1)[0][1]
+
+
+multilabel_roc_auc_score.from_ranking = _roc_auc_from_ranking
+multilabel_roc_auc_score.error_bound = _roc_auc_error_bound
+
+
+def multilabel_average_precision_score(target, prediction):
+    """
+    Computes the average precision for each feature (column) at once.
+    The predictions for each feature are sorted once, and tied
+    predictions are handled as in
+    `sklearn.metrics.average_precision_score`, which this matches.
+
+    This can be used as a metric in `PerformanceMetrics`, which computes
+    it together with the other metrics of this kind (e.g.
+    `multilabel_roc_auc_score`) from one sort of the predictions.
+
+    Parameters
+    ----------
+    target : numpy.ndarray
+        The :math:`N \\times F` binary targets for :math:`N` examples
+        and :math:`F` features. Nonzero values are positive.
+    prediction : numpy.ndarray
+        The :math:`N \\times F` predictions.
+
+    Returns
+    -------
+    numpy.ndarray
+        The score for each feature, which is NaN for features without
+        positive examples.
+
+    """
+    return _compute_ranking_scores(
+        prediction, target, [multilabel_average_precision_score],
+        report_gt_feature_n_positives=-1)[0][1]
+
+
+multilabel_average_precision_score.from_ranking = \
+    _average_precision_from_ranking
+multilabel_average_precision_score.error_bound = \
+    _average_precision_error_bound
 
 
 def compute_score(prediction, target, metric_fn,
@@ -186,7 +751,9 @@ def compute_score(prediction, target, metric_fn,
         True value that the user model was trying to predict.
     metric_fn : types.FunctionType
         A metric that can measure the distance between the prediction
-        and target variables.
+        and target variables. It is called on the targets and
+        predictions of each feature, unless it is a ranking metric that
+        scores all features at once (e.g. `multilabel_roc_auc_score`).
     report_gt_feature_n_positives : int, optional
         Default is 10. The minimum number of positive examples for a
         feature in order to compute the score for it.
@@ -199,6 +766,10 @@ def compute_score(prediction, target, metric_fn,
         no features meeting our filtering thresholds, will return
         `(None, [])`.
     """
+    if hasattr(metric_fn, "from_ranking"):
+        return _compute_ranking_scores(
+            prediction, target, [metric_fn],
+            report_gt_feature_n_positives=report_gt_feature_n_positives)[0]
     feature_scores = np.ones(target.shape[1]) * np.nan
     for index, feature_preds in enumerate(prediction.T):
         feature_targets = target[:, index]
@@ -216,6 +787,36 @@ def compute_score(prediction, target, metric_fn,
     return average_score, feature_scores
 
 
+def _score_features(prediction, target, metric_fns,
+                    report_gt_feature_n_positives):
+    """
+    Computes the score of each feature for each of `metric_fns` (see
+    `compute_score`). The ranking metrics are computed together, so
+    that the predictions are only sorted once.
+
+    Returns
+    -------
+    list(numpy.ndarray)
+        The vector of scores for each feature, for each metric.
+
+    """
+    feature_scores = [None] * len(metric_fns)
+    ranking_metrics = [i for i, metric_fn in enumerate(metric_fns)
+                       if hasattr(metric_fn, "from_ranking")]
+    if ranking_metrics:
+        ranking_scores = _compute_ranking_scores(
+            prediction, target, [metric_fns[i] for i in ranking_metrics],
+            report_gt_feature_n_positives=report_gt_feature_n_positives)
+        for i, (_, scores) in zip(ranking_metrics, ranking_scores):
+            feature_scores[i] = scores
+    for i, metric_fn in enumerate(metric_fns):
+        if feature_scores[i] is None:
+            _, feature_scores[i] = compute_score(
+                prediction, target, metric_fn,
+                report_gt_feature_n_positives=report_gt_feature_n_positives)
+    return feature_scores
+
+
 def get_feature_specific_scores(data, get_feature_from_index_fn):
     """
     Generates a dictionary mapping feature names to feature scores from
@@ -292,10 +893,19 @@ class PerformanceMetrics(object):
     metrics : dict
         A dictionary that maps metric names (`str`) to metric functions.
         By default, this contains `"roc_auc"`, which maps to
-        `sklearn.metrics.roc_auc_score`, and `"average_precision"`,
-        which maps to `sklearn.metrics.average_precision_score`.
-
-
+        `multilabel_roc_auc_score`, and `"average_precision"`, which
+        maps to `multilabel_average_precision_score`. These compute the
+        same scores as `sklearn.metrics.roc_auc_score` and
+        `sklearn.metrics.average_precision_score` for all features at
+        once. Any function that takes the targets and predictions of a
+        feature and returns a score (e.g. those in `sklearn.metrics`)
+        can also be used.
+    n_workers : int, optional
+        Default is 1. The number of threads that compute the metrics and
+        the curves of `visualize`, each for a block of the features, and
+        the number of processes that plot the figures of `visualize`.
+        The ranking metrics and the curves are computed by numpy, which
+        runs in parallel threads.
 
     Attributes
     ----------
@@ -316,12 +926,16 @@ class PerformanceMetrics(object):
     def __init__(self,
                  get_feature_from_index_fn,
                  report_gt_feature_n_positives=10,
-                 metrics=dict(roc_auc=roc_auc_score, average_precision=average_precision_score)):
+                 metrics=dict(
+                     roc_auc=multilabel_roc_auc_score,
+                     average_precision=multilabel_average_precision_score),
+                 n_workers=1):
         """
         Creates a new object of the `PerformanceMetrics` class.
         """
         self.skip_threshold = report_gt_feature_n_positives
         self.get_feature_from_index = get_feature_from_index_fn
+        self.n_workers = n_workers
         self.metrics = dict()
         for k, v in metrics.items():
             self.metrics[k] = Metric(fn=v, data=[])
@@ -382,18 +996,23 @@ class PerformanceMetrics(object):
 
         """
         metric_scores = {}
-        for name, metric in self.metrics.items():
-            avg_score, feature_scores = compute_score(
-                prediction, target, metric.fn,
-                report_gt_feature_n_positives=self.skip_threshold)
+        block_scores = _map_column_blocks(
+            _score_features, prediction, target, self.n_workers,
+            [metric.fn for metric in self.metrics.values()],
+            self.skip_threshold)
+        for i, (name, metric) in enumerate(self.metrics.items()):
+            feature_scores = np.concatenate(
+                [scores[i] for scores in block_scores])
             metric.data.append(feature_scores)
-            metric_scores[name] = avg_score
+            metric_scores[name] = _average_score(feature_scores)
         return metric_scores
 
-    def visualize(self, prediction, target, output_dir, **kwargs):
+    def visualize(self, prediction, target, output_dir, background=False,
+                  **kwargs):
         """
         Outputs ROC and PR curves. Does not support other metrics
-        currently.
+        currently. The curves of all features are computed from one
+        sort of the predictions of each feature, in `n_workers` threads.
 
         Parameters
         ----------
@@ -404,6 +1023,13 @@ class PerformanceMetrics(object):
         output_dir : str
             The path to the directory to output the figures. Directories that
             do not currently exist will be automatically created.
+        background : bool, optional
+            Default is `False`. If `True`, the figures are plotted in a
+            background process, and this returns as soon as the curves
+            are computed. The process is spawned, so a script that uses
+            this must guard its entry point with
+            `if __name__ == "__main__":`. The interpreter waits for the
+            figures to be written before it exits.
         **kwargs : dict
             Keyword arguments to pass to each visualization function. Each
             function accepts the following args:
@@ -413,24 +1039,30 @@ class PerformanceMetrics(object):
                           `matplotlib.pyplot.style.available` to use.
                 * dpi : int - Default is 500. Specify dots per inch \
                               (resolution) of the figure.
+                * n_curve_points : int - Default is 1000. The \
+                                   maximum number of points drawn for \
+                                   each curve.
+                * file_format : str - Default is "svg". The format of \
+                                the figures, e.g. "png".
+                * rasterized : bool - Default is `False`. Whether to draw \
+                               the curves as an image inside a vector \
+                               figure.
 
         Returns
         -------
-        None
-            Outputs figures to `output_dir`.
+        multiprocessing.Process or None
+            The process plotting the figures if `background`. Outputs
+            figures to `output_dir`.
 
         """
         os.makedirs(output_dir, exist_ok=True)
-        if "roc_auc" in self.metrics:
-            visualize_roc_curves(
-                prediction, target, output_dir,
-                report_gt_feature_n_positives=self.skip_threshold,
-                **kwargs)
-        if "average_precision" in self.metrics:
-            visualize_precision_recall_curves(
-                prediction, target, output_dir,
-                report_gt_feature_n_positives=self.skip_threshold,
-                **kwargs)
+        return _visualize_curves(
+            prediction, target, output_dir, self.skip_threshold,
+            roc="roc_auc" in self.metrics,
+            precision_recall="average_precision" in self.metrics,
+            n_workers=self.n_workers,
+            background=background,
+            **kwargs)
 
     def write_feature_scores_to_file(self, output_path):
         """
@@ -476,3 +1108,268 @@ class PerformanceMetrics(object):
                     file_handle.write("{0}\t{1}\n".format(feature,
                                                           metric_score_cols))
         return feature_scores
+
+
+class StreamingPerformanceMetrics(PerformanceMetrics):
+    """
+    Tracks the same metrics as `PerformanceMetrics`, but estimates them
+    from per-feature histograms of the predictions for the positive and
+    negative examples, which are accumulated one batch at a time
+    (`add`). The predictions and targets are never held in memory
+    together, so the memory used depends only on the number of features
+    and bins, and not on the number of examples evaluated.
+
+    The examples in a bin are treated as tied predictions, so the scores
+    are those that `multilabel_roc_auc_score` and
+    `multilabel_average_precision_score` would compute from the binned
+    predictions. For each score, a bound on its difference from the
+    score of the exact predictions is computed from the histograms
+    (see `error_bounds`). The bound shrinks as the number of bins grows.
+
+    Parameters
+    ----------
+    get_feature_from_index_fn : types.FunctionType
+        A function that takes an index (`int`) and returns a feature
+        name (`str`).
+    n_features : int
+        The number of features predicted.
+    n_bins : int, optional
+        Default is 1000. The number of bins of each histogram.
+    value_range : tuple(float, float), optional
+        Default is `(0., 1.)`. The range of the predictions, which is
+        divided into `n_bins` bins of equal width. Predictions outside
+        of it are counted in the first or the last bin.
+    report_gt_feature_n_positives : int, optional
+        Default is 10. The minimum number of positive examples for a
+        feature in order to compute the score for it.
+    metrics : dict
+        A dictionary that maps metric names (`str`) to metric functions.
+        Only metrics computed from a ranking of the predictions are
+        supported, i.e. `multilabel_roc_auc_score` and
+        `multilabel_average_precision_score`, which are the default.
+    n_workers : int, optional
+        Default is 1. The number of processes that plot the figures of
+        `visualize`.
+
+    Attributes
+    ----------
+    skip_threshold : int
+        The minimum number of positive examples of a feature that must
+        be included in an update for a metric score to be
+        calculated for it.
+    get_feature_from_index : types.FunctionType
+        A function that takes an index (`int`) and returns a feature
+        name (`str`).
+    metrics : dict
+        A dictionary that maps metric names (`str`) to metric objects
+        (`Metric`).
+    error_bounds : dict
+        A dictionary that maps metric names (`str`) to the bounds on the
+        error of each feature score (`numpy.ndarray`) from the last
+        update.
+
+    """
+
+    def __init__(self,
+                 get_feature_from_index_fn,
+                 n_features,
+                 n_bins=1000,
+                 value_range=(0., 1.),
+                 report_gt_feature_n_positives=10,
+                 metrics=dict(
+                     roc_auc=multilabel_roc_auc_score,
+                     average_precision=multilabel_average_precision_score),
+                 n_workers=1):
+        """
+        Creates a new object of the `StreamingPerformanceMetrics` class.
+        """
+        if n_bins < 1:
+            raise ValueError(
+                "The number of bins must be at least 1, but was "
+                "{0}.".format(n_bins))
+        if value_range[1] <= value_range[0]:
+            raise ValueError(
+                "The range of the predictions {0} is empty.".format(
+                    value_range))
+        self.n_features = n_features
+        self.n_bins = n_bins
+        self.value_range = value_range
+        self.error_bounds = dict()
+        super(StreamingPerformanceMetrics, self).__init__(
+            get_feature_from_index_fn,
+            report_gt_feature_n_positives=report_gt_feature_n_positives,
+            metrics=dict(),
+            n_workers=n_workers)
+        for k, v in metrics.items():
+            self.add_metric(k, v)
+        self._bin_offsets = np.arange(n_features) * n_bins
+        self.reset()
+
+    def add_metric(self, name, metric_fn):
+        """
+        Begins tracking of the specified metric.
+
+        Parameters
+        ----------
+        name : str
+            The name of the metric.
+        metric_fn : types.FunctionType
+            A metric function that is computed from a ranking of the
+            predictions, e.g. `multilabel_roc_auc_score`.
+
+        Raises
+        ------
+        ValueError
+            If the metric cannot be computed from the histograms.
+
+        """
+        if not hasattr(metric_fn, "from_ranking"):
+            raise ValueError(
+                "The metric '{0}' cannot be computed from histograms of "
+                "the predictions. Only `multilabel_roc_auc_score` and "
+                "`multilabel_average_precision_score` are supported.".format(
+                    name))
+        super(StreamingPerformanceMetrics, self).add_metric(name, metric_fn)
+
+    def reset(self):
+        """
+        Clears the histograms, e.g. before evaluating the model again.
+        """
+        self._positives = np.zeros(
+            (self.n_features, self.n_bins), dtype=np.int64)
+        self._negatives = np.zeros(
+            (self.n_features, self.n_bins), dtype=np.int64)
+
+    def add(self, prediction, target):
+        """
+        Adds a batch of predictions to the histograms.
+
+        Parameters
+        ----------
+        prediction : numpy.ndarray
+            The :math:`B \\times F` predictions for a batch.
+        target : numpy.ndarray
+            The :math:`B \\times F` binary targets for the batch.
+            Nonzero values are positive.
+
+        """
+        low, high = self.value_range
+        bins = np.floor((prediction - low) * (self.n_bins / (high - low)))
+        bins = np.clip(bins, 0, self.n_bins - 1).astype(np.int64)
+        bins = (bins + self._bin_offsets).ravel()
+        n_values = self.n_features * self.n_bins
+        counts = np.bincount(bins, minlength=n_values)
+        positives = np.bincount(
+            bins[np.asarray(target).ravel() != 0], minlength=n_values)
+        self._positives += positives.reshape(self._positives.shape)
+        self._negatives += (counts - positives).reshape(
+            self._negatives.shape)
+
+    def _ranking(self, features):
+        """
+        Ranks the bins of each of `features` in descending order, as
+        `_rank_columns` ranks the predictions.
+        """
+        positives = self._positives[features, ::-1]
+        negatives = self._negatives[features, ::-1]
+        tps = np.cumsum(positives, axis=1)
+        fps = np.cumsum(negatives, axis=1)
+        column, position = np.nonzero(positives + negatives)
+        return _ranking_from_thresholds(
+            column, tps[column, position], fps[column, position],
+            tps[:, -1], fps[:, -1])
+
+    def update(self, prediction=None, target=None):
+        """
+        Computes the tracked metrics from the histograms, after adding
+        a last batch of predictions if one is given, and adds these to
+        the metric histories.
+
+        Parameters
+        ----------
+        prediction : numpy.ndarray or None, optional
+            Default is None. Predictions to add (see `add`) first.
+        target : numpy.ndarray or None, optional
+            Default is None. The targets of `prediction`.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping each metric names (`str`) to the
+            average score of that metric across all features
+            (`float`).
+
+        """
+        if prediction is not None:
+            self.add(prediction, target)
+        scored_features = np.nonzero(
+            self._positives.sum(axis=1) > self.skip_threshold)[0]
+        ranking = self._ranking(scored_features)
+        metric_scores = {}
+        for name, metric in self.metrics.items():
+            feature_scores = np.ones(self.n_features) * np.nan
+            bounds = np.ones(self.n_features) * np.nan
+            if len(scored_features):
+                feature_scores[scored_features] = \
+                    metric.fn.from_ranking(ranking)
+                if hasattr(metric.fn, "error_bound"):
+                    bounds[scored_features] = metric.fn.error_bound(ranking)
+            metric.data.append(feature_scores)
+            self.error_bounds[name] = bounds
+            metric_scores[name] = _average_score(feature_scores)
+        return metric_scores
+
+    def average_error_bounds(self):
+        """
+        Bounds the error of the average scores returned by the last
+        `update`, i.e. the average of the bounds on the feature scores.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping each metric name (`str`) to the bound
+            (`float`), or None if no feature was scored.
+
+        """
+        return {name: _average_score(bounds)
+                for name, bounds in self.error_bounds.items()}
+
+    def visualize(self, output_dir, background=False, **kwargs):
+        """
+        Outputs the ROC and PR curves of the binned predictions. Does
+        not support other metrics currently.
+
+        Parameters
+        ----------
+        output_dir : str
+            The path to the directory to output the figures. Directories
+            that do not currently exist will be automatically created.
+        background : bool, optional
+            Default is `False`. If `True`, the figures are plotted in a
+            background process, as in `PerformanceMetrics.visualize`.
+        **kwargs : dict
+            Keyword arguments to pass to each visualization function, as
+            in `PerformanceMetrics.visualize`.
+
+        Returns
+        -------
+        multiprocessing.Process or None
+            The process plotting the figures if `background`. Outputs
+            figures to `output_dir`.
+
+        """
+        n_curve_points = kwargs.pop("n_curve_points", 1000)
+        features = np.nonzero(
+            self._positives.sum(axis=1) > self.skip_threshold)[0]
+        roc_curves, precision_recall_curves = _curves_from_ranking(
+            self._ranking(features), n_curve_points=n_curve_points)
+        figures = _curve_figures(
+            roc_curves if "roc_auc" in self.metrics else None,
+            (precision_recall_curves if "average_precision" in self.metrics
+             else None),
+            output_dir,
+            **kwargs)
+        if background:
+            return _start_process(
+                _plot_figures, figures, n_processes=self.n_workers)
+        _plot_figures(figures, n_processes=self.n_workers)
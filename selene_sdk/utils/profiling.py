@@ -0,0 +1,451 @@
+"""
+This module provides utilities for profiling the models that Selene
+trains, evaluates and runs predictions with.
+
+"""
+import logging
+import os
+from time import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import PackedSequence
+from torch.profiler import ProfilerActivity
+
+from .multi_model_wrapper import MultiModelWrapper
+from .utils import _is_lua_trained_model
+
+
+logger = logging.getLogger("selene")
+
+
+class _TorchProfiler(object):
+    """
+    Profiles a window of the steps of a run (e.g. training steps or
+    batches that are evaluated) with `torch.profiler`. Whenever a
+    window of `active` steps has been recorded, a Chrome trace
+    (`<name>.<step>.pt.trace.json`, which can be opened in
+    `chrome://tracing` or Perfetto) and a table of the time spent in
+    each operator (`<name>.<step>.operators.txt`) are written to
+    `output_dir`.
+
+    Parameters
+    ----------
+    name : str
+        The prefix of the names of the files that are written.
+    output_dir : str
+        The directory the files are written to. It is created if it does
+        not exist.
+    use_cuda : bool, optional
+        Default is `False`. Whether to record the CUDA kernels as well.
+    skip_first : int, optional
+        Default is 0. The number of steps to skip before the first
+        window, e.g. to leave out the first steps of training.
+    wait : int, optional
+        Default is 0. The number of steps at the start of each window
+        that are not recorded.
+    warmup : int, optional
+        Default is 1. The number of steps after `wait` during which the
+        profiler is warmed up. These steps are not recorded.
+    active : int, optional
+        Default is 3. The number of steps that are recorded.
+    repeat : int, optional
+        Default is 1. The number of windows to record. If 0, windows are
+        recorded until the run ends.
+    record_shapes : bool, optional
+        Default is `False`. Whether to record the shapes of the inputs of
+        each operator. The operator table then has a row for each
+        operator and input shape.
+    profile_memory : bool, optional
+        Default is `False`. Whether to record the memory that the
+        operators allocate and free.
+    with_stack : bool, optional
+        Default is `False`. Whether to record the Python source locations
+        of the operators in the traces.
+    sort_by : str, optional
+        Default is "self_cpu_time_total". The column to sort the operator
+        table by, e.g. "cpu_time_total", "self_cuda_time_total" or
+        "self_cpu_memory_usage".
+    row_limit : int, optional
+        Default is 50. The number of operators in the operator table.
+
+    """
+
+    def __init__(self,
+                 name,
+                 output_dir,
+                 use_cuda=False,
+                 skip_first=0,
+                 wait=0,
+                 warmup=1,
+                 active=3,
+                 repeat=1,
+                 record_shapes=False,
+                 profile_memory=False,
+                 with_stack=False,
+                 sort_by="self_cpu_time_total",
+                 row_limit=50):
+        os.makedirs(output_dir, exist_ok=True)
+        self._name = name
+        self._output_dir = output_dir
+        self._record_shapes = record_shapes
+        self._sort_by = sort_by
+        self._row_limit = row_limit
+
+        activities = [ProfilerActivity.CPU]
+        if use_cuda:
+            activities.append(ProfilerActivity.CUDA)
+        self._profile = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(skip_first=skip_first,
+                                             wait=wait,
+                                             warmup=warmup,
+                                             active=active,
+                                             repeat=repeat),
+            on_trace_ready=self._write,
+            record_shapes=record_shapes,
+            profile_memory=profile_memory,
+            with_stack=with_stack)
+        self._running = False
+
+    def _write(self, profile):
+        """
+        Writes the trace and the operator table of the window that was
+        just recorded.
+        """
+        prefix = os.path.join(
+            self._output_dir,
+            "{0}.{1}".format(self._name, profile.step_num))
+        profile.export_chrome_trace("{0}.pt.trace.json".format(prefix))
+        table = profile.key_averages(
+            group_by_input_shape=self._record_shapes).table(
+                sort_by=self._sort_by, row_limit=self._row_limit)
+        with open("{0}.operators.txt".format(prefix), 'w') as file_handle:
+            file_handle.write(table)
+        logger.info("Wrote the profile of {0} up to step {1} to "
+                    "{2}.pt.trace.json and {2}.operators.txt".format(
+                        self._name, profile.step_num, prefix))
+
+    def start(self):
+        """
+        Starts profiling, if it has not been started yet.
+        """
+        if not self._running:
+            self._profile.start()
+            self._running = True
+
+    def step(self):
+        """
+        Marks the end of a step.
+        """
+        if self._running:
+            self._profile.step()
+
+    def stop(self):
+        """
+        Stops profiling, writing the window that is being recorded if
+        the run ended before it was complete.
+        """
+        if self._running:
+            self._profile.stop()
+            self._running = False
+
+
+def _torch_profiler(config, name, output_dir, use_cuda=False):
+    """
+    Creates a `_TorchProfiler` from the `profiler` dictionary passed to
+    `TrainModel`, `EvaluateModel` or `AnalyzeSequences`.
+
+    Parameters
+    ----------
+    config : dict or None
+        The keyword arguments of `_TorchProfiler`. The files are written
+        to `config["output_dir"]` if it is given, or else to a
+        `profiler` directory in `output_dir`.
+    name : str
+        The prefix of the names of the files that are written.
+    output_dir : str
+        The output directory of the run.
+    use_cuda : bool, optional
+        Default is `False`. Whether the run uses a CUDA-enabled GPU.
+
+    Returns
+    -------
+    _TorchProfiler or None
+        The profiler, or None if `config` is None.
+
+    """
+    if config is None:
+        return None
+    config = dict(config)
+    profiler_dir = config.pop(
+        "output_dir", os.path.join(output_dir, "profiler"))
+    return _TorchProfiler(name, profiler_dir, use_cuda=use_cuda, **config)
+
+
+def _child_layers(module):
+    """
+    Returns the names and modules of the children of `module`,
+    including the sub-models of a `MultiModelWrapper`, which are not
+    registered as its children.
+    """
+    children = list(module.named_children())
+    if isinstance(module, MultiModelWrapper) and \
+            not isinstance(module.sub_models, nn.Module):
+        children.extend(("sub_models.{0}".format(index), sub_model)
+                        for index, sub_model in enumerate(module.sub_models))
+    return children
+
+
+def _named_layers(module, name="", memo=None):
+    """
+    Yields the names and modules of `module` and of all its
+    submodules, in the order that `torch.nn.Module.named_modules` uses.
+    A module that is used in several places is only yielded once.
+    """
+    if memo is None:
+        memo = set()
+    if id(module) in memo:
+        return
+    memo.add(id(module))
+    yield name, module
+    for child_name, child in _child_layers(module):
+        if name:
+            child_name = "{0}.{1}".format(name, child_name)
+        yield from _named_layers(child, child_name, memo)
+
+
+def _count_parameters(module):
+    """
+    Counts the parameters of `module` and of all its submodules.
+    """
+    return sum(p.numel() for p in module.parameters(recurse=False)) + \
+        sum(_count_parameters(child) for _, child in _child_layers(module))
+
+
+def _tensors(output):
+    """
+    Yields the tensors in the (possibly nested) output of a module.
+    """
+    if isinstance(output, torch.Tensor):
+        yield output
+    elif isinstance(output, PackedSequence):
+        yield output.data
+    elif isinstance(output, (list, tuple)):
+        for item in output:
+            yield from _tensors(item)
+    elif isinstance(output, dict):
+        for item in output.values():
+            yield from _tensors(item)
+
+
+_RNN_GATES = {"LSTM": 4, "GRU": 3, "RNN_TANH": 1, "RNN_RELU": 1}
+
+
+def _estimate_flops(module, inputs, output):
+    """
+    Estimates the number of floating point operations of a call to a
+    layer, counting a multiply-add as 2 operations. Only convolutional,
+    linear, recurrent, normalization, pooling and activation layers
+    are counted; the estimate is 0 for any other layer.
+    """
+    tensors = list(_tensors(inputs))
+    n_inputs = tensors[0].numel() if tensors else 0
+    n_outputs = sum(t.numel() for t in _tensors(output))
+    if isinstance(module, nn.modules.conv._ConvNd):
+        kernel_size = int(np.prod(module.kernel_size))
+        if module.transposed:
+            return 2 * n_inputs * kernel_size * \
+                module.out_channels // module.groups
+        return 2 * n_outputs * kernel_size * \
+            module.in_channels // module.groups
+    if isinstance(module, nn.Linear):
+        return 2 * n_outputs * module.in_features
+    if isinstance(module, nn.RNNBase):
+        n_steps = n_inputs // module.input_size
+        n_directions = 2 if module.bidirectional else 1
+        flops = 0
+        input_size = module.input_size
+        for _ in range(module.num_layers):
+            flops += 2 * n_steps * n_directions * \
+                _RNN_GATES[module.mode] * module.hidden_size * \
+                (input_size + module.hidden_size)
+            input_size = module.hidden_size * n_directions
+        return flops
+    if isinstance(module, (nn.modules.batchnorm._NormBase,
+                           nn.LayerNorm,
+                           nn.GroupNorm)):
+        return 2 * n_outputs
+    if isinstance(module, (nn.modules.pooling._MaxPoolNd,
+                           nn.modules.pooling._AvgPoolNd)):
+        kernel_size = module.kernel_size
+        if isinstance(kernel_size, int):
+            kernel_size = (kernel_size,)
+        return n_outputs * int(np.prod(kernel_size))
+    if isinstance(module, (nn.modules.pooling._AdaptiveMaxPoolNd,
+                           nn.modules.pooling._AdaptiveAvgPoolNd)):
+        return n_inputs
+    if type(module).__module__ == nn.modules.activation.__name__ and \
+            not isinstance(module, nn.MultiheadAttention):
+        return n_outputs
+    return 0
+
+
+def profile_model_layers(model,
+                         sequence_length,
+                         batch_size=64,
+                         n_batches=10,
+                         n_warmup_batches=1,
+                         n_bases=4,
+                         use_cuda=False,
+                         output_path=None):
+    """
+    Profiles the forward pass of each layer (i.e. of the model and each
+    of its submodules, including the models wrapped by
+    `selene_sdk.utils.NonStrandSpecific` and
+    `selene_sdk.utils.MultiModelWrapper`) on batches of random
+    one-hot encoded sequences. This shows the cost of each layer of
+    a model before training or running predictions with it.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        The model. It is run in evaluation mode, without gradients, and
+        it and each of its submodules are returned to their previous
+        modes afterwards.
+    sequence_length : int
+        The length of the sequences that the model expects.
+    batch_size : int, optional
+        Default is 64. The number of sequences in each batch.
+    n_batches : int, optional
+        Default is 10. The number of batches that are profiled.
+    n_warmup_batches : int, optional
+        Default is 1. The number of batches that are run before
+        profiling, and not profiled.
+    n_bases : int, optional
+        Default is 4. The size of the sequence type's alphabet.
+    use_cuda : bool, optional
+        Default is `False`. Whether to run the model on a CUDA-enabled
+        GPU. If `True`, the model is moved to the GPU, and the GPU is
+        synchronized before and after each layer.
+    output_path : str or None, optional
+        Default is None. If specified, the profile of each layer is
+        written to this path as a tab-separated table.
+
+    Returns
+    -------
+    list(dict)
+        A dictionary for the model and for each of its submodules, with
+        the name of the layer (`"layer"`, which is empty for the model
+        itself), its class (`"type"`), the number of times it is called
+        (`"n_calls"`), its wall time in milliseconds including
+        (`"time_ms"`) and excluding (`"self_time_ms"`) the time spent in
+        its submodules, the share of the time of the whole forward pass
+        that it took (`"time_share"`), the estimated number of floating
+        point operations of the layer and its submodules (`"flops"`, see
+        below), the number of bytes of the tensors it outputs
+        (`"output_bytes"`) and the number of parameters of the layer and
+        its submodules (`"n_parameters"`). The numbers of calls,
+        times, operations and bytes are per batch.
+
+    Notes
+    -----
+    The floating point operations are only estimated for
+    convolutional, linear, recurrent, normalization, pooling and
+    activation layers, counting a multiply-add as 2 operations. The
+    operations of other layers and of functions called directly in a
+    `forward` method are not counted.
+
+    """
+    layers = list(_named_layers(model))
+    records = {id(module): dict(n_calls=0,
+                                time=0.,
+                                self_time=0.,
+                                flops=0,
+                                output_bytes=0)
+               for _, module in layers}
+    # the start time, the time spent in submodules and the operations
+    # of the submodules of each layer that is running.
+    frames = []
+    recording = [False]
+
+    def synchronize():
+        if use_cuda:
+            torch.cuda.synchronize()
+
+    def start_layer(module, inputs):
+        synchronize()
+        frames.append([time(), 0., 0])
+
+    def end_layer(module, inputs, output):
+        synchronize()
+        start, children_time, children_flops = frames.pop()
+        elapsed = time() - start
+        flops = _estimate_flops(module, inputs, output) + children_flops
+        if frames:
+            frames[-1][1] += elapsed
+            frames[-1][2] += flops
+        if not recording[0]:
+            return
+        record = records[id(module)]
+        record["n_calls"] += 1
+        record["time"] += elapsed
+        record["self_time"] += elapsed - children_time
+        record["flops"] += flops
+        record["output_bytes"] += sum(
+            t.numel() * t.element_size() for t in _tensors(output))
+
+    hooks = []
+    for _, module in layers:
+        hooks.append(module.register_forward_pre_hook(start_layer))
+        hooks.append(module.register_forward_hook(end_layer))
+
+    # the sub-models of a `MultiModelWrapper` are not children of the
+    # wrapper, so `model.train` would not restore their modes.
+    modes = [(module, module.training) for _, module in layers]
+    model.eval()
+    if use_cuda:
+        model.cuda()
+    from_lua = _is_lua_trained_model(model)
+    try:
+        with torch.no_grad():
+            for index in range(n_warmup_batches + n_batches):
+                recording[0] = index >= n_warmup_batches
+                bases = torch.randint(n_bases, (batch_size, sequence_length))
+                inputs = nn.functional.one_hot(bases, n_bases).float()
+                if use_cuda:
+                    inputs = inputs.cuda()
+                inputs = inputs.transpose(1, 2)
+                if from_lua:
+                    inputs = inputs.contiguous().unsqueeze_(2)
+                model(inputs)
+    finally:
+        for hook in hooks:
+            hook.remove()
+        for module, training in modes:
+            module.training = training
+
+    total_time = records[id(model)]["time"]
+    profile = []
+    for name, module in layers:
+        record = records[id(module)]
+        profile.append(dict(
+            layer=name,
+            type=type(module).__name__,
+            n_calls=record["n_calls"] / n_batches,
+            time_ms=record["time"] / n_batches * 1000,
+            self_time_ms=record["self_time"] / n_batches * 1000,
+            time_share=record["time"] / total_time if total_time else 0.,
+            flops=record["flops"] / n_batches,
+            output_bytes=record["output_bytes"] / n_batches,
+            n_parameters=_count_parameters(module)))
+
+    if output_path is not None:
+        columns = list(profile[0].keys())
+        with open(output_path, 'w') as file_handle:
+            file_handle.write("{0}\n".format("\t".join(columns)))
+            for layer in profile:
+                file_handle.write("{0}\n".format("\t".join(
+                    str(layer[column]) for column in columns)))
+    return profile
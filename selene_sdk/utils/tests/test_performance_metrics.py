@@ -0,0 +1,173 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+from sklearn.metrics import average_precision_score
+from sklearn.metrics import roc_auc_score
+
+from selene_sdk.utils import performance_metrics
+from selene_sdk.utils.performance_metrics import compute_score
+from selene_sdk.utils.performance_metrics import multilabel_average_precision_score
+from selene_sdk.utils.performance_metrics import multilabel_roc_auc_score
+from selene_sdk.utils.performance_metrics import PerformanceMetrics
+from selene_sdk.utils.performance_metrics import StreamingPerformanceMetrics
+
+
+def _predictions(n_samples, n_features, seed=0):
+    """
+    Draws targets and predictions that are correlated with them, with
+    some columns that have many tied predictions, one column with only
+    negative examples and one with only positive examples.
+    """
+    rng = np.random.RandomState(seed)
+    target = (rng.rand(n_samples, n_features) <
+              rng.uniform(0.05, 0.5, size=n_features)).astype(np.float32)
+    prediction = np.clip(
+        0.3 * target + rng.beta(2, 3, size=target.shape), 0, 0.999)
+    # half of the columns only take 6 or 21 distinct values.
+    prediction[:, ::4] = np.round(prediction[:, ::4] * 5) / 5
+    prediction[:, 1::4] = np.round(prediction[:, 1::4] * 20) / 20
+    target[:, 2] = 0
+    target[:, 3] = 1
+    return prediction, target
+
+
+def _sklearn_scores(metric_fn, target, prediction):
+    scores = np.ones(target.shape[1]) * np.nan
+    for i in range(target.shape[1]):
+        if 0 < np.count_nonzero(target[:, i]) < len(target):
+            scores[i] = metric_fn(target[:, i], prediction[:, i])
+    return scores
+
+
+class TestMultilabelScores(unittest.TestCase):
+
+    def setUp(self):
+        self.prediction, self.target = _predictions(300, 12)
+
+    def test_roc_auc_matches_sklearn(self):
+        scores = multilabel_roc_auc_score(self.target, self.prediction)
+        np.testing.assert_allclose(
+            scores,
+            _sklearn_scores(roc_auc_score, self.target, self.prediction))
+        # undefined for all-negative and all-positive features.
+        self.assertTrue(np.isnan(scores[2]))
+        self.assertTrue(np.isnan(scores[3]))
+
+    def test_average_precision_matches_sklearn(self):
+        scores = multilabel_average_precision_score(
+            self.target, self.prediction)
+        expected = _sklearn_scores(
+            average_precision_score, self.target, self.prediction)
+        expected[3] = average_precision_score(
+            self.target[:, 3], self.prediction[:, 3])
+        np.testing.assert_allclose(scores, expected)
+        # undefined without positive examples.
+        self.assertTrue(np.isnan(scores[2]))
+        self.assertEqual(scores[3], 1.)
+
+    def test_ranked_in_chunks(self):
+        for chunk_size in (1, 300, 301, 1000):
+            with self.subTest(chunk_size=chunk_size), \
+                    mock.patch.object(performance_metrics,
+                                      "_RANKING_CHUNK_SIZE", chunk_size):
+                np.testing.assert_allclose(
+                    multilabel_roc_auc_score(self.target, self.prediction),
+                    _sklearn_scores(
+                        roc_auc_score, self.target, self.prediction))
+
+    def test_compute_score_matches_per_feature_metric(self):
+        for metric_fn, sklearn_fn in (
+                (multilabel_roc_auc_score, roc_auc_score),
+                (multilabel_average_precision_score,
+                 average_precision_score)):
+            with self.subTest(metric=sklearn_fn.__name__):
+                average, scores = compute_score(
+                    self.prediction, self.target, metric_fn,
+                    report_gt_feature_n_positives=10)
+                expected_average, expected_scores = compute_score(
+                    self.prediction, self.target, sklearn_fn,
+                    report_gt_feature_n_positives=10)
+                np.testing.assert_allclose(scores, expected_scores)
+                self.assertAlmostEqual(average, expected_average)
+
+    def test_performance_metrics_workers(self):
+        features = ["f{0}".format(i) for i in range(12)]
+        results = []
+        for n_workers in (1, 3):
+            metrics = PerformanceMetrics(
+                lambda i: features[i], n_workers=n_workers)
+            results.append(metrics.update(self.prediction, self.target))
+            np.testing.assert_allclose(
+                metrics.metrics["roc_auc"].data[-1],
+                compute_score(self.prediction, self.target,
+                              roc_auc_score)[1])
+        self.assertEqual(results[0].keys(), results[1].keys())
+        for name in results[0]:
+            self.assertAlmostEqual(results[0][name], results[1][name])
+
+
+class TestStreamingPerformanceMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.prediction, self.target = _predictions(2000, 12, seed=1)
+        self.features = ["f{0}".format(i) for i in range(12)]
+
+    def _streaming_metrics(self, n_bins, batch_size=128):
+        metrics = StreamingPerformanceMetrics(
+            lambda i: self.features[i], 12, n_bins=n_bins)
+        for start in range(0, len(self.target), batch_size):
+            metrics.add(self.prediction[start:start + batch_size],
+                        self.target[start:start + batch_size])
+        return metrics, metrics.update()
+
+    def test_estimates_within_error_bounds(self):
+        exact = PerformanceMetrics(lambda i: self.features[i])
+        exact_averages = exact.update(self.prediction, self.target)
+        for n_bins in (1, 7, 50, 1000):
+            with self.subTest(n_bins=n_bins):
+                metrics, averages = self._streaming_metrics(n_bins)
+                average_bounds = metrics.average_error_bounds()
+                for name in ("roc_auc", "average_precision"):
+                    estimates = metrics.metrics[name].data[-1]
+                    scores = exact.metrics[name].data[-1]
+                    bounds = metrics.error_bounds[name]
+                    np.testing.assert_array_equal(
+                        np.isnan(estimates), np.isnan(scores))
+                    scored = ~np.isnan(scores)
+                    self.assertTrue(np.all(
+                        np.abs(estimates[scored] - scores[scored]) <=
+                        bounds[scored] + 1e-12))
+                    self.assertLessEqual(
+                        abs(averages[name] - exact_averages[name]),
+                        average_bounds[name] + 1e-12)
+
+    def test_bounds_shrink_with_more_bins(self):
+        coarse, _ = self._streaming_metrics(10)
+        fine, _ = self._streaming_metrics(1000)
+        for name in ("roc_auc", "average_precision"):
+            self.assertLess(fine.average_error_bounds()[name],
+                            coarse.average_error_bounds()[name])
+
+    def test_matches_exact_scores_of_binned_predictions(self):
+        n_bins = 20
+        metrics, _ = self._streaming_metrics(n_bins)
+        # predictions of 1 are counted in the last bin.
+        binned = np.minimum(
+            np.floor(self.prediction * n_bins), n_bins - 1) / n_bins
+        np.testing.assert_allclose(
+            metrics.metrics["roc_auc"].data[-1],
+            compute_score(binned, self.target, roc_auc_score)[1])
+        np.testing.assert_allclose(
+            metrics.metrics["average_precision"].data[-1],
+            compute_score(binned, self.target, average_precision_score)[1])
+
+    def test_unsupported_metric(self):
+        with self.assertRaises(ValueError):
+            StreamingPerformanceMetrics(
+                lambda i: self.features[i], 12,
+                metrics=dict(roc_auc=roc_auc_score))
+
+
+if __name__ == "__main__":
+    unittest.main()
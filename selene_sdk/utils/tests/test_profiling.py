@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from selene_sdk.utils import MultiModelWrapper
+from selene_sdk.utils import NonStrandSpecific
+from selene_sdk.utils import profile_model_layers
+from selene_sdk.utils.profiling import _TorchProfiler
+from selene_sdk.utils.profiling import _torch_profiler
+
+
+def _model():
+    return nn.Sequential(nn.Conv1d(4, 8, 5),
+                         nn.ReLU(),
+                         nn.MaxPool1d(2),
+                         nn.Flatten(),
+                         nn.Linear(8 * 8, 3))
+
+
+class TestTorchProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _run(self, profiler, n_steps):
+        profiler.start()
+        for _ in range(n_steps):
+            torch.randn(16, 16).mm(torch.randn(16, 16))
+            profiler.step()
+        profiler.stop()
+
+    def _check_window(self, prefix, n_steps):
+        with open(os.path.join(self.output_dir,
+                               "{0}.pt.trace.json".format(prefix))) as \
+                file_handle:
+            events = json.load(file_handle)["traceEvents"]
+        self.assertEqual(
+            len([event for event in events
+                 if event.get("name", "").startswith("ProfilerStep#")]),
+            n_steps)
+        with open(os.path.join(self.output_dir,
+                               "{0}.operators.txt".format(prefix))) as \
+                file_handle:
+            self.assertIn("aten::mm", file_handle.read())
+
+    def test_writes_recorded_windows(self):
+        profiler = _TorchProfiler(
+            "train", self.output_dir, skip_first=1, warmup=1, active=2,
+            repeat=2)
+        self._run(profiler, 10)
+        # steps 2 and 3, and 5 and 6 are recorded.
+        self.assertEqual(
+            sorted(os.listdir(self.output_dir)),
+            ["train.4.operators.txt", "train.4.pt.trace.json",
+             "train.7.operators.txt", "train.7.pt.trace.json"])
+        self._check_window("train.4", 2)
+        self._check_window("train.7", 2)
+
+    def test_stop_writes_incomplete_window(self):
+        profiler = _TorchProfiler(
+            "evaluate", self.output_dir, warmup=1, active=5)
+        self._run(profiler, 3)
+        self.assertEqual(len(os.listdir(self.output_dir)), 2)
+        # steps 1 and 2, and the step that was started when profiling
+        # was stopped, are recorded.
+        self._check_window("evaluate.3", 3)
+        # stopping again, or stepping after stopping, has no effect.
+        profiler.stop()
+        profiler.step()
+        self.assertEqual(len(os.listdir(self.output_dir)), 2)
+
+    def test_create_from_config(self):
+        self.assertIsNone(_torch_profiler(None, "train", self.output_dir))
+
+        config = dict(active=1)
+        self._run(_torch_profiler(config, "train", self.output_dir), 2)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.output_dir, "profiler"))),
+            ["train.2.operators.txt", "train.2.pt.trace.json"])
+
+        profiler_dir = os.path.join(self.output_dir, "traces")
+        self._run(_torch_profiler(dict(config, output_dir=profiler_dir),
+                                  "train", self.output_dir), 2)
+        self.assertEqual(len(os.listdir(profiler_dir)), 2)
+        # the config is not changed.
+        self.assertEqual(config, dict(active=1))
+
+
+class TestProfileModelLayers(unittest.TestCase):
+
+    def test_profile(self):
+        output_dir = tempfile.mkdtemp()
+        output_path = os.path.join(output_dir, "layers.tsv")
+        try:
+            profile = profile_model_layers(
+                _model(), 20, batch_size=4, n_batches=2,
+                output_path=output_path)
+            with open(output_path) as file_handle:
+                rows = [line.rstrip("\n").split("\t")
+                        for line in file_handle]
+        finally:
+            shutil.rmtree(output_dir)
+        self.assertEqual(
+            [(layer["layer"], layer["type"]) for layer in profile],
+            [("", "Sequential"), ("0", "Conv1d"), ("1", "ReLU"),
+             ("2", "MaxPool1d"), ("3", "Flatten"), ("4", "Linear")])
+        layers = {layer["layer"]: layer for layer in profile}
+        # 4 sequences of 16 positions and 8 channels, each computed from
+        # 5 positions and 4 channels.
+        self.assertEqual(layers["0"]["flops"], 2 * 4 * 16 * 8 * 5 * 4)
+        self.assertEqual(layers["4"]["flops"], 2 * 4 * 3 * 64)
+        self.assertEqual(layers["3"]["flops"], 0)
+        self.assertEqual(layers[""]["flops"],
+                         sum(layers[name]["flops"]
+                             for name in ("0", "1", "2", "3", "4")))
+        self.assertEqual(layers["0"]["output_bytes"], 4 * 8 * 16 * 4)
+        self.assertEqual(layers["0"]["n_parameters"], 8 * 4 * 5 + 8)
+        self.assertEqual(layers[""]["n_parameters"],
+                         8 * 4 * 5 + 8 + 64 * 3 + 3)
+        self.assertEqual(layers[""]["time_share"], 1.)
+        for layer in profile:
+            self.assertEqual(layer["n_calls"], 1)
+            self.assertLessEqual(layer["self_time_ms"], layer["time_ms"])
+        self.assertLessEqual(
+            sum(layers[name]["time_ms"]
+                for name in ("0", "1", "2", "3", "4")),
+            layers[""]["time_ms"])
+
+        self.assertEqual(rows[0], list(profile[0].keys()))
+        self.assertEqual([row[0] for row in rows[1:]],
+                         [layer["layer"] for layer in profile])
+
+    def test_wrapped_models(self):
+        model = NonStrandSpecific(_model())
+        profile = profile_model_layers(model, 20, batch_size=4, n_batches=2)
+        layers = {layer["layer"]: layer for layer in profile}
+        # the model is run on both strands.
+        self.assertEqual(layers["model.0"]["n_calls"], 2)
+        self.assertEqual(layers["model"]["flops"], layers[""]["flops"])
+
+        model = MultiModelWrapper([_model(), _model()])
+        profile = profile_model_layers(model, 20, batch_size=4, n_batches=2)
+        self.assertEqual(
+            [layer["layer"] for layer in profile][:3],
+            ["", "sub_models.0", "sub_models.0.0"])
+        layers = {layer["layer"]: layer for layer in profile}
+        self.assertEqual(
+            layers[""]["n_parameters"],
+            sum(p.numel() for sub_model in model.sub_models
+                for p in sub_model.parameters()))
+
+    def test_modes_restored(self):
+        sub_models = [_model(), _model()]
+        sub_models[1][1].eval()
+        model = MultiModelWrapper(sub_models)
+        modes = [module.training for sub_model in sub_models
+                 for module in sub_model.modules()]
+        training = []
+        sub_models[0][0].register_forward_hook(
+            lambda module, inputs, output: training.append(module.training))
+        profile_model_layers(model, 20, batch_size=4, n_batches=2)
+        self.assertEqual(training, [False] * 3)
+        self.assertTrue(model.training)
+        self.assertEqual([module.training for sub_model in sub_models
+                          for module in sub_model.modules()], modes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+import torch
+import torch.nn as nn
+
+from selene_sdk.utils.utils import _autocast
+from selene_sdk.utils.utils import _check_precision
+
+
+class TestPrecision(unittest.TestCase):
+
+    def test_check_precision(self):
+        _check_precision("float32")
+        _check_precision("bfloat16")
+        _check_precision("float16", use_cuda=True)
+        for precision, use_cuda in (("float16", False),
+                                    ("float64", False),
+                                    ("bf16", True)):
+            with self.subTest(precision=precision, use_cuda=use_cuda):
+                with self.assertRaises(ValueError):
+                    _check_precision(precision, use_cuda=use_cuda)
+
+    def test_autocast(self):
+        torch.manual_seed(0)
+        linear = nn.Linear(8, 2)
+        inputs = torch.randn(4, 8)
+        with _autocast("float32"):
+            outputs = linear(inputs)
+        self.assertEqual(outputs.dtype, torch.float32)
+        with _autocast("bfloat16"):
+            bfloat16_outputs = linear(inputs)
+        self.assertEqual(bfloat16_outputs.dtype, torch.bfloat16)
+        torch.testing.assert_close(
+            bfloat16_outputs.float(), outputs, atol=0.05, rtol=0.02)
+        # the parameters are kept in float32
+        self.assertEqual(linear.weight.dtype, torch.float32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,10 +5,12 @@ across many of the packages modules.
 
 """
 from collections import OrderedDict
+from contextlib import nullcontext
 import logging
 import sys
 
 import numpy as np
+import torch
 
 from .multi_model_wrapper import MultiModelWrapper
 
@@ -31,6 +33,60 @@ def _is_lua_trained_model(model):
     return model.from_lua
 
 
+def _to_tensor(array):
+    """
+    Converts an array to a float32 tensor that shares its memory, so
+    that no copy is made if the array is already a contiguous float32
+    array (as returned by the samplers).
+    """
+    return torch.from_numpy(np.ascontiguousarray(array, dtype=np.float32))
+
+
+_AUTOCAST_DTYPES = {
+    "float32": None,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+}
+
+
+def _check_precision(precision, use_cuda=False):
+    """
+    Checks that a model can be run in `precision` on the device
+    specified by `use_cuda`.
+
+    Raises
+    ------
+    ValueError
+        If `precision` is not one of "float32", "bfloat16" or "float16",
+        or if it is "float16" without CUDA.
+
+    """
+    if precision not in _AUTOCAST_DTYPES:
+        raise ValueError(
+            "Precision must be one of {0}, but was '{1}'.".format(
+                sorted(_AUTOCAST_DTYPES), precision))
+    if precision == "float16" and not use_cuda:
+        raise ValueError("Precision 'float16' is only supported with CUDA. "
+                         "Use 'bfloat16' on the CPU.")
+    if precision != "float32" and not hasattr(torch, "autocast"):
+        raise ValueError("Precision '{0}' requires PyTorch 1.10 or "
+                         "later.".format(precision))
+
+
+def _autocast(precision, use_cuda=False):
+    """
+    Returns a context in which the forward pass of a model runs with
+    automatic mixed precision in `precision` ("bfloat16" or "float16"),
+    or in float32 if `precision` is "float32". The outputs of the model
+    may then be in reduced precision and should be cast back to float32
+    before computing the loss.
+    """
+    dtype = _AUTOCAST_DTYPES[precision]
+    if dtype is None:
+        return nullcontext()
+    return torch.autocast("cuda" if use_cuda else "cpu", dtype=dtype)
+
+
 def get_indices_and_probabilities(interval_lengths, indices):
     """
     Given a list of different interval lengths and the indices of